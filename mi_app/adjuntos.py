@@ -0,0 +1,460 @@
+# -*- coding: utf-8 -*-
+"""
+Adjuntos del expediente: almacén de archivos direccionado por contenido.
+
+Las subidas no pasan por memoria: un manejador de subida propio escribe
+cada bloque del cuerpo en un temporal dentro del almacén mientras calcula su
+sha256, y al terminar el archivo se mueve (rename atómico) a
+ADJUNTOS_ROOT/ab/cd/<sha256>. Si ese contenido ya existía el temporal se
+descarta y el nuevo Attachment apunta al mismo StoredBlob (deduplicación).
+Miniatura y vista previa (Pillow para imágenes, PyMuPDF para PDF) se
+generan después del commit en un pool de hilos, y las descargas se sirven
+por bloques desde disco con soporte de Range, ETag (el propio sha256: el
+contenido nunca cambia) e If-Range.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+from django.db import IntegrityError, close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+BLOQUE = 64 * 1024
+
+MINIATURA = (256, 256)
+VISTA_PREVIA = (1600, 1600)
+CALIDAD_JPEG = 82
+
+TIPOS_IMAGEN = {'image/jpeg', 'image/png', 'image/gif', 'image/tiff', 'image/bmp', 'image/webp'}
+TIPOS_PDF = {'application/pdf'}
+
+# Se muestran en el navegador; el resto se descarga siempre (un HTML subido no se ejecuta)
+TIPOS_EN_LINEA = TIPOS_IMAGEN | TIPOS_PDF
+
+# Firmas de los primeros bytes: no se confía en la extensión ni en el navegador
+_FIRMAS = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+    (b'BM', 'image/bmp'),
+)
+_CABECERA = 512
+
+# Un temporal sin escribir en este tiempo ya no es de una subida en curso
+ANTIGUEDAD_TEMPORALES = 6 * 3600
+
+_RANGO = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class AdjuntoInvalido(Exception):
+    pass
+
+
+def _ruta(sha256, sufijo=''):
+    return os.path.join(settings.ADJUNTOS_ROOT, sha256[:2], sha256[2:4], sha256 + sufijo)
+
+
+def ruta_contenido(blob):
+    return _ruta(blob.sha256)
+
+
+def ruta_derivado(blob, tipo):
+    """Ruta de la 'miniatura' o la 'vista' previa (JPEG) de un contenido"""
+    return _ruta(blob.sha256, f'.{tipo}.jpg')
+
+
+def _directorio_temporal():
+    directorio = os.path.join(settings.ADJUNTOS_ROOT, 'tmp')
+    os.makedirs(directorio, exist_ok=True)
+    return directorio
+
+
+def detectar_tipo(cabecera, nombre):
+    """Tipo MIME por los primeros bytes; si no se reconoce, por la extensión"""
+    for firma, tipo in _FIRMAS:
+        if cabecera.startswith(firma):
+            return tipo
+    if cabecera[:4] == b'RIFF' and cabecera[8:12] == b'WEBP':
+        return 'image/webp'
+    if cabecera[128:132] == b'DICM':
+        return 'application/dicom'
+    tipo, _ = mimetypes.guess_type(nombre or '')
+    # Sin firma conocida no se acepta un tipo que el navegador mostraría en línea
+    if tipo in TIPOS_EN_LINEA or not tipo:
+        return 'application/octet-stream'
+    return tipo
+
+
+class ArchivoRecibido(UploadedFile):
+    """Archivo ya escrito en el temporal del almacén, con su sha256 calculado al recibirlo"""
+
+    def __init__(self, archivo, nombre, tipo, tamano, sha256):
+        super().__init__(archivo, nombre, tipo, tamano)
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def descartar(self):
+        self.file.close()
+        try:
+            os.unlink(self.file.name)
+        except FileNotFoundError:
+            pass
+
+
+class _Receptor:
+    """Escribe bloques en un temporal del almacén calculando sha256 y tamaño"""
+
+    def __init__(self):
+        self.archivo = tempfile.NamedTemporaryFile(dir=_directorio_temporal(), delete=False)
+        self.huella = hashlib.sha256()
+        self.tamano = 0
+        self.cabecera = b''
+
+    def escribir(self, datos):
+        self.tamano += len(datos)
+        if self.tamano > settings.ADJUNTOS_TAMANO_MAXIMO:
+            self.descartar()
+            return False
+        if len(self.cabecera) < _CABECERA:
+            self.cabecera += datos[:_CABECERA - len(self.cabecera)]
+        self.huella.update(datos)
+        self.archivo.write(datos)
+        return True
+
+    def terminar(self, nombre):
+        self.archivo.flush()
+        self.archivo.seek(0)
+        return ArchivoRecibido(
+            self.archivo, nombre, detectar_tipo(self.cabecera, nombre), self.tamano, self.huella.hexdigest(),
+        )
+
+    def descartar(self):
+        self.archivo.close()
+        try:
+            os.unlink(self.archivo.name)
+        except FileNotFoundError:
+            pass
+
+
+class ManejadorAdjuntos(FileUploadHandler):
+    """
+    Manejador de subida: cada bloque del cuerpo va directo al almacén
+    (nunca el archivo completo en memoria). Si se pasa de
+    ADJUNTOS_TAMANO_MAXIMO corta la subida y deja `excedido` en True.
+    """
+
+    chunk_size = BLOQUE
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.receptor = None
+        self.receptores = []
+        self.excedido = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.receptor = _Receptor()
+        self.receptores.append(self.receptor)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.receptor.escribir(raw_data):
+            self.excedido = True
+            raise StopUpload(connection_reset=True)
+        return None
+
+    def file_complete(self, file_size):
+        return self.receptor.terminar(self.file_name)
+
+    def upload_interrupted(self):
+        if self.receptor:
+            self.receptor.descartar()
+
+    def descartar_pendientes(self):
+        """Borra los temporales que no llegaron al almacén (CSRF, 404, validaciones, errores)"""
+        for receptor in self.receptores:
+            receptor.descartar()
+
+
+def limpiar_temporales(antiguedad=ANTIGUEDAD_TEMPORALES):
+    """Borra los temporales de subidas que murieron a medias; devuelve cuántos"""
+    limite = time.time() - antiguedad
+    borrados = 0
+    with os.scandir(_directorio_temporal()) as entradas:
+        for entrada in entradas:
+            if not entrada.is_file(follow_symlinks=False) or entrada.stat().st_mtime >= limite:
+                continue
+            try:
+                os.unlink(entrada.path)
+                borrados += 1
+            except FileNotFoundError:
+                pass
+    return borrados
+
+
+def recibir_flujo(flujo, nombre):
+    """ArchivoRecibido a partir de un archivo abierto (comandos, importaciones)"""
+    receptor = _Receptor()
+    for bloque in iter(lambda: flujo.read(BLOQUE), b''):
+        if not receptor.escribir(bloque):
+            raise AdjuntoInvalido(f'{nombre} excede el tamaño máximo de {settings.ADJUNTOS_TAMANO_MAXIMO} bytes')
+    return receptor.terminar(nombre)
+
+
+def guardar(recibido, programar=True):
+    """
+    Mueve el archivo a su lugar en el almacén si el contenido es nuevo:
+    (blob, nuevo). Con programar=False los derivados quedan pendientes para
+    `generar_vistas_previas` (importaciones masivas). Se llama dentro de la
+    transacción que crea lo que apunta al blob: un contenido repetido queda
+    bloqueado y eliminar_adjunto no lo borra mientras tanto.
+    """
+    from .models import StoredBlob
+
+    existente = StoredBlob.objects.select_for_update().filter(sha256=recibido.sha256).first()
+    if existente is not None:
+        recibido.descartar()
+        return existente, False
+
+    destino = _ruta(recibido.sha256)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    recibido.file.close()
+    # Mismo sistema de archivos: el rename es atómico y nadie ve un archivo a medias
+    os.replace(recibido.temporary_file_path(), destino)
+    derivados = 'pendiente' if recibido.content_type in TIPOS_IMAGEN | TIPOS_PDF else 'no_aplica'
+    try:
+        with transaction.atomic():
+            blob = StoredBlob.objects.create(
+                sha256=recibido.sha256,
+                tamano=recibido.size,
+                tipo_mime=recibido.content_type,
+                derivados=derivados,
+            )
+    except IntegrityError:
+        # Otra subida del mismo contenido ganó la carrera; el archivo en disco es idéntico
+        return StoredBlob.objects.select_for_update().get(sha256=recibido.sha256), False
+    if derivados == 'pendiente' and programar:
+        programar_derivados(blob.id)
+    return blob, True
+
+
+def crear_adjunto(patient_id, recibido, categoria='otro', descripcion='', consultation_id=None, usuario=None):
+    """Guarda el contenido (deduplicado) y crea el adjunto: (adjunto, contenido_nuevo)"""
+    from .models import Attachment
+
+    if categoria not in dict(Attachment.CATEGORIA_CHOICES):
+        recibido.descartar()
+        raise AdjuntoInvalido(f'Categoría no válida: {categoria}')
+    with transaction.atomic():
+        blob, nuevo = guardar(recibido)
+        adjunto = Attachment.objects.create(
+            patient_id=patient_id,
+            consultation_id=consultation_id,
+            blob=blob,
+            nombre=os.path.basename(recibido.name or 'archivo')[:255],
+            categoria=categoria,
+            descripcion=descripcion[:255],
+            usuario=usuario,
+        )
+    return adjunto, nuevo
+
+
+def eliminar_adjunto(adjunto):
+    """Borra el adjunto y, si era la última referencia, su contenido y derivados"""
+    from .models import Attachment, LabReport, StoredBlob
+
+    with transaction.atomic():
+        blob = StoredBlob.objects.select_for_update().get(id=adjunto.blob_id)
+        adjunto.delete()
+        # Un reporte de laboratorio conserva su PDF aunque se quite del expediente.
+        # Sin filtro de clínica: el contenido se comparte entre sucursales
+        if (Attachment._base_manager.filter(blob_id=blob.id).exists()
+                or LabReport._base_manager.filter(blob_id=blob.id).exists()):
+            return False
+        rutas = [ruta_contenido(blob), ruta_derivado(blob, 'miniatura'), ruta_derivado(blob, 'vista')]
+        blob.delete()
+        transaction.on_commit(lambda: _borrar_archivos(rutas))
+    return True
+
+
+def _borrar_archivos(rutas):
+    for ruta in rutas:
+        try:
+            os.unlink(ruta)
+        except FileNotFoundError:
+            pass
+
+
+# ---------- Miniaturas y vistas previas ----------
+
+_pool = None
+_candado_pool = threading.Lock()
+
+
+def _ejecutor():
+    global _pool
+    with _candado_pool:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=settings.ADJUNTOS_WORKERS, thread_name_prefix='adjuntos')
+    return _pool
+
+
+def programar_derivados(blob_id):
+    """Encola la miniatura y vista previa del contenido para después del commit"""
+    transaction.on_commit(lambda: _ejecutor().submit(_tarea_derivados, blob_id))
+
+
+def _tarea_derivados(blob_id):
+    close_old_connections()
+    try:
+        generar_derivados(blob_id)
+    except Exception:
+        logger.exception('No se pudieron generar los derivados del contenido %s', blob_id)
+    finally:
+        close_old_connections()
+
+
+def _imagen_base(blob):
+    """(imagen Pillow de la primera página o de la imagen, número de páginas)"""
+    from PIL import Image, ImageOps
+
+    ruta = ruta_contenido(blob)
+    if blob.tipo_mime in TIPOS_PDF:
+        import fitz
+
+        with fitz.open(ruta) as documento:
+            pagina = documento.load_page(0)
+            escala = min(VISTA_PREVIA[0] / pagina.rect.width, VISTA_PREVIA[1] / pagina.rect.height, 2)
+            mapa = pagina.get_pixmap(matrix=fitz.Matrix(escala, escala), alpha=False)
+            return Image.frombytes('RGB', (mapa.width, mapa.height), mapa.samples), documento.page_count
+
+    imagen = Image.open(ruta)
+    # JPEG: decodifica ya reducido, sin expandir la imagen completa
+    imagen.draft('RGB', VISTA_PREVIA)
+    paginas = getattr(imagen, 'n_frames', 1)
+    imagen = ImageOps.exif_transpose(imagen)
+    return imagen.convert('RGB'), paginas
+
+
+def _guardar_jpeg(imagen, ruta):
+    temporal = f'{ruta}.{threading.get_ident()}.tmp'
+    imagen.save(temporal, 'JPEG', quality=CALIDAD_JPEG, optimize=True)
+    os.replace(temporal, ruta)
+
+
+def generar_derivados(blob_id):
+    """Genera miniatura y vista previa de un contenido pendiente y registra el resultado"""
+    from .models import StoredBlob
+
+    blob = StoredBlob.objects.filter(id=blob_id, derivados='pendiente').first()
+    if blob is None:
+        return None
+    paginas = None
+    try:
+        imagen, paginas = _imagen_base(blob)
+        vista = imagen.copy()
+        vista.thumbnail(VISTA_PREVIA)
+        _guardar_jpeg(vista, ruta_derivado(blob, 'vista'))
+        imagen.thumbnail(MINIATURA)
+        _guardar_jpeg(imagen, ruta_derivado(blob, 'miniatura'))
+        estado = 'listo'
+    except ImportError:
+        estado = 'no_disponible'
+    except Exception:
+        logger.exception('Contenido %s: no se pudo generar la vista previa', blob.sha256)
+        estado = 'error'
+    StoredBlob.objects.filter(id=blob_id).update(derivados=estado, paginas=paginas)
+    return estado
+
+
+# ---------- Descargas ----------
+
+def rango_solicitado(cabecera, tamano):
+    """
+    (inicio, fin) inclusivos del Range de una sola parte, o None para enviar
+    el archivo completo (sin Range, o multi-rango que se permite ignorar).
+    ValueError si el rango no se puede satisfacer.
+    """
+    coincide = _RANGO.match((cabecera or '').strip())
+    if not coincide:
+        return None
+    inicio, fin = coincide.groups()
+    if not inicio:
+        if not fin:
+            return None
+        sufijo = int(fin)
+        if not sufijo or not tamano:
+            raise ValueError('Rango vacío')
+        return max(tamano - sufijo, 0), tamano - 1
+    inicio = int(inicio)
+    fin = min(int(fin), tamano - 1) if fin else tamano - 1
+    if inicio >= tamano or fin < inicio:
+        raise ValueError('Rango fuera del archivo')
+    return inicio, fin
+
+
+def leer_tramo(ruta, inicio, longitud):
+    """Bytes [inicio, inicio + longitud) del archivo, por bloques"""
+    with open(ruta, 'rb') as archivo:
+        archivo.seek(inicio)
+        restante = longitud
+        while restante > 0:
+            datos = archivo.read(min(BLOQUE, restante))
+            if not datos:
+                break
+            restante -= len(datos)
+            yield datos
+
+
+def respuesta_archivo(request, ruta, tipo, etag, nombre=None, en_linea=True):
+    """Respuesta en streaming desde disco con ETag, 304, Range (206/416) e If-Range"""
+    from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+    from django.utils.cache import get_conditional_response, patch_cache_control
+    from django.utils.http import content_disposition_header
+
+    etag = f'"{etag}"'
+    tamano = os.path.getsize(ruta)
+    respuesta = get_conditional_response(request, etag=etag)
+    if respuesta is None:
+        rango = request.headers.get('Range')
+        # If-Range: el rango solo vale si el cliente tiene esta misma versión
+        if rango and request.headers.get('If-Range', etag) != etag:
+            rango = None
+        try:
+            tramo = rango_solicitado(rango, tamano)
+        except ValueError:
+            respuesta = HttpResponse(status=416)
+            respuesta['Content-Range'] = f'bytes */{tamano}'
+            return respuesta
+
+        if tramo is None:
+            # FileResponse lee por bloques (o usa sendfile con wsgi.file_wrapper)
+            respuesta = FileResponse(open(ruta, 'rb'), content_type=tipo)
+        else:
+            inicio, fin = tramo
+            respuesta = StreamingHttpResponse(leer_tramo(ruta, inicio, fin - inicio + 1), status=206, content_type=tipo)
+            respuesta['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+            respuesta['Content-Length'] = str(fin - inicio + 1)
+        if nombre:
+            respuesta['Content-Disposition'] = content_disposition_header(not en_linea, nombre)
+    respuesta['ETag'] = etag
+    respuesta['Accept-Ranges'] = 'bytes'
+    # El contenido de un sha256 no cambia nunca
+    patch_cache_control(respuesta, private=True, max_age=60 * 60 * 24 * 30)
+    return respuesta
@@ -1,23 +1,412 @@
-from django.contrib import admin
-from .models import Payment, Invoice, ConceptoFactura
+import os
+
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connection
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import (
+    Clinic, Doctor, Patient, Consultation, MedicalRecord, Prescription, UserProfile,
+    VitalSign, ClinicalTerm, ClinicalFact, ClinicalNote, PatientBlockingKey, DuplicateCandidate, Tombstone, AgendaEvent,
+    AppointmentSeries, AgendaOperation, AgendaChange,
+    Payment, Invoice, ConceptoFactura, BankStatement, StatementLine, CashClose, CashCloseLine,
+    ClaimBatch, InsuranceClaim, StoredBlob, Attachment, LabReport, LabResult,
+    DrugCatalogVersion, Drug, DrugInteraction, ArchivedConsultation, RequestProfile,
+)
+from .perfilado import ruta_perfil
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    En PostgreSQL usa la estimación del planificador (pg_class.reltuples) para
+    el total de un changelist sin filtros, en lugar de COUNT(*) sobre millones
+    de filas. Con filtros o en otros motores usa el conteo normal.
+    """
+    UMBRAL_ESTIMACION = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                fila = cursor.fetchone()
+            if fila and fila[0] >= self.UMBRAL_ESTIMACION:
+                return fila[0]
+        return super().count
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    """Base para changelists de tablas grandes"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+@admin.register(Clinic)
+class ClinicAdmin(ScalableAdmin):
+    list_display = ['nombre', 'clave', 'activa', 'fecha_creacion']
+    list_filter = ['activa']
+    search_fields = ['nombre', '=clave']
+    prepopulated_fields = {'clave': ['nombre']}
+
+@admin.register(Doctor)
+class DoctorAdmin(ScalableAdmin):
+    list_display = ['nombres', 'apellidos', 'especialidad', 'cedula_profesional', 'activo']
+    list_filter = ['activo', 'especialidad']
+    search_fields = ['^apellidos', '^nombres', '=cedula_profesional']
+    raw_id_fields = ['usuario']
+    readonly_fields = ['token_calendario']
+    actions = ['regenerar_token_calendario']
+
+    @admin.action(description='Regenerar enlace de calendario (revoca el anterior)')
+    def regenerar_token_calendario(self, request, queryset):
+        from .calendario import nuevo_token
+
+        for doctor in queryset.only('id'):
+            doctor.token_calendario = nuevo_token()
+            doctor.save(update_fields=['token_calendario'])
+        self.message_user(request, f'{queryset.count()} enlace(s) de calendario regenerado(s)', messages.SUCCESS)
+
+@admin.register(Patient)
+class PatientAdmin(ScalableAdmin):
+    list_display = ['id', 'apellidos', 'nombres', 'fecha_nacimiento', 'telefono_principal', 'activo', 'fecha_registro']
+    list_filter = ['activo', 'genero']
+    search_fields = ['^apellidos', '^nombres', '=telefono_principal', '=email']
+    date_hierarchy = 'fecha_registro'
+
+@admin.register(Consultation)
+class ConsultationAdmin(ScalableAdmin):
+    list_display = ['id', 'patient', 'doctor', 'fecha_consulta', 'tipo_consulta', 'estado']
+    list_filter = ['estado', 'tipo_consulta']
+    list_select_related = ['patient', 'doctor']
+    search_fields = ['=id', '^patient__apellidos', '^patient__nombres']
+    autocomplete_fields = ['patient', 'doctor']
+    date_hierarchy = 'fecha_consulta'
+
+@admin.register(MedicalRecord)
+class MedicalRecordAdmin(ScalableAdmin):
+    list_display = ['patient', 'fecha_actualizacion']
+    list_select_related = ['patient']
+    search_fields = ['^patient__apellidos', '^patient__nombres']
+    autocomplete_fields = ['patient']
+
+@admin.register(Prescription)
+class PrescriptionAdmin(ScalableAdmin):
+    list_display = ['medicamento', 'consultation', 'dosis', 'frecuencia', 'fecha_creacion']
+    list_select_related = ['consultation__patient']
+    search_fields = ['^medicamento']
+    raw_id_fields = ['consultation', 'drug']
+    date_hierarchy = 'fecha_creacion'
+
+@admin.register(UserProfile)
+class UserProfileAdmin(ScalableAdmin):
+    list_display = ['user', 'rol', 'clinic', 'especialidad', 'activo']
+    list_filter = ['rol', 'clinic', 'activo']
+    list_select_related = ['user', 'clinic']
+    search_fields = ['^user__username', '=cedula_profesional']
+    raw_id_fields = ['user']
+
+@admin.register(VitalSign)
+class VitalSignAdmin(ScalableAdmin):
+    list_display = ['patient', 'fecha_medicion', 'presion_sistolica', 'presion_diastolica', 'frecuencia_cardiaca', 'temperatura', 'peso']
+    list_select_related = ['patient']
+    raw_id_fields = ['patient', 'consultation']
+
+@admin.register(ClinicalTerm)
+class ClinicalTermAdmin(ScalableAdmin):
+    list_display = ['etiqueta', 'tipo', 'termino']
+    list_filter = ['tipo']
+    search_fields = ['^termino']
+
+@admin.register(ClinicalFact)
+class ClinicalFactAdmin(ScalableAdmin):
+    list_display = ['consultation_id', 'term', 'doctor', 'fecha', 'genero']
+    list_select_related = ['term', 'doctor']
+    raw_id_fields = ['consultation', 'term', 'patient', 'doctor']
+
+@admin.register(ClinicalNote)
+class ClinicalNoteAdmin(ScalableAdmin):
+    list_display = ['consultation_id', 'patient', 'doctor', 'fecha_consulta']
+    list_select_related = ['patient', 'doctor']
+    raw_id_fields = ['consultation', 'patient', 'doctor']
+    date_hierarchy = 'fecha_consulta'
+
+@admin.register(PatientBlockingKey)
+class PatientBlockingKeyAdmin(ScalableAdmin):
+    list_display = ['patient', 'tipo', 'clave']
+    list_filter = ['tipo']
+    list_select_related = ['patient']
+    search_fields = ['=clave']
+    raw_id_fields = ['patient']
+
+@admin.register(DuplicateCandidate)
+class DuplicateCandidateAdmin(ScalableAdmin):
+    list_display = ['paciente_a', 'paciente_b', 'puntaje', 'razones', 'estado', 'fecha_deteccion']
+    list_filter = ['estado']
+    list_select_related = ['paciente_a', 'paciente_b']
+    raw_id_fields = ['paciente_a', 'paciente_b']
+    actions = ['fusionar', 'descartar']
+
+    @admin.action(description='Fusionar (conservar el registro más antiguo)')
+    def fusionar(self, request, queryset):
+        from .duplicados import fusionar_pacientes
+
+        fusionados = 0
+        for candidato in queryset.filter(estado='pendiente').select_related('paciente_a', 'paciente_b'):
+            # Un par puede haber desaparecido al fusionar otro del mismo lote
+            if not DuplicateCandidate.objects.filter(pk=candidato.pk).exists():
+                continue
+            try:
+                fusionar_pacientes(candidato.paciente_a, candidato.paciente_b)
+            except ValueError as error:
+                self.message_user(request, f'{candidato}: {error}', messages.ERROR)
+                continue
+            fusionados += 1
+        self.message_user(request, f'{fusionados} par(es) fusionado(s)', messages.SUCCESS)
+
+    @admin.action(description='Descartar (no son la misma persona)')
+    def descartar(self, request, queryset):
+        total = queryset.update(estado='descartado')
+        self.message_user(request, f'{total} par(es) descartado(s)', messages.SUCCESS)
+
+@admin.register(Tombstone)
+class TombstoneAdmin(ScalableAdmin):
+    list_display = ['modelo', 'objeto_id', 'fecha_eliminacion']
+    list_filter = ['modelo']
+    search_fields = ['=objeto_id']
+    date_hierarchy = 'fecha_eliminacion'
+
+@admin.register(AgendaEvent)
+class AgendaEventAdmin(ScalableAdmin):
+    list_display = ['id', 'tipo', 'consulta_id', 'doctor_id', 'estado', 'estado_anterior', 'fecha_evento']
+    list_filter = ['tipo', 'estado']
+    search_fields = ['=consulta_id']
+
+@admin.register(AppointmentSeries)
+class AppointmentSeriesAdmin(ScalableAdmin):
+    list_display = ['patient', 'doctor', 'tipo_consulta', 'frecuencia', 'intervalo', 'fecha_inicio', 'materializada_hasta', 'activa']
+    list_filter = ['frecuencia', 'activa']
+    list_select_related = ['patient', 'doctor']
+    raw_id_fields = ['patient', 'doctor']
+    readonly_fields = ['materializada_hasta']
+
+class AgendaChangeInline(admin.TabularInline):
+    model = AgendaChange
+    extra = 0
+    can_delete = False
+    readonly_fields = ['consulta_id', 'accion', 'estado_anterior', 'fecha_anterior', 'fecha_nueva', 'doctor_anterior_id']
+
+@admin.register(AgendaOperation)
+class AgendaOperationAdmin(ScalableAdmin):
+    list_display = ['fecha', 'tipo', 'descripcion', 'usuario', 'afectadas']
+    list_filter = ['tipo']
+    list_select_related = ['usuario']
+    raw_id_fields = ['doctor', 'usuario']
+    readonly_fields = ['conflictos']
+    date_hierarchy = 'fecha'
+    inlines = [AgendaChangeInline]
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
-    list_display = ['id', 'consultation', 'monto_total', 'monto_pagado', 'estado', 'metodo_pago', 'fecha_creacion']
+class PaymentAdmin(ScalableAdmin):
+    list_display = ['id', 'consultation', 'monto_total', 'monto_pagado', 'estado', 'metodo_pago', 'fecha_creacion', 'fecha_conciliacion']
     list_filter = ['estado', 'metodo_pago', 'fecha_creacion']
-    search_fields = ['consultation__patient__nombres', 'consultation__patient__apellidos', 'referencia']
+    list_select_related = ['consultation__patient']
+    search_fields = ['=id', '^consultation__patient__apellidos', '^consultation__patient__nombres', '=referencia']
+    raw_id_fields = ['consultation', 'registrado_por']
     date_hierarchy = 'fecha_creacion'
 
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(ScalableAdmin):
     list_display = ['folio', 'cliente_nombre', 'total', 'tipo_comprobante', 'cancelada', 'fecha_emision']
     list_filter = ['tipo_comprobante', 'cancelada', 'fecha_emision']
-    search_fields = ['folio', 'cliente_nombre', 'cliente_rfc']
+    search_fields = ['=folio', '^cliente_nombre', '=cliente_rfc']
+    raw_id_fields = ['payment']
     date_hierarchy = 'fecha_emision'
 
 @admin.register(ConceptoFactura)
-class ConceptoFacturaAdmin(admin.ModelAdmin):
+class ConceptoFacturaAdmin(ScalableAdmin):
     list_display = ['factura', 'descripcion', 'cantidad', 'precio_unitario', 'importe']
-    search_fields = ['descripcion', 'factura__folio']
+    list_select_related = ['factura']
+    search_fields = ['descripcion', '=factura__folio']
+    raw_id_fields = ['factura']
+
+@admin.register(BankStatement)
+class BankStatementAdmin(ScalableAdmin):
+    list_display = ['fecha_importacion', 'clinic', 'origen', 'archivo', 'desde', 'hasta', 'lineas', 'conciliadas', 'excepciones']
+    list_filter = ['origen']
+    list_select_related = ['clinic']
+    readonly_fields = ['huella', 'usuario']
+    date_hierarchy = 'fecha_importacion'
+
+@admin.register(StatementLine)
+class StatementLineAdmin(ScalableAdmin):
+    list_display = ['statement', 'linea', 'fecha', 'monto', 'referencia', 'estado', 'payment']
+    list_filter = ['estado']
+    list_select_related = ['statement']
+    search_fields = ['=referencia']
+    raw_id_fields = ['statement', 'payment']
+
+class CashCloseLineInline(admin.TabularInline):
+    model = CashCloseLine
+    extra = 0
+    can_delete = False
+    fields = ['metodo_pago', 'usuario_nombre', 'pagos', 'cobrado', 'descuentos', 'reembolsos', 'num_reembolsos']
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(CashClose)
+class CashCloseAdmin(ScalableAdmin):
+    list_display = ['fecha', 'clinic', 'pagos', 'cobrado', 'descuentos', 'reembolsos', 'usuario', 'fecha_cierre']
+    list_select_related = ['usuario', 'clinic']
+    date_hierarchy = 'fecha'
+    inlines = [CashCloseLineInline]
+
+    # Los cortes se crean con cerrar_dia y no se editan ni se eliminan
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(ClaimBatch)
+class ClaimBatchAdmin(ScalableAdmin):
+    list_display = ['periodo', 'clinic', 'aseguradora', 'estado', 'reclamaciones', 'monto_reclamado', 'aceptadas', 'rechazadas', 'monto_aprobado']
+    list_filter = ['estado', 'periodo']
+    list_select_related = ['clinic']
+    search_fields = ['aseguradora']
+    readonly_fields = ['clave_aseguradora', 'usuario']
+
+@admin.register(InsuranceClaim)
+class InsuranceClaimAdmin(ScalableAdmin):
+    list_display = ['id', 'batch', 'numero_poliza', 'paciente', 'fecha_consulta', 'monto', 'estado', 'monto_aprobado']
+    list_filter = ['estado']
+    list_select_related = ['batch']
+    search_fields = ['=numero_poliza', '=folio_factura']
+    raw_id_fields = ['batch', 'consultation', 'payment']
+
+@admin.register(StoredBlob)
+class StoredBlobAdmin(ScalableAdmin):
+    list_display = ['sha256', 'tipo_mime', 'tamano', 'paginas', 'derivados', 'fecha_creacion']
+    list_filter = ['derivados', 'tipo_mime']
+    search_fields = ['=sha256']
+    readonly_fields = ['sha256', 'tamano', 'tipo_mime', 'paginas']
+
+@admin.register(Attachment)
+class AttachmentAdmin(ScalableAdmin):
+    list_display = ['nombre', 'patient', 'categoria', 'fecha_subida', 'usuario']
+    list_filter = ['categoria']
+    list_select_related = ['patient', 'usuario']
+    search_fields = ['^patient__apellidos', '^patient__nombres', 'nombre']
+    raw_id_fields = ['patient', 'consultation', 'blob', 'usuario']
+    date_hierarchy = 'fecha_subida'
+
+class LabResultInline(admin.TabularInline):
+    model = LabResult
+    extra = 0
+    fields = ['analito', 'nombre', 'valor', 'unidad', 'referencia', 'fuera_de_rango']
+    readonly_fields = ['analito', 'nombre']
+
+@admin.register(LabReport)
+class LabReportAdmin(ScalableAdmin):
+    list_display = ['nombre_archivo', 'clinic', 'estado', 'patient', 'nombre_detectado', 'fecha_reporte', 'origen', 'fecha_creacion']
+    list_filter = ['estado', 'origen']
+    list_select_related = ['patient', 'clinic']
+    search_fields = ['^patient__apellidos', '^nombre_detectado', 'nombre_archivo']
+    raw_id_fields = ['patient', 'blob', 'attachment', 'usuario']
+    readonly_fields = ['texto', 'raices', 'tomado_por', 'tomado_en', 'intentos', 'fecha_proceso']
+    date_hierarchy = 'fecha_creacion'
+    inlines = [LabResultInline]
+
+@admin.register(DrugCatalogVersion)
+class DrugCatalogVersionAdmin(ScalableAdmin):
+    list_display = ['id', 'version', 'medicamentos', 'interacciones', 'usuario', 'fecha']
+    list_select_related = ['usuario']
+
+    # Las versiones las crea importar_medicamentos
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Drug)
+class DrugAdmin(ScalableAdmin):
+    list_display = ['nombre', 'concentracion', 'presentacion', 'principios_activos', 'clave', 'activo']
+    list_filter = ['activo', 'via']
+    search_fields = ['=clave', '^nombre_normalizado', '^principios_activos']
+    readonly_fields = ['nombre_normalizado']
+
+@admin.register(DrugInteraction)
+class DrugInteractionAdmin(ScalableAdmin):
+    list_display = ['principio_a', 'principio_b', 'severidad']
+    list_filter = ['severidad']
+    search_fields = ['^principio_a', '^principio_b']
+
+@admin.register(ArchivedConsultation)
+class ArchivedConsultationAdmin(ScalableAdmin):
+    list_display = ['id', 'patient', 'fecha_consulta', 'estado', 'clinic', 'fecha_archivo']
+    list_select_related = ['patient', 'clinic']
+    list_filter = ['estado']
+    raw_id_fields = ['patient']
+    date_hierarchy = 'fecha_consulta'
+
+    # Las crea archivar_consultas
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(ScalableAdmin):
+    list_display = ['fecha', 'metodo', 'ruta', 'vista', 'usuario', 'modo', 'duracion_ms', 'consultas_sql', 'estado_http', 'descarga']
+    list_select_related = ['usuario']
+    list_filter = ['modo', 'vista']
+    search_fields = ['=id_peticion', 'ruta']
+
+    # Los crea PerfiladoMiddleware
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        return [
+            path('<int:perfil_id>/descargar/', self.admin_site.admin_view(self.descargar), name='mi_app_requestprofile_descargar'),
+            *super().get_urls(),
+        ]
+
+    @admin.display(description='Archivo')
+    def descarga(self, obj):
+        return format_html(
+            '<a href="{}">{}</a>',
+            reverse('admin:mi_app_requestprofile_descargar', args=[obj.id]),
+            os.path.basename(obj.archivo),
+        )
 
-# Register your models here.
+    def descargar(self, request, perfil_id):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        perfil = get_object_or_404(RequestProfile, id=perfil_id)
+        try:
+            archivo = open(ruta_perfil(perfil), 'rb')
+        except FileNotFoundError:
+            raise Http404('El archivo del perfil ya no existe')
+        return FileResponse(archivo, as_attachment=True, filename=os.path.basename(perfil.archivo))
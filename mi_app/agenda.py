@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Agenda por doctor.
+
+Las estadísticas del día salen de una sola consulta agrupada por doctor
+(agregación condicional por estado) y las consultas del día de otra, de modo
+que el número de queries no crece con el número de doctores.
+"""
+from datetime import datetime, time
+
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, Q
+from django.utils import timezone
+
+# Estados que ocupan tiempo en la agenda del doctor
+ESTADOS_OCUPAN_AGENDA = ['programada', 'en_curso', 'completada']
+
+
+def doctor_del_usuario(user):
+    """
+    Doctor ligado al usuario si su perfil es de doctor (por usuario o cédula);
+    None si no lo es, y quien llama no filtra. Un perfil de doctor sin Doctor
+    ligado no ve ninguna agenda (PermissionDenied), salvo un superusuario.
+    """
+    from .models import Doctor
+
+    perfil = getattr(user, 'profile', None)
+    if perfil is None or perfil.rol != 'doctor':
+        return None
+    filtro = Q(usuario_id=user.id)
+    if perfil.cedula_profesional:
+        filtro |= Q(cedula_profesional=perfil.cedula_profesional)
+    doctor = Doctor.objects.filter(filtro).order_by('-usuario_id').first()
+    if doctor is None and not user.is_superuser:
+        raise PermissionDenied('El usuario no está ligado a un doctor')
+    return doctor
+
+
+def rango_dia(fecha):
+    """Inicio y fin del día en la zona horaria de la clínica"""
+    inicio = timezone.make_aware(datetime.combine(fecha, time.min))
+    fin = timezone.make_aware(datetime.combine(fecha, time.max))
+    return inicio, fin
+
+
+def estadisticas_por_doctor(fecha, doctor_id=None):
+    """{doctor_id: {estado: n, ..., 'total': n, 'ocupadas': n}} con una consulta agrupada"""
+    from .models import Consultation
+
+    inicio, fin = rango_dia(fecha)
+    consultas = Consultation.objects.filter(fecha_consulta__gte=inicio, fecha_consulta__lte=fin)
+    if doctor_id:
+        consultas = consultas.filter(doctor_id=doctor_id)
+
+    conteos = {
+        estado: Count('id', filter=Q(estado=estado))
+        for estado, _ in Consultation.ESTADO_CHOICES
+    }
+    filas = consultas.order_by().values('doctor_id').annotate(
+        total=Count('id'),
+        ocupadas=Count('id', filter=Q(estado__in=ESTADOS_OCUPAN_AGENDA)),
+        **conteos
+    )
+    return {fila.pop('doctor_id'): fila for fila in filas}
+
+
+def agenda_por_doctor(fecha, doctor_id=None):
+    """
+    Agenda del día agrupada por doctor con conteos por estado y utilización.
+
+    Devuelve (agenda, consultas): `agenda` es una lista de dicts por doctor y
+    `consultas` la lista plana del día (ya con pagos precargados).
+    """
+    from .models import Consultation, Doctor
+
+    estadisticas = estadisticas_por_doctor(fecha, doctor_id)
+
+    doctores = Doctor.objects.filter(Q(activo=True) | Q(id__in=estadisticas.keys())).only(
+        'id', 'nombres', 'apellidos', 'especialidad', 'hora_inicio', 'hora_fin', 'duracion_consulta',
+    ).order_by('apellidos', 'nombres')
+    if doctor_id:
+        doctores = doctores.filter(id=doctor_id)
+
+    inicio, fin = rango_dia(fecha)
+    consultas = Consultation.objects.para_agenda().filter(
+        fecha_consulta__gte=inicio,
+        fecha_consulta__lte=fin,
+    ).order_by('fecha_consulta')
+    if doctor_id:
+        consultas = consultas.filter(doctor_id=doctor_id)
+    consultas = list(consultas)
+
+    por_doctor = {}
+    for consulta in consultas:
+        por_doctor.setdefault(consulta.doctor_id, []).append(consulta)
+
+    vacio = {estado: 0 for estado, _ in Consultation.ESTADO_CHOICES}
+    agenda = []
+    for doctor in doctores:
+        stats = estadisticas.get(doctor.id, {**vacio, 'total': 0, 'ocupadas': 0})
+        minutos_reservados = stats['ocupadas'] * doctor.duracion_consulta
+        minutos_disponibles = doctor.minutos_jornada
+        agenda.append({
+            'doctor': doctor,
+            'stats': stats,
+            'consultas': por_doctor.get(doctor.id, []),
+            'minutos_reservados': minutos_reservados,
+            'minutos_disponibles': minutos_disponibles,
+            'utilizacion': round(100 * minutos_reservados / minutos_disponibles) if minutos_disponibles else 0,
+        })
+    return agenda, consultas
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Analítica clínica sobre diagnósticos y recetas.
+
+Consultation.diagnostico y Prescription.medicamento son texto libre. Al
+completarse una consulta se normalizan en términos (ClinicalTerm) y se
+registra un hecho por término (ClinicalFact) con los datos del paciente y
+doctor desnormalizados; los reportes son consultas agrupadas sobre esa tabla
+angosta e indexada en lugar de recorrer las consultas completas.
+"""
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, Value, When
+from django.utils import timezone
+
+from .querysets import restar_anios
+
+# Grupos de edad para cohortes: (etiqueta, edad mínima)
+GRUPOS_EDAD = [
+    ('0-17', 0),
+    ('18-29', 18),
+    ('30-44', 30),
+    ('45-59', 45),
+    ('60+', 60),
+]
+
+_SEPARADORES_DIAGNOSTICO = re.compile(r'[\n;,]+')
+_VINETA = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s*')
+_NO_ALFANUMERICO = re.compile(r'[^a-z0-9 ]+')
+_ESPACIOS = re.compile(r'\s+')
+_DOSIS = re.compile(r'[\d(]')
+
+
+def normalizar_termino(texto):
+    """Minúsculas, sin acentos ni signos y con espacios colapsados"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = _NO_ALFANUMERICO.sub(' ', texto)
+    return _ESPACIOS.sub(' ', texto).strip()[:200]
+
+
+def terminos_diagnostico(texto):
+    """Separa un diagnóstico libre en términos: [(termino, etiqueta), ...]"""
+    terminos = {}
+    for parte in _SEPARADORES_DIAGNOSTICO.split(texto or ''):
+        etiqueta = _VINETA.sub('', parte).strip()
+        termino = normalizar_termino(etiqueta)
+        if termino and termino not in terminos:
+            terminos[termino] = etiqueta[:200]
+    return list(terminos.items())
+
+
+def termino_medicamento(texto):
+    """Nombre del medicamento sin dosis ni presentación: 'Paracetamol 500mg' -> 'paracetamol'"""
+    etiqueta = _DOSIS.split(texto or '', maxsplit=1)[0].strip()
+    termino = normalizar_termino(etiqueta)
+    if not termino:
+        return None
+    return termino, etiqueta[:200]
+
+
+def expresion_grupo_edad(campo='fecha_nacimiento', hoy=None):
+    """
+    Expresión SQL con el grupo de edad a partir de la fecha de nacimiento.
+
+    La edad se traduce a rangos de `campo` relativos a hoy (zona horaria de
+    la clínica), de modo que la comparación es directa sobre la columna.
+    """
+    hoy = hoy or timezone.localdate()
+    casos = []
+    for (etiqueta, _), (_, edad_siguiente) in zip(GRUPOS_EDAD, GRUPOS_EDAD[1:]):
+        casos.append(When(**{f'{campo}__gt': restar_anios(hoy, edad_siguiente)}, then=Value(etiqueta)))
+    return Case(*casos, default=Value(GRUPOS_EDAD[-1][0]), output_field=CharField())
+
+
+def _terminos_de_consulta(consulta):
+    """Términos (tipo, termino, etiqueta) de una consulta completada"""
+    terminos = [('diagnostico', t, e) for t, e in terminos_diagnostico(consulta.diagnostico)]
+    for receta in consulta.prescription_set.all():
+        medicamento = termino_medicamento(receta.medicamento)
+        if medicamento:
+            terminos.append(('medicamento', *medicamento))
+    return terminos
+
+
+def _obtener_terminos(claves):
+    """Devuelve {(tipo, termino): id}, creando en bloque los que falten"""
+    from .models import ClinicalTerm
+
+    if not claves:
+        return {}
+    por_tipo = {}
+    for tipo, termino, _ in claves:
+        por_tipo.setdefault(tipo, set()).add(termino)
+
+    def consultar():
+        ids = {}
+        for tipo, terminos in por_tipo.items():
+            for term_id, termino in ClinicalTerm.objects.filter(
+                tipo=tipo, termino__in=terminos
+            ).values_list('id', 'termino'):
+                ids[(tipo, termino)] = term_id
+        return ids
+
+    ids = consultar()
+    faltantes = {(t, n): e for t, n, e in claves if (t, n) not in ids}
+    if faltantes:
+        ClinicalTerm.objects.bulk_create(
+            [ClinicalTerm(tipo=t, termino=n, etiqueta=e) for (t, n), e in faltantes.items()],
+            ignore_conflicts=True,
+        )
+        ids = consultar()
+    return ids
+
+
+def registrar_consultas(consultas):
+    """
+    (Re)genera los hechos clínicos de un lote de consultas.
+
+    Las consultas que no estén completadas simplemente pierden sus hechos.
+    Se espera que `consultas` traiga patient y prescription_set precargados.
+    """
+    from .models import ClinicalFact
+
+    consultas = list(consultas)
+    if not consultas:
+        return 0
+
+    terminos_por_consulta = {
+        c.id: _terminos_de_consulta(c) for c in consultas if c.estado == 'completada'
+    }
+    ids = _obtener_terminos([t for lista in terminos_por_consulta.values() for t in lista])
+
+    hechos = []
+    for consulta in consultas:
+        if consulta.id not in terminos_por_consulta:
+            continue
+        fecha = timezone.localtime(consulta.fecha_consulta).date()
+        term_ids = {ids[(tipo, termino)] for tipo, termino, _ in terminos_por_consulta[consulta.id]}
+        for term_id in term_ids:
+            hechos.append(ClinicalFact(
+                consultation_id=consulta.id,
+                term_id=term_id,
+                patient_id=consulta.patient_id,
+                doctor_id=consulta.doctor_id,
+                fecha=fecha,
+                mes=fecha.replace(day=1),
+                genero=consulta.patient.genero,
+                fecha_nacimiento=consulta.patient.fecha_nacimiento,
+                clinic_id=consulta.clinic_id,
+            ))
+
+    with transaction.atomic():
+        ClinicalFact.objects.filter(consultation_id__in=[c.id for c in consultas]).delete()
+        ClinicalFact.objects.bulk_create(hechos)
+    return len(hechos)
+
+
+def registrar_consulta(consulta):
+    """Actualiza los hechos de una sola consulta (llamado desde señales)"""
+    from .models import Consultation
+
+    consulta = Consultation.objects.select_related('patient').prefetch_related(
+        'prescription_set'
+    ).get(pk=consulta.pk)
+    return registrar_consultas([consulta])
+
+
+# ==================== REPORTES ====================
+
+def top_diagnosticos(desde, hasta, doctor_id=None, por_doctor=False, limite=10):
+    """Diagnósticos más frecuentes por mes (y opcionalmente por doctor)"""
+    from .models import ClinicalFact
+
+    hechos = ClinicalFact.objects.filter(
+        term__tipo='diagnostico',
+        mes__gte=desde.replace(day=1),
+        mes__lte=hasta,
+    )
+    if doctor_id:
+        hechos = hechos.filter(doctor_id=doctor_id)
+
+    campos = ['mes', 'term_id', 'term__etiqueta']
+    if por_doctor:
+        campos.append('doctor_id')
+    filas = hechos.values(*campos).annotate(total=Count('id')).order_by('mes', '-total')
+
+    resultado = {}
+    for fila in filas:
+        clave = (fila['mes'].strftime('%Y-%m'), fila.get('doctor_id'))
+        grupo = resultado.setdefault(clave, [])
+        if len(grupo) < limite:
+            grupo.append({
+                'termino_id': fila['term_id'],
+                'diagnostico': fila['term__etiqueta'],
+                'total': fila['total'],
+            })
+    return [
+        {'mes': mes, 'doctor_id': doctor, 'diagnosticos': grupo}
+        for (mes, doctor), grupo in resultado.items()
+    ]
+
+
+def pacientes_con_medicamento(nombre, limite=200):
+    """Pacientes a los que se les ha recetado un medicamento (por nombre o prefijo)"""
+    from .models import ClinicalFact, Patient
+
+    termino = normalizar_termino(nombre)
+    if not termino:
+        return Patient.objects.none()
+    pacientes_ids = ClinicalFact.objects.filter(
+        term__tipo='medicamento',
+        term__termino__startswith=termino,
+    ).values('patient_id')
+    return Patient.objects.filter(id__in=pacientes_ids).only(
+        'id', 'nombres', 'apellidos', 'fecha_nacimiento', 'genero'
+    )[:limite]
+
+
+def cohortes(termino_id=None, desde=None, hasta=None):
+    """Pacientes y consultas por grupo de edad y género, en una consulta agrupada"""
+    from .models import ClinicalFact
+
+    hechos = ClinicalFact.objects.all()
+    if termino_id:
+        hechos = hechos.filter(term_id=termino_id)
+    if desde:
+        hechos = hechos.filter(fecha__gte=desde)
+    if hasta:
+        hechos = hechos.filter(fecha__lte=hasta)
+
+    filas = hechos.annotate(
+        grupo_edad=expresion_grupo_edad()
+    ).values('grupo_edad', 'genero').annotate(
+        pacientes=Count('patient_id', distinct=True),
+        consultas=Count('consultation_id', distinct=True),
+    ).order_by('grupo_edad', 'genero')
+    return list(filas)
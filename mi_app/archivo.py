@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Archivo de consultas antiguas.
+
+Las consultas cerradas (completadas, canceladas o de inasistencia) de hace
+más de ANIOS años salen de las tablas calientes: cada una se copia, con sus
+recetas, pagos, facturas y reclamaciones de lotes cerrados, a un documento
+de ArchivedConsultation con el mismo id, y se borran las filas originales.
+Las tablas de consultas, pagos y recetas —y sus índices— quedan del tamaño
+de los años en uso. No se archivan consultas con pagos por cobrar ni con
+reclamaciones en un lote que la aseguradora no ha cerrado.
+
+El trabajo va por lotes de LOTE consultas, cada uno en su transacción: si
+el proceso se interrumpe, lo archivado queda completo y la siguiente
+ejecución sigue con lo que falta (la elegibilidad depende solo de los
+datos). Los borrados van sin señales: archivar no es una baja, así que no
+deja Tombstone ni evento de agenda. Los signos vitales y los adjuntos se
+quedan en el expediente, desligados de la consulta; los hechos de analítica
+de la consulta se borran con ella.
+
+La lectura es transparente: `consultas_archivadas` y `consulta_archivada`
+reconstruyen instancias de Consultation (sin guardar, con `archivada=True`)
+para el historial del paciente y el detalle de la consulta.
+"""
+from collections import Counter, defaultdict
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .querysets import restar_anios
+
+ANIOS = 5
+LOTE = 500
+
+ESTADOS_CERRADOS = ('completada', 'cancelada', 'no_asistio')
+ESTADOS_PAGO_ABIERTOS = ('pendiente', 'parcial')
+
+
+class CodificadorArchivo(DjangoJSONEncoder):
+    """Como DjangoJSONEncoder, pero sin recortar los microsegundos de las fechas"""
+
+    def default(self, o):
+        if isinstance(o, (datetime, time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def fecha_corte(anios=ANIOS, hoy=None):
+    """Primer instante que no se archiva: se archiva lo anterior"""
+    inicio = restar_anios(hoy or timezone.localdate(), anios)
+    return timezone.make_aware(datetime.combine(inicio, time.min))
+
+
+def archivables(corte):
+    """Consultas cerradas anteriores a `corte` sin pagos por cobrar ni reclamaciones en trámite"""
+    from .models import Consultation, InsuranceClaim, Payment
+
+    pagos_abiertos = Payment._base_manager.filter(
+        consultation=OuterRef('pk'), estado__in=ESTADOS_PAGO_ABIERTOS
+    )
+    en_tramite = InsuranceClaim._base_manager.filter(consultation=OuterRef('pk')).exclude(batch__estado='cerrado')
+    return (
+        Consultation.objects
+        .filter(fecha_consulta__lt=corte, estado__in=ESTADOS_CERRADOS)
+        .exclude(Exists(pagos_abiertos))
+        .exclude(Exists(en_tramite))
+    )
+
+
+def _columnas(modelo):
+    return [campo.attname for campo in modelo._meta.concrete_fields]
+
+
+def _agrupar(filas, llave):
+    grupos = defaultdict(list)
+    for fila in filas:
+        grupos[fila[llave]].append(fila)
+    return grupos
+
+
+def _borrar(queryset):
+    # DELETE directo, sin cargar instancias ni enviar señales (ver docstring)
+    return queryset._raw_delete(queryset.db)
+
+
+def _archivar_lote(corte, desde, cantidad):
+    """Archiva hasta `cantidad` consultas con id > `desde`; devuelve (ids, conteos)"""
+    from .models import (
+        ArchivedConsultation, Attachment, ClinicalFact, ClinicalNote, ConceptoFactura,
+        Consultation, InsuranceClaim, Invoice, Payment, Prescription, StatementLine,
+        VitalSign,
+    )
+
+    with transaction.atomic():
+        ids = list(
+            archivables(corte).filter(id__gt=desde).select_for_update()
+            .order_by('id').values_list('id', flat=True)[:cantidad]
+        )
+        if not ids:
+            return ids, Counter()
+
+        consultas = Consultation._base_manager.filter(id__in=ids).order_by('id').values(*_columnas(Consultation))
+        recetas = _agrupar(
+            Prescription._base_manager.filter(consultation_id__in=ids).order_by('id').values(*_columnas(Prescription)),
+            'consultation_id',
+        )
+        pagos = list(Payment._base_manager.filter(consultation_id__in=ids).order_by('id').values(*_columnas(Payment)))
+        id_pagos = [pago['id'] for pago in pagos]
+        facturas = {
+            factura['payment_id']: factura
+            for factura in Invoice.objects.filter(payment_id__in=id_pagos).values(*_columnas(Invoice))
+        }
+        id_facturas = [factura['id'] for factura in facturas.values()]
+        conceptos = _agrupar(
+            ConceptoFactura.objects.filter(factura_id__in=id_facturas).order_by('id').values(*_columnas(ConceptoFactura)),
+            'factura_id',
+        )
+        reclamaciones = _agrupar(
+            InsuranceClaim._base_manager.filter(consultation_id__in=ids).order_by('id').values(*_columnas(InsuranceClaim)),
+            'consultation_id',
+        )
+
+        pagos_por_consulta = defaultdict(list)
+        for pago in pagos:
+            factura = facturas.get(pago['id'])
+            if factura is not None:
+                factura['conceptos'] = conceptos.get(factura['id'], [])
+            pago['factura'] = factura
+            pagos_por_consulta[pago['consultation_id']].append(pago)
+
+        ArchivedConsultation.objects.bulk_create([
+            ArchivedConsultation(
+                id=consulta['id'],
+                patient_id=consulta['patient_id'],
+                clinic_id=consulta['clinic_id'],
+                fecha_consulta=consulta['fecha_consulta'],
+                estado=consulta['estado'],
+                datos={
+                    'consulta': consulta,
+                    'recetas': recetas.get(consulta['id'], []),
+                    'pagos': pagos_por_consulta.get(consulta['id'], []),
+                    'reclamaciones': reclamaciones.get(consulta['id'], []),
+                },
+            )
+            for consulta in consultas
+        ])
+
+        # Lo que se queda en las tablas calientes pierde la referencia
+        VitalSign.objects.filter(consultation_id__in=ids).update(consultation=None)
+        Attachment._base_manager.filter(consultation_id__in=ids).update(consultation=None)
+        StatementLine._base_manager.filter(payment_id__in=id_pagos).update(payment=None)
+        InsuranceClaim._base_manager.filter(payment_id__in=id_pagos).exclude(consultation_id__in=ids).update(payment=None)
+
+        _borrar(ConceptoFactura.objects.filter(factura_id__in=id_facturas))
+        _borrar(Invoice.objects.filter(id__in=id_facturas))
+        _borrar(InsuranceClaim._base_manager.filter(consultation_id__in=ids))
+        _borrar(Payment._base_manager.filter(id__in=id_pagos))
+        _borrar(Prescription._base_manager.filter(consultation_id__in=ids))
+        _borrar(ClinicalFact._base_manager.filter(consultation_id__in=ids))
+        _borrar(ClinicalNote.objects.filter(consultation_id__in=ids))
+        _borrar(Consultation._base_manager.filter(id__in=ids))
+
+    return ids, Counter(
+        consultas=len(ids),
+        recetas=sum(map(len, recetas.values())),
+        pagos=len(id_pagos),
+        facturas=len(id_facturas),
+        reclamaciones=sum(map(len, reclamaciones.values())),
+    )
+
+
+def archivar(corte, lote=LOTE, limite=None, avance=None):
+    """Archiva las consultas elegibles anteriores a `corte`; devuelve los conteos por tabla"""
+    totales = Counter()
+    desde = 0
+    while limite is None or totales['consultas'] < limite:
+        cantidad = lote if limite is None else min(lote, limite - totales['consultas'])
+        ids, conteos = _archivar_lote(corte, desde, cantidad)
+        if not ids:
+            break
+        totales.update(conteos)
+        desde = ids[-1]
+        if avance:
+            avance(totales)
+    return totales
+
+
+# ---------- Lectura ----------
+
+def _instancia(modelo, datos):
+    objeto = modelo(**{
+        campo.attname: campo.to_python(datos[campo.attname])
+        for campo in modelo._meta.concrete_fields
+        if campo.attname in datos
+    })
+    objeto._state.adding = False
+    objeto.archivada = True
+    return objeto
+
+
+def _reconstruir(archivadas, paciente=None):
+    from .models import Consultation, Doctor, Payment, Prescription
+
+    consultas = []
+    for archivada in archivadas:
+        consulta = _instancia(Consultation, archivada.datos['consulta'])
+        consulta.recetas = [_instancia(Prescription, receta) for receta in archivada.datos['recetas']]
+        consulta.pagos_archivados = [_instancia(Payment, pago) for pago in archivada.datos['pagos']]
+        for relacionado in consulta.recetas + consulta.pagos_archivados:
+            relacionado.consultation = consulta
+        if paciente is not None:
+            consulta.patient = paciente
+        consultas.append(consulta)
+
+    # El doctor sigue en las tablas calientes (o ya no existe)
+    doctores = Doctor._base_manager.in_bulk({consulta.doctor_id for consulta in consultas})
+    for consulta in consultas:
+        if consulta.doctor_id in doctores:
+            consulta.doctor = doctores[consulta.doctor_id]
+    return consultas
+
+
+def consultas_archivadas(paciente, limite=None, estado=None):
+    """Consultas archivadas del paciente, de la más reciente a la más antigua"""
+    from .models import ArchivedConsultation
+
+    archivadas = ArchivedConsultation.objects.filter(patient=paciente)
+    if estado:
+        archivadas = archivadas.filter(estado=estado)
+    return _reconstruir(archivadas.order_by('-fecha_consulta')[:limite], paciente)
+
+
+def consulta_archivada(consulta_id):
+    """Consulta archivada por su id original, o None"""
+    from .models import ArchivedConsultation
+
+    archivada = ArchivedConsultation.objects.filter(id=consulta_id).first()
+    if archivada is None:
+        return None
+    return _reconstruir([archivada])[0]
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+Búsqueda de texto completo sobre notas clínicas.
+
+Al guardar una consulta (o sus recetas) su texto clínico se normaliza en
+Python —sin acentos y reducido a raíces en español— y se guarda en
+ClinicalNote. El motor solo indexa esas raíces: FTS5 en SQLite y un índice
+GIN sobre to_tsvector('simple', ...) en PostgreSQL, así ambos motores
+encuentran exactamente lo mismo. Los resultados salen ordenados por fecha
+de consulta, de la más reciente a la más antigua (una consulta capturada o
+reprogramada después conserva su lugar por fecha, no por id); el índice
+(fecha_consulta, consultation) de ClinicalNote da ese orden, y los de
+(doctor, fecha_consulta) y (patient, fecha_consulta) cuando hay filtro.
+"""
+import re
+from functools import lru_cache
+
+from django.db import connection
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .analitica import normalizar_termino
+from .clinicas import clinica_actual
+
+TABLA_FTS = 'mi_app_clinicalnote_fts'
+
+POR_PAGINA = 20
+
+# Palabras alrededor de la primera coincidencia en el fragmento
+ANCHO_FRAGMENTO = 12
+
+# Campos de la consulta que forman la nota
+CAMPOS_NOTA = ('diagnostico', 'sintomas', 'tratamiento', 'observaciones')
+
+# Sufijos derivativos y flexivos, de más largo a más corto
+_SUFIJOS = (
+    'amientos', 'imientos', 'aciones', 'uciones', 'amiento', 'imiento',
+    'idades', 'acion', 'ucion', 'mente', 'ables', 'ibles', 'istas', 'ismos',
+    'idad', 'able', 'ible', 'ista', 'ismo', 'osos', 'osas', 'ivos', 'ivas',
+    'icos', 'icas', 'oso', 'osa', 'ivo', 'iva', 'ico', 'ica', 'es', 's',
+)
+_VOCAL_FINAL = re.compile(r'[aeio]$')
+
+_STOPWORDS = frozenset(
+    'de la el los las y o en con por para sin un una unos unas del al se su sus '
+    'que no es lo le les a como mas muy'.split()
+)
+
+
+def raiz(palabra):
+    """Raíz aproximada de una palabra ya normalizada: 'asmáticos' -> 'asmat'"""
+    for sufijo in _SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= 3:
+            palabra = palabra[:-len(sufijo)]
+            break
+    if len(palabra) > 3:
+        palabra = _VOCAL_FINAL.sub('', palabra)
+    return palabra
+
+
+@lru_cache(maxsize=50000)
+def _raices_palabra(palabra):
+    # El vocabulario clínico se repite mucho: cada palabra se normaliza una vez
+    return tuple(raiz(p) for p in normalizar_termino(palabra).split() if p not in _STOPWORDS)
+
+
+def raices(texto):
+    """Lista de raíces de un texto (sin acentos, signos ni palabras vacías)"""
+    # Palabra por palabra: normalizar_termino recorta a 200 caracteres
+    return [r for palabra in (texto or '').split() for r in _raices_palabra(palabra)]
+
+
+def texto_consulta(consulta, recetas=None):
+    """Texto clínico completo de una consulta, incluidas sus recetas"""
+    if recetas is None:
+        recetas = consulta.prescription_set.values_list('medicamento', 'indicaciones')
+    partes = [getattr(consulta, campo) or '' for campo in CAMPOS_NOTA]
+    partes.extend(f'{medicamento} {indicaciones}' for medicamento, indicaciones in recetas)
+    return '\n'.join(p for p in partes if p.strip())
+
+
+def indexar_consulta(consulta, recetas=None):
+    """Crea, actualiza o elimina la nota indexada de una consulta"""
+    from .models import ClinicalNote
+
+    texto = ' '.join(raices(texto_consulta(consulta, recetas)))
+    if not texto:
+        ClinicalNote.objects.filter(consultation_id=consulta.pk).delete()
+        return None
+    nota, _ = ClinicalNote.objects.update_or_create(
+        consultation_id=consulta.pk,
+        defaults={
+            'patient_id': consulta.patient_id,
+            'doctor_id': consulta.doctor_id,
+            'fecha_consulta': consulta.fecha_consulta,
+            'raices': texto,
+        },
+    )
+    return nota
+
+
+def _consulta_motor(terminos):
+    """Expresión de búsqueda del motor: todas las raíces, cada una como prefijo"""
+    if connection.vendor == 'postgresql':
+        return ' & '.join(f'{t}:*' for t in terminos)
+    return ' AND '.join(f'"{t}"*' for t in terminos)
+
+
+def buscar_ids(consulta, doctor_id=None, patient_id=None, desde=None, hasta=None,
+               pagina=1, por_pagina=POR_PAGINA):
+    """Ids de consulta que contienen todas las palabras, de la más reciente a la más antigua"""
+    terminos = sorted(set(raices(consulta)))
+    if not terminos:
+        return []
+
+    filtros, parametros = [], [_consulta_motor(terminos)]
+    if connection.vendor == 'postgresql':
+        sql = (
+            "SELECT n.consultation_id FROM mi_app_clinicalnote n "
+            "WHERE to_tsvector('simple', n.raices) @@ to_tsquery('simple', %s)"
+        )
+    elif connection.vendor == 'sqlite':
+        sql = (
+            f"SELECT n.consultation_id FROM {TABLA_FTS} f "
+            f"JOIN mi_app_clinicalnote n ON n.consultation_id = f.rowid "
+            f"WHERE {TABLA_FTS} MATCH %s"
+        )
+    else:
+        # Otros motores (MariaDB): sin índice de texto, LIKE sobre las raíces
+        sql = "SELECT n.consultation_id FROM mi_app_clinicalnote n WHERE " + ' AND '.join(
+            ['n.raices LIKE %s'] * len(terminos)
+        )
+        parametros = [f'%{t}%' for t in terminos]
+
+    if doctor_id:
+        filtros.append('n.doctor_id = %s')
+        parametros.append(doctor_id)
+    elif clinica_actual() is not None:
+        # SQL directo: el manager no filtra; la consulta es de la clínica de su doctor
+        filtros.append('n.doctor_id IN (SELECT id FROM mi_app_doctor WHERE clinic_id = %s)')
+        parametros.append(clinica_actual())
+    if patient_id:
+        filtros.append('n.patient_id = %s')
+        parametros.append(patient_id)
+    if desde:
+        filtros.append('n.fecha_consulta >= %s')
+        parametros.append(connection.ops.adapt_datetimefield_value(desde))
+    if hasta:
+        filtros.append('n.fecha_consulta <= %s')
+        parametros.append(connection.ops.adapt_datetimefield_value(hasta))
+    for filtro in filtros:
+        sql += f' AND {filtro}'
+    sql += ' ORDER BY n.fecha_consulta DESC, n.consultation_id DESC LIMIT %s OFFSET %s'
+    parametros += [por_pagina, (max(pagina, 1) - 1) * por_pagina]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+        return [fila[0] for fila in cursor.fetchall()]
+
+
+def fragmento(texto, terminos, ancho=ANCHO_FRAGMENTO):
+    """Fragmento HTML alrededor de la primera coincidencia con las palabras resaltadas"""
+    palabras = texto.split()
+    marcadas, primera = [], None
+    for i, palabra in enumerate(palabras):
+        coincide = any(
+            raiz(parte).startswith(t) for parte in normalizar_termino(palabra).split() for t in terminos
+        )
+        if coincide and primera is None:
+            primera = i
+        marcadas.append(f'<mark>{escape(palabra)}</mark>' if coincide else escape(palabra))
+    if primera is None:
+        return ''
+    inicio = max(primera - ancho // 2, 0)
+    fin = min(inicio + ancho, len(palabras))
+    return mark_safe(
+        ('… ' if inicio else '') + ' '.join(marcadas[inicio:fin]) + (' …' if fin < len(palabras) else '')
+    )
+
+
+def buscar(consulta, pagina=1, por_pagina=POR_PAGINA, **filtros):
+    """
+    Página de resultados: [{'consulta', 'fragmentos': {campo: html}}, ...].
+
+    Los fragmentos se calculan solo para la página, a partir del texto
+    original de la consulta y sus recetas (dos consultas más).
+    """
+    from .models import Consultation, Prescription
+
+    ids = buscar_ids(consulta, pagina=pagina, por_pagina=por_pagina, **filtros)
+    if not ids:
+        return []
+    terminos = sorted(set(raices(consulta)))
+
+    consultas = Consultation.objects.select_related('patient', 'doctor').only(
+        'id', 'fecha_consulta', 'estado', 'tipo_consulta', *CAMPOS_NOTA,
+        'patient__id', 'patient__nombres', 'patient__apellidos',
+        'doctor__id', 'doctor__nombres', 'doctor__apellidos',
+    ).in_bulk(ids)
+    recetas = {}
+    for consulta_id, medicamento, indicaciones in Prescription.objects.filter(
+        consultation_id__in=ids
+    ).values_list('consultation_id', 'medicamento', 'indicaciones'):
+        recetas.setdefault(consulta_id, []).append(f'{medicamento} {indicaciones}')
+
+    resultados = []
+    for consulta_id in ids:
+        objeto = consultas.get(consulta_id)
+        if objeto is None:
+            continue
+        textos = {campo: getattr(objeto, campo) or '' for campo in CAMPOS_NOTA}
+        textos['recetas'] = '; '.join(recetas.get(consulta_id, []))
+        fragmentos = {campo: fragmento(texto, terminos) for campo, texto in textos.items()}
+        resultados.append({
+            'consulta': objeto,
+            'fragmentos': {campo: html for campo, html in fragmentos.items() if html},
+        })
+    return resultados
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+Feeds iCalendar (.ics) por doctor para los calendarios del teléfono.
+
+El feed se autentica con un token por doctor en la URL (los clientes de
+calendario no manejan sesiones) y cubre una ventana fija alrededor de hoy,
+leída por rango del índice (doctor, fecha_consulta). Su huella es una sola
+consulta agregada —máximo de fecha_actualizacion y conteo de la ventana—:
+de ahí salen el ETag (los clientes que ya lo tienen reciben 304) y la llave
+de caché del cuerpo generado. Como la llave cambia con cualquier alta,
+cambio o baja, la caché se invalida sola y nunca sirve un feed viejo, aunque
+sea memoria local de cada worker.
+"""
+import hashlib
+import secrets
+from datetime import timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from .agenda import rango_dia
+from .clinicas import llave_cache
+
+# Ventana del feed alrededor de hoy
+DIAS_PASADOS = 30
+DIAS_FUTUROS = 180
+
+# Los clientes vuelven a pedir el feed cada 15 minutos
+INTERVALO_ACTUALIZACION = 'PT15M'
+
+# Vida en caché de un cuerpo generado (la huella ya lo invalida al cambiar)
+DURACION_CACHE = 60 * 60 * 24
+
+FILAS_POR_LOTE = 500
+
+_ESTADOS_ICAL = {
+    'programada': 'CONFIRMED',
+    'en_curso': 'CONFIRMED',
+    'completada': 'CONFIRMED',
+    'cancelada': 'CANCELLED',
+    'no_asistio': 'CANCELLED',
+}
+
+
+def nuevo_token():
+    return secrets.token_urlsafe(32)
+
+
+def doctor_por_token(token):
+    from .models import Doctor
+
+    if not token:
+        return None
+    return Doctor.objects.filter(token_calendario=token, activo=True).only(
+        'id', 'nombres', 'apellidos', 'duracion_consulta', 'clinic_id',
+    ).first()
+
+
+def _ventana():
+    hoy = timezone.localdate()
+    inicio, _ = rango_dia(hoy - timedelta(days=DIAS_PASADOS))
+    _, fin = rango_dia(hoy + timedelta(days=DIAS_FUTUROS))
+    return inicio, fin
+
+
+def _consultas(doctor_id):
+    from .models import Consultation
+
+    return Consultation.objects.filter(doctor_id=doctor_id, fecha_consulta__range=_ventana()).order_by()
+
+
+def huella(doctor):
+    """Huella del feed: cambia con cualquier alta, cambio o baja en la ventana (una consulta)"""
+    estado = _consultas(doctor.id).aggregate(ultima=Max('fecha_actualizacion'), total=Count('id'))
+    texto = f"{doctor.id}|{doctor.duracion_consulta}|{timezone.localdate()}|{estado['ultima']}|{estado['total']}"
+    return hashlib.md5(texto.encode()).hexdigest()
+
+
+def _escapar(texto):
+    """Escapa un valor TEXT (RFC 5545 §3.3.11)"""
+    return (
+        texto.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def _linea(linea):
+    """Línea terminada en CRLF y plegada a 75 octetos (RFC 5545 §3.1)"""
+    datos = linea.encode()
+    if len(datos) <= 75:
+        return linea + '\r\n'
+    partes, actual = [], ''
+    for caracter in linea:
+        limite = 75 if not partes else 74
+        if len((actual + caracter).encode()) > limite:
+            partes.append(actual)
+            actual = caracter
+        else:
+            actual += caracter
+    partes.append(actual)
+    return '\r\n '.join(partes) + '\r\n'
+
+
+def _utc(fecha):
+    return fecha.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _iniciales(nombres, apellidos):
+    return ''.join(parte[0] for parte in f'{nombres} {apellidos}'.split() if parte).upper()
+
+
+def generar(doctor, url_consulta=None):
+    """
+    Genera el .ics línea por línea, leyendo las consultas por lotes.
+
+    Por privacidad el resumen solo lleva el tipo de consulta y las iniciales
+    del paciente; el detalle queda detrás del inicio de sesión (URL).
+    """
+    from .models import Consultation
+
+    tipos = dict(Consultation.TIPO_CHOICES)
+    duracion = timedelta(minutes=doctor.duracion_consulta)
+
+    yield _linea('BEGIN:VCALENDAR')
+    yield _linea('VERSION:2.0')
+    yield _linea('PRODID:-//Consultorio//Agenda//ES')
+    yield _linea('CALSCALE:GREGORIAN')
+    yield _linea('METHOD:PUBLISH')
+    yield _linea(f'X-WR-CALNAME:{_escapar(f"Consultas - Dr. {doctor.nombre_completo}")}')
+    yield _linea(f'X-PUBLISHED-TTL:{INTERVALO_ACTUALIZACION}')
+    yield _linea(f'REFRESH-INTERVAL;VALUE=DURATION:{INTERVALO_ACTUALIZACION}')
+
+    filas = _consultas(doctor.id).order_by('fecha_consulta').values_list(
+        'id', 'fecha_consulta', 'estado', 'tipo_consulta', 'fecha_actualizacion',
+        'patient__nombres', 'patient__apellidos',
+    )
+    for consulta_id, fecha, estado, tipo, actualizada, nombres, apellidos in filas.iterator(chunk_size=FILAS_POR_LOTE):
+        evento = [
+            'BEGIN:VEVENT',
+            f'UID:consulta-{consulta_id}@consultorio',
+            f'DTSTAMP:{_utc(actualizada)}',
+            f'LAST-MODIFIED:{_utc(actualizada)}',
+            f'DTSTART:{_utc(fecha)}',
+            f'DTEND:{_utc(fecha + duracion)}',
+            f'SUMMARY:{_escapar(f"{tipos.get(tipo, tipo)} - {_iniciales(nombres, apellidos)}")}',
+            f'STATUS:{_ESTADOS_ICAL.get(estado, "CONFIRMED")}',
+        ]
+        if url_consulta:
+            evento.append(f'URL:{url_consulta(consulta_id)}')
+        evento.append('END:VEVENT')
+        yield ''.join(_linea(linea) for linea in evento)
+
+    yield _linea('END:VCALENDAR')
+
+
+def _llave_cache(doctor, etag):
+    # El feed no tiene sesión: la clínica es la del doctor, no la activa
+    return llave_cache('calendario', doctor.id, etag, clinica=doctor.clinic_id)
+
+
+def cuerpo_en_cache(doctor, etag):
+    return cache.get(_llave_cache(doctor, etag))
+
+
+def generar_y_guardar(doctor, etag, url_consulta=None):
+    """Genera el feed en streaming y, al terminar, deja el cuerpo completo en caché"""
+    partes = []
+    for parte in generar(doctor, url_consulta):
+        partes.append(parte)
+        yield parte
+    cache.set(_llave_cache(doctor, etag), ''.join(partes).encode(), DURACION_CACHE)
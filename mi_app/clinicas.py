@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Varias clínicas (sucursales) en un solo despliegue.
+
+La clínica de cada petición la resuelve ClinicaMiddleware a partir del
+perfil del usuario y queda en una ContextVar mientras dura la petición. Los
+managers de Doctor, Patient, Consultation, Payment y de los cortes, estados
+de cuenta, lotes de reclamaciones, reportes de laboratorio, hechos
+clínicos, claves de duplicados, eventos de agenda y bajas filtran por ella,
+así que las vistas, el admin y la sincronización ven solo los datos de su
+sucursal sin cambiar sus consultas; los índices de las tablas que se leen
+por rango de fecha empiezan por la clínica para que el rango que lee una
+sucursal pequeña no recorra las filas de una grande. Lo que cuelga de un
+registro con clínica (recetas, expedientes, adjuntos, series, movimientos,
+reclamaciones, resultados, notas, signos vitales, posibles duplicados) se
+filtra por la de su padre.
+
+Sin clínica activa (comandos de gestión, superusuarios sin clínica,
+instalaciones de una sola sucursal) no se filtra nada. `activar(clinica)`
+fija una clínica fuera de una petición, y las llaves de caché llevan la
+clínica como prefijo (`llave_cache`) para que las sucursales no compartan
+entradas.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import models
+from django.http import FileResponse
+
+_clinica = ContextVar('clinica', default=None)
+
+_FIN = object()
+
+
+def clinica_actual():
+    """Id de la clínica activa o None (sin filtro por clínica)"""
+    return _clinica.get()
+
+
+@contextmanager
+def activar(clinica):
+    """Fija la clínica activa (objeto, id o None) dentro del bloque"""
+    token = _clinica.set(getattr(clinica, 'pk', clinica))
+    try:
+        yield
+    finally:
+        _clinica.reset(token)
+
+
+def por_clave(clave):
+    """Clínica por su clave (opción --clinica de los comandos); None si no existe"""
+    from .models import Clinic
+
+    return Clinic.objects.filter(clave=clave).first()
+
+
+def llave_cache(*partes, clinica=None):
+    """Llave de caché con el espacio de nombres de la clínica (explícita o la activa)"""
+    clinica = clinica if clinica is not None else clinica_actual()
+    return ':'.join(['c' + str(clinica or 0), *map(str, partes)])
+
+
+class ManagerClinica(models.Manager):
+    """
+    Manager que limita los registros a la clínica activa. Las tablas sin
+    columna de clínica declaran en el modelo RUTA_CLINICA, el camino hasta la
+    de su padre (p. ej. 'patient__clinic'); va en el modelo y no en el
+    manager porque los managers de relaciones se construyen sin argumentos.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        clinica = clinica_actual()
+        if clinica is None:
+            return queryset
+        return queryset.filter(**{f"{getattr(self.model, 'RUTA_CLINICA', 'clinic')}_id": clinica})
+
+
+def clinica_de(instancia):
+    """
+    Id de la clínica de una instancia: la activa si la hay (los managers ya
+    no dejan llegar a otra), o la suya siguiendo RUTA_CLINICA, con una
+    consulta si la columna está en el padre.
+    """
+    clinica = clinica_actual()
+    if clinica is not None:
+        return clinica
+    modelo = type(instancia)
+    padre, _, resto = getattr(modelo, 'RUTA_CLINICA', 'clinic').partition('__')
+    if not resto:
+        return getattr(instancia, f'{padre}_id')
+    campo = modelo._meta.get_field(padre)
+    return campo.related_model._base_manager.filter(
+        pk=getattr(instancia, campo.attname)
+    ).values_list(f'{resto}_id', flat=True).first()
+
+
+def clinica_de_usuario(user):
+    from .models import UserProfile
+
+    if not user.is_authenticated:
+        return None
+    return UserProfile.objects.filter(user_id=user.pk).values_list('clinic_id', flat=True).first()
+
+
+# Cada parte se genera con la clínica activa; entre partes no queda fijada
+# (el servidor puede cerrar el generador desde otro contexto)
+
+def _en_clinica(contenido, clinica):
+    iterador = iter(contenido)
+    try:
+        while True:
+            with activar(clinica):
+                parte = next(iterador, _FIN)
+            if parte is _FIN:
+                return
+            yield parte
+    finally:
+        if hasattr(iterador, 'close'):
+            with activar(clinica):
+                iterador.close()
+
+
+async def _en_clinica_async(contenido, clinica):
+    iterador = aiter(contenido)
+    try:
+        while True:
+            with activar(clinica):
+                try:
+                    parte = await anext(iterador)
+                except StopAsyncIteration:
+                    return
+            yield parte
+    finally:
+        if hasattr(iterador, 'aclose'):
+            with activar(clinica):
+                await iterador.aclose()
+
+
+class ClinicaMiddleware:
+    """Activa la clínica del usuario durante la petición (después de AuthenticationMiddleware)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.clinica_id = clinica_de_usuario(request.user)
+        with activar(request.clinica_id):
+            response = self.get_response(request)
+        # El cuerpo en streaming (exportaciones, SSE) se genera al salir de
+        # aquí; los archivos no consultan la BD y conservan su sendfile
+        if request.clinica_id is not None and response.streaming and not isinstance(response, FileResponse):
+            envoltura = _en_clinica_async if response.is_async else _en_clinica
+            response.streaming_content = envoltura(response.streaming_content, request.clinica_id)
+        return response
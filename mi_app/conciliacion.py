@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Conciliación de pagos contra estados de cuenta (banco y terminal).
+
+El CSV se lee en streaming, fila por fila. Los pagos candidatos
+(transferencias o tarjeta pagados y aún sin conciliar, en el periodo del
+estado de cuenta más un margen) se cargan con una sola consulta y se indexan
+en diccionarios: por referencia normalizada y por (monto en centavos, día).
+Cada movimiento se resuelve con búsquedas en esos diccionarios —nunca una
+consulta por línea— y al final los movimientos se insertan con executemany
+(sin instanciar modelos) y los pagos conciliados se marcan con UPDATE por
+lotes.
+"""
+import csv
+import hashlib
+import io
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .agenda import rango_dia
+from .analitica import normalizar_termino
+
+# Días de diferencia aceptados entre el pago registrado y el movimiento
+VENTANA_DIAS = 3
+
+LOTE = 2000
+
+METODOS_POR_ORIGEN = {
+    'banco': ['transferencia'],
+    'terminal': ['tarjeta'],
+}
+ESTADOS_CONCILIABLES = ['pagado', 'parcial']
+
+# Encabezados aceptados (normalizados) por columna
+COLUMNAS = {
+    'fecha': ('fecha', 'fecha operacion', 'fecha de operacion', 'fecha movimiento', 'fecha transaccion', 'date'),
+    'monto': ('monto', 'importe', 'abono', 'abonos', 'deposito', 'depositos', 'monto abono', 'amount'),
+    'referencia': ('referencia', 'folio', 'autorizacion', 'no autorizacion', 'numero de autorizacion',
+                   'referencia numerica', 'clave de rastreo', 'reference'),
+    'descripcion': ('descripcion', 'concepto', 'detalle', 'description'),
+}
+FORMATOS_FECHA = ('%d/%m/%Y', '%Y-%m-%d', '%d-%m-%Y', '%d/%m/%y')
+
+# Referencias dentro de la descripción: tramos alfanuméricos de al menos 6
+_TOKEN_REFERENCIA = re.compile(r'[0-9A-Z]{6,}')
+_NO_ALFANUMERICO = re.compile(r'[^0-9A-Z]')
+
+
+class EstadoCuentaInvalido(Exception):
+    pass
+
+
+def normalizar_referencia(texto):
+    """'ref: 000123-45' -> '12345' (mayúsculas, solo alfanuméricos, sin ceros a la izquierda)"""
+    return _NO_ALFANUMERICO.sub('', (texto or '').upper()).lstrip('0')
+
+
+def _claves_referencia(*textos):
+    """Referencia completa y tramos largos (p. ej. el folio dentro de 'SPEI 123456 CLINICA')"""
+    claves = []
+    for texto in textos:
+        completa = normalizar_referencia(texto)
+        if completa:
+            claves.append(completa)
+        claves.extend(t.lstrip('0') for t in _TOKEN_REFERENCIA.findall((texto or '').upper()))
+    return [c for c in dict.fromkeys(claves) if c]
+
+
+def huella_archivo(archivo):
+    """SHA-256 del archivo leído por bloques; deja el archivo al inicio"""
+    huella = hashlib.sha256()
+    for bloque in iter(lambda: archivo.read(1024 * 1024), b''):
+        huella.update(bloque)
+    archivo.seek(0)
+    return huella.hexdigest()
+
+
+def _centavos(monto):
+    return int(monto * 100)
+
+
+def _monto(texto):
+    """'$1,234.50' / '1234,50' / '(100.00)' -> Decimal; None si no es un monto"""
+    texto = texto.strip().replace('$', '').replace(' ', '')
+    negativo = texto.startswith('(') and texto.endswith(')')
+    texto = texto.strip('()')
+    if ',' in texto and '.' in texto:
+        texto = texto.replace(',', '')
+    elif ',' in texto and len(texto.rsplit(',', 1)[1]) == 2:
+        texto = texto.replace(',', '.')
+    else:
+        texto = texto.replace(',', '')
+    try:
+        monto = Decimal(texto)
+    except InvalidOperation:
+        return None
+    return -monto if negativo else monto
+
+
+def _columnas(encabezado):
+    posiciones = {}
+    normalizados = [normalizar_termino(celda) for celda in encabezado]
+    for columna, alias in COLUMNAS.items():
+        for i, nombre in enumerate(normalizados):
+            if nombre in alias:
+                posiciones[columna] = i
+                break
+    faltantes = {'fecha', 'monto'} - set(posiciones)
+    if faltantes:
+        raise EstadoCuentaInvalido(f'Faltan columnas en el encabezado: {", ".join(sorted(faltantes))}')
+    return posiciones
+
+
+def leer_movimientos(archivo):
+    """
+    Movimientos de abono del CSV: (línea, fecha, monto, referencia, descripción).
+
+    Detecta el separador y las columnas por el encabezado. Se omiten cargos
+    (montos negativos) y filas sin fecha válida (saldos, totales, pies).
+    """
+    texto = io.TextIOWrapper(archivo, encoding='utf-8-sig', errors='replace', newline='')
+    muestra = texto.read(4096)
+    texto.seek(0)
+    try:
+        dialecto = csv.Sniffer().sniff(muestra, delimiters=',;\t|')
+    except csv.Error:
+        dialecto = csv.excel
+    filas = csv.reader(texto, dialecto)
+
+    encabezado = next(filas, None)
+    if not encabezado:
+        raise EstadoCuentaInvalido('El archivo está vacío')
+    columnas = _columnas(encabezado)
+    i_fecha, i_monto = columnas['fecha'], columnas['monto']
+    i_referencia, i_descripcion = columnas.get('referencia'), columnas.get('descripcion')
+
+    # Un estado de cuenta mensual trae pocas fechas distintas: se parsean una vez
+    fechas = {}
+
+    def fecha_de(valor):
+        if valor not in fechas:
+            fechas[valor] = None
+            for formato in FORMATOS_FECHA:
+                try:
+                    fechas[valor] = datetime.strptime(valor.strip(), formato).date()
+                    break
+                except ValueError:
+                    continue
+        return fechas[valor]
+
+    try:
+        for linea, fila in enumerate(filas, start=2):
+            if len(fila) <= max(i_fecha, i_monto):
+                continue
+            fecha = fecha_de(fila[i_fecha])
+            monto = _monto(fila[i_monto]) if fecha else None
+            if monto is None or monto <= 0:
+                continue
+            yield (
+                linea,
+                fecha,
+                monto,
+                fila[i_referencia].strip()[:100] if i_referencia is not None and i_referencia < len(fila) else '',
+                fila[i_descripcion].strip()[:255] if i_descripcion is not None and i_descripcion < len(fila) else '',
+            )
+    finally:
+        texto.detach()
+
+
+def _cargar_pagos(origen, desde, hasta, ventana):
+    """Pagos candidatos del periodo en una consulta: [(id, referencia, centavos, día), ...]"""
+    from .models import Payment
+
+    inicio, _ = rango_dia(desde - timedelta(days=ventana))
+    _, fin = rango_dia(hasta + timedelta(days=ventana))
+    zona = timezone.get_current_timezone()
+    return [
+        (pago_id, referencia, _centavos(monto), fecha.astimezone(zona).date())
+        for pago_id, referencia, monto, fecha in Payment.objects.filter(
+            metodo_pago__in=METODOS_POR_ORIGEN[origen],
+            estado__in=ESTADOS_CONCILIABLES,
+            fecha_conciliacion__isnull=True,
+            fecha_pago__range=(inicio, fin),
+        ).order_by().values_list('id', 'referencia', 'monto_pagado', 'fecha_pago').iterator(chunk_size=LOTE)
+    ]
+
+
+class _Indice:
+    """Tablas hash de pagos por referencia y por (centavos, día)"""
+
+    def __init__(self, pagos, ventana):
+        self.pagos = pagos
+        self.ventana = ventana
+        self.usados = set()
+        self.por_referencia = defaultdict(list)
+        self.por_monto_dia = defaultdict(list)
+        for i, (_, referencia, centavos, dia) in enumerate(pagos):
+            for clave in _claves_referencia(referencia):
+                self.por_referencia[clave].append(i)
+            self.por_monto_dia[(centavos, dia)].append(i)
+
+    def _en_ventana(self, i, fecha):
+        return abs((self.pagos[i][3] - fecha).days) <= self.ventana
+
+    def por_referencias(self, claves, fecha):
+        for clave in claves:
+            candidatos = [
+                i for i in self.por_referencia.get(clave, ())
+                if i not in self.usados and self._en_ventana(i, fecha)
+            ]
+            if candidatos:
+                return candidatos
+        return []
+
+    def por_monto(self, centavos, fecha, con_referencia):
+        """Candidatos del mismo monto en la ventana, primero los del mismo día"""
+        candidatos = []
+        for desfase in sorted(range(-self.ventana, self.ventana + 1), key=abs):
+            dia = fecha + timedelta(days=desfase)
+            for i in self.por_monto_dia.get((centavos, dia), ()):
+                # Si ambos traen referencia y no coincidieron, no son el mismo movimiento
+                if i not in self.usados and not (con_referencia and self.pagos[i][1].strip()):
+                    candidatos.append((abs(desfase), i))
+        return candidatos
+
+
+def _resolver(indice, fecha, monto, referencia, descripcion):
+    """(estado, índice del pago o None) de un movimiento"""
+    centavos = _centavos(monto)
+    # La referencia tal cual resuelve casi todo; los tramos de la descripción son el respaldo
+    completa = normalizar_referencia(referencia)
+    candidatos = indice.por_referencias([completa], fecha) if completa else []
+    claves = [completa] if completa else []
+    if not candidatos:
+        claves = _claves_referencia(referencia, descripcion)
+        candidatos = indice.por_referencias(claves, fecha)
+    if candidatos:
+        exactos = [i for i in candidatos if indice.pagos[i][2] == centavos]
+        if exactos:
+            return 'conciliada', min(exactos, key=lambda i: abs((indice.pagos[i][3] - fecha).days))
+        return 'monto_distinto', candidatos[0]
+
+    candidatos = indice.por_monto(centavos, fecha, con_referencia=bool(claves))
+    if len(candidatos) == 1:
+        return 'conciliada', candidatos[0][1]
+    if candidatos:
+        mismo_dia = [i for desfase, i in candidatos if desfase == 0]
+        if len(mismo_dia) == 1:
+            return 'conciliada', mismo_dia[0]
+        return 'ambigua', None
+    return 'sin_pago', None
+
+
+def _insertar_movimientos(estado_cuenta_id, filas):
+    """INSERT por lotes con executemany: 100k movimientos sin instanciar modelos"""
+    from .models import StatementLine
+
+    operaciones = connection.ops
+    sql = (
+        f'INSERT INTO {StatementLine._meta.db_table} '
+        '(statement_id, linea, fecha, monto, referencia, descripcion, estado, payment_id) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s)'
+    )
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(filas), LOTE):
+            cursor.executemany(sql, [
+                (
+                    estado_cuenta_id, linea, operaciones.adapt_datefield_value(fecha),
+                    operaciones.adapt_decimalfield_value(monto, 12, 2),
+                    referencia, descripcion, estado, pago_id,
+                )
+                for linea, fecha, monto, referencia, descripcion, estado, pago_id in filas[inicio:inicio + LOTE]
+            ])
+
+
+def conciliar(archivo, nombre, origen, usuario=None, ventana=VENTANA_DIAS):
+    """
+    Importa un estado de cuenta (archivo binario abierto) y concilia sus
+    movimientos contra los pagos. Devuelve el BankStatement con sus conteos.
+    """
+    from .models import BankStatement, Payment
+
+    if origen not in METODOS_POR_ORIGEN:
+        raise EstadoCuentaInvalido(f'Origen no válido: {origen}')
+    huella = huella_archivo(archivo)
+    if BankStatement.objects.filter(huella=huella).exists():
+        raise EstadoCuentaInvalido('Este estado de cuenta ya fue importado')
+
+    movimientos = list(leer_movimientos(archivo))
+    if not movimientos:
+        raise EstadoCuentaInvalido('El archivo no tiene movimientos de abono')
+    desde = min(m[1] for m in movimientos)
+    hasta = max(m[1] for m in movimientos)
+
+    indice = _Indice(_cargar_pagos(origen, desde, hasta, ventana), ventana)
+    conciliados_por_llave = set()
+    lineas, conciliados = [], []
+    for linea, fecha, monto, referencia, descripcion in movimientos:
+        estado, i = _resolver(indice, fecha, monto, referencia, descripcion)
+        # Solo con referencia se puede afirmar que es el mismo movimiento repetido
+        llave = (fecha, monto, referencia) if referencia else None
+        if estado == 'conciliada':
+            indice.usados.add(i)
+            conciliados.append(indice.pagos[i][0])
+            conciliados_por_llave.add(llave)
+        elif estado == 'sin_pago' and llave and llave in conciliados_por_llave:
+            estado = 'duplicada'
+        lineas.append((
+            linea, fecha, monto, referencia, descripcion, estado,
+            indice.pagos[i][0] if i is not None else None,
+        ))
+
+    ahora = timezone.now()
+    try:
+        with transaction.atomic():
+            estado_cuenta = BankStatement.objects.create(
+                archivo=nombre[:255],
+                origen=origen,
+                huella=huella,
+                desde=desde,
+                hasta=hasta,
+                lineas=len(lineas),
+                conciliadas=len(conciliados),
+                excepciones=len(lineas) - len(conciliados),
+                usuario=usuario if usuario and usuario.is_authenticated else None,
+            )
+            _insertar_movimientos(estado_cuenta.id, lineas)
+            for inicio in range(0, len(conciliados), LOTE):
+                Payment.objects.filter(id__in=conciliados[inicio:inicio + LOTE]).update(
+                    fecha_conciliacion=ahora,
+                    fecha_actualizacion=ahora,
+                )
+    except IntegrityError:
+        # Otra importación del mismo archivo ganó la carrera desde la verificación de arriba
+        raise EstadoCuentaInvalido('Este estado de cuenta ya fue importado') from None
+    return estado_cuenta
+
+
+def pagos_sin_movimiento(estado_cuenta):
+    """Pagos del periodo y del origen del estado de cuenta que siguen sin conciliar"""
+    from .models import Payment
+
+    inicio, _ = rango_dia(estado_cuenta.desde)
+    _, fin = rango_dia(estado_cuenta.hasta)
+    pagos = Payment.objects.filter(
+        metodo_pago__in=METODOS_POR_ORIGEN[estado_cuenta.origen],
+        estado__in=ESTADOS_CONCILIABLES,
+        fecha_conciliacion__isnull=True,
+        fecha_pago__range=(inicio, fin),
+    )
+    # Visto sin clínica activa (superusuario): solo los pagos de la clínica que lo importó
+    if estado_cuenta.clinic_id:
+        pagos = pagos.filter(clinic_id=estado_cuenta.clinic_id)
+    return pagos.order_by('fecha_pago')
+
+
+def excepciones(estado_cuenta):
+    """Reporte de excepciones: movimientos sin conciliar y pagos sin movimiento"""
+    movimientos = estado_cuenta.movimientos.exclude(estado='conciliada').values(
+        'linea', 'fecha', 'monto', 'referencia', 'descripcion', 'estado', 'payment_id',
+    )
+    pagos = pagos_sin_movimiento(estado_cuenta).values(
+        'id', 'referencia', 'monto_pagado', 'fecha_pago', 'metodo_pago', 'consultation_id',
+    )
+    return {'movimientos': list(movimientos), 'pagos_sin_movimiento': list(pagos)}
+
+
+def escribir_excepciones_csv(estado_cuenta, salida):
+    """Escribe el reporte de excepciones como CSV (una tabla con el tipo de excepción)"""
+    from .models import StatementLine
+
+    estados = dict(StatementLine.ESTADO_CHOICES)
+    reporte = excepciones(estado_cuenta)
+    escritor = csv.writer(salida)
+    escritor.writerow(['tipo', 'linea', 'fecha', 'monto', 'referencia', 'descripcion', 'pago_id'])
+    for m in reporte['movimientos']:
+        escritor.writerow([
+            estados[m['estado']], m['linea'], m['fecha'].isoformat(), m['monto'],
+            m['referencia'], m['descripcion'], m['payment_id'] or '',
+        ])
+    for p in reporte['pagos_sin_movimiento']:
+        escritor.writerow([
+            'Pago sin movimiento', '', timezone.localtime(p['fecha_pago']).date().isoformat(),
+            p['monto_pagado'], p['referencia'], f"Consulta #{p['consultation_id']}", p['id'],
+        ])
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Corte de caja diario.
+
+Los totales de un día —cobrado, descuentos y reembolsos por método de pago y
+por usuario— salen de una sola consulta agrupada con agregación condicional
+sobre el rango de fecha_pago del día (índice pagos_fecha_pago_idx), en lugar
+de una consulta por cifra. Al cerrar el día esos totales se copian a
+CashClose/CashCloseLine, que ya no se modifican: un corte histórico se lee de
+ahí sin recalcular, y si después se edita un pago de ese día la diferencia
+aparece como discrepancia en vez de cambiar el corte en silencio.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .agenda import rango_dia
+
+# Un pago reembolsado se cobró y se devolvió: cuenta en cobrado y en reembolsos
+ESTADOS_COBRADOS = ['pagado', 'parcial', 'reembolsado']
+
+CAMPOS_TOTALES = ('pagos', 'cobrado', 'descuentos', 'reembolsos', 'num_reembolsos')
+
+_CERO = Decimal('0.00')
+
+
+class CorteInvalido(Exception):
+    pass
+
+
+def _centavos(valor):
+    # SQLite devuelve las sumas sin escala ('983352'): se igualan a la de los campos
+    return valor.quantize(_CERO) if isinstance(valor, Decimal) else valor
+
+
+def _sumas():
+    cobrados = Q(estado__in=ESTADOS_COBRADOS)
+    reembolsados = Q(estado='reembolsado')
+    dinero = {'default': _CERO, 'output_field': DecimalField(max_digits=12, decimal_places=2)}
+    return {
+        'pagos': Count('id', filter=cobrados),
+        'cobrado': Sum('monto_pagado', filter=cobrados, **dinero),
+        'descuentos': Sum('descuento', filter=cobrados, **dinero),
+        'reembolsos': Sum('monto_pagado', filter=reembolsados, **dinero),
+        'num_reembolsos': Count('id', filter=reembolsados),
+    }
+
+
+def totales_por_dia(desde, hasta):
+    """
+    {fecha: [fila, ...]} con una fila por (método, usuario) y una sola consulta.
+
+    Cada fila: metodo_pago, usuario_id, usuario_nombre y CAMPOS_TOTALES.
+    """
+    from .models import Payment
+
+    inicio, _ = rango_dia(desde)
+    _, fin = rango_dia(hasta)
+    filas = Payment.objects.filter(
+        fecha_pago__range=(inicio, fin),
+        estado__in=ESTADOS_COBRADOS,
+    ).order_by().annotate(
+        dia=TruncDate('fecha_pago', tzinfo=timezone.get_current_timezone()),
+    ).values(
+        'dia', 'metodo_pago', 'registrado_por_id', 'registrado_por__username',
+    ).annotate(**_sumas())
+
+    dias = {}
+    for fila in filas:
+        dias.setdefault(fila['dia'], []).append({
+            'metodo_pago': fila['metodo_pago'],
+            'usuario_id': fila['registrado_por_id'],
+            'usuario_nombre': fila['registrado_por__username'] or '',
+            **{campo: _centavos(fila[campo]) for campo in CAMPOS_TOTALES},
+        })
+    for lineas in dias.values():
+        lineas.sort(key=lambda l: (l['metodo_pago'], l['usuario_nombre']))
+    return dias
+
+
+def totales_dia(fecha):
+    return totales_por_dia(fecha, fecha).get(fecha, [])
+
+
+def sumar(lineas):
+    """Total del día a partir de sus líneas"""
+    total = {campo: 0 for campo in CAMPOS_TOTALES}
+    for linea in lineas:
+        for campo in CAMPOS_TOTALES:
+            total[campo] += linea[campo]
+    total['neto'] = total['cobrado'] - total['reembolsos']
+    return total
+
+
+def cerrar_dia(fecha, usuario=None, notas=''):
+    """
+    Guarda la foto inmutable de los totales del día; un día se cierra una sola
+    vez. El día en curso se puede cerrar al terminar el turno: lo que se cobre
+    después aparece como discrepancia en el reporte.
+    """
+    from .models import CashClose, CashCloseLine
+
+    if fecha > timezone.localdate():
+        raise CorteInvalido('No se puede cerrar un día futuro')
+    with transaction.atomic():
+        if CashClose.objects.filter(fecha=fecha).exists():
+            raise CorteInvalido(f'El día {fecha:%d/%m/%Y} ya tiene corte de caja')
+        lineas = totales_dia(fecha)
+        total = sumar(lineas)
+        corte = CashClose.objects.create(
+            fecha=fecha,
+            usuario=usuario,
+            notas=notas,
+            **{campo: total[campo] for campo in ('pagos', 'cobrado', 'descuentos', 'reembolsos')},
+        )
+        CashCloseLine.objects.bulk_create([
+            CashCloseLine(
+                corte=corte,
+                metodo_pago=linea['metodo_pago'],
+                usuario_id_cobro=linea['usuario_id'],
+                usuario_nombre=linea['usuario_nombre'],
+                **{campo: linea[campo] for campo in CAMPOS_TOTALES},
+            )
+            for linea in lineas
+        ])
+    return corte
+
+
+def _lineas_corte(corte):
+    return [
+        {
+            'metodo_pago': linea.metodo_pago,
+            'usuario_id': linea.usuario_id_cobro,
+            'usuario_nombre': linea.usuario_nombre,
+            **{campo: getattr(linea, campo) for campo in CAMPOS_TOTALES},
+        }
+        for linea in corte.lineas.all()
+    ]
+
+
+def discrepancias(cerradas, actuales):
+    """Diferencias entre las líneas del corte y los pagos como están hoy"""
+    clave = lambda linea: (linea['metodo_pago'], linea['usuario_id'])
+    antes = {clave(l): l for l in cerradas}
+    ahora = {clave(l): l for l in actuales}
+    diferencias = []
+    for llave in sorted(antes.keys() | ahora.keys(), key=lambda k: (k[0], k[1] or 0)):
+        cerrada, actual = antes.get(llave), ahora.get(llave)
+        cambios = {
+            campo: {
+                'corte': cerrada[campo] if cerrada else 0,
+                'actual': actual[campo] if actual else 0,
+            }
+            for campo in CAMPOS_TOTALES
+            if (cerrada[campo] if cerrada else 0) != (actual[campo] if actual else 0)
+        }
+        if cambios:
+            diferencias.append({
+                'metodo_pago': llave[0],
+                'usuario_id': llave[1],
+                'usuario_nombre': (cerrada or actual)['usuario_nombre'],
+                'cambios': cambios,
+            })
+    return diferencias
+
+
+def reporte(fecha, verificar=True):
+    """
+    Corte de un día. Cerrado: la foto guardada (y, con `verificar`, las
+    discrepancias contra los pagos actuales, una consulta más). Abierto: los
+    totales en vivo.
+    """
+    from .models import CashClose
+
+    corte = CashClose.objects.filter(fecha=fecha).select_related('usuario').prefetch_related('lineas').first()
+    if corte is None:
+        lineas = totales_dia(fecha)
+        return {'fecha': fecha, 'cerrado': False, 'lineas': lineas, 'totales': sumar(lineas)}
+
+    lineas = _lineas_corte(corte)
+    datos = {
+        'fecha': fecha,
+        'cerrado': True,
+        'corte_id': corte.id,
+        'cerrado_por': corte.usuario.username if corte.usuario else '',
+        'fecha_cierre': corte.fecha_cierre,
+        'notas': corte.notas,
+        'lineas': lineas,
+        'totales': sumar(lineas),
+    }
+    if verificar:
+        datos['discrepancias'] = discrepancias(lineas, totales_dia(fecha))
+    return datos
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Detección y fusión de pacientes duplicados.
+
+Cada paciente deja claves de bloqueo (nombre fonético + fecha de nacimiento,
+teléfono normalizado, email) en una tabla indexada; solo se comparan los
+pacientes de la misma clínica que comparten alguna clave, nunca todos
+contra todos. Los pares se
+puntúan por lotes (una consulta por lote para traer los datos) y los que
+superan el umbral quedan como DuplicateCandidate para revisión en el admin.
+"""
+import re
+from difflib import SequenceMatcher
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .analitica import normalizar_termino
+
+# Puntaje mínimo para registrar un par como posible duplicado
+UMBRAL = 0.7
+
+# Bloques más grandes (p. ej. un teléfono de recepción capturado en muchos
+# pacientes) no discriminan y se ignoran
+MAX_BLOQUE = 30
+
+# Pares puntuados por consulta
+LOTE = 2000
+
+# Reglas fonéticas para nombres en español, en orden
+_REGLAS_FONETICAS = [
+    (re.compile(r'ch'), 'x'),
+    (re.compile(r'qu'), 'k'),
+    (re.compile(r'll'), 'y'),
+    (re.compile(r'gu(?=[ei])'), 'g'),
+    (re.compile(r'g(?=[ei])'), 'j'),
+    (re.compile(r'c(?=[ei])'), 's'),
+    (re.compile(r'z'), 's'),
+    (re.compile(r'[cq]'), 'k'),
+    (re.compile(r'v'), 'b'),
+    (re.compile(r'w'), 'u'),
+    (re.compile(r'y'), 'i'),
+    (re.compile(r'h'), ''),
+    (re.compile(r'(.)\1+'), r'\1'),
+]
+
+_NO_DIGITOS = re.compile(r'\D+')
+
+
+def codigo_fonetico(texto):
+    """Código fonético de la primera palabra: 'Gonzáles' y 'Gonzalez' -> 'gonsales'"""
+    palabras = normalizar_termino(texto).split()
+    if not palabras:
+        return ''
+    codigo = palabras[0]
+    for patron, reemplazo in _REGLAS_FONETICAS:
+        codigo = patron.sub(reemplazo, codigo)
+    return codigo
+
+
+def normalizar_telefono(telefono):
+    """Últimos 10 dígitos; vacío si es un teléfono de relleno (0000000000, 1111111111...)"""
+    digitos = _NO_DIGITOS.sub('', telefono or '')[-10:]
+    if len(digitos) < 7 or len(set(digitos)) == 1:
+        return ''
+    return digitos
+
+
+def claves_paciente(paciente):
+    """Claves de bloqueo {(tipo, clave)} de un paciente"""
+    claves = set()
+    nombre = codigo_fonetico(paciente.nombres)
+    apellido = codigo_fonetico(paciente.apellidos)
+    if nombre and apellido and paciente.fecha_nacimiento:
+        # Ordenados: también empata nombres y apellidos capturados al revés
+        claves.add(('nombre_nacimiento', '|'.join(sorted([nombre, apellido]) + [str(paciente.fecha_nacimiento)])))
+    for telefono in (paciente.telefono_principal, paciente.telefono_alternativo):
+        telefono = normalizar_telefono(telefono)
+        if telefono:
+            claves.add(('telefono', telefono))
+    for email in (paciente.email, paciente.email_alternativo):
+        email = (email or '').strip().lower()
+        if email:
+            claves.add(('email', email[:120]))
+    return claves
+
+
+def indexar_paciente(paciente):
+    """Sincroniza las claves de bloqueo del paciente; devuelve las vigentes"""
+    from .models import PatientBlockingKey
+
+    claves = claves_paciente(paciente)
+    # Con la clínica: si el paciente cambió de clínica, sus claves se rehacen
+    vigentes = {(tipo, clave, paciente.clinic_id) for tipo, clave in claves}
+    actuales = set(PatientBlockingKey._base_manager.filter(patient_id=paciente.pk).values_list('tipo', 'clave', 'clinic_id'))
+    for tipo, clave, _ in actuales - vigentes:
+        PatientBlockingKey._base_manager.filter(patient_id=paciente.pk, tipo=tipo, clave=clave).delete()
+    PatientBlockingKey.objects.bulk_create(
+        [
+            PatientBlockingKey(patient_id=paciente.pk, tipo=tipo, clave=clave, clinic_id=clinica)
+            for tipo, clave, clinica in vigentes - actuales
+        ],
+        ignore_conflicts=True,
+    )
+    return claves
+
+
+# ---------------------------------------------------------------------------
+# Puntuación
+# ---------------------------------------------------------------------------
+
+_CAMPOS_RASGOS = (
+    'id', 'nombres', 'apellidos', 'fecha_nacimiento', 'genero',
+    'telefono_principal', 'telefono_alternativo', 'email', 'email_alternativo',
+)
+
+
+def _rasgos(ids):
+    """Rasgos normalizados por paciente (una consulta para todo el lote)"""
+    from .models import Patient
+
+    rasgos = {}
+    for fila in Patient.objects.filter(id__in=ids).values(*_CAMPOS_RASGOS):
+        nombre = normalizar_termino(f"{fila['nombres']} {fila['apellidos']}")
+        rasgos[fila['id']] = {
+            # Palabras ordenadas: el orden nombre/apellido no cuenta
+            'nombre': ' '.join(sorted(nombre.split())),
+            'nacimiento': fila['fecha_nacimiento'],
+            'genero': fila['genero'],
+            'telefonos': {t for t in map(normalizar_telefono, (fila['telefono_principal'], fila['telefono_alternativo'])) if t},
+            'emails': {e.strip().lower() for e in (fila['email'], fila['email_alternativo']) if e},
+        }
+    return rasgos
+
+
+def puntuar(a, b):
+    """(puntaje 0..1, razones) de que dos pacientes sean la misma persona"""
+    razones = []
+    similitud = SequenceMatcher(None, a['nombre'], b['nombre']).ratio()
+    puntaje = 0.5 * similitud
+    if similitud >= 0.85:
+        razones.append('nombre')
+
+    na, nb = a['nacimiento'], b['nacimiento']
+    if na and nb:
+        if na == nb:
+            puntaje += 0.25
+            razones.append('nacimiento')
+        elif na.year == nb.year and (na.month, na.day) in ((nb.day, nb.month), (nb.month, nb.day + 1), (nb.month, nb.day - 1)):
+            # Día y mes invertidos o un día de diferencia
+            puntaje += 0.1
+            razones.append('nacimiento similar')
+
+    if a['telefonos'] & b['telefonos']:
+        puntaje += 0.15
+        razones.append('teléfono')
+    if a['emails'] & b['emails']:
+        puntaje += 0.1
+        razones.append('email')
+    if a['genero'] and b['genero'] and a['genero'] != b['genero']:
+        puntaje -= 0.1
+    return round(min(max(puntaje, 0), 1), 3), razones
+
+
+def registrar_pares(pares):
+    """
+    Puntúa pares (id_a, id_b) por lotes y guarda los que superan el umbral.
+
+    Un par ya descartado conserva su estado aunque se vuelva a detectar.
+    Devuelve el número de candidatos registrados o actualizados.
+    """
+    from .models import DuplicateCandidate
+
+    pares = sorted({(min(a, b), max(a, b)) for a, b in pares if a != b})
+    registrados = 0
+    for inicio in range(0, len(pares), LOTE):
+        lote = pares[inicio:inicio + LOTE]
+        rasgos = _rasgos({i for par in lote for i in par})
+        candidatos = []
+        for a, b in lote:
+            if a not in rasgos or b not in rasgos:
+                continue
+            puntaje, razones = puntuar(rasgos[a], rasgos[b])
+            if puntaje >= UMBRAL:
+                candidatos.append(DuplicateCandidate(
+                    paciente_a_id=a, paciente_b_id=b, puntaje=puntaje, razones=', '.join(razones),
+                ))
+        DuplicateCandidate.objects.bulk_create(
+            candidatos,
+            update_conflicts=True,
+            unique_fields=['paciente_a', 'paciente_b'],
+            update_fields=['puntaje', 'razones', 'fecha_deteccion'],
+        )
+        registrados += len(candidatos)
+    return registrados
+
+
+def _pares_de_bloques(filas):
+    """Pares dentro de cada bloque a partir de filas (clínica, tipo, clave, patient_id) ordenadas por bloque"""
+    pares = set()
+    bloque, miembros = None, []
+
+    def cerrar():
+        if 1 < len(miembros) <= MAX_BLOQUE:
+            pares.update((a, b) for i, a in enumerate(miembros) for b in miembros[i + 1:])
+
+    for clinica, tipo, clave, paciente_id in filas:
+        if (clinica, tipo, clave) != bloque:
+            cerrar()
+            bloque, miembros = (clinica, tipo, clave), []
+        miembros.append(paciente_id)
+    cerrar()
+    return pares
+
+
+def detectar_para_paciente(paciente):
+    """Paso incremental (al guardar un paciente): solo sus bloques"""
+    from .models import DuplicateCandidate, PatientBlockingKey
+
+    claves = indexar_paciente(paciente)
+
+    pares = set()
+    if claves:
+        filtro = Q()
+        for tipo, clave in claves:
+            filtro |= Q(tipo=tipo, clave=clave)
+        # Sin el manager: los bloques son los de la clínica del paciente, no la activa
+        filas = PatientBlockingKey._base_manager.filter(
+            filtro, clinic_id=paciente.clinic_id
+        ).order_by('tipo', 'clave').values_list('clinic_id', 'tipo', 'clave', 'patient_id')
+        pares = {par for par in _pares_de_bloques(filas) if paciente.pk in par}
+    registrar_pares(pares)
+
+    # Pares pendientes que ya no comparten bloque (se corrigió el dato)
+    vigentes = {(min(a, b), max(a, b)) for a, b in pares}
+    for candidato in DuplicateCandidate.objects.filter(
+        Q(paciente_a_id=paciente.pk) | Q(paciente_b_id=paciente.pk), estado='pendiente'
+    ).only('id', 'paciente_a_id', 'paciente_b_id'):
+        if (candidato.paciente_a_id, candidato.paciente_b_id) not in vigentes:
+            candidato.delete()
+
+
+def reindexar_todos(lote=1000, stdout=None):
+    """Reconstruye las claves de bloqueo de todos los pacientes por lotes de id"""
+    from .models import Patient, PatientBlockingKey
+
+    PatientBlockingKey.objects.all().delete()
+    ultimo_id, total = 0, 0
+    while True:
+        pacientes = list(
+            Patient.objects.filter(id__gt=ultimo_id).order_by('id').only(*_CAMPOS_RASGOS, 'clinic_id')[:lote]
+        )
+        if not pacientes:
+            return total
+        PatientBlockingKey.objects.bulk_create(
+            [
+                PatientBlockingKey(patient_id=p.pk, tipo=tipo, clave=clave, clinic_id=p.clinic_id)
+                for p in pacientes for tipo, clave in claves_paciente(p)
+            ],
+            ignore_conflicts=True,
+        )
+        ultimo_id = pacientes[-1].pk
+        total += len(pacientes)
+        if stdout:
+            stdout.write(f'  {total} pacientes indexados (hasta id {ultimo_id})')
+
+
+def detectar_todos():
+    """Pasada completa: recorre solo los bloques con más de un paciente"""
+    from .models import PatientBlockingKey
+
+    otros = PatientBlockingKey.objects.filter(
+        tipo=OuterRef('tipo'), clave=OuterRef('clave')
+    ).exclude(patient_id=OuterRef('patient_id'))
+    # Los bloques se cierran por (clínica, tipo, clave); NULL = NULL cuenta como la misma
+    filas = PatientBlockingKey.objects.filter(Exists(otros)).order_by('clinic_id', 'tipo', 'clave').values_list(
+        'clinic_id', 'tipo', 'clave', 'patient_id'
+    )
+    pares = _pares_de_bloques(filas.iterator(chunk_size=LOTE))
+    return len(pares), registrar_pares(pares)
+
+
+# ---------------------------------------------------------------------------
+# Fusión
+# ---------------------------------------------------------------------------
+
+# Estado del registro, no datos de la persona: se queda el de `conservar`
+_NO_COMBINAR = {'activo', 'clinic'}
+
+
+def _vacio(valor):
+    return valor is None or valor == ''
+
+
+def fusionar_pacientes(conservar, duplicado):
+    """
+    Fusiona `duplicado` en `conservar` en una sola transacción.
+
+    Todas las relaciones hacia Patient (consultas y con ellas sus pagos,
+    signos vitales, hechos clínicos...) se reapuntan; el expediente se combina
+    o se traslada; los campos en blanco de `conservar` se completan con los
+    del duplicado y los antecedentes en texto libre se concatenan (activo y
+    clínica quedan como en `conservar`). Al final se elimina el duplicado.
+    """
+    from .models import DuplicateCandidate, MedicalRecord, Patient, PatientBlockingKey
+
+    if conservar.pk == duplicado.pk:
+        raise ValueError('No se puede fusionar un paciente consigo mismo')
+    if conservar.clinic_id != duplicado.clinic_id:
+        # Las consultas del duplicado conservarían la clínica de origen
+        raise ValueError('No se pueden fusionar pacientes de clínicas distintas')
+
+    with transaction.atomic():
+        ahora = timezone.now()
+        # include_hidden: también las relaciones sin nombre inverso (related_name='+'),
+        # como las notas del índice de búsqueda, que se borrarían en cascada con el duplicado
+        for relacion in Patient._meta.get_fields(include_hidden=True):
+            if not (relacion.auto_created and not relacion.concrete and relacion.one_to_many):
+                continue
+            modelo = relacion.related_model
+            if modelo in (PatientBlockingKey, DuplicateCandidate):
+                continue
+            cambios = {relacion.field.name: conservar}
+            # Para que la sincronización delta vea el nuevo paciente
+            if any(f.name == 'fecha_actualizacion' for f in modelo._meta.concrete_fields):
+                cambios['fecha_actualizacion'] = ahora
+            modelo._base_manager.filter(**{relacion.field.name: duplicado}).update(**cambios)
+
+        expediente_duplicado = MedicalRecord.objects.filter(patient=duplicado).first()
+        if expediente_duplicado:
+            expediente = MedicalRecord.objects.filter(patient=conservar).first()
+            if expediente is None:
+                expediente_duplicado.patient = conservar
+                expediente_duplicado.save()
+            else:
+                _combinar(expediente, expediente_duplicado, excluir={'id', 'patient'})
+                expediente.save()
+
+        _combinar(conservar, duplicado, excluir={'id', 'fecha_registro'})
+        conservar.save()
+        duplicado.delete()
+    return conservar
+
+
+def _combinar(destino, origen, excluir):
+    """Completa los campos en blanco de `destino`; banderas y relaciones no se tocan"""
+    for campo in destino._meta.concrete_fields:
+        if (campo.name in excluir or campo.name in _NO_COMBINAR or not campo.editable
+                or campo.is_relation or campo.get_internal_type() == 'BooleanField'):
+            continue
+        actual = getattr(destino, campo.attname)
+        otro = getattr(origen, campo.attname)
+        if _vacio(otro):
+            continue
+        if _vacio(actual):
+            setattr(destino, campo.attname, otro)
+        elif campo.get_internal_type() == 'TextField' and otro.strip() not in actual:
+            setattr(destino, campo.attname, f'{actual}\n{otro}')
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Feed en vivo de la agenda.
+
+Las señales de Consultation escriben un AgendaEvent por alta, cambio de
+estado, reprogramación o baja; su id autoincremental es la versión del feed.
+Al vivir en la base de datos el feed funciona con varios workers/procesos:
+cada cliente (SSE o long-poll) solo lee `id > última versión vista` por rango
+de la llave primaria, en lugar de recargar la agenda completa.
+
+Ese cursor exige que los ids se vuelvan visibles en orden: si una
+transacción confirmara el id 11 antes que otra el 10, un cliente pasaría
+de largo el 10. Por eso el evento no se inserta en la transacción de quien
+cambia la consulta sino al confirmarse esta (`on_commit`), en una
+transacción propia y corta. SQLite ya serializa a los escritores; en
+PostgreSQL esa transacción toma un candado (`_serializar`) que solo dura
+el INSERT, de modo que el id se asigna y se confirma en el mismo orden sin
+hacer esperar a las demás clínicas tras la petición más lenta. Un cambio
+que se deshace tampoco deja evento.
+"""
+import json
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .agenda import rango_dia
+
+# Segundos entre lecturas del feed por conexión abierta
+INTERVALO = 1.0
+
+# Comentario keep-alive para proxies que cierran conexiones inactivas
+INTERVALO_PING = 15
+
+# Una conexión SSE se cierra sola tras este tiempo y el navegador reconecta
+# (con Last-Event-ID). El sitio corre bajo ASGI (Procfile): bajo WSGI Django
+# leería el flujo async completo antes de enviar nada y cada pestaña abierta
+# ocuparía un worker síncrono
+DURACION_MAXIMA_SSE = 300
+
+# Espera máxima del long-poll
+ESPERA_MAXIMA = 30
+
+EVENTOS_POR_LECTURA = 200
+
+# Eventos más viejos que esto se purgan (el feed solo sirve para el día)
+RETENCION = timedelta(days=2)
+_PURGAR_CADA = 1000
+
+
+# Llave del candado consultivo de PostgreSQL que ordena las altas del feed
+_CANDADO_FEED = 0x61676e64
+
+
+def _serializar():
+    """Candado hasta el fin de la transacción: la siguiente alta espera a que esta confirme"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [_CANDADO_FEED])
+
+
+def _publicar(eventos):
+    """Inserta los eventos en su propia transacción (corre ya confirmada la del cambio)"""
+    from .models import AgendaEvent
+
+    with transaction.atomic():
+        _serializar()
+        creados = AgendaEvent.objects.bulk_create([AgendaEvent(**evento) for evento in eventos])
+    if creados and creados[-1].pk and creados[-1].pk // _PURGAR_CADA != (creados[0].pk - 1) // _PURGAR_CADA:
+        AgendaEvent.objects.filter(fecha_evento__lt=timezone.now() - RETENCION).delete()
+
+
+def registrar_evento(consulta, tipo, estado_anterior='', fecha_anterior=None):
+    registrar_eventos([{
+        'consulta_id': consulta.pk,
+        'doctor_id': consulta.doctor_id,
+        'fecha_consulta': consulta.fecha_consulta,
+        'tipo': tipo,
+        'estado': consulta.estado,
+        'estado_anterior': estado_anterior,
+        'fecha_anterior': fecha_anterior,
+        'clinic_id': consulta.clinic_id,
+    }])
+
+
+def registrar_eventos(eventos):
+    """Alta en bloque para operaciones masivas: lista de dicts con los campos de AgendaEvent"""
+    from .models import Consultation
+
+    sin_clinica = {evento['consulta_id'] for evento in eventos if 'clinic_id' not in evento}
+    if sin_clinica:
+        # La de cada consulta, en una sola lectura (las operaciones masivas no la traen)
+        clinicas = dict(Consultation._base_manager.filter(id__in=sin_clinica).values_list('id', 'clinic_id'))
+        for evento in eventos:
+            evento.setdefault('clinic_id', clinicas.get(evento['consulta_id']))
+    if eventos:
+        # Un feed que falla no deshace ni convierte en error el cambio ya confirmado
+        transaction.on_commit(lambda: _publicar(eventos), robust=True)
+
+
+def ultima_version():
+    from .models import AgendaEvent
+
+    return AgendaEvent.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def eventos_desde(version, fecha, doctor_id=None, limite=EVENTOS_POR_LECTURA):
+    """Eventos posteriores a `version` que afectan la agenda de `fecha` (lista de dicts)"""
+    from .models import AgendaEvent, Consultation
+
+    inicio, fin = rango_dia(fecha)
+    eventos = AgendaEvent.objects.filter(id__gt=version).filter(
+        Q(fecha_consulta__range=(inicio, fin)) | Q(fecha_anterior__range=(inicio, fin))
+    )
+    if doctor_id:
+        eventos = eventos.filter(doctor_id=doctor_id)
+    eventos = list(eventos.order_by('id')[:limite])
+    if not eventos:
+        return []
+
+    pacientes = {
+        fila['id']: f"{fila['patient__nombres']} {fila['patient__apellidos']}"
+        for fila in Consultation.objects.filter(id__in={e.consulta_id for e in eventos}).values(
+            'id', 'patient__nombres', 'patient__apellidos'
+        )
+    }
+    return [
+        {
+            'version': evento.id,
+            'tipo': evento.tipo,
+            'consulta_id': evento.consulta_id,
+            'doctor_id': evento.doctor_id,
+            'paciente': pacientes.get(evento.consulta_id, ''),
+            'estado': evento.estado,
+            'estado_anterior': evento.estado_anterior,
+            'hora': timezone.localtime(evento.fecha_consulta).strftime('%H:%M'),
+            # Reprogramada a otro día: sale de la agenda de `fecha`
+            'en_fecha': inicio <= evento.fecha_consulta <= fin,
+        }
+        for evento in eventos
+    ]
+
+
+def formato_sse(evento):
+    """Mensaje SSE con el id del evento (el navegador lo reenvía como Last-Event-ID)"""
+    return f"id: {evento['version']}\nevent: consulta\ndata: {json.dumps(evento)}\n\n"
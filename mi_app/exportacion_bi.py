@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Exportación incremental a Parquet para BI.
+
+Finanzas y dirección analizan copias columnares en lugar de consultar la
+base de datos de las clínicas. Cada corrida escribe, por tabla, las filas
+creadas o modificadas desde la anterior en
+
+    <BI_CARPETA>/<tabla>/fecha=AAAA-MM-DD/<tabla>-HHMMSS.parquet
+
+(particiones por día de corrida, legibles con pyarrow.dataset, DuckDB o
+Spark). La lectura va por rango de índice —(clinic, fecha_actualizacion, id)
+por clínica, fecha_emision/fecha_cancelacion en facturas— con .iterator()
+en bloques de LOTE filas, que se acumulan en grupos de FILAS_POR_GRUPO: la
+memoria no crece con la tabla y la BD de las clínicas no ordena ni escribe
+nada (BI_BASE_DATOS puede apuntar a una réplica).
+
+Las marcas de agua viven junto a los archivos (_marcas.json). Como en la
+sincronización, retroceden MARGEN para no perder filas de transacciones
+confirmadas tarde, así que una fila puede salir en dos corridas: vale la
+de mayor fecha_actualizacion (o la última corrida) por id. Las bajas de
+pacientes y consultas salen en la tabla `bajas`.
+
+Los pacientes van sin identificadores: no se exportan nombre, contacto,
+dirección, póliza ni textos clínicos, la fecha de nacimiento queda en el
+año y el id se sustituye por un seudónimo estable (HMAC con
+BI_SEUDONIMO_CLAVE, una clave que solo vive en el entorno), el mismo en
+consultas y bajas.
+
+pyarrow es opcional: no está en requirements.txt sino en
+requirements-bi.txt, que se instala solo donde corre la exportación; sin él
+el comando falla con un mensaje claro y el resto de la aplicación no lo
+necesita.
+"""
+import json
+import os
+from itertools import islice
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from django.utils.dateparse import parse_datetime
+
+from .analitica import normalizar_termino
+from .sincronizacion import MARGEN
+
+# Filas por lectura de la BD y filas por grupo del archivo Parquet
+LOTE = 2000
+FILAS_POR_GRUPO = 100_000
+
+ARCHIVO_MARCAS = '_marcas.json'
+
+_SALT_SEUDONIMO = 'mi_app.exportacion_bi.paciente'
+
+
+class ExportacionInvalida(Exception):
+    pass
+
+
+def _clave_seudonimo():
+    if not settings.BI_SEUDONIMO_CLAVE:
+        raise ExportacionInvalida('Falta BI_SEUDONIMO_CLAVE en el entorno: sin ella no se seudonimizan los pacientes')
+    return settings.BI_SEUDONIMO_CLAVE
+
+
+def seudonimo(patient_id):
+    """Id del paciente para BI: estable entre corridas, no reversible sin la clave (entero de 63 bits)"""
+    if patient_id is None:
+        return None
+    digest = salted_hmac(_SALT_SEUDONIMO, str(patient_id), secret=_clave_seudonimo()).digest()
+    return int.from_bytes(digest[:8], 'big') >> 1
+
+
+def _anio(fecha):
+    return fecha.year if fecha else None
+
+
+def _objeto_baja(modelo, objeto_id):
+    return seudonimo(objeto_id) if modelo == 'patient' else objeto_id
+
+
+# tabla -> (modelo, columnas). Una columna es un campo que se copia tal cual
+# o (nombre, campo(s) de origen, función, tipo de Arrow)
+TABLAS = {
+    'pacientes': ('Patient', (
+        ('paciente', 'id', seudonimo, 'int64'),
+        'clinic_id',
+        ('anio_nacimiento', 'fecha_nacimiento', _anio, 'int16'),
+        'genero', 'estado_civil', 'tipo_sangre', 'estado',
+        ('aseguradora', 'seguro_medico', normalizar_termino, 'string'),
+        'activo', 'fecha_registro', 'fecha_actualizacion',
+    )),
+    'consultas': ('Consultation', (
+        'id',
+        ('paciente', 'patient_id', seudonimo, 'int64'),
+        'doctor_id', 'clinic_id', 'serie_id', 'fecha_consulta', 'tipo_consulta', 'estado',
+        'proxima_cita', 'fecha_creacion', 'fecha_actualizacion',
+    )),
+    'pagos': ('Payment', (
+        'id', 'consultation_id', 'clinic_id', 'monto_total', 'monto_pagado', 'descuento',
+        'metodo_pago', 'estado', 'fecha_pago', 'fecha_conciliacion', 'registrado_por_id',
+        'fecha_creacion', 'fecha_actualizacion',
+    )),
+    'facturas': ('Invoice', (
+        'id', 'payment_id', 'folio', 'tipo_comprobante', 'subtotal', 'iva', 'total',
+        'fecha_emision', 'cancelada', 'fecha_cancelacion',
+    )),
+    'conceptos': ('ConceptoFactura', (
+        'id', 'factura_id', 'cantidad', 'descripcion', 'precio_unitario', 'importe',
+    )),
+    'bajas': ('Tombstone', (
+        'id', 'modelo',
+        ('objeto_id', ('modelo', 'objeto_id'), _objeto_baja, 'int64'),
+        'fecha_eliminacion',
+    )),
+}
+
+# Tablas que se leen clínica por clínica (sus índices empiezan por la clínica)
+_POR_CLINICA = {'pacientes', 'consultas', 'pagos'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ExportacionInvalida('La exportación a Parquet necesita pyarrow (pip install -r requirements-bi.txt)') from None
+    return pyarrow
+
+
+def _tipo(pa, campo):
+    tipo = campo.get_internal_type()
+    if tipo == 'DecimalField':
+        return pa.decimal128(campo.max_digits, campo.decimal_places)
+    if tipo == 'DateTimeField':
+        return pa.timestamp('us', tz='UTC')
+    if tipo == 'DateField':
+        return pa.date32()
+    if tipo == 'BooleanField':
+        return pa.bool_()
+    if tipo == 'FloatField':
+        return pa.float64()
+    if tipo in ('CharField', 'TextField', 'EmailField', 'SlugField'):
+        return pa.string()
+    return pa.int64()
+
+
+def _plan(tabla):
+    """(campos a leer, [(nombre, índices en la fila leída, función)])"""
+    fuentes, columnas = [], []
+    for columna in TABLAS[tabla][1]:
+        nombre, origen, funcion = (columna, columna, None) if isinstance(columna, str) else columna[:3]
+        indices = []
+        for campo in (origen,) if isinstance(origen, str) else origen:
+            if campo not in fuentes:
+                fuentes.append(campo)
+            indices.append(fuentes.index(campo))
+        columnas.append((nombre, indices, funcion))
+    return fuentes, columnas
+
+
+def esquema(tabla):
+    """Esquema Arrow de la tabla: fijo entre corridas para que los archivos se lean como un solo dataset"""
+    pa = _pyarrow()
+    modelo = apps.get_model('mi_app', TABLAS[tabla][0])
+    campos = []
+    for columna in TABLAS[tabla][1]:
+        if isinstance(columna, str):
+            campos.append(pa.field(columna, _tipo(pa, modelo._meta.get_field(columna))))
+        else:
+            campos.append(pa.field(columna[0], getattr(pa, columna[3])()))
+    return pa.schema(campos)
+
+
+def _rango(queryset, campo, desde, hasta):
+    if desde is not None:
+        queryset = queryset.filter(**{f'{campo}__gte': desde})
+    return queryset.filter(**{f'{campo}__lt': hasta})
+
+
+def _consultas(tabla, base_datos, desde, hasta):
+    """Querysets (values_list) con las filas de la tabla cambiadas en [desde, hasta)"""
+    modelo = apps.get_model('mi_app', TABLAS[tabla][0])
+    fuentes = _plan(tabla)[0]
+    objetos = modelo._base_manager.using(base_datos)
+
+    if tabla in _POR_CLINICA:
+        from .models import Clinic
+
+        clinicas = [*Clinic.objects.using(base_datos).order_by('id').values_list('id', flat=True), None]
+        for clinica in clinicas:
+            queryset = _rango(objetos.filter(clinic_id=clinica), 'fecha_actualizacion', desde, hasta)
+            yield queryset.order_by('fecha_actualizacion', 'id').values_list(*fuentes)
+    elif tabla == 'facturas':
+        # Emitidas o canceladas en el periodo (una factura no cambia de otra forma)
+        cambios = Q(fecha_emision__lt=hasta) | Q(fecha_cancelacion__lt=hasta)
+        if desde is not None:
+            cambios = (
+                Q(fecha_emision__gte=desde, fecha_emision__lt=hasta)
+                | Q(fecha_cancelacion__gte=desde, fecha_cancelacion__lt=hasta)
+            )
+        yield objetos.filter(cambios).order_by().values_list(*fuentes)
+    elif tabla == 'conceptos':
+        # Los conceptos se crean con su factura y no se editan
+        yield _rango(objetos, 'factura__fecha_emision', desde, hasta).order_by().values_list(*fuentes)
+    elif tabla == 'bajas':
+        queryset = _rango(objetos.filter(modelo__in=('patient', 'consultation')), 'fecha_eliminacion', desde, hasta)
+        yield queryset.order_by('fecha_eliminacion', 'id').values_list(*fuentes)
+
+
+def _filas(tabla, base_datos, desde, hasta):
+    columnas = _plan(tabla)[1]
+    for queryset in _consultas(tabla, base_datos, desde, hasta):
+        for fila in queryset.iterator(chunk_size=LOTE):
+            yield tuple(
+                funcion(*(fila[i] for i in indices)) if funcion else fila[indices[0]]
+                for _, indices, funcion in columnas
+            )
+
+
+def _escribir(ruta, esquema_tabla, filas):
+    """Escribe las filas en `ruta` (vía un temporal); devuelve cuántas. Sin filas no crea el archivo"""
+    pa = _pyarrow()
+    temporal = ruta + '.tmp'
+    escritor = None
+    pendientes, en_grupo, total = [], 0, 0
+
+    def volcar():
+        escritor.write_table(pa.Table.from_batches(pendientes, schema=esquema_tabla))
+        pendientes.clear()
+
+    try:
+        while True:
+            bloque = list(islice(filas, LOTE))
+            if not bloque:
+                break
+            if escritor is None:
+                os.makedirs(os.path.dirname(ruta), exist_ok=True)
+                escritor = pa.parquet.ParquetWriter(temporal, esquema_tabla, compression='zstd')
+            pendientes.append(pa.record_batch(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(zip(*bloque), esquema_tabla)],
+                schema=esquema_tabla,
+            ))
+            en_grupo += len(bloque)
+            total += len(bloque)
+            if en_grupo >= FILAS_POR_GRUPO:
+                volcar()
+                en_grupo = 0
+        if pendientes:
+            volcar()
+    except BaseException:
+        if escritor is not None:
+            escritor.close()
+            os.remove(temporal)
+        raise
+    if escritor is not None:
+        escritor.close()
+        os.replace(temporal, ruta)
+    return total
+
+
+def leer_marcas(carpeta):
+    try:
+        with open(os.path.join(carpeta, ARCHIVO_MARCAS), encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except FileNotFoundError:
+        return {}
+
+
+def _guardar_marcas(carpeta, marcas):
+    ruta = os.path.join(carpeta, ARCHIVO_MARCAS)
+    with open(ruta + '.tmp', 'w', encoding='utf-8') as archivo:
+        json.dump(marcas, archivo, indent=2, sort_keys=True)
+    os.replace(ruta + '.tmp', ruta)
+
+
+def exportar(carpeta=None, tablas=None, completo=False, base_datos=None, avance=None):
+    """
+    Exporta los cambios de cada tabla desde su marca; devuelve {tabla: filas}.
+
+    `completo` ignora las marcas y copia todo. La marca de una tabla avanza
+    solo cuando su archivo quedó escrito, así que una corrida interrumpida
+    se repite desde donde estaba.
+    """
+    _pyarrow()
+    _clave_seudonimo()
+    carpeta = carpeta or settings.BI_CARPETA
+    base_datos = base_datos or settings.BI_BASE_DATOS
+    tablas = tablas or list(TABLAS)
+    desconocidas = set(tablas) - set(TABLAS)
+    if desconocidas:
+        raise ExportacionInvalida(f"Tablas desconocidas: {', '.join(sorted(desconocidas))}")
+
+    os.makedirs(carpeta, exist_ok=True)
+    marcas = leer_marcas(carpeta)
+    corte = timezone.now()
+    local = timezone.localtime(corte)
+    resultado = {}
+    for tabla in tablas:
+        desde = None if completo or tabla not in marcas else parse_datetime(marcas[tabla])
+        ruta = os.path.join(carpeta, tabla, f'fecha={local:%Y-%m-%d}', f'{tabla}-{local:%H%M%S}.parquet')
+        resultado[tabla] = _escribir(ruta, esquema(tabla), _filas(tabla, base_datos, desde, corte))
+        marcas[tabla] = (corte - MARGEN).isoformat()
+        _guardar_marcas(carpeta, marcas)
+        if avance:
+            avance(tabla, resultado[tabla])
+    return resultado
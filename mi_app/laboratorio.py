@@ -0,0 +1,633 @@
+# -*- coding: utf-8 -*-
+"""
+Ingesta de reportes de laboratorio en PDF.
+
+Los PDF (subidos o dejados en una carpeta de entrada) se guardan en el
+almacén de adjuntos y quedan como LabReport 'pendiente': esa tabla es la
+cola. Un proceso toma lotes marcándolos con su token y la hora; la
+extracción (texto con PyMuPDF o pypdf, datos del paciente, analitos y raíces
+para la búsqueda) corre en un pool de procesos y cada lote se guarda en una
+transacción: una consulta para los pacientes candidatos del lote,
+bulk_create de resultados y adjuntos. Si el proceso muere, la toma vence
+(TOMA_MINUTOS) y los reportes vuelven a la cola; nada queda a medias.
+La memoria está acotada por lote: el texto de cada PDF se recorta y solo un
+lote de resultados vive en memoria a la vez.
+"""
+import logging
+import multiprocessing
+import os
+import re
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .analitica import normalizar_termino
+from .clinicas import activar, clinica_actual
+
+logger = logging.getLogger(__name__)
+
+LOTE = 100
+
+# Texto guardado por reporte (los reportes reales ocupan unas pocas páginas)
+TEXTO_MAXIMO = 100_000
+
+# Minutos tras los que un reporte 'procesando' se considera abandonado
+TOMA_MINUTOS = 15
+MAXIMO_INTENTOS = 3
+
+# El pool se renueva tras estas tareas por proceso (fugas de memoria de las librerías PDF).
+# Se hace a mano: max_tasks_per_child se bloquea al reemplazar procesos en Python 3.11.
+TAREAS_POR_PROCESO = 200
+
+# Segundos sin cambios antes de tomar un archivo de la carpeta (copias a medias)
+ESPERA_ARCHIVO = 10
+
+TABLA_FTS = 'mi_app_labreport_fts'
+
+# Analito: nombres con los que aparece en los reportes (ya normalizados)
+ANALITOS = {
+    'glucosa': ('glucosa', 'glucosa en ayunas', 'glucosa serica', 'glucemia'),
+    'hba1c': ('hemoglobina glucosilada', 'hemoglobina glicosilada', 'hemoglobina glicada', 'hba1c', 'hb a1c', 'a1c'),
+    'hemoglobina': ('hemoglobina', 'hb', 'hgb'),
+    'hematocrito': ('hematocrito', 'hto', 'hct'),
+    'leucocitos': ('leucocitos', 'globulos blancos', 'wbc'),
+    'plaquetas': ('plaquetas', 'plt'),
+    'colesterol_total': ('colesterol total', 'colesterol'),
+    'hdl': ('colesterol hdl', 'hdl colesterol', 'hdl'),
+    'ldl': ('colesterol ldl', 'ldl colesterol', 'ldl'),
+    'trigliceridos': ('trigliceridos',),
+    'creatinina': ('creatinina', 'creatinina serica'),
+    'urea': ('urea', 'nitrogeno ureico', 'bun'),
+    'acido_urico': ('acido urico',),
+    'tsh': ('tsh', 'hormona estimulante de tiroides', 'tirotropina'),
+    't4_libre': ('t4 libre', 'tiroxina libre'),
+    'alt': ('alt', 'tgp', 'alanina aminotransferasa'),
+    'ast': ('ast', 'tgo', 'aspartato aminotransferasa'),
+    'sodio': ('sodio', 'na'),
+    'potasio': ('potasio', 'k'),
+}
+# Alias de más largo a más corto: 'hemoglobina glucosilada' antes que 'hemoglobina'
+_ALIAS = sorted(
+    ((alias, clave) for clave, aliases in ANALITOS.items() for alias in aliases),
+    key=lambda par: -len(par[0]),
+)
+
+_FECHA = r'\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{2}-\d{2}'
+_NOMBRE = re.compile(
+    r'^\s*(?:nombre(?:\s+del\s+paciente)?|paciente)\s*[:.]\s*(.+?)\s*'
+    r'(?:\b(?:edad|sexo|g[eé]nero|fecha|f\.\s*nac|expediente|folio|m[eé]dico|doctor|dr)\b.*)?$',
+    re.IGNORECASE,
+)
+_NACIMIENTO = re.compile(
+    r'(?:fecha\s+de\s+nacimiento|f\.?\s*(?:de\s+)?nac(?:imiento)?\.?|nacimiento)\s*[:.]?\s*(' + _FECHA + ')',
+    re.IGNORECASE,
+)
+_FECHA_REPORTE = re.compile(
+    r'fecha(?:\s+de)?\s*(?:toma|muestra|reporte|emisi[oó]n|impresi[oó]n|recepci[oó]n)?\s*[:.]\s*(' + _FECHA + ')',
+    re.IGNORECASE,
+)
+_VALOR = re.compile(
+    r'(?P<valor>[<>≤≥]?\s*\d+(?:[.,]\d+)?)\s*'
+    r'(?P<unidad>(?:x?\s*10\^?\d+\s*/\s*[a-zµμ]+|[a-zµμ%][\w/%µμ.^³]*(?:/[\w.^³µμ]+)?)?)\s*'
+    r'(?P<resto>.*)$',
+    re.IGNORECASE,
+)
+# El valor es un número suelto: el '1' de 'HbA1c' o el '4' de 'T4 libre' son parte del nombre
+_INICIO_VALOR = re.compile(r'(?<![\w(^.,])[<>≤≥]?\s*\d+(?:[.,]\d+)?(?=\s|$|[%/a-zA-Zµμ])')
+_INTERVALO = re.compile(r'(\d+(?:[.,]\d+)?)\s*(?:-|–|a)\s*(\d+(?:[.,]\d+)?)')
+_MAXIMO = re.compile(r'[<≤]\s*(\d+(?:[.,]\d+)?)')
+_MINIMO = re.compile(r'[>≥]\s*(\d+(?:[.,]\d+)?)')
+_MILES = re.compile(r'^\d{1,3}(?:,\d{3})+$')
+
+_PARTICULAS = frozenset('de del la las los y e da das do dos van von'.split())
+
+
+class LaboratorioInvalido(Exception):
+    pass
+
+
+# ---------- Extracción (corre en el pool de procesos: sin base de datos) ----------
+
+def _numero(texto):
+    texto = texto.strip().lstrip('<>≤≥').strip()
+    texto = texto.replace(',', '') if _MILES.match(texto) else texto.replace(',', '.')
+    try:
+        return Decimal(texto)
+    except InvalidOperation:
+        return None
+
+
+def _fecha(texto):
+    """'05/03/1980', '5-3-80' o '1980-03-05' -> date (día primero); None si no es válida"""
+    try:
+        if re.match(r'^\d{4}-', texto):
+            anio, mes, dia = (int(p) for p in texto.split('-'))
+        else:
+            dia, mes, anio = (int(p) for p in re.split(r'[/.-]', texto))
+            if anio < 100:
+                anio += 2000 if anio <= date.today().year % 100 else 1900
+        return date(anio, mes, dia)
+    except ValueError:
+        return None
+
+
+def _texto_pdf(ruta):
+    """(texto, páginas) con PyMuPDF; pypdf si no está instalado o no puede abrir el archivo"""
+    try:
+        import fitz
+    except ImportError:
+        fitz = None
+    if fitz is not None:
+        try:
+            with fitz.open(ruta) as documento:
+                partes, total = [], 0
+                for pagina in documento:
+                    texto = pagina.get_text('text', sort=True)
+                    partes.append(texto)
+                    total += len(texto)
+                    if total >= TEXTO_MAXIMO:
+                        break
+                return '\n'.join(partes)[:TEXTO_MAXIMO], documento.page_count
+        except Exception as error:
+            try:
+                import pypdf  # noqa: F401
+            except ImportError:
+                raise error from None
+            logger.debug('PyMuPDF no pudo leer %s; se intenta con pypdf', ruta, exc_info=True)
+
+    from pypdf import PdfReader
+
+    lector = PdfReader(ruta)
+    partes, total = [], 0
+    for pagina in lector.pages:
+        texto = pagina.extract_text() or ''
+        partes.append(texto)
+        total += len(texto)
+        if total >= TEXTO_MAXIMO:
+            break
+    return '\n'.join(partes)[:TEXTO_MAXIMO], len(lector.pages)
+
+
+def _analito(linea):
+    """(clave, nombre, valor, unidad, referencia, fuera_de_rango) de una línea de resultados, o None"""
+    coincide = _INICIO_VALOR.search(linea)
+    if not coincide or coincide.start() == 0:
+        return None
+    nombre = linea[:coincide.start()].strip(' \t:.*')
+    if not nombre or len(nombre) > 60 or not nombre[0].isalpha():
+        return None
+    normalizado = normalizar_termino(nombre)
+    clave = next(
+        (c for alias, c in _ALIAS if normalizado == alias or normalizado.startswith(alias + ' ')),
+        None,
+    )
+    if clave is None:
+        return None
+
+    partes = _VALOR.match(linea[coincide.start():])
+    valor = _numero(partes['valor']) if partes else None
+    if valor is None:
+        return None
+    resto = partes['resto']
+    minimo = maximo = None
+    referencia = ''
+    if intervalo := _INTERVALO.search(resto):
+        minimo, maximo = _numero(intervalo[1]), _numero(intervalo[2])
+        referencia = intervalo[0]
+    elif tope := _MAXIMO.search(resto):
+        maximo, referencia = _numero(tope[1]), tope[0]
+    elif piso := _MINIMO.search(resto):
+        minimo, referencia = _numero(piso[1]), piso[0]
+    fuera = None
+    if minimo is not None or maximo is not None:
+        fuera = (minimo is not None and valor < minimo) or (maximo is not None and valor > maximo)
+    return clave, nombre[:100], valor, partes['unidad'].strip()[:30], referencia[:50], fuera
+
+
+def analizar_texto(texto):
+    """Datos del paciente, fecha y analitos de un reporte ya convertido a texto"""
+    nombre, nacimiento, fecha_reporte = '', None, None
+    analitos, vistos = [], set()
+    for linea in texto.splitlines():
+        if not linea.strip():
+            continue
+        if not nombre and (coincide := _NOMBRE.match(linea)):
+            # Columnas separadas por varios espacios: el nombre es la primera
+            nombre = re.split(r'\s{2,}', coincide[1].strip())[0][:255]
+        if nacimiento is None and (coincide := _NACIMIENTO.search(linea)):
+            nacimiento = _fecha(coincide[1])
+        if fecha_reporte is None and (coincide := _FECHA_REPORTE.search(linea)):
+            fecha_reporte = _fecha(coincide[1])
+        resultado = _analito(linea)
+        if resultado and resultado[0] not in vistos:
+            vistos.add(resultado[0])
+            analitos.append(resultado)
+    return {
+        'nombre': nombre,
+        'fecha_nacimiento': nacimiento,
+        'fecha_reporte': fecha_reporte,
+        'analitos': analitos,
+    }
+
+
+def extraer(ruta):
+    """Todo lo que se saca de un PDF; nunca lanza: los errores van en 'error'"""
+    from .busqueda import raices
+
+    try:
+        texto, paginas = _texto_pdf(ruta)
+    except Exception as e:
+        return {'error': f'No se pudo leer el PDF: {e}'[:500]}
+    datos = analizar_texto(texto)
+    datos.update(
+        texto=texto,
+        paginas=paginas,
+        raices=' '.join(raices(texto)),
+        error='' if texto.strip() else 'El PDF no tiene texto (¿escaneado?)',
+    )
+    return datos
+
+
+# ---------- Vinculación con el paciente ----------
+
+def _tokens(texto):
+    return frozenset(t for t in normalizar_termino(texto).split() if t not in _PARTICULAS and len(t) > 1)
+
+
+def _candidatos(fechas):
+    """{(clínica, fecha_nacimiento): [(patient_id, tokens del nombre)]} en una consulta"""
+    from .models import Patient
+
+    candidatos = {}
+    if fechas:
+        for patient_id, nombres, apellidos, nacimiento, clinica in Patient.objects.filter(
+            activo=True, fecha_nacimiento__in=fechas,
+        ).values_list('id', 'nombres', 'apellidos', 'fecha_nacimiento', 'clinic_id'):
+            candidatos.setdefault((clinica, nacimiento), []).append((patient_id, _tokens(f'{nombres} {apellidos}')))
+    return candidatos
+
+
+def elegir_paciente(nombre, candidatos):
+    """
+    (patient_id, estado) entre los pacientes con la misma fecha de
+    nacimiento. Coincide si un nombre contiene al otro (en cualquier orden,
+    sin acentos) con al menos dos palabras en común.
+    """
+    tokens = _tokens(nombre)
+    if len(tokens) < 2:
+        return None, 'sin_paciente'
+    coinciden = [
+        patient_id for patient_id, del_paciente in candidatos
+        if len(tokens & del_paciente) >= 2 and (del_paciente <= tokens or tokens <= del_paciente)
+    ]
+    if len(coinciden) == 1:
+        return coinciden[0], 'vinculado'
+    return None, 'ambiguo' if coinciden else 'sin_paciente'
+
+
+# ---------- Cola ----------
+
+def registrar(recibido, origen, usuario=None):
+    """Guarda el PDF en el almacén y lo encola: (reporte, nuevo)"""
+    from .adjuntos import guardar
+    from .models import LabReport
+
+    if recibido.content_type != 'application/pdf':
+        recibido.descartar()
+        raise LaboratorioInvalido(f'{recibido.name} no es un PDF')
+    try:
+        with transaction.atomic():
+            # Las miniaturas de una importación masiva las hace después generar_vistas_previas
+            blob, _ = guardar(recibido, programar=origen == 'subida')
+            return LabReport.objects.get_or_create(
+                blob=blob,
+                defaults={
+                    'nombre_archivo': os.path.basename(recibido.name or 'reporte.pdf')[:255],
+                    'origen': origen,
+                    'usuario': usuario,
+                },
+            )
+    except IntegrityError:
+        # Un reporte por contenido: este PDF ya está en la cola de otra clínica
+        raise LaboratorioInvalido(f'{recibido.name} ya se recibió en otra clínica') from None
+
+
+def _mover(ruta, directorio):
+    os.makedirs(directorio, exist_ok=True)
+    base, extension = os.path.splitext(os.path.basename(ruta))
+    destino = os.path.join(directorio, base + extension)
+    n = 1
+    while os.path.exists(destino):
+        destino = os.path.join(directorio, f'{base}_{n}{extension}')
+        n += 1
+    os.replace(ruta, destino)
+
+
+def _archivos_carpeta(carpeta, excluir):
+    ahora = time.time()
+    pendientes = [carpeta]
+    while pendientes:
+        with os.scandir(pendientes.pop()) as entradas:
+            for entrada in entradas:
+                if entrada.name.startswith('.') or entrada.name.endswith(('~', '.part', '.tmp')):
+                    continue
+                if entrada.is_dir(follow_symlinks=False):
+                    if entrada.path not in excluir:
+                        pendientes.append(entrada.path)
+                elif entrada.is_file() and ahora - entrada.stat().st_mtime >= ESPERA_ARCHIVO:
+                    yield entrada
+
+
+def registrar_carpeta(carpeta):
+    """
+    Encola los archivos de la carpeta de entrada y los mueve a procesados/
+    (o rechazados/ si no son PDF). Registrar es idempotente por sha256: si
+    el proceso muere antes de mover un archivo, la siguiente corrida solo lo
+    mueve. Devuelve {'nuevos', 'repetidos', 'rechazados'}.
+    """
+    from .adjuntos import AdjuntoInvalido, recibir_flujo
+
+    procesados = os.path.join(carpeta, 'procesados')
+    rechazados = os.path.join(carpeta, 'rechazados')
+    totales = Counter()
+    for entrada in _archivos_carpeta(carpeta, {procesados, rechazados}):
+        try:
+            with open(entrada.path, 'rb') as archivo:
+                _, nuevo = registrar(recibir_flujo(archivo, entrada.name), 'carpeta')
+            totales['nuevos' if nuevo else 'repetidos'] += 1
+            _mover(entrada.path, procesados)
+        except (AdjuntoInvalido, LaboratorioInvalido) as e:
+            logger.warning('Reporte rechazado %s: %s', entrada.path, e)
+            totales['rechazados'] += 1
+            _mover(entrada.path, rechazados)
+    return dict(totales)
+
+
+def liberar_vencidos(minutos=TOMA_MINUTOS):
+    """Devuelve a la cola los reportes de procesos que murieron (o los da por perdidos tras MAXIMO_INTENTOS)"""
+    from .models import LabReport
+
+    limite = timezone.now() - timedelta(minutes=minutos)
+    vencidos = LabReport.objects.filter(estado='procesando', tomado_en__lt=limite)
+    perdidos = vencidos.filter(intentos__gte=MAXIMO_INTENTOS).update(
+        estado='error', error='El proceso se interrumpió varias veces con este PDF',
+    )
+    return vencidos.update(estado='pendiente') + perdidos
+
+
+def tomar_lote(token, cantidad=LOTE, ids=None):
+    """Marca hasta `cantidad` pendientes como tomados por `token` y los devuelve"""
+    from .models import LabReport
+
+    pendientes = LabReport.objects.filter(estado='pendiente')
+    if ids is not None:
+        pendientes = pendientes.filter(id__in=ids)
+    elegidos = list(pendientes.order_by('id').values_list('id', flat=True)[:cantidad])
+    if not elegidos:
+        return []
+    # Solo se llevan los que siguen pendientes: otro proceso no puede tomar los mismos
+    LabReport.objects.filter(id__in=elegidos, estado='pendiente').update(
+        estado='procesando', tomado_por=token, tomado_en=timezone.now(), intentos=F('intentos') + 1,
+    )
+    return list(
+        LabReport.objects.filter(id__in=elegidos, estado='procesando', tomado_por=token)
+        .select_related('blob')
+        .only(
+            'id', 'nombre_archivo', 'intentos', 'usuario_id', 'patient_id', 'attachment_id', 'clinic_id',
+            'blob__id', 'blob__sha256',
+        )
+    )
+
+
+def guardar_lote(reportes, resultados):
+    """
+    Guarda lo extraído de un lote en una transacción. Un resultado None
+    (el proceso que lo leía murió) devuelve el reporte a la cola. Volver a
+    procesar un reporte reemplaza sus resultados y reutiliza su adjunto; si
+    ya no se vincula a ningún paciente, el adjunto sale del expediente en
+    que estaba (el PDF se conserva en el reporte). Devuelve un Counter de
+    estados.
+    """
+    from .models import Attachment, LabReport, LabResult, StoredBlob
+
+    candidatos = _candidatos({r['fecha_nacimiento'] for r in resultados if r and r.get('fecha_nacimiento')})
+    ahora = timezone.now()
+    estados = Counter()
+    nuevos_resultados, adjuntos, movidos, retirados = [], {}, [], []
+    with transaction.atomic():
+        for reporte, datos in zip(reportes, resultados):
+            if datos is None:
+                reporte.estado = 'pendiente' if reporte.intentos < MAXIMO_INTENTOS else 'error'
+                reporte.error = 'El proceso de extracción terminó inesperadamente'
+                estados[reporte.estado] += 1
+                continue
+            reporte.fecha_proceso = ahora
+            reporte.error = datos.get('error', '')
+            if 'texto' not in datos:
+                reporte.estado = 'error'
+                estados['error'] += 1
+                continue
+            reporte.texto = datos['texto']
+            reporte.raices = datos['raices']
+            reporte.nombre_detectado = datos['nombre']
+            reporte.fecha_nacimiento_detectada = datos['fecha_nacimiento']
+            reporte.fecha_reporte = datos['fecha_reporte']
+            reporte.blob.paginas = datos['paginas']
+            anterior = reporte.patient_id
+            # Solo pacientes de la clínica que recibió el reporte
+            reporte.patient_id, reporte.estado = elegir_paciente(
+                datos['nombre'], candidatos.get((reporte.clinic_id, datos['fecha_nacimiento']), []),
+            ) if datos['fecha_nacimiento'] else (None, 'sin_paciente')
+            estados[reporte.estado] += 1
+            if reporte.patient_id and reporte.attachment_id:
+                if reporte.patient_id != anterior:
+                    movidos.append(reporte)
+            elif reporte.attachment_id:
+                # Sin paciente o ambiguo: no se queda en el expediente del paciente anterior
+                retirados.append(reporte.attachment_id)
+                reporte.attachment_id = None
+            elif reporte.patient_id:
+                adjuntos[reporte.id] = Attachment(
+                    patient_id=reporte.patient_id,
+                    blob_id=reporte.blob.id,
+                    nombre=reporte.nombre_archivo,
+                    categoria='laboratorio',
+                    descripcion='Reporte de laboratorio',
+                    usuario_id=reporte.usuario_id,
+                )
+            nuevos_resultados.extend(
+                LabResult(
+                    reporte_id=reporte.id,
+                    patient_id=reporte.patient_id,
+                    analito=clave,
+                    nombre=nombre,
+                    valor=valor,
+                    unidad=unidad,
+                    referencia=referencia,
+                    fuera_de_rango=fuera,
+                    fecha=datos['fecha_reporte'],
+                )
+                for clave, nombre, valor, unidad, referencia, fuera in datos['analitos']
+            )
+
+        Attachment.objects.filter(id__in=retirados).delete()
+        Attachment.objects.bulk_create(adjuntos.values())
+        for reporte in movidos:
+            Attachment.objects.filter(id=reporte.attachment_id).update(patient_id=reporte.patient_id)
+        LabResult.objects.filter(reporte__in=[r.id for r in reportes if r.estado != 'pendiente']).delete()
+        for reporte in reportes:
+            if reporte.id in adjuntos:
+                reporte.attachment_id = adjuntos[reporte.id].pk
+        LabReport.objects.bulk_update(reportes, [
+            'estado', 'error', 'fecha_proceso', 'texto', 'raices', 'nombre_detectado',
+            'fecha_nacimiento_detectada', 'fecha_reporte', 'patient', 'attachment',
+        ], batch_size=50)
+        LabResult.objects.bulk_create(nuevos_resultados, batch_size=500)
+        StoredBlob.objects.bulk_update([r.blob for r in reportes if r.blob.paginas], ['paginas'], batch_size=200)
+    return estados
+
+
+def _extraer_en(pool, rutas):
+    """Resultados de extraer() en el pool; None donde el pool se rompió"""
+    futuros = []
+    for ruta in rutas:
+        try:
+            futuros.append(pool.submit(extraer, ruta))
+        except BrokenProcessPool:
+            futuros.append(None)
+    resultados = []
+    for futuro in futuros:
+        try:
+            resultados.append(futuro.result() if futuro else None)
+        except BrokenProcessPool:
+            resultados.append(None)
+    return resultados
+
+
+def procesar_pendientes(procesos=None, lote=LOTE, limite=None, avance=None):
+    """
+    Procesa la cola con un pool de `procesos` hasta vaciarla (o `limite`
+    reportes). Se puede cortar y volver a correr en cualquier momento.
+    """
+    from .adjuntos import ruta_contenido
+
+    liberar_vencidos()
+    procesos = procesos or os.cpu_count() or 1
+    token = uuid.uuid4().hex
+    totales = Counter()
+    pool, tareas = None, 0
+    try:
+        while limite is None or sum(totales.values()) < limite:
+            cantidad = lote if limite is None else min(lote, limite - sum(totales.values()))
+            reportes = tomar_lote(token, cantidad)
+            if not reportes:
+                break
+            if pool is not None and tareas >= TAREAS_POR_PROCESO * procesos:
+                pool.shutdown()
+                pool = None
+            if pool is None:
+                # spawn: los procesos no heredan las conexiones a la base de datos
+                pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context('spawn'))
+                tareas = 0
+            resultados = _extraer_en(pool, [ruta_contenido(r.blob) for r in reportes])
+            tareas += len(reportes)
+            if None in resultados:
+                # Un PDF tumbó a su proceso: pool nuevo y ese lote vuelve a la cola
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = None
+            totales.update(guardar_lote(reportes, resultados))
+            if avance:
+                avance(totales)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return totales
+
+
+def procesar_en_segundo_plano(reporte_id):
+    """Procesa un reporte recién subido en el pool de hilos de adjuntos, después del commit"""
+    from .adjuntos import _ejecutor
+
+    # El hilo no hereda la clínica de la petición: el paciente se busca en la de quien subió
+    clinica = clinica_actual()
+    transaction.on_commit(lambda: _ejecutor().submit(_tarea_reporte, reporte_id, clinica))
+
+
+def _tarea_reporte(reporte_id, clinica=None):
+    from .adjuntos import ruta_contenido
+
+    close_old_connections()
+    try:
+        reportes = tomar_lote(uuid.uuid4().hex, 1, ids=[reporte_id])
+        if reportes:
+            with activar(clinica):
+                guardar_lote(reportes, [extraer(ruta_contenido(reportes[0].blob))])
+    except Exception:
+        logger.exception('No se pudo procesar el reporte de laboratorio %s', reporte_id)
+    finally:
+        close_old_connections()
+
+
+def vincular(reporte, patient_id):
+    """Vinculación manual (reportes sin paciente o ambiguos)"""
+    from .models import Attachment
+
+    with transaction.atomic():
+        if reporte.attachment_id:
+            Attachment.objects.filter(id=reporte.attachment_id).update(patient_id=patient_id)
+        else:
+            reporte.attachment = Attachment.objects.create(
+                patient_id=patient_id,
+                blob_id=reporte.blob_id,
+                nombre=reporte.nombre_archivo,
+                categoria='laboratorio',
+                descripcion='Reporte de laboratorio',
+                usuario_id=reporte.usuario_id,
+            )
+        reporte.patient_id = patient_id
+        reporte.estado = 'vinculado'
+        reporte.save(update_fields=['patient', 'estado', 'attachment'])
+        reporte.resultados.update(patient_id=patient_id)
+    return reporte
+
+
+# ---------- Búsqueda ----------
+
+def buscar_reportes(consulta, patient_id=None, pagina=1, por_pagina=20):
+    """Ids de reportes que contienen todas las palabras, del más reciente al más antiguo"""
+    from .busqueda import _consulta_motor, raices
+
+    terminos = sorted(set(raices(consulta)))
+    if not terminos:
+        return []
+    parametros = [_consulta_motor(terminos)]
+    if connection.vendor == 'postgresql':
+        sql = (
+            "SELECT r.id FROM mi_app_labreport r "
+            "WHERE to_tsvector('simple', r.raices) @@ to_tsquery('simple', %s)"
+        )
+    elif connection.vendor == 'sqlite':
+        sql = f"SELECT r.id FROM {TABLA_FTS} f JOIN mi_app_labreport r ON r.id = f.rowid WHERE {TABLA_FTS} MATCH %s"
+    else:
+        sql = "SELECT r.id FROM mi_app_labreport r WHERE " + ' AND '.join(['r.raices LIKE %s'] * len(terminos))
+        parametros = [f'%{t}%' for t in terminos]
+    if patient_id:
+        sql += ' AND r.patient_id = %s'
+        parametros.append(patient_id)
+    clinica = clinica_actual()
+    if clinica is not None:
+        sql += ' AND r.clinic_id = %s'
+        parametros.append(clinica)
+    sql += ' ORDER BY r.id DESC LIMIT %s OFFSET %s'
+    parametros += [por_pagina, (max(pagina, 1) - 1) * por_pagina]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+        return [fila[0] for fila in cursor.fetchall()]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+
+from mi_app.archivo import ANIOS, LOTE, archivar, fecha_corte
+from mi_app.clinicas import activar, por_clave
+
+
+class Command(BaseCommand):
+    help = ('Mueve al archivo las consultas cerradas de hace más de N años con sus recetas, '
+            'pagos y facturas; se puede interrumpir y volver a ejecutar')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--anios', type=int, default=ANIOS,
+                            help=f'Antigüedad mínima en años (por defecto {ANIOS})')
+        parser.add_argument('--lote', type=int, default=LOTE,
+                            help='Consultas por transacción')
+        parser.add_argument('--limite', type=int, default=None,
+                            help='Máximo de consultas a archivar en esta ejecución')
+        parser.add_argument('--clinica', default=None,
+                            help='Clave de la clínica (por defecto, todas)')
+
+    def handle(self, *args, **options):
+        if options['anios'] < 1 or options['lote'] < 1:
+            raise CommandError('--anios y --lote deben ser mayores que cero')
+        clinica = None
+        if options['clinica']:
+            clinica = por_clave(options['clinica'])
+            if clinica is None:
+                raise CommandError(f"No existe la clínica {options['clinica']}")
+
+        corte = fecha_corte(options['anios'])
+        self.stdout.write(f'Archivando consultas cerradas anteriores al {corte:%d/%m/%Y}...')
+
+        def avance(totales):
+            self.stdout.write(f"  {totales['consultas']} consultas archivadas")
+
+        with activar(clinica):
+            totales = archivar(corte, lote=options['lote'], limite=options['limite'], avance=avance)
+        self.stdout.write(self.style.SUCCESS(
+            f"Archivadas {totales['consultas']} consultas, {totales['recetas']} recetas, "
+            f"{totales['pagos']} pagos, {totales['facturas']} facturas y "
+            f"{totales['reclamaciones']} reclamaciones"
+        ))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from mi_app.models import Consultation, VitalSign
+from mi_app.signos_vitales import valores_desde_consulta
+
+
+class Command(BaseCommand):
+    help = 'Llena la serie de signos vitales a partir de las consultas existentes (por lotes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help='Consultas por lote')
+        parser.add_argument('--desde-id', type=int, default=0, help='Reanudar a partir de este id de consulta')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        ultimo_id = options['desde_id']
+        total = 0
+
+        con_signos = (
+            Q(frecuencia_cardiaca__isnull=False) |
+            Q(temperatura__isnull=False) |
+            Q(peso_consulta__isnull=False) |
+            ~Q(presion_arterial='')
+        )
+        consultas = Consultation.objects.filter(con_signos).only(
+            'id', 'patient_id', 'fecha_consulta', 'presion_arterial',
+            'frecuencia_cardiaca', 'temperatura', 'peso_consulta',
+        ).order_by('id')
+
+        while True:
+            bloque = list(consultas.filter(id__gt=ultimo_id)[:lote])
+            if not bloque:
+                break
+
+            nuevos = []
+            for consulta in bloque:
+                valores = valores_desde_consulta(consulta)
+                if valores:
+                    nuevos.append(VitalSign(
+                        patient_id=consulta.patient_id,
+                        consultation_id=consulta.id,
+                        **valores
+                    ))
+
+            # consultation es única: reejecutar el comando no duplica puntos
+            with transaction.atomic():
+                VitalSign.objects.bulk_create(nuevos, ignore_conflicts=True)
+
+            total += len(nuevos)
+            ultimo_id = bloque[-1].id
+            self.stdout.write(f'Lote hasta consulta #{ultimo_id}: {len(nuevos)} mediciones')
+
+        self.stdout.write(self.style.SUCCESS(f'Signos vitales registrados: {total}'))
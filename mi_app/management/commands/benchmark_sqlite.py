@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de concurrencia para SQLite: workers en procesos separados que
+mezclan lecturas tipo dashboard con escrituras tipo registrar_pago, comparando
+el modo de journal por defecto (rollback) contra el perfil WAL de settings.
+"""
+import multiprocessing
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+
+PERFILES = {
+    'rollback': {
+        'pragmas': ['PRAGMA journal_mode=DELETE', 'PRAGMA synchronous=FULL'],
+        'begin': 'BEGIN',
+        'timeout': 5,
+    },
+    'wal': {
+        'pragmas': [
+            'PRAGMA journal_mode=WAL',
+            'PRAGMA synchronous=NORMAL',
+            'PRAGMA mmap_size=268435456',
+            'PRAGMA cache_size=-64000',
+            'PRAGMA temp_store=MEMORY',
+        ],
+        'begin': 'BEGIN IMMEDIATE',
+        'timeout': 20,
+    },
+}
+
+
+def _preparar_base(ruta, consultas):
+    conn = sqlite3.connect(ruta)
+    conn.executescript('''
+        CREATE TABLE consulta (id INTEGER PRIMARY KEY, estado TEXT, fecha REAL);
+        CREATE TABLE pago (
+            id INTEGER PRIMARY KEY, consulta_id INTEGER, monto REAL,
+            estado TEXT, fecha REAL
+        );
+        CREATE INDEX pago_fecha ON pago(fecha);
+        CREATE INDEX consulta_fecha ON consulta(fecha);
+    ''')
+    ahora = time.time()
+    conn.executemany(
+        'INSERT INTO consulta (estado, fecha) VALUES (?, ?)',
+        [(random.choice(['programada', 'completada']), ahora - i * 60) for i in range(consultas)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def _worker(ruta, perfil, segundos, proporcion_escritura, semilla, resultados):
+    config = PERFILES[perfil]
+    rng = random.Random(semilla)
+    conn = sqlite3.connect(ruta, timeout=config['timeout'], isolation_level=None)
+    for pragma in config['pragmas']:
+        conn.execute(pragma)
+
+    lecturas = escrituras = bloqueos = 0
+    latencias = []
+    fin = time.time() + segundos
+    while time.time() < fin:
+        inicio = time.perf_counter()
+        try:
+            if rng.random() < proporcion_escritura:
+                # registrar_pago: leer la consulta, insertar pago y actualizarlo
+                conn.execute(config['begin'])
+                consulta_id = conn.execute(
+                    'SELECT id FROM consulta WHERE estado = ? ORDER BY fecha DESC LIMIT 1 OFFSET ?',
+                    ('completada', rng.randint(0, 50)),
+                ).fetchone()
+                cursor = conn.execute(
+                    'INSERT INTO pago (consulta_id, monto, estado, fecha) VALUES (?, ?, ?, ?)',
+                    (consulta_id[0] if consulta_id else None, 500, 'pendiente', time.time()),
+                )
+                conn.execute('UPDATE pago SET estado = ? WHERE id = ?', ('pagado', cursor.lastrowid))
+                conn.execute('COMMIT')
+                escrituras += 1
+            else:
+                # dashboard: agregados sobre el último mes
+                desde = time.time() - 30 * 86400
+                conn.execute('SELECT COUNT(*) FROM consulta WHERE fecha >= ?', (desde,)).fetchone()
+                conn.execute(
+                    'SELECT SUM(monto) FROM pago WHERE fecha >= ? AND estado = ?', (desde, 'pagado')
+                ).fetchone()
+                lecturas += 1
+            latencias.append(time.perf_counter() - inicio)
+        except sqlite3.OperationalError as e:
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            bloqueos += 1
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+    conn.close()
+    resultados.put((lecturas, escrituras, bloqueos, latencias))
+
+
+class Command(BaseCommand):
+    help = 'Mide lecturas/escrituras concurrentes sobre SQLite con journal rollback vs WAL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--segundos', type=float, default=5.0)
+        parser.add_argument('--escrituras', type=float, default=0.2, help='Proporción de operaciones de escritura')
+        parser.add_argument('--consultas', type=int, default=20000, help='Filas de consulta precargadas')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{options['workers']} workers, {options['segundos']}s, "
+            f"{options['escrituras']:.0%} escrituras\n"
+        )
+        self.stdout.write(f"{'perfil':<10} {'lect/s':>9} {'escr/s':>9} {'bloqueos':>9} {'p50 ms':>8} {'p95 ms':>8}")
+
+        for perfil in PERFILES:
+            with tempfile.TemporaryDirectory() as directorio:
+                ruta = str(Path(directorio) / 'benchmark.sqlite3')
+                _preparar_base(ruta, options['consultas'])
+
+                resultados = multiprocessing.Queue()
+                procesos = [
+                    multiprocessing.Process(
+                        target=_worker,
+                        args=(ruta, perfil, options['segundos'], options['escrituras'], i, resultados),
+                    )
+                    for i in range(options['workers'])
+                ]
+                for proceso in procesos:
+                    proceso.start()
+                datos = [resultados.get() for _ in procesos]
+                for proceso in procesos:
+                    proceso.join()
+
+            lecturas = sum(d[0] for d in datos)
+            escrituras = sum(d[1] for d in datos)
+            bloqueos = sum(d[2] for d in datos)
+            latencias = sorted(l for d in datos for l in d[3])
+            p50 = latencias[len(latencias) // 2] * 1000 if latencias else 0
+            p95 = latencias[int(len(latencias) * 0.95)] * 1000 if latencias else 0
+            self.stdout.write(
+                f"{perfil:<10} {lecturas / options['segundos']:>9.0f} {escrituras / options['segundos']:>9.0f} "
+                f"{bloqueos:>9} {p50:>8.2f} {p95:>8.2f}"
+            )
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from mi_app.clinicas import activar, por_clave
+from mi_app.corte_caja import CorteInvalido, cerrar_dia
+
+
+class Command(BaseCommand):
+    help = 'Cierra el corte de caja de un día (hoy por defecto) guardando sus totales por método y usuario'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fecha', help='Día a cerrar (YYYY-MM-DD)')
+        parser.add_argument('--notas', default='')
+        parser.add_argument('--clinica', default=None,
+                            help='Clave de la clínica a cerrar (por defecto, cada clínica activa)')
+
+    def handle(self, *args, **options):
+        from mi_app.models import Clinic
+
+        try:
+            fecha = (
+                datetime.strptime(options['fecha'], '%Y-%m-%d').date()
+                if options['fecha'] else timezone.localdate()
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['clinica']:
+            clinicas = [por_clave(options['clinica'])]
+            if clinicas[0] is None:
+                raise CommandError(f"No existe la clínica {options['clinica']}")
+        else:
+            clinicas = list(Clinic.objects.filter(activa=True)) or [None]
+
+        errores = []
+        for clinica in clinicas:
+            prefijo = f'{clinica}: ' if clinica else ''
+            try:
+                with activar(clinica):
+                    corte = cerrar_dia(fecha, notas=options['notas'])
+            except CorteInvalido as e:
+                errores.append(f'{prefijo}{e}')
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f'{prefijo}Corte {corte.fecha:%d/%m/%Y}: {corte.pagos} pagos, cobrado ${corte.cobrado}, '
+                f'descuentos ${corte.descuentos}, reembolsos ${corte.reembolsos}, neto ${corte.neto}'
+            ))
+        if errores:
+            raise CommandError('; '.join(errores))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mi_app.clinicas import activar, por_clave
+
+from mi_app.conciliacion import (
+    EstadoCuentaInvalido, METODOS_POR_ORIGEN, VENTANA_DIAS, conciliar, escribir_excepciones_csv,
+)
+
+
+class Command(BaseCommand):
+    help = 'Importa un estado de cuenta CSV (banco o terminal) y concilia sus movimientos contra los pagos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archivo', help='CSV del banco o de la terminal')
+        parser.add_argument('--origen', choices=list(METODOS_POR_ORIGEN), default='banco')
+        parser.add_argument('--ventana', type=int, default=VENTANA_DIAS, help='Días de tolerancia entre pago y movimiento')
+        parser.add_argument('--reporte', help='Ruta donde escribir el CSV de excepciones')
+        parser.add_argument('--clinica', default=None,
+                            help='Clave de la clínica cuyos pagos se concilian (por defecto, todas)')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        clinica = None
+        if options['clinica']:
+            clinica = por_clave(options['clinica'])
+            if clinica is None:
+                raise CommandError(f"No existe la clínica {options['clinica']}")
+        try:
+            with activar(clinica), open(options['archivo'], 'rb') as archivo:
+                estado_cuenta = conciliar(
+                    archivo,
+                    os.path.basename(options['archivo']),
+                    options['origen'],
+                    ventana=options['ventana'],
+                )
+        except (OSError, EstadoCuentaInvalido) as e:
+            raise CommandError(str(e))
+
+        if options['reporte']:
+            with open(options['reporte'], 'w', newline='', encoding='utf-8') as salida:
+                escribir_excepciones_csv(estado_cuenta, salida)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{estado_cuenta.lineas} movimientos: {estado_cuenta.conciliadas} conciliados, '
+            f'{estado_cuenta.excepciones} excepciones ({time.perf_counter() - inicio:.1f} s)'
+        ))
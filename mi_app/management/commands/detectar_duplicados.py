@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from mi_app.duplicados import detectar_todos, reindexar_todos
+
+
+class Command(BaseCommand):
+    help = 'Pasada completa (nocturna) de detección de pacientes duplicados por claves de bloqueo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reindexar', action='store_true', help='Reconstruir primero todas las claves de bloqueo')
+        parser.add_argument('--lote', type=int, default=1000, help='Pacientes por lote al reindexar')
+
+    def handle(self, *args, **options):
+        if options['reindexar']:
+            total = reindexar_todos(lote=options['lote'], stdout=self.stdout)
+            self.stdout.write(f'Claves reconstruidas para {total} pacientes')
+
+        pares, candidatos = detectar_todos()
+        self.stdout.write(self.style.SUCCESS(
+            f'Pares comparados: {pares} - posibles duplicados registrados: {candidatos}'
+        ))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand, CommandError
+
+from mi_app.exportacion_bi import TABLAS, ExportacionInvalida, exportar
+
+
+class Command(BaseCommand):
+    help = ('Escribe en Parquet los cambios desde la última corrida de consultas, pagos, '
+            'facturas y pacientes (sin identificadores) para BI')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carpeta', default=None,
+                            help='Carpeta destino (por defecto settings.BI_CARPETA)')
+        parser.add_argument('--tablas', nargs='+', choices=list(TABLAS), default=None,
+                            help='Tablas a exportar (por defecto, todas)')
+        parser.add_argument('--completo', action='store_true',
+                            help='Ignora las marcas y exporta todas las filas')
+        parser.add_argument('--base-datos', default=None,
+                            help='Alias de la BD de lectura (por defecto settings.BI_BASE_DATOS)')
+
+    def handle(self, *args, **options):
+        def avance(tabla, filas):
+            self.stdout.write(f'  {tabla}: {filas} filas')
+
+        try:
+            resultado = exportar(
+                carpeta=options['carpeta'],
+                tablas=options['tablas'],
+                completo=options['completo'],
+                base_datos=options['base_datos'],
+                avance=avance,
+            )
+        except ExportacionInvalida as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Exportadas {sum(resultado.values())} filas'))
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mi_app.analitica import normalizar_termino
+from mi_app.reclamaciones import ARCHIVOS, ReclamacionInvalida, generar_lotes, mes_anterior, periodo_de
+
+
+class Command(BaseCommand):
+    help = 'Genera los lotes mensuales de reclamaciones por aseguradora y escribe sus archivos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--periodo', help='Mes a reclamar (AAAA-MM); por defecto el anterior')
+        parser.add_argument('--aseguradora', help='Solo esta aseguradora')
+        parser.add_argument('--formato', choices=list(ARCHIVOS), default='csv')
+        parser.add_argument('--salida', help='Directorio donde escribir un archivo por lote')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            periodo = periodo_de(options['periodo']) if options['periodo'] else mes_anterior()
+        except ReclamacionInvalida as e:
+            raise CommandError(str(e))
+
+        lotes, omitidas = generar_lotes(
+            periodo,
+            clave_aseguradora=normalizar_termino(options['aseguradora'] or '') or None,
+        )
+        generar, _ = ARCHIVOS[options['formato']]
+        for lote in lotes:
+            linea = f'{lote.aseguradora}: {lote.reclamaciones} reclamaciones, ${lote.monto_reclamado}'
+            if options['salida']:
+                ruta = os.path.join(
+                    options['salida'],
+                    f'reclamaciones_{lote.clave_aseguradora.replace(" ", "_")}_{periodo:%Y%m}.{options["formato"]}',
+                )
+                with open(ruta, 'w', encoding='utf-8', newline='') as archivo:
+                    for parte in generar(lote):
+                        archivo.write(parte)
+                linea += f' -> {ruta}'
+            self.stdout.write(linea)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(lotes)} lotes de {periodo:%m/%Y}; omitidas sin póliza: {omitidas["sin_poliza"]}, '
+            f'sin pago: {omitidas["sin_pago"]} ({time.perf_counter() - inicio:.1f} s)'
+        ))
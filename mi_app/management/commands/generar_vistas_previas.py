@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from mi_app.adjuntos import generar_derivados, limpiar_temporales
+from mi_app.models import StoredBlob
+
+
+def _generar(blob_id):
+    try:
+        return generar_derivados(blob_id)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        'Genera miniaturas y vistas previas pendientes (p. ej. tras reiniciar con subidas en cola) '
+        'y borra los temporales de subidas abandonadas'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=settings.ADJUNTOS_WORKERS)
+        parser.add_argument('--reintentar', action='store_true', help='Vuelve a intentar los que terminaron en error')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        temporales = limpiar_temporales()
+        if options['reintentar']:
+            StoredBlob.objects.filter(derivados__in=['error', 'no_disponible']).update(derivados='pendiente')
+        pendientes = list(StoredBlob.objects.filter(derivados='pendiente').values_list('id', flat=True))
+
+        resultados = {}
+        with ThreadPoolExecutor(max_workers=max(options['hilos'], 1)) as pool:
+            for estado in pool.map(_generar, pendientes):
+                resultados[estado] = resultados.get(estado, 0) + 1
+
+        resumen = ', '.join(f'{estado}: {n}' for estado, n in sorted(resultados.items(), key=str)) or 'nada pendiente'
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(pendientes)} contenidos ({resumen}), {temporales} temporales borrados '
+            f'en {time.perf_counter() - inicio:.1f} s'
+        ))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mi_app.medicamentos import CatalogoInvalido, importar, leer_csv
+
+
+class Command(BaseCommand):
+    help = (
+        'Carga el catálogo de medicamentos (CSV: clave, nombre, principios_activos, concentracion, '
+        'presentacion, via) y, opcionalmente, las interacciones (CSV: principio_a, principio_b, '
+        'severidad, descripcion, recomendacion)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('catalogo', help='CSV de medicamentos')
+        parser.add_argument('--interacciones', help='CSV de interacciones (reemplaza las actuales)')
+        parser.add_argument('--version-proveedor', default='', help='Versión del catálogo según el proveedor')
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        try:
+            catalogo = importar(
+                leer_csv(options['catalogo']),
+                leer_csv(options['interacciones']) if options['interacciones'] else None,
+                version=options['version_proveedor'],
+            )
+        except (OSError, CatalogoInvalido) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Catálogo #{catalogo.id}: {catalogo.medicamentos} medicamentos, '
+            f'{catalogo.interacciones} interacciones ({time.perf_counter() - inicio:.1f} s)'
+        ))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mi_app.clinicas import activar, por_clave
+from mi_app.laboratorio import LOTE, liberar_vencidos, procesar_pendientes, registrar_carpeta
+
+
+class Command(BaseCommand):
+    help = (
+        'Encola los PDF de la carpeta de laboratorio y extrae los pendientes en un pool de procesos. '
+        'Se puede interrumpir: la siguiente corrida continúa donde quedó.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carpeta', default=settings.LABORATORIO_CARPETA,
+                            help='Carpeta de entrada (por defecto LABORATORIO_CARPETA)')
+        parser.add_argument('--procesos', type=int, default=None, help='Procesos de extracción (por defecto, uno por CPU)')
+        parser.add_argument('--lote', type=int, default=LOTE)
+        parser.add_argument('--limite', type=int, default=None, help='Máximo de reportes a procesar en esta corrida')
+        parser.add_argument('--liberar', action='store_true',
+                            help='Devuelve a la cola ya los reportes tomados por un proceso que murió')
+        parser.add_argument('--clinica', default=None,
+                            help='Clave de la clínica cuyos pacientes se vinculan (por defecto, todas)')
+
+    def handle(self, *args, **options):
+        clinica = None
+        if options['clinica']:
+            clinica = por_clave(options['clinica'])
+            if clinica is None:
+                raise CommandError(f"No existe la clínica {options['clinica']}")
+        with activar(clinica):
+            self._ingerir(options)
+
+    def _ingerir(self, options):
+        inicio = time.perf_counter()
+        if options['liberar']:
+            self.stdout.write(f'{liberar_vencidos(minutos=0)} reportes devueltos a la cola')
+        if options['carpeta']:
+            encolados = registrar_carpeta(options['carpeta'])
+            self.stdout.write(', '.join(f'{k}: {n}' for k, n in sorted(encolados.items())) or 'Carpeta vacía')
+
+        def avance(totales):
+            self.stdout.write(f'  {sum(totales.values())} procesados ({time.perf_counter() - inicio:.0f} s)')
+
+        totales = procesar_pendientes(
+            procesos=options['procesos'],
+            lote=max(options['lote'], 1),
+            limite=options['limite'],
+            avance=avance if options['verbosity'] > 1 else None,
+        )
+        resumen = ', '.join(f'{estado}: {n}' for estado, n in sorted(totales.items())) or 'nada pendiente'
+        self.stdout.write(self.style.SUCCESS(
+            f'{sum(totales.values())} reportes ({resumen}) en {time.perf_counter() - inicio:.1f} s'
+        ))
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mi_app.series import HORIZONTE, extender_series
+
+
+class Command(BaseCommand):
+    help = 'Crea las citas de las series activas hasta el horizonte de programación (diario)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=HORIZONTE.days, help='Días hacia adelante a materializar')
+
+    def handle(self, *args, **options):
+        hasta = timezone.localdate() + timedelta(days=options['dias'])
+        total = extender_series(hasta=hasta)
+        self.stdout.write(self.style.SUCCESS(f'Citas creadas hasta {hasta:%d/%m/%Y}: {total}'))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from mi_app.analitica import registrar_consultas
+from mi_app.models import Consultation
+
+
+class Command(BaseCommand):
+    help = 'Regenera los hechos de analítica clínica de las consultas completadas (por lotes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Consultas por lote')
+        parser.add_argument('--desde-id', type=int, default=0, help='Reanudar a partir de este id de consulta')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        ultimo_id = options['desde_id']
+        total = 0
+
+        consultas = Consultation.objects.filter(estado='completada').select_related(
+            'patient'
+        ).only(
+            'id', 'estado', 'fecha_consulta', 'diagnostico', 'doctor_id',
+            'patient__id', 'patient__genero', 'patient__fecha_nacimiento',
+        ).prefetch_related('prescription_set').order_by('id')
+
+        while True:
+            bloque = list(consultas.filter(id__gt=ultimo_id)[:lote])
+            if not bloque:
+                break
+            total += registrar_consultas(bloque)
+            ultimo_id = bloque[-1].id
+            self.stdout.write(f'Lote hasta consulta #{ultimo_id}')
+
+        self.stdout.write(self.style.SUCCESS(f'Hechos clínicos generados: {total}'))
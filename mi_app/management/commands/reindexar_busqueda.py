@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from mi_app.busqueda import CAMPOS_NOTA, indexar_consulta
+from mi_app.models import Consultation
+
+
+class Command(BaseCommand):
+    help = 'Construye el índice de búsqueda de notas clínicas (por lotes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Consultas por lote')
+        parser.add_argument('--desde-id', type=int, default=0, help='Reanudar a partir de este id de consulta')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        ultimo_id = options['desde_id']
+        total = 0
+
+        consultas = Consultation.objects.only(
+            'id', 'patient_id', 'doctor_id', 'fecha_consulta', *CAMPOS_NOTA,
+        ).prefetch_related('prescription_set').order_by('id')
+
+        while True:
+            bloque = list(consultas.filter(id__gt=ultimo_id)[:lote])
+            if not bloque:
+                break
+            for consulta in bloque:
+                recetas = [(r.medicamento, r.indicaciones) for r in consulta.prescription_set.all()]
+                if indexar_consulta(consulta, recetas):
+                    total += 1
+            ultimo_id = bloque[-1].id
+            self.stdout.write(f'Lote hasta consulta #{ultimo_id}')
+
+        self.stdout.write(self.style.SUCCESS(f'Notas clínicas indexadas: {total}'))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    help = 'Respaldo en caliente de la base SQLite con la API de backup (sin detener la app)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--destino', default=None, help='Archivo o directorio de destino (default: respaldos/)')
+        parser.add_argument('--paginas', type=int, default=1024, help='Páginas copiadas por paso')
+        parser.add_argument('--pausa', type=float, default=0.005, help='Segundos de pausa entre pasos para no bloquear escrituras')
+        parser.add_argument('--conservar', type=int, default=0, help='Conservar solo los N respaldos más recientes del directorio')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        conexion = connections[options['database']]
+        if conexion.vendor != 'sqlite':
+            raise CommandError('Este comando solo aplica a bases SQLite')
+
+        origen = Path(conexion.settings_dict['NAME'])
+        if not origen.exists():
+            raise CommandError(f'No existe la base de datos: {origen}')
+
+        destino = Path(options['destino'] or Path(settings.BASE_DIR) / 'respaldos')
+        if destino.suffix == '':
+            destino.mkdir(parents=True, exist_ok=True)
+            destino = destino / f'{origen.stem}-{timezone.localtime():%Y%m%d-%H%M%S}.sqlite3'
+        else:
+            destino.parent.mkdir(parents=True, exist_ok=True)
+
+        temporal = destino.with_name(destino.name + '.parcial')
+
+        def progreso(status, restantes, total):
+            if total:
+                self.stdout.write(f'\r  {total - restantes}/{total} páginas', ending='')
+
+        # Conexiones propias: la API de backup copia por pasos y permite que
+        # los workers sigan escribiendo entre paso y paso
+        fuente = sqlite3.connect(str(origen), timeout=30)
+        copia = sqlite3.connect(str(temporal))
+        try:
+            fuente.backup(copia, pages=options['paginas'], progress=progreso, sleep=options['pausa'])
+            resultado = copia.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            copia.close()
+            fuente.close()
+        self.stdout.write('')
+
+        if resultado != 'ok':
+            temporal.unlink(missing_ok=True)
+            raise CommandError(f'El respaldo no pasó la verificación de integridad: {resultado}')
+
+        temporal.replace(destino)
+        self.stdout.write(self.style.SUCCESS(f'Respaldo creado: {destino} ({destino.stat().st_size // 1024} KB)'))
+
+        if options['conservar'] > 0:
+            respaldos = sorted(destino.parent.glob(f'{origen.stem}-*.sqlite3'), reverse=True)
+            for viejo in respaldos[options['conservar']:]:
+                viejo.unlink()
+                self.stdout.write(f'Respaldo eliminado: {viejo.name}')
@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+Catálogo de medicamentos, autocompletado e interacciones.
+
+El catálogo (Drug) y las interacciones entre principios activos
+(DrugInteraction) se cargan con `importar_medicamentos`; cada importación
+crea una DrugCatalogVersion. El autocompletado busca primero por prefijo
+sobre el nombre normalizado (rango del índice B-tree) y completa con el
+índice de trigramas (FTS5 en SQLite, pg_trgm en PostgreSQL) para
+coincidencias a media palabra.
+
+La verificación de interacciones no consulta la tabla: cada proceso guarda
+el grafo como listas de adyacencia en memoria ({principio: {principio:
+interacción}}) y lo reconstruye cuando cambia la versión del catálogo, que
+revisa como mucho cada REVISAR_VERSION segundos. Revisar una receta contra
+los medicamentos activos del paciente son unas cuantas búsquedas en
+diccionarios.
+"""
+import csv
+import re
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .analitica import normalizar_termino, termino_medicamento
+
+SEVERIDADES = ['leve', 'moderada', 'grave', 'contraindicada']
+# Sin confirmación explícita estas alertas impiden guardar la receta
+SEVERIDADES_BLOQUEAN = {'grave', 'contraindicada'}
+
+LIMITE_AUTOCOMPLETADO = 15
+REVISAR_VERSION = 30  # segundos
+
+# Una receta sigue activa durante su duración ('7 días', '3 meses'); si no se
+# entiende, VIGENCIA_PREDETERMINADA; los tratamientos continuos, hasta VIGENCIA_MAXIMA
+VIGENCIA_PREDETERMINADA = timedelta(days=30)
+VIGENCIA_MAXIMA = timedelta(days=365)
+
+TABLA_FTS = 'mi_app_drug_fts'
+
+_DURACION = re.compile(r'(\d+)\s*(d[ií]as?|semanas?|mes(?:es)?|a[nñ]os?)', re.IGNORECASE)
+_CONTINUA = re.compile(r'indefinid|permanente|cr[oó]nic|continu|de por vida', re.IGNORECASE)
+_DIAS_UNIDAD = {'d': 1, 's': 7, 'm': 30, 'a': 365}
+_SEPARADORES = re.compile(r'[\n;,]+|\s+y\s+')
+
+
+class CatalogoInvalido(Exception):
+    pass
+
+
+def principios(texto):
+    """'Paracetamol + Cafeína' o 'paracetamol/cafeina' -> 'cafeina+paracetamol'"""
+    nombres = {normalizar_termino(p) for p in re.split(r'[+/,;]', texto or '')}
+    return '+'.join(sorted(n for n in nombres if n))
+
+
+# ---------- Importación ----------
+
+def leer_csv(ruta):
+    """Filas del CSV como dicts con encabezados normalizados (utf-8, con o sin BOM)"""
+    with open(ruta, newline='', encoding='utf-8-sig') as archivo:
+        lector = csv.reader(archivo)
+        encabezados = [normalizar_termino(e).replace(' ', '_') for e in next(lector, [])]
+        for fila in lector:
+            yield {e: v.strip() for e, v in zip(encabezados, fila) if e}
+
+
+def _medicamento(fila):
+    from .models import Drug
+
+    clave, nombre = fila.get('clave', ''), fila.get('nombre', '')
+    activos = principios(fila.get('principios_activos') or fila.get('principio_activo') or '')
+    if not clave or not nombre or not activos:
+        raise CatalogoInvalido(f'Medicamento incompleto (clave, nombre y principios activos): {fila}')
+    return Drug(
+        clave=clave[:50],
+        nombre=nombre[:200],
+        nombre_normalizado=normalizar_termino(nombre),
+        principios_activos=activos[:300],
+        concentracion=fila.get('concentracion', '')[:100],
+        presentacion=fila.get('presentacion', '')[:100],
+        via=fila.get('via', '')[:50],
+        activo=True,
+    )
+
+
+def _interacciones(filas):
+    """Pares normalizados (a < b) sin repetir; si un par viene dos veces gana la mayor severidad"""
+    from .models import DrugInteraction
+
+    pares = {}
+    for fila in filas:
+        a = normalizar_termino(fila.get('principio_a', ''))
+        b = normalizar_termino(fila.get('principio_b', ''))
+        severidad = normalizar_termino(fila.get('severidad', ''))
+        if not a or not b or a == b or severidad not in SEVERIDADES:
+            raise CatalogoInvalido(f'Interacción inválida (principio_a, principio_b, severidad): {fila}')
+        a, b = sorted((a, b))
+        actual = pares.get((a, b))
+        if actual is None or SEVERIDADES.index(severidad) > SEVERIDADES.index(actual.severidad):
+            pares[(a, b)] = DrugInteraction(
+                principio_a=a[:100],
+                principio_b=b[:100],
+                severidad=severidad,
+                descripcion=fila.get('descripcion', ''),
+                recomendacion=fila.get('recomendacion', ''),
+            )
+    return list(pares.values())
+
+
+def importar(medicamentos, interacciones=None, version='', usuario=None):
+    """
+    Carga el catálogo completo en una transacción: los medicamentos se
+    insertan o actualizan por clave y los que ya no vienen quedan inactivos
+    (las recetas que los usan no se tocan). Si se dan interacciones,
+    reemplazan a las anteriores. Devuelve la nueva DrugCatalogVersion.
+    """
+    from .models import Drug, DrugCatalogVersion, DrugInteraction
+
+    por_clave = {}
+    for fila in medicamentos:
+        medicamento = _medicamento(fila)
+        por_clave[medicamento.clave] = medicamento
+    pares = _interacciones(interacciones) if interacciones is not None else None
+
+    with transaction.atomic():
+        Drug.objects.filter(activo=True).update(activo=False)
+        Drug.objects.bulk_create(
+            por_clave.values(),
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['clave'],
+            update_fields=['nombre', 'nombre_normalizado', 'principios_activos', 'concentracion',
+                           'presentacion', 'via', 'activo'],
+        )
+        if pares is not None:
+            DrugInteraction.objects.all().delete()
+            DrugInteraction.objects.bulk_create(pares, batch_size=500)
+        catalogo = DrugCatalogVersion.objects.create(
+            version=version[:50],
+            medicamentos=len(por_clave),
+            interacciones=len(pares) if pares is not None else DrugInteraction.objects.count(),
+            usuario=usuario,
+        )
+    transaction.on_commit(invalidar_grafo)
+    return catalogo
+
+
+# ---------- Autocompletado ----------
+
+def _por_prefijo(campo, prefijo, excluir, limite):
+    from .models import Drug
+
+    medicamentos = Drug.objects.filter(activo=True).exclude(id__in=excluir)
+    if connection.vendor == 'sqlite':
+        # El LIKE de SQLite no usa índices: el prefijo se busca como rango
+        medicamentos = medicamentos.filter(**{f'{campo}__gte': prefijo, f'{campo}__lt': prefijo + '\x7f'})
+    else:
+        medicamentos = medicamentos.filter(**{f'{campo}__startswith': prefijo})
+    return list(medicamentos.order_by(campo, 'id')[:limite])
+
+
+def _por_trigramas(texto, excluir, limite):
+    """Ids de medicamentos activos que contienen cada palabra (≥ 3 letras) en el nombre o principios"""
+    palabras = [p for p in texto.split() if len(p) >= 3]
+    if not palabras:
+        return []
+    if connection.vendor == 'sqlite':
+        consulta = ' '.join('"{}"'.format(p) for p in palabras)
+        sql = (
+            f"SELECT d.id FROM {TABLA_FTS} f JOIN mi_app_drug d ON d.id = f.rowid "
+            f"WHERE {TABLA_FTS} MATCH %s AND d.activo ORDER BY d.nombre_normalizado LIMIT %s"
+        )
+        parametros = [consulta, limite + len(excluir)]
+    else:
+        condiciones = ' AND '.join(["(d.nombre_normalizado || ' ' || d.principios_activos) LIKE %s"] * len(palabras))
+        sql = f"SELECT d.id FROM mi_app_drug d WHERE d.activo AND {condiciones} ORDER BY d.nombre_normalizado LIMIT %s"
+        parametros = [f'%{p}%' for p in palabras] + [limite + len(excluir)]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+        return [fila[0] for fila in cursor.fetchall() if fila[0] not in excluir][:limite]
+
+
+def autocompletar(texto, limite=LIMITE_AUTOCOMPLETADO):
+    """
+    Medicamentos activos para el campo de receta: primero los que empiezan
+    por el texto (nombre, luego principio activo) y después los que lo
+    contienen a media palabra.
+    """
+    from .models import Drug
+
+    prefijo = normalizar_termino(texto)
+    if not prefijo:
+        return []
+    encontrados = _por_prefijo('nombre_normalizado', prefijo, (), limite)
+    if len(encontrados) < limite:
+        encontrados += _por_prefijo('principios_activos', prefijo, [m.id for m in encontrados], limite - len(encontrados))
+    if len(encontrados) < limite:
+        ids = _por_trigramas(prefijo, {m.id for m in encontrados}, limite - len(encontrados))
+        por_id = Drug.objects.in_bulk(ids)
+        encontrados += [por_id[i] for i in ids if i in por_id]
+    return encontrados
+
+
+# ---------- Grafo de interacciones en memoria ----------
+
+class GrafoInteracciones:
+    """Adyacencia {principio: {principio: (severidad, descripción, recomendación)}} y nombres -> principios"""
+
+    __slots__ = ('version', 'adyacencia', 'por_nombre')
+
+    def __init__(self, version, interacciones, medicamentos):
+        self.version = version
+        self.adyacencia = {}
+        for a, b, severidad, descripcion, recomendacion in interacciones:
+            datos = (severidad, descripcion, recomendacion)
+            self.adyacencia.setdefault(a, {})[b] = datos
+            self.adyacencia.setdefault(b, {})[a] = datos
+        # Nombre comercial o principio activo (normalizados) -> principios activos
+        self.por_nombre = {}
+        for nombre, activos in medicamentos:
+            self.por_nombre.setdefault(nombre, frozenset(activos.split('+')))
+        for principio in self.adyacencia:
+            self.por_nombre[principio] = frozenset([principio])
+
+    def principios_de_texto(self, texto):
+        """Principios activos reconocidos en texto libre ('Losartán 50 mg, metformina 850')"""
+        encontrados = set()
+        for parte in _SEPARADORES.split(texto or ''):
+            termino = termino_medicamento(parte)
+            if not termino:
+                continue
+            palabras = termino[0].split()
+            # El nombre más largo del catálogo con que empieza: 'tempra forte infantil' -> 'tempra forte'
+            for n in range(len(palabras), 0, -1):
+                activos = self.por_nombre.get(' '.join(palabras[:n]))
+                if activos:
+                    encontrados |= activos
+                    break
+        return encontrados
+
+    def interacciones(self, nuevos, actuales):
+        """[(principio nuevo, principio actual, datos)] entre dos conjuntos de principios"""
+        encontradas = []
+        for principio in nuevos:
+            vecinos = self.adyacencia.get(principio)
+            if vecinos:
+                encontradas.extend((principio, otro, vecinos[otro]) for otro in actuales if otro in vecinos)
+        return encontradas
+
+
+_grafo = None
+_revisado = 0.0
+_candado = threading.Lock()
+
+
+def version_catalogo():
+    from .models import DrugCatalogVersion
+
+    return DrugCatalogVersion.objects.order_by('-id').values_list('id', flat=True).first()
+
+
+def _construir(version):
+    from .models import Drug, DrugInteraction
+
+    return GrafoInteracciones(
+        version,
+        DrugInteraction.objects.values_list('principio_a', 'principio_b', 'severidad', 'descripcion', 'recomendacion'),
+        Drug.objects.filter(activo=True).values_list('nombre_normalizado', 'principios_activos').iterator(chunk_size=5000),
+    )
+
+
+def grafo():
+    """El grafo del proceso; se reconstruye si otra importación cambió la versión del catálogo"""
+    global _grafo, _revisado
+
+    ahora = time.monotonic()
+    if _grafo is not None and ahora - _revisado < REVISAR_VERSION:
+        return _grafo
+    with _candado:
+        if _grafo is None or ahora - _revisado >= REVISAR_VERSION:
+            version = version_catalogo()
+            if _grafo is None or _grafo.version != version:
+                _grafo = _construir(version)
+            _revisado = ahora
+    return _grafo
+
+
+def invalidar_grafo():
+    global _grafo
+    with _candado:
+        _grafo = None
+
+
+# ---------- Medicamentos activos del paciente ----------
+
+def _vigencia(duracion):
+    """Tiempo que sigue activa una receta según su duración; None si es un tratamiento continuo"""
+    if _CONTINUA.search(duracion or ''):
+        return None
+    coincide = _DURACION.search(duracion or '')
+    if not coincide:
+        return VIGENCIA_PREDETERMINADA
+    return timedelta(days=int(coincide[1]) * _DIAS_UNIDAD[coincide[2][0].lower()])
+
+
+def medicamentos_activos(patient_id, excluir_receta=None, consulta_id=None, ahora=None):
+    """
+    Lo que el paciente toma: recetas vigentes (del último año), las ya
+    escritas en la consulta en curso y medicamentos_actuales.
+    [{'origen', 'receta_id', 'etiqueta', 'principios'}]
+    """
+    from .models import Patient, Prescription
+
+    ahora = ahora or timezone.now()
+    actual = grafo()
+    activos = []
+    periodo = Q(consultation__fecha_consulta__gte=ahora - VIGENCIA_MAXIMA, consultation__fecha_consulta__lte=ahora)
+    if consulta_id:
+        periodo |= Q(consultation_id=consulta_id)
+    recetas = Prescription.objects.filter(periodo, consultation__patient_id=patient_id).exclude(
+        consultation__estado='cancelada',
+    ).values_list(
+        'id', 'medicamento', 'duracion', 'drug__principios_activos', 'consultation_id', 'consultation__fecha_consulta',
+    )
+    for receta_id, medicamento, duracion, de_catalogo, receta_consulta, fecha in recetas:
+        if receta_id == excluir_receta:
+            continue
+        vigencia = _vigencia(duracion)
+        if receta_consulta != consulta_id and vigencia is not None and fecha + vigencia < ahora:
+            continue
+        nombres = frozenset(de_catalogo.split('+')) if de_catalogo else actual.principios_de_texto(medicamento)
+        if nombres:
+            activos.append({'origen': 'receta', 'receta_id': receta_id, 'etiqueta': medicamento, 'principios': nombres})
+
+    texto = Patient.objects.filter(id=patient_id).values_list('medicamentos_actuales', flat=True).first()
+    for parte in _SEPARADORES.split(texto or ''):
+        nombres = actual.principios_de_texto(parte)
+        if nombres:
+            activos.append({'origen': 'medicamentos_actuales', 'receta_id': None, 'etiqueta': parte.strip(), 'principios': nombres})
+    return activos
+
+
+def verificar(patient_id, drug=None, texto='', excluir_receta=None, consulta_id=None):
+    """
+    Alertas de un medicamento nuevo (del catálogo o en texto libre) contra
+    los activos del paciente, de la más a la menos severa: interacciones y
+    duplicidad del mismo principio activo.
+    """
+    actual = grafo()
+    nuevos = frozenset(drug.principios_activos.split('+')) if drug else actual.principios_de_texto(texto)
+    alertas = []
+    if not nuevos:
+        return alertas
+    for activo in medicamentos_activos(patient_id, excluir_receta=excluir_receta, consulta_id=consulta_id):
+        repetidos = nuevos & activo['principios']
+        if repetidos:
+            alertas.append({
+                'tipo': 'duplicidad',
+                'severidad': 'moderada',
+                'principios': sorted(repetidos),
+                'con': activo['etiqueta'],
+                'origen': activo['origen'],
+                'descripcion': 'El paciente ya toma este principio activo',
+                'recomendacion': '',
+            })
+        for nuevo, otro, (severidad, descripcion, recomendacion) in actual.interacciones(nuevos, activo['principios']):
+            alertas.append({
+                'tipo': 'interaccion',
+                'severidad': severidad,
+                'principios': [nuevo, otro],
+                'con': activo['etiqueta'],
+                'origen': activo['origen'],
+                'descripcion': descripcion,
+                'recomendacion': recomendacion,
+            })
+    alertas.sort(key=lambda a: -SEVERIDADES.index(a['severidad']))
+    return alertas
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0005_auto_20251112_2208'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VitalSign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha_medicion', models.DateTimeField(verbose_name='Fecha de Medición')),
+                ('presion_sistolica', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Presión Sistólica')),
+                ('presion_diastolica', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Presión Diastólica')),
+                ('frecuencia_cardiaca', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Frecuencia Cardíaca')),
+                ('temperatura', models.DecimalField(blank=True, decimal_places=1, max_digits=4, null=True, verbose_name='Temperatura')),
+                ('peso', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True, verbose_name='Peso (kg)')),
+                ('consultation', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='signo_vital', to='mi_app.consultation', verbose_name='Consulta')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='signos_vitales', to='mi_app.patient', verbose_name='Paciente')),
+            ],
+            options={
+                'verbose_name': 'Signo Vital',
+                'verbose_name_plural': 'Signos Vitales',
+                'ordering': ['fecha_medicion'],
+                'indexes': [models.Index(fields=['patient', 'fecha_medicion'], name='signos_paciente_fecha_idx')],
+            },
+        ),
+    ]
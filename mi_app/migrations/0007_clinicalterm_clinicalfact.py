@@ -0,0 +1,49 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0006_vitalsign'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClinicalTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('diagnostico', 'Diagnóstico'), ('medicamento', 'Medicamento')], max_length=20, verbose_name='Tipo')),
+                ('termino', models.CharField(max_length=200, verbose_name='Término Normalizado')),
+                ('etiqueta', models.CharField(max_length=200, verbose_name='Etiqueta')),
+            ],
+            options={
+                'verbose_name': 'Término Clínico',
+                'verbose_name_plural': 'Términos Clínicos',
+                'ordering': ['tipo', 'termino'],
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'termino'), name='termino_clinico_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ClinicalFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha de Consulta')),
+                ('mes', models.DateField(verbose_name='Mes')),
+                ('genero', models.CharField(max_length=20, verbose_name='Género')),
+                ('fecha_nacimiento', models.DateField(verbose_name='Fecha de Nacimiento')),
+                ('consultation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hechos_clinicos', to='mi_app.consultation')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hechos_clinicos', to='mi_app.doctor')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hechos_clinicos', to='mi_app.patient')),
+                ('term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hechos', to='mi_app.clinicalterm')),
+            ],
+            options={
+                'verbose_name': 'Hecho Clínico',
+                'verbose_name_plural': 'Hechos Clínicos',
+                'indexes': [models.Index(fields=['mes', 'term'], name='hechos_mes_term_idx'), models.Index(fields=['doctor', 'mes'], name='hechos_doctor_mes_idx'), models.Index(fields=['term', 'patient'], name='hechos_term_patient_idx')],
+                'constraints': [models.UniqueConstraint(fields=('consultation', 'term'), name='hecho_clinico_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0007_clinicalterm_clinicalfact'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['activo', 'apellidos', 'nombres'], name='pacientes_activo_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['activo', 'fecha_nacimiento'], name='pacientes_activo_nac_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['activo', 'fecha_registro'], name='pacientes_activo_registro_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:20
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0008_patient_pacientes_activo_nombre_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='duracion_consulta',
+            field=models.PositiveSmallIntegerField(default=30, verbose_name='Duración de Consulta (min)'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='hora_fin',
+            field=models.TimeField(default=datetime.time(17, 0), verbose_name='Fin de Jornada'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='hora_inicio',
+            field=models.TimeField(default=datetime.time(9, 0), verbose_name='Inicio de Jornada'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='usuario',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='doctor', to=settings.AUTH_USER_MODEL, verbose_name='Usuario'),
+        ),
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['fecha_consulta', 'estado'], name='consultas_fecha_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['doctor', 'fecha_consulta'], name='consultas_doctor_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0009_doctor_duracion_consulta_doctor_hora_fin_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['fecha_emision'], name='facturas_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['fecha_registro'], name='pacientes_registro_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['fecha_creacion'], name='pagos_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['fecha_creacion'], name='recetas_fecha_idx'),
+        ),
+    ]
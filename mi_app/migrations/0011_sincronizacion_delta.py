@@ -0,0 +1,51 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0010_invoice_facturas_fecha_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(max_length=50, verbose_name='Modelo')),
+                ('objeto_id', models.BigIntegerField(verbose_name='ID del Objeto')),
+                ('fecha_eliminacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Eliminación')),
+            ],
+            options={
+                'verbose_name': 'Registro Eliminado',
+                'verbose_name_plural': 'Registros Eliminados',
+            },
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='fecha_actualizacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='consultas_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medicalrecord',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='expedientes_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='pacientes_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['fecha_actualizacion', 'id'], name='recetas_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['fecha_eliminacion', 'id'], name='bajas_fecha_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0011_sincronizacion_delta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgendaEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consulta_id', models.BigIntegerField(verbose_name='ID de Consulta')),
+                ('doctor_id', models.BigIntegerField(verbose_name='ID de Doctor')),
+                ('fecha_consulta', models.DateTimeField(verbose_name='Fecha de la Consulta')),
+                ('tipo', models.CharField(choices=[('nueva', 'Nueva'), ('estado', 'Cambio de Estado'), ('reprogramada', 'Reprogramada'), ('eliminada', 'Eliminada')], max_length=20, verbose_name='Tipo')),
+                ('estado', models.CharField(max_length=20, verbose_name='Estado')),
+                ('estado_anterior', models.CharField(blank=True, max_length=20, verbose_name='Estado Anterior')),
+                ('fecha_anterior', models.DateTimeField(blank=True, null=True, verbose_name='Fecha Anterior')),
+                ('fecha_evento', models.DateTimeField(auto_now_add=True, verbose_name='Fecha del Evento')),
+            ],
+            options={
+                'verbose_name': 'Evento de Agenda',
+                'verbose_name_plural': 'Eventos de Agenda',
+                'indexes': [models.Index(fields=['fecha_evento'], name='eventos_agenda_fecha_idx')],
+            },
+        ),
+    ]
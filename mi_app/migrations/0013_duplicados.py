@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0012_agendaevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puntaje', models.FloatField(verbose_name='Puntaje')),
+                ('razones', models.CharField(blank=True, max_length=200, verbose_name='Coincidencias')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('descartado', 'Descartado')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('fecha_deteccion', models.DateTimeField(auto_now=True, verbose_name='Fecha de Detección')),
+                ('paciente_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mi_app.patient', verbose_name='Paciente A')),
+                ('paciente_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mi_app.patient', verbose_name='Paciente B')),
+            ],
+            options={
+                'verbose_name': 'Posible Duplicado',
+                'verbose_name_plural': 'Posibles Duplicados',
+                'ordering': ['-puntaje'],
+                'indexes': [models.Index(fields=['estado', '-puntaje'], name='duplicados_estado_idx')],
+                'constraints': [models.UniqueConstraint(fields=('paciente_a', 'paciente_b'), name='duplicado_par_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PatientBlockingKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('nombre_nacimiento', 'Nombre fonético + Nacimiento'), ('telefono', 'Teléfono'), ('email', 'Email')], max_length=20, verbose_name='Tipo')),
+                ('clave', models.CharField(max_length=120, verbose_name='Clave')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='claves_bloqueo', to='mi_app.patient')),
+            ],
+            options={
+                'verbose_name': 'Clave de Bloqueo',
+                'verbose_name_plural': 'Claves de Bloqueo',
+                'indexes': [models.Index(fields=['tipo', 'clave'], name='claves_bloqueo_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patient', 'tipo', 'clave'), name='clave_bloqueo_unica')],
+            },
+        ),
+    ]
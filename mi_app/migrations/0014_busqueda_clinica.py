@@ -0,0 +1,76 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Índice de texto según el motor: tabla FTS5 de contenido externo (sincronizada
+# por triggers) en SQLite, índice GIN de expresión en PostgreSQL
+SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE mi_app_clinicalnote_fts USING fts5(
+        raices,
+        content='mi_app_clinicalnote',
+        content_rowid='consultation_id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER mi_app_clinicalnote_ai AFTER INSERT ON mi_app_clinicalnote BEGIN
+        INSERT INTO mi_app_clinicalnote_fts(rowid, raices) VALUES (new.consultation_id, new.raices);
+    END""",
+    """CREATE TRIGGER mi_app_clinicalnote_ad AFTER DELETE ON mi_app_clinicalnote BEGIN
+        INSERT INTO mi_app_clinicalnote_fts(mi_app_clinicalnote_fts, rowid, raices)
+        VALUES ('delete', old.consultation_id, old.raices);
+    END""",
+    """CREATE TRIGGER mi_app_clinicalnote_au AFTER UPDATE ON mi_app_clinicalnote BEGIN
+        INSERT INTO mi_app_clinicalnote_fts(mi_app_clinicalnote_fts, rowid, raices)
+        VALUES ('delete', old.consultation_id, old.raices);
+        INSERT INTO mi_app_clinicalnote_fts(rowid, raices) VALUES (new.consultation_id, new.raices);
+    END""",
+]
+SQLITE_FTS_REVERSA = [
+    'DROP TRIGGER IF EXISTS mi_app_clinicalnote_ai',
+    'DROP TRIGGER IF EXISTS mi_app_clinicalnote_ad',
+    'DROP TRIGGER IF EXISTS mi_app_clinicalnote_au',
+    'DROP TABLE IF EXISTS mi_app_clinicalnote_fts',
+]
+POSTGRES_GIN = [
+    "CREATE INDEX notas_raices_gin_idx ON mi_app_clinicalnote USING gin (to_tsvector('simple', raices))",
+]
+POSTGRES_GIN_REVERSA = ['DROP INDEX IF EXISTS notas_raices_gin_idx']
+
+
+def _ejecutar(schema_editor, por_motor):
+    for sentencia in por_motor.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sentencia)
+
+
+def crear_indice_texto(apps, schema_editor):
+    _ejecutar(schema_editor, {'sqlite': SQLITE_FTS, 'postgresql': POSTGRES_GIN})
+
+
+def eliminar_indice_texto(apps, schema_editor):
+    _ejecutar(schema_editor, {'sqlite': SQLITE_FTS_REVERSA, 'postgresql': POSTGRES_GIN_REVERSA})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0013_duplicados'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClinicalNote',
+            fields=[
+                ('consultation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='nota_clinica', serialize=False, to='mi_app.consultation')),
+                ('fecha_consulta', models.DateTimeField(verbose_name='Fecha de Consulta')),
+                ('raices', models.TextField(verbose_name='Texto Indexado')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mi_app.doctor')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='mi_app.patient')),
+            ],
+            options={
+                'verbose_name': 'Nota Clínica Indexada',
+                'verbose_name_plural': 'Notas Clínicas Indexadas',
+                'indexes': [models.Index(fields=['doctor', 'fecha_consulta'], name='notas_doctor_fecha_idx'), models.Index(fields=['patient', 'fecha_consulta'], name='notas_paciente_fecha_idx')],
+            },
+        ),
+        migrations.RunPython(crear_indice_texto, eliminar_indice_texto),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0014_busqueda_clinica'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgendaOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('serie', 'Alta de Serie'), ('reprogramar_dia', 'Reprogramar Día'), ('cancelar_dia', 'Cancelar Día'), ('cancelar_serie', 'Cancelar Serie')], max_length=20, verbose_name='Tipo')),
+                ('descripcion', models.CharField(max_length=200, verbose_name='Descripción')),
+                ('motivo', models.TextField(blank=True, verbose_name='Motivo')),
+                ('afectadas', models.PositiveIntegerField(default=0, verbose_name='Consultas Afectadas')),
+                ('conflictos', models.JSONField(blank=True, default=list, verbose_name='Conflictos')),
+                ('fecha', models.DateTimeField(auto_now_add=True, verbose_name='Fecha')),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='mi_app.doctor', verbose_name='Doctor')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Operación de Agenda',
+                'verbose_name_plural': 'Operaciones de Agenda',
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AppointmentSeries',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo_consulta', models.CharField(default='seguimiento', max_length=20, verbose_name='Tipo de Consulta')),
+                ('motivo', models.TextField(verbose_name='Motivo')),
+                ('fecha_inicio', models.DateTimeField(verbose_name='Primera Cita')),
+                ('frecuencia', models.CharField(choices=[('diaria', 'Diaria'), ('semanal', 'Semanal'), ('mensual', 'Mensual')], default='semanal', max_length=10, verbose_name='Frecuencia')),
+                ('intervalo', models.PositiveSmallIntegerField(default=1, verbose_name='Cada (intervalo)')),
+                ('dias_semana', models.CharField(blank=True, max_length=20, verbose_name='Días de la Semana')),
+                ('repeticiones', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Número de Citas')),
+                ('fecha_fin', models.DateField(blank=True, null=True, verbose_name='Hasta')),
+                ('materializada_hasta', models.DateField(blank=True, null=True, verbose_name='Materializada Hasta')),
+                ('activa', models.BooleanField(default=True, verbose_name='Activa')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_citas', to='mi_app.doctor', verbose_name='Doctor')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_citas', to='mi_app.patient', verbose_name='Paciente')),
+            ],
+            options={
+                'verbose_name': 'Serie de Citas',
+                'verbose_name_plural': 'Series de Citas',
+            },
+        ),
+        migrations.AddField(
+            model_name='consultation',
+            name='serie',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='consultas', to='mi_app.appointmentseries', verbose_name='Serie'),
+        ),
+        migrations.CreateModel(
+            name='AgendaChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consulta_id', models.BigIntegerField(verbose_name='ID de Consulta')),
+                ('accion', models.CharField(choices=[('creada', 'Creada'), ('reprogramada', 'Reprogramada'), ('cancelada', 'Cancelada')], max_length=20, verbose_name='Acción')),
+                ('estado_anterior', models.CharField(blank=True, max_length=20, verbose_name='Estado Anterior')),
+                ('fecha_anterior', models.DateTimeField(blank=True, null=True, verbose_name='Fecha Anterior')),
+                ('fecha_nueva', models.DateTimeField(blank=True, null=True, verbose_name='Fecha Nueva')),
+                ('doctor_anterior_id', models.BigIntegerField(blank=True, null=True, verbose_name='ID de Doctor Anterior')),
+                ('operacion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cambios', to='mi_app.agendaoperation', verbose_name='Operación')),
+            ],
+            options={
+                'verbose_name': 'Cambio de Agenda',
+                'verbose_name_plural': 'Cambios de Agenda',
+                'indexes': [models.Index(fields=['consulta_id'], name='cambios_agenda_consulta_idx')],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='appointmentseries',
+            index=models.Index(fields=['activa', 'materializada_hasta'], name='series_materializar_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0015_series_citas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='token_calendario',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='Token de Calendario'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0016_calendario_doctores'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BankStatement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archivo', models.CharField(max_length=255, verbose_name='Archivo')),
+                ('origen', models.CharField(choices=[('banco', 'Banco (transferencias)'), ('terminal', 'Terminal (tarjetas)')], max_length=20, verbose_name='Origen')),
+                ('huella', models.CharField(max_length=64, unique=True, verbose_name='Huella')),
+                ('desde', models.DateField(blank=True, null=True, verbose_name='Desde')),
+                ('hasta', models.DateField(blank=True, null=True, verbose_name='Hasta')),
+                ('lineas', models.PositiveIntegerField(default=0, verbose_name='Líneas')),
+                ('conciliadas', models.PositiveIntegerField(default=0, verbose_name='Conciliadas')),
+                ('excepciones', models.PositiveIntegerField(default=0, verbose_name='Excepciones')),
+                ('fecha_importacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Importación')),
+            ],
+            options={
+                'verbose_name': 'Estado de Cuenta',
+                'verbose_name_plural': 'Estados de Cuenta',
+                'ordering': ['-fecha_importacion'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StatementLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('linea', models.PositiveIntegerField(verbose_name='Línea')),
+                ('fecha', models.DateField(verbose_name='Fecha')),
+                ('monto', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Monto')),
+                ('referencia', models.CharField(blank=True, max_length=100, verbose_name='Referencia')),
+                ('descripcion', models.CharField(blank=True, max_length=255, verbose_name='Descripción')),
+                ('estado', models.CharField(choices=[('conciliada', 'Conciliada'), ('sin_pago', 'Sin Pago Registrado'), ('monto_distinto', 'Monto Distinto'), ('ambigua', 'Varios Pagos Posibles'), ('duplicada', 'Movimiento Duplicado')], max_length=20, verbose_name='Estado')),
+            ],
+            options={
+                'verbose_name': 'Movimiento Bancario',
+                'verbose_name_plural': 'Movimientos Bancarios',
+                'ordering': ['statement', 'linea'],
+            },
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='fecha_conciliacion',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Fecha de Conciliación'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('fecha_conciliacion__isnull', True), ('metodo_pago__in', ['transferencia', 'tarjeta'])), fields=['fecha_pago'], name='pagos_por_conciliar_idx'),
+        ),
+        migrations.AddField(
+            model_name='bankstatement',
+            name='usuario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Usuario'),
+        ),
+        migrations.AddField(
+            model_name='statementline',
+            name='payment',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='movimientos_bancarios', to='mi_app.payment', verbose_name='Pago'),
+        ),
+        migrations.AddField(
+            model_name='statementline',
+            name='statement',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movimientos', to='mi_app.bankstatement', verbose_name='Estado de Cuenta'),
+        ),
+        migrations.AddIndex(
+            model_name='statementline',
+            index=models.Index(fields=['statement', 'estado'], name='movimientos_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0017_conciliacion_bancaria'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashClose',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(unique=True, verbose_name='Fecha')),
+                ('pagos', models.PositiveIntegerField(default=0, verbose_name='Pagos')),
+                ('cobrado', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Cobrado')),
+                ('descuentos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Descuentos')),
+                ('reembolsos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Reembolsos')),
+                ('notas', models.TextField(blank=True, verbose_name='Notas')),
+                ('fecha_cierre', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Cierre')),
+            ],
+            options={
+                'verbose_name': 'Corte de Caja',
+                'verbose_name_plural': 'Cortes de Caja',
+                'ordering': ['-fecha'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CashCloseLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metodo_pago', models.CharField(choices=[('efectivo', 'Efectivo'), ('tarjeta', 'Tarjeta de Crédito/Débito'), ('transferencia', 'Transferencia Bancaria'), ('cheque', 'Cheque'), ('paypal', 'PayPal'), ('otro', 'Otro')], max_length=20, verbose_name='Método de Pago')),
+                ('usuario_id_cobro', models.IntegerField(blank=True, null=True, verbose_name='Id del Usuario')),
+                ('usuario_nombre', models.CharField(blank=True, max_length=150, verbose_name='Usuario')),
+                ('pagos', models.PositiveIntegerField(default=0, verbose_name='Pagos')),
+                ('cobrado', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Cobrado')),
+                ('descuentos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Descuentos')),
+                ('reembolsos', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Reembolsos')),
+                ('num_reembolsos', models.PositiveIntegerField(default=0, verbose_name='Núm. Reembolsos')),
+            ],
+            options={
+                'verbose_name': 'Línea de Corte',
+                'verbose_name_plural': 'Líneas de Corte',
+                'ordering': ['corte', 'metodo_pago', 'usuario_nombre'],
+            },
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='registrado_por',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Registrado por'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['fecha_pago'], name='pagos_fecha_pago_idx'),
+        ),
+        migrations.AddField(
+            model_name='cashclose',
+            name='usuario',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Cerrado por'),
+        ),
+        migrations.AddField(
+            model_name='cashcloseline',
+            name='corte',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lineas', to='mi_app.cashclose', verbose_name='Corte'),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:01
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0018_corte_caja'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaimBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave_aseguradora', models.CharField(max_length=100, verbose_name='Clave de Aseguradora')),
+                ('aseguradora', models.CharField(max_length=100, verbose_name='Aseguradora')),
+                ('periodo', models.DateField(help_text='Primer día del mes reclamado', verbose_name='Periodo')),
+                ('estado', models.CharField(choices=[('generado', 'Generado'), ('enviado', 'Enviado'), ('en_revision', 'En Revisión'), ('cerrado', 'Cerrado')], default='generado', max_length=20, verbose_name='Estado')),
+                ('reclamaciones', models.PositiveIntegerField(default=0, verbose_name='Reclamaciones')),
+                ('monto_reclamado', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Monto Reclamado')),
+                ('monto_aprobado', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Monto Aprobado')),
+                ('aceptadas', models.PositiveIntegerField(default=0, verbose_name='Aceptadas')),
+                ('rechazadas', models.PositiveIntegerField(default=0, verbose_name='Rechazadas')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Creación')),
+                ('fecha_envio', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de Envío')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Lote de Reclamaciones',
+                'verbose_name_plural': 'Lotes de Reclamaciones',
+                'ordering': ['-periodo', 'aseguradora'],
+            },
+        ),
+        migrations.CreateModel(
+            name='InsuranceClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('patient_id_reclamado', models.IntegerField(verbose_name='Id del Paciente')),
+                ('paciente', models.CharField(max_length=255, verbose_name='Paciente')),
+                ('numero_poliza', models.CharField(max_length=50, verbose_name='Número de Póliza')),
+                ('fecha_consulta', models.DateTimeField(verbose_name='Fecha de Consulta')),
+                ('tipo_consulta', models.CharField(max_length=20, verbose_name='Tipo de Consulta')),
+                ('diagnostico', models.TextField(blank=True, verbose_name='Diagnóstico')),
+                ('folio_factura', models.CharField(blank=True, max_length=50, verbose_name='Folio de Factura')),
+                ('monto', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Monto Reclamado')),
+                ('monto_aprobado', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Monto Aprobado')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('enviada', 'Enviada'), ('aceptada', 'Aceptada'), ('rechazada', 'Rechazada'), ('pagada', 'Pagada')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('motivo_rechazo', models.CharField(blank=True, max_length=255, verbose_name='Motivo de Rechazo')),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True, verbose_name='Última Actualización')),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='partidas', to='mi_app.claimbatch', verbose_name='Lote')),
+                ('consultation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reclamaciones', to='mi_app.consultation', verbose_name='Consulta')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='mi_app.payment', verbose_name='Pago')),
+            ],
+            options={
+                'verbose_name': 'Reclamación',
+                'verbose_name_plural': 'Reclamaciones',
+                'ordering': ['batch', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='claimbatch',
+            index=models.Index(fields=['periodo', 'clave_aseguradora'], name='lotes_periodo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='insuranceclaim',
+            index=models.Index(fields=['batch', 'estado'], name='reclamaciones_estado_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='insuranceclaim',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'rechazada'), _negated=True), fields=('consultation',), name='reclamacion_activa_unica'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0019_reclamaciones_aseguradoras'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='SHA-256')),
+                ('tamano', models.BigIntegerField(verbose_name='Tamaño (bytes)')),
+                ('tipo_mime', models.CharField(max_length=100, verbose_name='Tipo MIME')),
+                ('paginas', models.PositiveIntegerField(blank=True, null=True, verbose_name='Páginas')),
+                ('derivados', models.CharField(choices=[('pendiente', 'Pendiente'), ('listo', 'Listo'), ('no_aplica', 'No Aplica'), ('no_disponible', 'Sin Pillow/PyMuPDF'), ('error', 'Error')], default='pendiente', max_length=20, verbose_name='Miniatura y Vista Previa')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Creación')),
+            ],
+            options={
+                'verbose_name': 'Contenido de Adjunto',
+                'verbose_name_plural': 'Contenidos de Adjuntos',
+                'indexes': [models.Index(condition=models.Q(('derivados', 'pendiente')), fields=['id'], name='blobs_derivados_pendientes_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=255, verbose_name='Nombre del Archivo')),
+                ('categoria', models.CharField(choices=[('laboratorio', 'Resultado de Laboratorio'), ('imagen', 'Imagen / Rayos X'), ('consentimiento', 'Consentimiento Informado'), ('receta', 'Receta Externa'), ('otro', 'Otro')], default='otro', max_length=20, verbose_name='Categoría')),
+                ('descripcion', models.CharField(blank=True, max_length=255, verbose_name='Descripción')),
+                ('fecha_subida', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Subida')),
+                ('consultation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='adjuntos', to='mi_app.consultation', verbose_name='Consulta')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='adjuntos', to='mi_app.patient', verbose_name='Paciente')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Subido por')),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='adjuntos', to='mi_app.storedblob', verbose_name='Contenido')),
+            ],
+            options={
+                'verbose_name': 'Adjunto',
+                'verbose_name_plural': 'Adjuntos',
+                'ordering': ['-fecha_subida'],
+                'indexes': [models.Index(fields=['patient', '-fecha_subida'], name='adjuntos_paciente_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,129 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Índice de texto de los reportes, igual que el de notas clínicas (0014). El
+# trigger de actualización solo se dispara cuando cambian las raíces: tomar un
+# reporte de la cola no toca el índice.
+SQLITE_FTS = [
+    """CREATE VIRTUAL TABLE mi_app_labreport_fts USING fts5(
+        raices,
+        content='mi_app_labreport',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER mi_app_labreport_ai AFTER INSERT ON mi_app_labreport BEGIN
+        INSERT INTO mi_app_labreport_fts(rowid, raices) VALUES (new.id, new.raices);
+    END""",
+    """CREATE TRIGGER mi_app_labreport_ad AFTER DELETE ON mi_app_labreport BEGIN
+        INSERT INTO mi_app_labreport_fts(mi_app_labreport_fts, rowid, raices)
+        VALUES ('delete', old.id, old.raices);
+    END""",
+    """CREATE TRIGGER mi_app_labreport_au AFTER UPDATE OF raices ON mi_app_labreport BEGIN
+        INSERT INTO mi_app_labreport_fts(mi_app_labreport_fts, rowid, raices)
+        VALUES ('delete', old.id, old.raices);
+        INSERT INTO mi_app_labreport_fts(rowid, raices) VALUES (new.id, new.raices);
+    END""",
+]
+SQLITE_FTS_REVERSA = [
+    'DROP TRIGGER IF EXISTS mi_app_labreport_ai',
+    'DROP TRIGGER IF EXISTS mi_app_labreport_ad',
+    'DROP TRIGGER IF EXISTS mi_app_labreport_au',
+    'DROP TABLE IF EXISTS mi_app_labreport_fts',
+]
+POSTGRES_GIN = [
+    "CREATE INDEX reportes_raices_gin_idx ON mi_app_labreport USING gin (to_tsvector('simple', raices))",
+]
+POSTGRES_GIN_REVERSA = ['DROP INDEX IF EXISTS reportes_raices_gin_idx']
+
+
+def _ejecutar(schema_editor, por_motor):
+    for sentencia in por_motor.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sentencia)
+
+
+def crear_indice_texto(apps, schema_editor):
+    _ejecutar(schema_editor, {'sqlite': SQLITE_FTS, 'postgresql': POSTGRES_GIN})
+
+
+def eliminar_indice_texto(apps, schema_editor):
+    _ejecutar(schema_editor, {'sqlite': SQLITE_FTS_REVERSA, 'postgresql': POSTGRES_GIN_REVERSA})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0020_adjuntos_expediente'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabReport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre_archivo', models.CharField(max_length=255, verbose_name='Archivo')),
+                ('origen', models.CharField(choices=[('subida', 'Subido'), ('carpeta', 'Carpeta de Entrada')], max_length=20, verbose_name='Origen')),
+                ('estado', models.CharField(choices=[('pendiente', 'Pendiente'), ('procesando', 'Procesando'), ('vinculado', 'Vinculado al Paciente'), ('sin_paciente', 'Sin Paciente Identificado'), ('ambiguo', 'Varios Pacientes Posibles'), ('error', 'Error')], default='pendiente', max_length=20, verbose_name='Estado')),
+                ('nombre_detectado', models.CharField(blank=True, max_length=255, verbose_name='Nombre Detectado')),
+                ('fecha_nacimiento_detectada', models.DateField(blank=True, null=True, verbose_name='Fecha de Nacimiento Detectada')),
+                ('fecha_reporte', models.DateField(blank=True, null=True, verbose_name='Fecha del Reporte')),
+                ('texto', models.TextField(blank=True, verbose_name='Texto Extraído')),
+                ('raices', models.TextField(blank=True, verbose_name='Texto Indexado')),
+                ('tomado_por', models.CharField(blank=True, max_length=32, verbose_name='Tomado por')),
+                ('tomado_en', models.DateTimeField(blank=True, null=True, verbose_name='Tomado en')),
+                ('intentos', models.PositiveSmallIntegerField(default=0, verbose_name='Intentos')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Recepción')),
+                ('fecha_proceso', models.DateTimeField(blank=True, null=True, verbose_name='Fecha de Proceso')),
+                ('attachment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reporte_laboratorio', to='mi_app.attachment', verbose_name='Adjunto')),
+                ('blob', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='reporte_laboratorio', to='mi_app.storedblob', verbose_name='Contenido')),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reportes_laboratorio', to='mi_app.patient', verbose_name='Paciente')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Subido por')),
+            ],
+            options={
+                'verbose_name': 'Reporte de Laboratorio',
+                'verbose_name_plural': 'Reportes de Laboratorio',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LabResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('analito', models.CharField(max_length=50, verbose_name='Analito')),
+                ('nombre', models.CharField(max_length=100, verbose_name='Nombre en el Reporte')),
+                ('valor', models.DecimalField(decimal_places=4, max_digits=14, verbose_name='Valor')),
+                ('unidad', models.CharField(blank=True, max_length=30, verbose_name='Unidad')),
+                ('referencia', models.CharField(blank=True, max_length=50, verbose_name='Valores de Referencia')),
+                ('fuera_de_rango', models.BooleanField(blank=True, null=True, verbose_name='Fuera de Rango')),
+                ('fecha', models.DateField(blank=True, null=True, verbose_name='Fecha')),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='resultados_laboratorio', to='mi_app.patient', verbose_name='Paciente')),
+                ('reporte', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resultados', to='mi_app.labreport', verbose_name='Reporte')),
+            ],
+            options={
+                'verbose_name': 'Resultado de Laboratorio',
+                'verbose_name_plural': 'Resultados de Laboratorio',
+                'ordering': ['reporte', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='labreport',
+            index=models.Index(condition=models.Q(('estado', 'pendiente')), fields=['id'], name='reportes_pendientes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labreport',
+            index=models.Index(fields=['estado', 'tomado_en'], name='reportes_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labreport',
+            index=models.Index(fields=['patient', '-fecha_reporte'], name='reportes_paciente_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='labresult',
+            index=models.Index(fields=['patient', 'analito', 'fecha'], name='resultados_paciente_idx'),
+        ),
+        migrations.RunPython(crear_indice_texto, eliminar_indice_texto),
+    ]
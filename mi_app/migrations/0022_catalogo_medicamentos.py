@@ -0,0 +1,128 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Índice de trigramas para el autocompletado a media palabra: tabla FTS5 con
+# tokenizador trigram (SQLite ≥ 3.34) sincronizada por triggers, o pg_trgm.
+# Reimportar el catálogo sin cambios de nombre no toca el índice.
+SQLITE_TRIGRAMAS = [
+    """CREATE VIRTUAL TABLE mi_app_drug_fts USING fts5(
+        nombre_normalizado,
+        principios_activos,
+        content='mi_app_drug',
+        content_rowid='id',
+        tokenize='trigram'
+    )""",
+    """CREATE TRIGGER mi_app_drug_ai AFTER INSERT ON mi_app_drug BEGIN
+        INSERT INTO mi_app_drug_fts(rowid, nombre_normalizado, principios_activos)
+        VALUES (new.id, new.nombre_normalizado, new.principios_activos);
+    END""",
+    """CREATE TRIGGER mi_app_drug_ad AFTER DELETE ON mi_app_drug BEGIN
+        INSERT INTO mi_app_drug_fts(mi_app_drug_fts, rowid, nombre_normalizado, principios_activos)
+        VALUES ('delete', old.id, old.nombre_normalizado, old.principios_activos);
+    END""",
+    """CREATE TRIGGER mi_app_drug_au AFTER UPDATE OF nombre_normalizado, principios_activos ON mi_app_drug
+    WHEN old.nombre_normalizado IS NOT new.nombre_normalizado OR old.principios_activos IS NOT new.principios_activos
+    BEGIN
+        INSERT INTO mi_app_drug_fts(mi_app_drug_fts, rowid, nombre_normalizado, principios_activos)
+        VALUES ('delete', old.id, old.nombre_normalizado, old.principios_activos);
+        INSERT INTO mi_app_drug_fts(rowid, nombre_normalizado, principios_activos)
+        VALUES (new.id, new.nombre_normalizado, new.principios_activos);
+    END""",
+]
+SQLITE_TRIGRAMAS_REVERSA = [
+    'DROP TRIGGER IF EXISTS mi_app_drug_ai',
+    'DROP TRIGGER IF EXISTS mi_app_drug_ad',
+    'DROP TRIGGER IF EXISTS mi_app_drug_au',
+    'DROP TABLE IF EXISTS mi_app_drug_fts',
+]
+POSTGRES_TRIGRAMAS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "CREATE INDEX medicamentos_trgm_idx ON mi_app_drug USING gin ((nombre_normalizado || ' ' || principios_activos) gin_trgm_ops)",
+]
+POSTGRES_TRIGRAMAS_REVERSA = ['DROP INDEX IF EXISTS medicamentos_trgm_idx']
+
+
+def _ejecutar(schema_editor, por_motor):
+    for sentencia in por_motor.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sentencia)
+
+
+def crear_trigramas(apps, schema_editor):
+    _ejecutar(schema_editor, {'sqlite': SQLITE_TRIGRAMAS, 'postgresql': POSTGRES_TRIGRAMAS})
+
+
+def eliminar_trigramas(apps, schema_editor):
+    _ejecutar(schema_editor, {'sqlite': SQLITE_TRIGRAMAS_REVERSA, 'postgresql': POSTGRES_TRIGRAMAS_REVERSA})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0021_laboratorio'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Drug',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=50, unique=True, verbose_name='Clave')),
+                ('nombre', models.CharField(max_length=200, verbose_name='Nombre')),
+                ('nombre_normalizado', models.CharField(max_length=200, verbose_name='Nombre Normalizado')),
+                ('principios_activos', models.CharField(max_length=300, verbose_name='Principios Activos')),
+                ('concentracion', models.CharField(blank=True, max_length=100, verbose_name='Concentración')),
+                ('presentacion', models.CharField(blank=True, max_length=100, verbose_name='Presentación')),
+                ('via', models.CharField(blank=True, max_length=50, verbose_name='Vía de Administración')),
+                ('activo', models.BooleanField(default=True, verbose_name='Activo')),
+            ],
+            options={
+                'verbose_name': 'Medicamento',
+                'verbose_name_plural': 'Medicamentos',
+                'ordering': ['nombre_normalizado'],
+                'indexes': [models.Index(fields=['nombre_normalizado'], name='medicamentos_nombre_idx', opclasses=['varchar_pattern_ops']), models.Index(fields=['principios_activos'], name='medicamentos_principio_idx', opclasses=['varchar_pattern_ops'])],
+            },
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='drug',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recetas', to='mi_app.drug', verbose_name='Medicamento del Catálogo'),
+        ),
+        migrations.CreateModel(
+            name='DrugCatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.CharField(blank=True, max_length=50, verbose_name='Versión del Proveedor')),
+                ('medicamentos', models.PositiveIntegerField(default=0, verbose_name='Medicamentos')),
+                ('interacciones', models.PositiveIntegerField(default=0, verbose_name='Interacciones')),
+                ('fecha', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Importación')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Importado por')),
+            ],
+            options={
+                'verbose_name': 'Versión del Catálogo de Medicamentos',
+                'verbose_name_plural': 'Versiones del Catálogo de Medicamentos',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DrugInteraction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('principio_a', models.CharField(max_length=100, verbose_name='Principio Activo A')),
+                ('principio_b', models.CharField(max_length=100, verbose_name='Principio Activo B')),
+                ('severidad', models.CharField(choices=[('leve', 'Leve'), ('moderada', 'Moderada'), ('grave', 'Grave'), ('contraindicada', 'Contraindicada')], max_length=20, verbose_name='Severidad')),
+                ('descripcion', models.TextField(blank=True, verbose_name='Descripción')),
+                ('recomendacion', models.TextField(blank=True, verbose_name='Recomendación')),
+            ],
+            options={
+                'verbose_name': 'Interacción Medicamentosa',
+                'verbose_name_plural': 'Interacciones Medicamentosas',
+                'ordering': ['principio_a', 'principio_b'],
+                'constraints': [models.UniqueConstraint(fields=('principio_a', 'principio_b'), name='interaccion_unica')],
+            },
+        ),
+        migrations.RunPython(crear_trigramas, eliminar_trigramas),
+    ]
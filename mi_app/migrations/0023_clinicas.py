@@ -0,0 +1,171 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:35
+
+import django.db.models.deletion
+import mi_app.clinicas
+from django.conf import settings
+from django.db import migrations, models
+
+# Las instalaciones con datos pasan a tener una clínica "Principal" con todos
+# sus registros y usuarios: nada deja de verse tras migrar. Va antes de crear
+# los índices para no actualizarlos fila por fila.
+MODELOS_CON_CLINICA = ['Doctor', 'Patient', 'Consultation', 'Payment', 'CashClose', 'UserProfile']
+
+
+def asignar_clinica_principal(apps, schema_editor):
+    modelos = [apps.get_model('mi_app', nombre) for nombre in MODELOS_CON_CLINICA]
+    if not any(modelo.objects.exists() for modelo in modelos[:-1]):
+        return
+    Clinic = apps.get_model('mi_app', 'Clinic')
+    principal, _ = Clinic.objects.get_or_create(clave='principal', defaults={'nombre': 'Principal'})
+    for modelo in modelos:
+        modelo.objects.filter(clinic__isnull=True).update(clinic=principal)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0022_catalogo_medicamentos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Clinic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nombre', models.CharField(max_length=150, verbose_name='Nombre')),
+                ('clave', models.SlugField(unique=True, verbose_name='Clave')),
+                ('activa', models.BooleanField(default=True, verbose_name='Activa')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Clínica',
+                'verbose_name_plural': 'Clínicas',
+                'ordering': ['nombre'],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name='consultation',
+            name='consultas_fecha_estado_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='consultation',
+            name='consultas_actualizacion_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='pacientes_activo_nombre_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='pacientes_activo_nac_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='pacientes_activo_registro_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='pacientes_registro_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='patient',
+            name='pacientes_actualizacion_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='pagos_fecha_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='pagos_por_conciliar_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='payment',
+            name='pagos_fecha_pago_idx',
+        ),
+        migrations.AlterField(
+            model_name='cashclose',
+            name='fecha',
+            field=models.DateField(verbose_name='Fecha'),
+        ),
+        migrations.AddField(
+            model_name='cashclose',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='consultation',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='doctor',
+            name='clinic',
+            field=models.ForeignKey(blank=True, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='clinic',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='usuarios', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.RunPython(asignar_clinica_principal, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['clinic', 'fecha_consulta', 'estado'], name='consultas_fecha_estado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='consultation',
+            index=models.Index(fields=['clinic', 'fecha_actualizacion', 'id'], name='consultas_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['clinic', 'activo', 'apellidos', 'nombres'], name='pacientes_activo_nombre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['clinic', 'activo', 'fecha_nacimiento'], name='pacientes_activo_nac_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['clinic', 'activo', 'fecha_registro'], name='pacientes_activo_registro_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['clinic', 'fecha_registro'], name='pacientes_registro_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['clinic', 'fecha_actualizacion', 'id'], name='pacientes_actualizacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['clinic', 'fecha_creacion'], name='pagos_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['clinic', 'fecha_pago'], name='pagos_fecha_pago_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('fecha_conciliacion__isnull', True), ('metodo_pago__in', ['transferencia', 'tarjeta'])), fields=['clinic', 'fecha_pago'], name='pagos_por_conciliar_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='cashclose',
+            constraint=models.UniqueConstraint(fields=('clinic', 'fecha'), name='corte_clinica_fecha_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='cashclose',
+            constraint=models.UniqueConstraint(condition=models.Q(('clinic__isnull', True)), fields=('fecha',), name='corte_fecha_unico'),
+        ),
+    ]
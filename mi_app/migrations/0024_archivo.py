@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:55
+
+import django.db.models.deletion
+import mi_app.archivo
+import mi_app.clinicas
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0023_clinicas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedConsultation',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='Id de la Consulta')),
+                ('fecha_consulta', models.DateTimeField(verbose_name='Fecha de Consulta')),
+                ('estado', models.CharField(max_length=20, verbose_name='Estado')),
+                ('datos', models.JSONField(encoder=mi_app.archivo.CodificadorArchivo, verbose_name='Datos')),
+                ('fecha_archivo', models.DateTimeField(auto_now_add=True, verbose_name='Fecha de Archivo')),
+                ('clinic', models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica')),
+                ('patient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consultas_archivadas', to='mi_app.patient', verbose_name='Paciente')),
+            ],
+            options={
+                'verbose_name': 'Consulta Archivada',
+                'verbose_name_plural': 'Consultas Archivadas',
+                'ordering': ['-fecha_consulta'],
+                'indexes': [models.Index(fields=['patient', 'fecha_consulta'], name='archivo_paciente_fecha_idx'), models.Index(fields=['clinic', 'fecha_consulta'], name='archivo_clinica_fecha_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-19 18:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0024_archivo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['fecha_cancelacion'], name='facturas_cancelacion_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['clinic', 'fecha_actualizacion', 'id'], name='pagos_actualizacion_idx'),
+        ),
+    ]
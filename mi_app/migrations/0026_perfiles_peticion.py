@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0025_indices_exportacion_bi'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('id_peticion', models.CharField(max_length=32, unique=True, verbose_name='Id de Petición')),
+                ('metodo', models.CharField(max_length=10, verbose_name='Método')),
+                ('ruta', models.CharField(max_length=500, verbose_name='Ruta')),
+                ('vista', models.CharField(blank=True, max_length=100, verbose_name='Vista')),
+                ('modo', models.CharField(choices=[('muestreo', 'Muestreo (flame graph)'), ('cprofile', 'Determinista (pstats)')], max_length=20, verbose_name='Modo')),
+                ('estado_http', models.PositiveSmallIntegerField(verbose_name='Estado HTTP')),
+                ('duracion_ms', models.FloatField(verbose_name='Duración (ms)')),
+                ('consultas_sql', models.PositiveIntegerField(verbose_name='Consultas SQL')),
+                ('tiempo_sql_ms', models.FloatField(verbose_name='Tiempo SQL (ms)')),
+                ('muestras', models.PositiveIntegerField(blank=True, null=True, verbose_name='Muestras')),
+                ('archivo', models.CharField(max_length=255, verbose_name='Archivo')),
+                ('resumen', models.TextField(blank=True, verbose_name='Resumen')),
+                ('fecha', models.DateTimeField(auto_now_add=True, verbose_name='Fecha')),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Usuario')),
+            ],
+            options={
+                'verbose_name': 'Perfil de Petición',
+                'verbose_name_plural': 'Perfiles de Peticiones',
+                'ordering': ['-id'],
+            },
+        ),
+    ]
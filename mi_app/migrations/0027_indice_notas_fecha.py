@@ -0,0 +1,17 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0026_perfiles_peticion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clinicalnote',
+            index=models.Index(fields=['fecha_consulta', 'consultation'], name='notas_fecha_idx'),
+        ),
+    ]
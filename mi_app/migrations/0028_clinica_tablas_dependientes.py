@@ -0,0 +1,98 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:27
+
+import django.db.models.deletion
+import mi_app.clinicas
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+# Cada fila toma la clínica de su padre (consulta, paciente, pago); lo que no
+# tiene padre con clínica queda en la "Principal" de 0023_clinicas, si existe.
+# Va antes de crear los índices para no actualizarlos fila por fila.
+
+
+def asignar_clinica(apps, schema_editor):
+    Clinic = apps.get_model('mi_app', 'Clinic')
+    Consultation = apps.get_model('mi_app', 'Consultation')
+    Patient = apps.get_model('mi_app', 'Patient')
+    ClinicalFact = apps.get_model('mi_app', 'ClinicalFact')
+    LabReport = apps.get_model('mi_app', 'LabReport')
+    ClaimBatch = apps.get_model('mi_app', 'ClaimBatch')
+    InsuranceClaim = apps.get_model('mi_app', 'InsuranceClaim')
+    BankStatement = apps.get_model('mi_app', 'BankStatement')
+    StatementLine = apps.get_model('mi_app', 'StatementLine')
+
+    ClinicalFact.objects.update(
+        clinic=Subquery(Consultation.objects.filter(id=OuterRef('consultation_id')).values('clinic_id')[:1])
+    )
+    LabReport.objects.filter(patient__isnull=False).update(
+        clinic=Subquery(Patient.objects.filter(id=OuterRef('patient_id')).values('clinic_id')[:1])
+    )
+    ClaimBatch.objects.update(clinic=Subquery(
+        InsuranceClaim.objects.filter(batch_id=OuterRef('id')).values('consultation__clinic_id')[:1]
+    ))
+    BankStatement.objects.update(clinic=Subquery(
+        StatementLine.objects.filter(statement_id=OuterRef('id'), payment__isnull=False)
+        .values('payment__clinic_id')[:1]
+    ))
+
+    principal = Clinic.objects.filter(clave='principal').first()
+    if principal is not None:
+        for modelo in (LabReport, ClaimBatch, BankStatement):
+            modelo.objects.filter(clinic__isnull=True).update(clinic=principal)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0027_indice_notas_fecha'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='claimbatch',
+            name='lotes_periodo_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='clinicalfact',
+            name='hechos_mes_term_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='clinicalfact',
+            name='hechos_term_patient_idx',
+        ),
+        migrations.AddField(
+            model_name='bankstatement',
+            name='clinic',
+            field=models.ForeignKey(blank=True, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='claimbatch',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='clinicalfact',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='labreport',
+            name='clinic',
+            field=models.ForeignKey(blank=True, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.RunPython(asignar_clinica, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='claimbatch',
+            index=models.Index(fields=['clinic', 'periodo', 'clave_aseguradora'], name='lotes_clinica_periodo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clinicalfact',
+            index=models.Index(fields=['clinic', 'mes', 'term'], name='hechos_clinica_mes_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='clinicalfact',
+            index=models.Index(fields=['clinic', 'term', 'patient'], name='hechos_clinica_term_pac_idx'),
+        ),
+    ]
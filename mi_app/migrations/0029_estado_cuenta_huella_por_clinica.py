@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:32
+
+import django.db.models.deletion
+import mi_app.clinicas
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0028_clinica_tablas_dependientes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bankstatement',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AlterField(
+            model_name='bankstatement',
+            name='huella',
+            field=models.CharField(max_length=64, verbose_name='Huella'),
+        ),
+        migrations.AddConstraint(
+            model_name='bankstatement',
+            constraint=models.UniqueConstraint(fields=('clinic', 'huella'), name='estado_cuenta_clinica_huella_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='bankstatement',
+            constraint=models.UniqueConstraint(condition=models.Q(('clinic__isnull', True)), fields=('huella',), name='estado_cuenta_huella_unico'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.6 on 2026-10-19 19:48
+
+import django.db.models.deletion
+import mi_app.clinicas
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+# Claves de bloqueo y eventos toman la clínica del paciente o la consulta (o
+# del doctor si la consulta ya no existe); las bajas previas, sin rastro del
+# objeto, quedan en la "Principal". Los candidatos pendientes entre clínicas
+# se borran: ya no se pueden fusionar. Va antes de crear el índice.
+
+
+def asignar_clinica(apps, schema_editor):
+    Clinic = apps.get_model('mi_app', 'Clinic')
+    Patient = apps.get_model('mi_app', 'Patient')
+    Consultation = apps.get_model('mi_app', 'Consultation')
+    Doctor = apps.get_model('mi_app', 'Doctor')
+    PatientBlockingKey = apps.get_model('mi_app', 'PatientBlockingKey')
+    DuplicateCandidate = apps.get_model('mi_app', 'DuplicateCandidate')
+    AgendaEvent = apps.get_model('mi_app', 'AgendaEvent')
+    Tombstone = apps.get_model('mi_app', 'Tombstone')
+
+    PatientBlockingKey.objects.update(
+        clinic=Subquery(Patient.objects.filter(id=OuterRef('patient_id')).values('clinic_id')[:1])
+    )
+    AgendaEvent.objects.update(
+        clinic=Subquery(Consultation.objects.filter(id=OuterRef('consulta_id')).values('clinic_id')[:1])
+    )
+    AgendaEvent.objects.filter(clinic__isnull=True).update(
+        clinic=Subquery(Doctor.objects.filter(id=OuterRef('doctor_id')).values('clinic_id')[:1])
+    )
+    # En Python: NULL frente a NULL es la misma clínica, no una distinta
+    cruzados = [
+        id_ for id_, clinica_a, clinica_b in DuplicateCandidate.objects.filter(estado='pendiente').values_list(
+            'id', 'paciente_a__clinic_id', 'paciente_b__clinic_id'
+        ).iterator()
+        if clinica_a != clinica_b
+    ]
+    DuplicateCandidate.objects.filter(id__in=cruzados).delete()
+
+    principal = Clinic.objects.filter(clave='principal').first()
+    if principal is not None:
+        for modelo in (AgendaEvent, Tombstone):
+            modelo.objects.filter(clinic__isnull=True).update(clinic=principal)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mi_app', '0029_estado_cuenta_huella_por_clinica'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='patientblockingkey',
+            name='claves_bloqueo_idx',
+        ),
+        migrations.AddField(
+            model_name='agendaevent',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='patientblockingkey',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='clinic',
+            field=models.ForeignKey(blank=True, db_index=False, default=mi_app.clinicas.clinica_actual, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='mi_app.clinic', verbose_name='Clínica'),
+        ),
+        migrations.RunPython(asignar_clinica, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patientblockingkey',
+            index=models.Index(fields=['clinic', 'tipo', 'clave'], name='claves_bloqueo_clinica_idx'),
+        ),
+    ]
@@ -1,9 +1,42 @@
 # -*- coding: utf-8 -*-
 from django.db import models
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 from django.utils import timezone
-from datetime import date, timedelta
+from datetime import date, time, timedelta
 from django.contrib.auth.models import User
+from .archivo import CodificadorArchivo
+from .clinicas import ManagerClinica, clinica_actual, clinica_de
+from .querysets import PatientQuerySet, ConsultationQuerySet, PaymentQuerySet, InmutableQuerySet
+
+class Clinic(models.Model):
+    """Sucursal: los doctores, pacientes, consultas y pagos pertenecen a una (ver clinicas.py)"""
+    nombre = models.CharField(max_length=150, verbose_name="Nombre")
+    clave = models.SlugField(max_length=50, unique=True, verbose_name="Clave")
+    activa = models.BooleanField(default=True, verbose_name="Activa")
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Clínica"
+        verbose_name_plural = "Clínicas"
+        ordering = ['nombre']
+
+    def __str__(self):
+        return self.nombre
+
+def _campo_clinica(db_index=True):
+    # Sin clínica activa queda en NULL; Consultation y Payment la toman de su
+    # doctor o consulta al guardarse (asignar_clinica_consulta y _pago)
+    return models.ForeignKey(
+        Clinic,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        default=clinica_actual,
+        db_index=db_index,
+        related_name='+',
+        verbose_name="Clínica"
+    )
 
 class Doctor(models.Model):
     """Modelo para doctores/médicos"""
@@ -16,6 +49,28 @@ class Doctor(models.Model):
     activo = models.BooleanField(default=True)
     fecha_registro = models.DateTimeField(auto_now_add=True)
     
+    # Usuario del sistema con el que inicia sesión el doctor
+    usuario = models.OneToOneField(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='doctor',
+        verbose_name="Usuario"
+    )
+    
+    # Jornada para calcular la capacidad de la agenda
+    hora_inicio = models.TimeField(default=time(9, 0), verbose_name="Inicio de Jornada")
+    hora_fin = models.TimeField(default=time(17, 0), verbose_name="Fin de Jornada")
+    duracion_consulta = models.PositiveSmallIntegerField(default=30, verbose_name="Duración de Consulta (min)")
+    
+    # Token del feed iCal (.ics); regenerarlo revoca la URL anterior
+    token_calendario = models.CharField(max_length=64, null=True, blank=True, unique=True, verbose_name="Token de Calendario")
+    
+    clinic = _campo_clinica()
+    
+    objects = ManagerClinica()
+    
     class Meta:
         verbose_name = "Doctor"
         verbose_name_plural = "Doctores"
@@ -26,6 +81,13 @@ class Doctor(models.Model):
     @property
     def nombre_completo(self):
         return f"{self.nombres} {self.apellidos}"
+    
+    @property
+    def minutos_jornada(self):
+        """Minutos disponibles por día según la jornada"""
+        inicio = self.hora_inicio.hour * 60 + self.hora_inicio.minute
+        fin = self.hora_fin.hour * 60 + self.hora_fin.minute
+        return max(fin - inicio, 0)
 
 class Patient(models.Model):
     """Modelo principal para pacientes"""
@@ -95,11 +157,22 @@ class Patient(models.Model):
     activo = models.BooleanField(default=True, verbose_name="Activo")
     fecha_registro = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Registro")
     fecha_actualizacion = models.DateTimeField(auto_now=True, verbose_name="Última Actualización")
+    # Los índices ya empiezan por la clínica
+    clinic = _campo_clinica(db_index=False)
+    
+    objects = ManagerClinica.from_queryset(PatientQuerySet)()
     
     class Meta:
         verbose_name = "Paciente"
         verbose_name_plural = "Pacientes"
         ordering = ['apellidos', 'nombres']
+        indexes = [
+            models.Index(fields=['clinic', 'activo', 'apellidos', 'nombres'], name='pacientes_activo_nombre_idx'),
+            models.Index(fields=['clinic', 'activo', 'fecha_nacimiento'], name='pacientes_activo_nac_idx'),
+            models.Index(fields=['clinic', 'activo', 'fecha_registro'], name='pacientes_activo_registro_idx'),
+            models.Index(fields=['clinic', 'fecha_registro'], name='pacientes_registro_idx'),
+            models.Index(fields=['clinic', 'fecha_actualizacion', 'id'], name='pacientes_actualizacion_idx'),
+        ]
         
     def __str__(self):
         return f"{self.apellidos}, {self.nombres}"
@@ -136,6 +209,76 @@ class Patient(models.Model):
             return 'nuevo'
         return 'activo'
 
+class AppointmentSeries(models.Model):
+    """Serie de citas recurrentes (regla estilo RRULE) para seguimiento y control"""
+
+    FRECUENCIA_CHOICES = [
+        ('diaria', 'Diaria'),
+        ('semanal', 'Semanal'),
+        ('mensual', 'Mensual'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='series_citas', verbose_name="Paciente")
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='series_citas', verbose_name="Doctor")
+    tipo_consulta = models.CharField(max_length=20, default='seguimiento', verbose_name="Tipo de Consulta")
+    motivo = models.TextField(verbose_name="Motivo")
+
+    # Primera cita: fecha y hora local de todas las ocurrencias
+    fecha_inicio = models.DateTimeField(verbose_name="Primera Cita")
+    frecuencia = models.CharField(max_length=10, choices=FRECUENCIA_CHOICES, default='semanal', verbose_name="Frecuencia")
+    intervalo = models.PositiveSmallIntegerField(default=1, verbose_name="Cada (intervalo)")
+    # Días de la semana para series semanales: "0,3" = lunes y jueves (vacío = el de la primera cita)
+    dias_semana = models.CharField(max_length=20, blank=True, verbose_name="Días de la Semana")
+    repeticiones = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Número de Citas")
+    fecha_fin = models.DateField(null=True, blank=True, verbose_name="Hasta")
+
+    # Las series sin fin se materializan por ventanas (ver series.HORIZONTE)
+    materializada_hasta = models.DateField(null=True, blank=True, verbose_name="Materializada Hasta")
+    activa = models.BooleanField(default=True, verbose_name="Activa")
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+
+    RUTA_CLINICA = 'doctor__clinic'
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Serie de Citas"
+        verbose_name_plural = "Series de Citas"
+        indexes = [
+            models.Index(fields=['activa', 'materializada_hasta'], name='series_materializar_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patient.nombre_completo} - {self.regla}"
+
+    def clean(self):
+        errores = {}
+        if self.tipo_consulta not in dict(Consultation.TIPO_CHOICES):
+            errores['tipo_consulta'] = 'Tipo de consulta no válido'
+        if not self.intervalo:
+            errores['intervalo'] = 'El intervalo debe ser al menos 1'
+        try:
+            if any(not 0 <= d <= 6 for d in self.dias):
+                errores['dias_semana'] = 'Los días van de 0 (lunes) a 6 (domingo)'
+        except ValueError:
+            errores['dias_semana'] = 'Días de la semana no válidos'
+        if self.repeticiones and self.fecha_fin:
+            # RFC 5545: COUNT y UNTIL no pueden ir juntos en una regla
+            errores['fecha_fin'] = 'Indica el número de citas o la fecha final, no ambos'
+        elif self.fecha_fin and self.fecha_inicio and self.fecha_fin < timezone.localtime(self.fecha_inicio).date():
+            errores['fecha_fin'] = 'La fecha final es anterior a la primera cita'
+        if errores:
+            raise ValidationError(errores)
+
+    @property
+    def dias(self):
+        return sorted({int(d) for d in self.dias_semana.split(',') if d.strip()})
+
+    @property
+    def regla(self):
+        """Regla en formato RRULE (RFC 5545)"""
+        from .series import regla_rrule
+        return regla_rrule(self)
+
 class Consultation(models.Model):
     """Modelo para consultas médicas"""
     
@@ -161,6 +304,14 @@ class Consultation(models.Model):
     tipo_consulta = models.CharField(max_length=20, choices=TIPO_CHOICES, verbose_name="Tipo de Consulta")
     motivo = models.TextField(verbose_name="Motivo de la Consulta")
     estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='programada', verbose_name="Estado")
+    serie = models.ForeignKey(
+        AppointmentSeries,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='consultas',
+        verbose_name="Serie"
+    )
     
     # Información clínica
     sintomas = models.TextField(blank=True, verbose_name="Síntomas")
@@ -179,11 +330,20 @@ class Consultation(models.Model):
     # Control
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
+    clinic = _campo_clinica(db_index=False)
+    
+    objects = ManagerClinica.from_queryset(ConsultationQuerySet)()
     
     class Meta:
         verbose_name = "Consulta"
         verbose_name_plural = "Consultas"
         ordering = ['-fecha_consulta']
+        indexes = [
+            models.Index(fields=['clinic', 'fecha_consulta', 'estado'], name='consultas_fecha_estado_idx'),
+            # El doctor ya pertenece a una sola clínica
+            models.Index(fields=['doctor', 'fecha_consulta'], name='consultas_doctor_fecha_idx'),
+            models.Index(fields=['clinic', 'fecha_actualizacion', 'id'], name='consultas_actualizacion_idx'),
+        ]
         
     def __str__(self):
         return f"{self.patient.nombre_completo} - {self.fecha_consulta.strftime('%d/%m/%Y %H:%M')}"
@@ -210,10 +370,16 @@ class MedicalRecord(models.Model):
     
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    RUTA_CLINICA = 'patient__clinic'
+    objects = ManagerClinica()
     
     class Meta:
         verbose_name = "Expediente Médico"
         verbose_name_plural = "Expedientes Médicos"
+        indexes = [
+            models.Index(fields=['fecha_actualizacion', 'id'], name='expedientes_actualizacion_idx'),
+        ]
         
     def __str__(self):
         return f"Expediente de {self.patient.nombre_completo}"
@@ -222,21 +388,326 @@ class Prescription(models.Model):
     """Modelo para recetas médicas"""
     consultation = models.ForeignKey(Consultation, on_delete=models.CASCADE, verbose_name="Consulta")
     medicamento = models.CharField(max_length=200, verbose_name="Medicamento")
+    drug = models.ForeignKey('Drug', on_delete=models.SET_NULL, null=True, blank=True, related_name='recetas', verbose_name="Medicamento del Catálogo")
     dosis = models.CharField(max_length=100, verbose_name="Dosis")
     frecuencia = models.CharField(max_length=100, verbose_name="Frecuencia")
     duracion = models.CharField(max_length=100, verbose_name="Duración del Tratamiento")
     indicaciones = models.TextField(blank=True, verbose_name="Indicaciones Especiales")
     
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    RUTA_CLINICA = 'consultation__clinic'
+    objects = ManagerClinica()
     
     class Meta:
         verbose_name = "Receta"
         verbose_name_plural = "Recetas"
         ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['fecha_creacion'], name='recetas_fecha_idx'),
+            models.Index(fields=['fecha_actualizacion', 'id'], name='recetas_actualizacion_idx'),
+        ]
         
     def __str__(self):
         return f"{self.medicamento} - {self.consultation.patient.nombre_completo}"
 
+class VitalSign(models.Model):
+    """Serie tipada de signos vitales por paciente (para tendencias)"""
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='signos_vitales', verbose_name="Paciente")
+    consultation = models.OneToOneField(
+        Consultation,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='signo_vital',
+        verbose_name="Consulta"
+    )
+    fecha_medicion = models.DateTimeField(verbose_name="Fecha de Medición")
+
+    presion_sistolica = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Presión Sistólica")
+    presion_diastolica = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Presión Diastólica")
+    frecuencia_cardiaca = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Frecuencia Cardíaca")
+    temperatura = models.DecimalField(max_digits=4, decimal_places=1, null=True, blank=True, verbose_name="Temperatura")
+    peso = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, verbose_name="Peso (kg)")
+
+    RUTA_CLINICA = 'patient__clinic'
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Signo Vital"
+        verbose_name_plural = "Signos Vitales"
+        ordering = ['fecha_medicion']
+        indexes = [
+            models.Index(fields=['patient', 'fecha_medicion'], name='signos_paciente_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"Signos vitales {self.patient_id} - {self.fecha_medicion:%d/%m/%Y}"
+
+class ClinicalTerm(models.Model):
+    """Término clínico normalizado (diagnóstico o medicamento) para analítica"""
+
+    TIPO_CHOICES = [
+        ('diagnostico', 'Diagnóstico'),
+        ('medicamento', 'Medicamento'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, verbose_name="Tipo")
+    termino = models.CharField(max_length=200, verbose_name="Término Normalizado")
+    etiqueta = models.CharField(max_length=200, verbose_name="Etiqueta")
+
+    class Meta:
+        verbose_name = "Término Clínico"
+        verbose_name_plural = "Términos Clínicos"
+        ordering = ['tipo', 'termino']
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'termino'], name='termino_clinico_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()}: {self.etiqueta}"
+
+class ClinicalFact(models.Model):
+    """
+    Hecho analítico: una consulta completada asociada a un término clínico.
+    Se desnormalizan doctor, fecha, género y fecha de nacimiento para que los
+    reportes agrupados no necesiten joins contra las tablas operativas.
+    """
+    consultation = models.ForeignKey(Consultation, on_delete=models.CASCADE, related_name='hechos_clinicos')
+    term = models.ForeignKey(ClinicalTerm, on_delete=models.CASCADE, related_name='hechos')
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='hechos_clinicos')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='hechos_clinicos')
+    fecha = models.DateField(verbose_name="Fecha de Consulta")
+    mes = models.DateField(verbose_name="Mes")
+    genero = models.CharField(max_length=20, verbose_name="Género")
+    fecha_nacimiento = models.DateField(verbose_name="Fecha de Nacimiento")
+    # La de la consulta, también desnormalizada: los reportes no hacen join para filtrar la sucursal
+    clinic = _campo_clinica(db_index=False)
+
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Hecho Clínico"
+        verbose_name_plural = "Hechos Clínicos"
+        constraints = [
+            models.UniqueConstraint(fields=['consultation', 'term'], name='hecho_clinico_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['clinic', 'mes', 'term'], name='hechos_clinica_mes_term_idx'),
+            models.Index(fields=['doctor', 'mes'], name='hechos_doctor_mes_idx'),
+            models.Index(fields=['clinic', 'term', 'patient'], name='hechos_clinica_term_pac_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} - consulta #{self.consultation_id}"
+
+class ClinicalNote(models.Model):
+    """
+    Texto clínico de una consulta (diagnóstico, síntomas, tratamiento,
+    observaciones y recetas) ya sin acentos y reducido a raíces, para el índice
+    de búsqueda: FTS5 en SQLite, GIN sobre tsvector en PostgreSQL.
+    """
+    consultation = models.OneToOneField(
+        Consultation,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='nota_clinica'
+    )
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='+')
+    fecha_consulta = models.DateTimeField(verbose_name="Fecha de Consulta")
+    raices = models.TextField(verbose_name="Texto Indexado")
+
+    RUTA_CLINICA = 'patient__clinic'
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Nota Clínica Indexada"
+        verbose_name_plural = "Notas Clínicas Indexadas"
+        indexes = [
+            models.Index(fields=['fecha_consulta', 'consultation'], name='notas_fecha_idx'),
+            models.Index(fields=['doctor', 'fecha_consulta'], name='notas_doctor_fecha_idx'),
+            models.Index(fields=['patient', 'fecha_consulta'], name='notas_paciente_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"Nota de consulta {self.consultation_id}"
+
+class PatientBlockingKey(models.Model):
+    """Clave de bloqueo para detectar pacientes duplicados sin comparar todos contra todos"""
+
+    TIPO_CHOICES = [
+        ('nombre_nacimiento', 'Nombre fonético + Nacimiento'),
+        ('telefono', 'Teléfono'),
+        ('email', 'Email'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='claves_bloqueo')
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, verbose_name="Tipo")
+    clave = models.CharField(max_length=120, verbose_name="Clave")
+    # La del paciente: los bloques no cruzan clínicas
+    clinic = _campo_clinica(db_index=False)
+
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Clave de Bloqueo"
+        verbose_name_plural = "Claves de Bloqueo"
+        constraints = [
+            models.UniqueConstraint(fields=['patient', 'tipo', 'clave'], name='clave_bloqueo_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['clinic', 'tipo', 'clave'], name='claves_bloqueo_clinica_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo}: {self.clave}"
+
+class DuplicateCandidate(models.Model):
+    """Par de pacientes que probablemente son la misma persona"""
+
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('descartado', 'Descartado'),
+    ]
+
+    # paciente_a es siempre el de menor id (el registro más antiguo)
+    paciente_a = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+', verbose_name="Paciente A")
+    paciente_b = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+', verbose_name="Paciente B")
+    puntaje = models.FloatField(verbose_name="Puntaje")
+    razones = models.CharField(max_length=200, blank=True, verbose_name="Coincidencias")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente', verbose_name="Estado")
+    fecha_deteccion = models.DateTimeField(auto_now=True, verbose_name="Fecha de Detección")
+
+    # Los dos pacientes son siempre de la misma clínica (ver duplicados.py)
+    RUTA_CLINICA = 'paciente_a__clinic'
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Posible Duplicado"
+        verbose_name_plural = "Posibles Duplicados"
+        ordering = ['-puntaje']
+        constraints = [
+            models.UniqueConstraint(fields=['paciente_a', 'paciente_b'], name='duplicado_par_unico'),
+        ]
+        indexes = [
+            models.Index(fields=['estado', '-puntaje'], name='duplicados_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.paciente_a_id} ~ {self.paciente_b_id} ({self.puntaje:.2f})"
+
+class Tombstone(models.Model):
+    """Marca de borrado para que los clientes sin conexión eliminen su copia local"""
+    modelo = models.CharField(max_length=50, verbose_name="Modelo")
+    objeto_id = models.BigIntegerField(verbose_name="ID del Objeto")
+    fecha_eliminacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Eliminación")
+    # La del registro borrado: cada tableta solo recibe las bajas de su clínica
+    clinic = _campo_clinica(db_index=False)
+
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Registro Eliminado"
+        verbose_name_plural = "Registros Eliminados"
+        indexes = [
+            models.Index(fields=['fecha_eliminacion', 'id'], name='bajas_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.modelo} #{self.objeto_id} eliminado"
+
+class AgendaEvent(models.Model):
+    """Cambio en la agenda (alta, cambio de estado, reprogramación o baja de una consulta)"""
+
+    TIPO_CHOICES = [
+        ('nueva', 'Nueva'),
+        ('estado', 'Cambio de Estado'),
+        ('reprogramada', 'Reprogramada'),
+        ('eliminada', 'Eliminada'),
+    ]
+
+    # Sin FK: el evento sobrevive a la baja de la consulta
+    consulta_id = models.BigIntegerField(verbose_name="ID de Consulta")
+    doctor_id = models.BigIntegerField(verbose_name="ID de Doctor")
+    fecha_consulta = models.DateTimeField(verbose_name="Fecha de la Consulta")
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, verbose_name="Tipo")
+    estado = models.CharField(max_length=20, verbose_name="Estado")
+    estado_anterior = models.CharField(max_length=20, blank=True, verbose_name="Estado Anterior")
+    fecha_anterior = models.DateTimeField(null=True, blank=True, verbose_name="Fecha Anterior")
+    fecha_evento = models.DateTimeField(auto_now_add=True, verbose_name="Fecha del Evento")
+    # La de la consulta; el feed se lee por rango de id, así que no lleva índice
+    clinic = _campo_clinica(db_index=False)
+
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Evento de Agenda"
+        verbose_name_plural = "Eventos de Agenda"
+        indexes = [
+            models.Index(fields=['fecha_evento'], name='eventos_agenda_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - consulta {self.consulta_id}"
+
+class AgendaOperation(models.Model):
+    """Operación masiva sobre la agenda (reprogramar o cancelar un día, una serie...)"""
+
+    TIPO_CHOICES = [
+        ('serie', 'Alta de Serie'),
+        ('reprogramar_dia', 'Reprogramar Día'),
+        ('cancelar_dia', 'Cancelar Día'),
+        ('cancelar_serie', 'Cancelar Serie'),
+    ]
+
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES, verbose_name="Tipo")
+    doctor = models.ForeignKey(Doctor, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Doctor")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Usuario")
+    descripcion = models.CharField(max_length=200, verbose_name="Descripción")
+    motivo = models.TextField(blank=True, verbose_name="Motivo")
+    afectadas = models.PositiveIntegerField(default=0, verbose_name="Consultas Afectadas")
+    # [{'consulta_id', 'fecha', 'razon'}, ...] de las citas que no se pudieron aplicar
+    conflictos = models.JSONField(default=list, blank=True, verbose_name="Conflictos")
+    fecha = models.DateTimeField(auto_now_add=True, verbose_name="Fecha")
+
+    class Meta:
+        verbose_name = "Operación de Agenda"
+        verbose_name_plural = "Operaciones de Agenda"
+        ordering = ['-fecha']
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} - {self.descripcion}"
+
+class AgendaChange(models.Model):
+    """Bitácora por cita de una operación de agenda"""
+
+    ACCION_CHOICES = [
+        ('creada', 'Creada'),
+        ('reprogramada', 'Reprogramada'),
+        ('cancelada', 'Cancelada'),
+    ]
+
+    operacion = models.ForeignKey(AgendaOperation, on_delete=models.CASCADE, related_name='cambios', verbose_name="Operación")
+    # Sin FK: la bitácora sobrevive a la baja de la consulta
+    consulta_id = models.BigIntegerField(verbose_name="ID de Consulta")
+    accion = models.CharField(max_length=20, choices=ACCION_CHOICES, verbose_name="Acción")
+    estado_anterior = models.CharField(max_length=20, blank=True, verbose_name="Estado Anterior")
+    fecha_anterior = models.DateTimeField(null=True, blank=True, verbose_name="Fecha Anterior")
+    fecha_nueva = models.DateTimeField(null=True, blank=True, verbose_name="Fecha Nueva")
+    doctor_anterior_id = models.BigIntegerField(null=True, blank=True, verbose_name="ID de Doctor Anterior")
+
+    class Meta:
+        verbose_name = "Cambio de Agenda"
+        verbose_name_plural = "Cambios de Agenda"
+        indexes = [
+            models.Index(fields=['consulta_id'], name='cambios_agenda_consulta_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_accion_display()} - consulta {self.consulta_id}"
+
 class UserProfile(models.Model):
     """Perfil extendido de usuario"""
     ROLES = [
@@ -252,6 +723,8 @@ class UserProfile(models.Model):
     especialidad = models.CharField(max_length=100, blank=True, null=True)
     telefono = models.CharField(max_length=20, blank=True, null=True)
     foto_perfil = models.CharField(max_length=255, blank=True, null=True)
+    # Clínica que ve el usuario; sin clínica (superusuarios) ve todas
+    clinic = models.ForeignKey(Clinic, on_delete=models.SET_NULL, null=True, blank=True, related_name='usuarios', verbose_name="Clínica")
     activo = models.BooleanField(default=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
     
@@ -264,19 +737,130 @@ class UserProfile(models.Model):
         return f"{self.user.get_full_name() or self.user.username} - {self.get_rol_display()}"
 
 # Señales para crear perfil automáticamente
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        UserProfile.objects.create(user=instance)
+        # Los usuarios que da de alta alguien de una clínica quedan en esa clínica
+        UserProfile.objects.create(user=instance, clinic_id=clinica_actual())
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
     if hasattr(instance, 'profile'):
         instance.profile.save()
 
+@receiver(pre_save, sender=Consultation)
+def asignar_clinica_consulta(sender, instance, raw=False, **kwargs):
+    """Sin clínica activa, la consulta queda en la clínica de su doctor"""
+    if raw or instance.clinic_id is not None:
+        return
+    instance.clinic_id = Doctor._base_manager.filter(pk=instance.doctor_id).values_list('clinic_id', flat=True).first()
+
+@receiver(pre_save, sender=Consultation)
+def recordar_estado_consulta(sender, instance, raw=False, **kwargs):
+    """Guarda estado y fecha previos para detectar cambios en post_save"""
+    if raw or not instance.pk:
+        return
+    instance._agenda_anterior = Consultation.objects.filter(pk=instance.pk).values_list(
+        'estado', 'fecha_consulta', 'doctor_id'
+    ).first()
+
+@receiver(post_save, sender=Consultation)
+def publicar_evento_agenda(sender, instance, created, raw=False, **kwargs):
+    """Publica altas, cambios de estado y reprogramaciones para el feed en vivo"""
+    if raw:
+        return
+    from .eventos_agenda import registrar_evento
+    anterior = getattr(instance, '_agenda_anterior', None)
+    if created or anterior is None:
+        registrar_evento(instance, 'nueva')
+    elif anterior[0] != instance.estado:
+        registrar_evento(instance, 'estado', estado_anterior=anterior[0])
+    elif (anterior[1], anterior[2]) != (instance.fecha_consulta, instance.doctor_id):
+        registrar_evento(instance, 'reprogramada', fecha_anterior=anterior[1])
+
+@receiver(post_delete, sender=Consultation)
+def publicar_baja_agenda(sender, instance, **kwargs):
+    from .eventos_agenda import registrar_evento
+    registrar_evento(instance, 'eliminada')
+
+@receiver(post_save, sender=Consultation)
+def sincronizar_signos_vitales(sender, instance, created, raw=False, **kwargs):
+    """Mantiene la serie de signos vitales al día con la consulta"""
+    if raw:
+        return
+    from .signos_vitales import registrar_desde_consulta
+    registrar_desde_consulta(instance, creada=created)
+
+@receiver(post_save, sender=Consultation)
+def actualizar_analitica_consulta(sender, instance, created, raw=False, **kwargs):
+    """Normaliza diagnóstico y recetas al completarse la consulta"""
+    if raw:
+        return
+    if instance.estado == 'completada':
+        from .analitica import registrar_consulta
+        registrar_consulta(instance)
+    elif not created:
+        ClinicalFact.objects.filter(consultation_id=instance.pk).delete()
+
+def _borrado_en_cascada(modelo, origin=None, **kwargs):
+    """True si el post_delete viene de borrar otro objeto (p. ej. la consulta de la receta)"""
+    return origin is not None and not isinstance(origin, modelo) and getattr(origin, 'model', None) is not modelo
+
+@receiver(post_save, sender=Consultation)
+def indexar_nota_clinica(sender, instance, raw=False, **kwargs):
+    """Mantiene el índice de búsqueda de notas clínicas al día"""
+    if raw:
+        return
+    from .busqueda import indexar_consulta
+    indexar_consulta(instance)
+
+@receiver([post_save, post_delete], sender=Prescription)
+def indexar_nota_receta(sender, instance, raw=False, **kwargs):
+    if raw or _borrado_en_cascada(Prescription, **kwargs):
+        return
+    consulta = Consultation.objects.filter(pk=instance.consultation_id).first()
+    if consulta:
+        from .busqueda import indexar_consulta
+        indexar_consulta(consulta)
+
+@receiver([post_save, post_delete], sender=Prescription)
+def actualizar_analitica_receta(sender, instance, raw=False, **kwargs):
+    """Las recetas de una consulta completada alimentan la dimensión de medicamentos"""
+    if raw or _borrado_en_cascada(Prescription, **kwargs):
+        return
+    consulta = Consultation.objects.filter(pk=instance.consultation_id, estado='completada').first()
+    if consulta:
+        from .analitica import registrar_consulta
+        registrar_consulta(consulta)
+
+@receiver(post_delete, sender=Patient)
+@receiver(post_delete, sender=Consultation)
+@receiver(post_delete, sender=MedicalRecord)
+@receiver(post_delete, sender=Prescription)
+def registrar_baja(sender, instance, **kwargs):
+    """Deja una marca de borrado para la sincronización delta"""
+    Tombstone.objects.create(modelo=sender._meta.model_name, objeto_id=instance.pk, clinic_id=clinica_de(instance))
+
+@receiver(post_save, sender=Patient)
+def detectar_duplicados_paciente(sender, instance, raw=False, **kwargs):
+    """Reindexa las claves de bloqueo y busca duplicados solo dentro de sus bloques"""
+    if raw:
+        return
+    from .duplicados import detectar_para_paciente
+    detectar_para_paciente(instance)
+
+@receiver(post_save, sender=Patient)
+def actualizar_analitica_paciente(sender, instance, created, raw=False, **kwargs):
+    """Propaga género y fecha de nacimiento a los hechos desnormalizados"""
+    if raw or created:
+        return
+    ClinicalFact.objects.filter(patient_id=instance.pk).exclude(
+        genero=instance.genero, fecha_nacimiento=instance.fecha_nacimiento
+    ).update(genero=instance.genero, fecha_nacimiento=instance.fecha_nacimiento)
+
 # Al final de models.py, después de todos tus modelos existentes
 
 class Payment(models.Model):
@@ -359,11 +943,46 @@ class Payment(models.Model):
         auto_now=True,
         verbose_name="Última Actualización"
     )
+    # Se llena al encontrar el movimiento en un estado de cuenta (ver conciliacion.py)
+    fecha_conciliacion = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name="Fecha de Conciliación"
+    )
+    # Quién cobró: el corte de caja se desglosa por usuario
+    registrado_por = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name="Registrado por"
+    )
+    # Copia de la clínica de la consulta para filtrar sin JOIN
+    clinic = _campo_clinica(db_index=False)
+    
+    objects = ManagerClinica.from_queryset(PaymentQuerySet)()
     
     class Meta:
         verbose_name = "Pago"
         verbose_name_plural = "Pagos"
         ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['clinic', 'fecha_creacion'], name='pagos_fecha_idx'),
+            # Corte de caja: pagos de un día por rango
+            models.Index(fields=['clinic', 'fecha_pago'], name='pagos_fecha_pago_idx'),
+            # Solo los pagos bancarios aún sin conciliar: el índice se queda chico
+            models.Index(
+                fields=['clinic', 'fecha_pago'],
+                name='pagos_por_conciliar_idx',
+                condition=models.Q(
+                    fecha_conciliacion__isnull=True,
+                    metodo_pago__in=['transferencia', 'tarjeta'],
+                ),
+            ),
+            # Exportación a BI: cambios desde la última corrida
+            models.Index(fields=['clinic', 'fecha_actualizacion', 'id'], name='pagos_actualizacion_idx'),
+        ]
     
     def __str__(self):
         return f"Pago #{self.id} - {self.consultation.patient.nombre_completo}"
@@ -385,6 +1004,16 @@ class Payment(models.Model):
         self.save()
 
 
+@receiver(pre_save, sender=Payment)
+def asignar_clinica_pago(sender, instance, raw=False, **kwargs):
+    """Sin clínica activa, el pago queda en la clínica de su consulta"""
+    if raw or instance.clinic_id is not None:
+        return
+    instance.clinic_id = Consultation._base_manager.filter(
+        pk=instance.consultation_id
+    ).values_list('clinic_id', flat=True).first()
+
+
 class Invoice(models.Model):
     """Modelo para facturas"""
     
@@ -470,6 +1099,11 @@ class Invoice(models.Model):
         verbose_name = "Factura"
         verbose_name_plural = "Facturas"
         ordering = ['-fecha_emision']
+        indexes = [
+            models.Index(fields=['fecha_emision'], name='facturas_fecha_idx'),
+            # Exportación a BI: facturas canceladas desde la última corrida
+            models.Index(fields=['fecha_cancelacion'], name='facturas_cancelacion_idx'),
+        ]
     
     def __str__(self):
         return f"Factura {self.folio} - {self.cliente_nombre}"
@@ -520,4 +1154,532 @@ class ConceptoFactura(models.Model):
     
     def save(self, *args, **kwargs):
         self.importe = self.cantidad * self.precio_unitario
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class BankStatement(models.Model):
+    """Estado de cuenta bancario o de terminal importado para conciliar pagos"""
+
+    ORIGEN_CHOICES = [
+        ('banco', 'Banco (transferencias)'),
+        ('terminal', 'Terminal (tarjetas)'),
+    ]
+
+    archivo = models.CharField(max_length=255, verbose_name="Archivo")
+    origen = models.CharField(max_length=20, choices=ORIGEN_CHOICES, verbose_name="Origen")
+    # SHA-256 del archivo: el mismo estado de cuenta no se importa dos veces en la misma clínica
+    huella = models.CharField(max_length=64, verbose_name="Huella")
+    desde = models.DateField(null=True, blank=True, verbose_name="Desde")
+    hasta = models.DateField(null=True, blank=True, verbose_name="Hasta")
+    lineas = models.PositiveIntegerField(default=0, verbose_name="Líneas")
+    conciliadas = models.PositiveIntegerField(default=0, verbose_name="Conciliadas")
+    excepciones = models.PositiveIntegerField(default=0, verbose_name="Excepciones")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Usuario")
+    fecha_importacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Importación")
+    # Se concilia contra los pagos de la clínica que lo importa
+    clinic = _campo_clinica(db_index=False)
+
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Estado de Cuenta"
+        verbose_name_plural = "Estados de Cuenta"
+        ordering = ['-fecha_importacion']
+        constraints = [
+            models.UniqueConstraint(fields=['clinic', 'huella'], name='estado_cuenta_clinica_huella_unico'),
+            models.UniqueConstraint(fields=['huella'], condition=models.Q(clinic__isnull=True), name='estado_cuenta_huella_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_origen_display()} - {self.archivo}"
+
+
+class StatementLine(models.Model):
+    """Movimiento de un estado de cuenta y su resultado de conciliación"""
+
+    ESTADO_CHOICES = [
+        ('conciliada', 'Conciliada'),
+        ('sin_pago', 'Sin Pago Registrado'),
+        ('monto_distinto', 'Monto Distinto'),
+        ('ambigua', 'Varios Pagos Posibles'),
+        ('duplicada', 'Movimiento Duplicado'),
+    ]
+
+    statement = models.ForeignKey(BankStatement, on_delete=models.CASCADE, related_name='movimientos', verbose_name="Estado de Cuenta")
+    linea = models.PositiveIntegerField(verbose_name="Línea")
+    fecha = models.DateField(verbose_name="Fecha")
+    monto = models.DecimalField(max_digits=12, decimal_places=2, verbose_name="Monto")
+    referencia = models.CharField(max_length=100, blank=True, verbose_name="Referencia")
+    descripcion = models.CharField(max_length=255, blank=True, verbose_name="Descripción")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, verbose_name="Estado")
+    # Pago conciliado, o el candidato a revisar en monto_distinto
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='movimientos_bancarios', verbose_name="Pago")
+
+    RUTA_CLINICA = 'statement__clinic'
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Movimiento Bancario"
+        verbose_name_plural = "Movimientos Bancarios"
+        ordering = ['statement', 'linea']
+        indexes = [
+            models.Index(fields=['statement', 'estado'], name='movimientos_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"Línea {self.linea}: {self.fecha} ${self.monto} ({self.get_estado_display()})"
+
+
+class CashClose(models.Model):
+    """Corte de caja de un día: foto inmutable de los totales al cerrar"""
+
+    fecha = models.DateField(verbose_name="Fecha")
+    pagos = models.PositiveIntegerField(default=0, verbose_name="Pagos")
+    cobrado = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Cobrado")
+    descuentos = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Descuentos")
+    reembolsos = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Reembolsos")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Cerrado por")
+    notas = models.TextField(blank=True, verbose_name="Notas")
+    fecha_cierre = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Cierre")
+    # Cada sucursal cierra su propia caja
+    clinic = _campo_clinica(db_index=False)
+
+    objects = ManagerClinica.from_queryset(InmutableQuerySet)()
+
+    class Meta:
+        verbose_name = "Corte de Caja"
+        verbose_name_plural = "Cortes de Caja"
+        ordering = ['-fecha']
+        constraints = [
+            models.UniqueConstraint(fields=['clinic', 'fecha'], name='corte_clinica_fecha_unico'),
+            models.UniqueConstraint(fields=['fecha'], condition=models.Q(clinic__isnull=True), name='corte_fecha_unico'),
+        ]
+
+    def __str__(self):
+        return f"Corte {self.fecha:%d/%m/%Y} - ${self.cobrado - self.reembolsos}"
+
+    @property
+    def neto(self):
+        return self.cobrado - self.reembolsos
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError('Un corte de caja cerrado no se modifica')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError('Un corte de caja cerrado no se elimina')
+
+
+class CashCloseLine(models.Model):
+    """Totales de un corte por método de pago y usuario"""
+
+    corte = models.ForeignKey(CashClose, on_delete=models.CASCADE, related_name='lineas', verbose_name="Corte")
+    metodo_pago = models.CharField(max_length=20, choices=Payment.METODO_PAGO_CHOICES, verbose_name="Método de Pago")
+    # Id y nombre copiados: la foto no cambia si el usuario se renombra o se elimina
+    usuario_id_cobro = models.IntegerField(null=True, blank=True, verbose_name="Id del Usuario")
+    usuario_nombre = models.CharField(max_length=150, blank=True, verbose_name="Usuario")
+    pagos = models.PositiveIntegerField(default=0, verbose_name="Pagos")
+    cobrado = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Cobrado")
+    descuentos = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Descuentos")
+    reembolsos = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Reembolsos")
+    num_reembolsos = models.PositiveIntegerField(default=0, verbose_name="Núm. Reembolsos")
+
+    objects = InmutableQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Línea de Corte"
+        verbose_name_plural = "Líneas de Corte"
+        ordering = ['corte', 'metodo_pago', 'usuario_nombre']
+
+    def __str__(self):
+        return f"{self.corte.fecha} {self.metodo_pago} {self.usuario_nombre or 'Sin usuario'}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError('Un corte de caja cerrado no se modifica')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError('Un corte de caja cerrado no se elimina')
+
+
+class ClaimBatch(models.Model):
+    """Lote mensual de reclamaciones para una aseguradora"""
+
+    ESTADO_CHOICES = [
+        ('generado', 'Generado'),
+        ('enviado', 'Enviado'),
+        ('en_revision', 'En Revisión'),
+        ('cerrado', 'Cerrado'),
+    ]
+
+    # Clave normalizada de Patient.seguro_medico ('GNP Seguros' y 'gnp seguros' son la misma)
+    clave_aseguradora = models.CharField(max_length=100, verbose_name="Clave de Aseguradora")
+    aseguradora = models.CharField(max_length=100, verbose_name="Aseguradora")
+    periodo = models.DateField(verbose_name="Periodo", help_text="Primer día del mes reclamado")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='generado', verbose_name="Estado")
+    reclamaciones = models.PositiveIntegerField(default=0, verbose_name="Reclamaciones")
+    monto_reclamado = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Monto Reclamado")
+    monto_aprobado = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Monto Aprobado")
+    aceptadas = models.PositiveIntegerField(default=0, verbose_name="Aceptadas")
+    rechazadas = models.PositiveIntegerField(default=0, verbose_name="Rechazadas")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Usuario")
+    fecha_creacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Creación")
+    fecha_envio = models.DateTimeField(null=True, blank=True, verbose_name="Fecha de Envío")
+    # Cada sucursal reclama sus propias consultas
+    clinic = _campo_clinica(db_index=False)
+
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Lote de Reclamaciones"
+        verbose_name_plural = "Lotes de Reclamaciones"
+        ordering = ['-periodo', 'aseguradora']
+        indexes = [
+            models.Index(fields=['clinic', 'periodo', 'clave_aseguradora'], name='lotes_clinica_periodo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.aseguradora} {self.periodo:%m/%Y} ({self.reclamaciones})"
+
+
+class InsuranceClaim(models.Model):
+    """Reclamación de una consulta completada dentro de un lote"""
+
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('enviada', 'Enviada'),
+        ('aceptada', 'Aceptada'),
+        ('rechazada', 'Rechazada'),
+        ('pagada', 'Pagada'),
+    ]
+
+    batch = models.ForeignKey(ClaimBatch, on_delete=models.CASCADE, related_name='partidas', verbose_name="Lote")
+    consultation = models.ForeignKey(Consultation, on_delete=models.CASCADE, related_name='reclamaciones', verbose_name="Consulta")
+    # Datos copiados al generar: el archivo enviado no cambia si después se edita el paciente
+    patient_id_reclamado = models.IntegerField(verbose_name="Id del Paciente")
+    paciente = models.CharField(max_length=255, verbose_name="Paciente")
+    numero_poliza = models.CharField(max_length=50, verbose_name="Número de Póliza")
+    fecha_consulta = models.DateTimeField(verbose_name="Fecha de Consulta")
+    tipo_consulta = models.CharField(max_length=20, verbose_name="Tipo de Consulta")
+    diagnostico = models.TextField(blank=True, verbose_name="Diagnóstico")
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Pago")
+    folio_factura = models.CharField(max_length=50, blank=True, verbose_name="Folio de Factura")
+    monto = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Monto Reclamado")
+    monto_aprobado = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Monto Aprobado")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente', verbose_name="Estado")
+    motivo_rechazo = models.CharField(max_length=255, blank=True, verbose_name="Motivo de Rechazo")
+    fecha_actualizacion = models.DateTimeField(auto_now=True, verbose_name="Última Actualización")
+
+    RUTA_CLINICA = 'batch__clinic'
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Reclamación"
+        verbose_name_plural = "Reclamaciones"
+        ordering = ['batch', 'id']
+        indexes = [
+            models.Index(fields=['batch', 'estado'], name='reclamaciones_estado_idx'),
+        ]
+        constraints = [
+            # Una consulta se reclama una vez; si la rechazan puede ir en un lote posterior
+            models.UniqueConstraint(
+                fields=['consultation'],
+                condition=~models.Q(estado='rechazada'),
+                name='reclamacion_activa_unica',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Reclamación #{self.id} - {self.paciente} ({self.get_estado_display()})"
+
+
+class StoredBlob(models.Model):
+    """Contenido de un archivo adjunto, guardado una sola vez por su sha256"""
+
+    DERIVADOS_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('listo', 'Listo'),
+        ('no_aplica', 'No Aplica'),
+        ('no_disponible', 'Sin Pillow/PyMuPDF'),
+        ('error', 'Error'),
+    ]
+
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name="SHA-256")
+    tamano = models.BigIntegerField(verbose_name="Tamaño (bytes)")
+    tipo_mime = models.CharField(max_length=100, verbose_name="Tipo MIME")
+    paginas = models.PositiveIntegerField(null=True, blank=True, verbose_name="Páginas")
+    derivados = models.CharField(max_length=20, choices=DERIVADOS_CHOICES, default='pendiente', verbose_name="Miniatura y Vista Previa")
+    fecha_creacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Creación")
+
+    class Meta:
+        verbose_name = "Contenido de Adjunto"
+        verbose_name_plural = "Contenidos de Adjuntos"
+        indexes = [
+            # Solo los que esperan miniatura: la cola del worker
+            models.Index(fields=['id'], name='blobs_derivados_pendientes_idx', condition=models.Q(derivados='pendiente')),
+        ]
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.tipo_mime}, {self.tamano} bytes)"
+
+
+class Attachment(models.Model):
+    """Archivo adjunto al expediente de un paciente (laboratorio, imagen, consentimiento...)"""
+
+    CATEGORIA_CHOICES = [
+        ('laboratorio', 'Resultado de Laboratorio'),
+        ('imagen', 'Imagen / Rayos X'),
+        ('consentimiento', 'Consentimiento Informado'),
+        ('receta', 'Receta Externa'),
+        ('otro', 'Otro'),
+    ]
+
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='adjuntos', verbose_name="Paciente")
+    consultation = models.ForeignKey(Consultation, on_delete=models.SET_NULL, null=True, blank=True, related_name='adjuntos', verbose_name="Consulta")
+    blob = models.ForeignKey(StoredBlob, on_delete=models.PROTECT, related_name='adjuntos', verbose_name="Contenido")
+    nombre = models.CharField(max_length=255, verbose_name="Nombre del Archivo")
+    categoria = models.CharField(max_length=20, choices=CATEGORIA_CHOICES, default='otro', verbose_name="Categoría")
+    descripcion = models.CharField(max_length=255, blank=True, verbose_name="Descripción")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Subido por")
+    fecha_subida = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Subida")
+
+    RUTA_CLINICA = 'patient__clinic'
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Adjunto"
+        verbose_name_plural = "Adjuntos"
+        ordering = ['-fecha_subida']
+        indexes = [
+            models.Index(fields=['patient', '-fecha_subida'], name='adjuntos_paciente_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre} - {self.patient.nombre_completo}"
+
+
+class LabReport(models.Model):
+    """Reporte de laboratorio en PDF en la cola de ingesta (ver laboratorio.py)"""
+
+    ORIGEN_CHOICES = [
+        ('subida', 'Subido'),
+        ('carpeta', 'Carpeta de Entrada'),
+    ]
+
+    ESTADO_CHOICES = [
+        ('pendiente', 'Pendiente'),
+        ('procesando', 'Procesando'),
+        ('vinculado', 'Vinculado al Paciente'),
+        ('sin_paciente', 'Sin Paciente Identificado'),
+        ('ambiguo', 'Varios Pacientes Posibles'),
+        ('error', 'Error'),
+    ]
+
+    # Un reporte por contenido: el mismo PDF recibido dos veces no se procesa otra vez
+    blob = models.OneToOneField(StoredBlob, on_delete=models.PROTECT, related_name='reporte_laboratorio', verbose_name="Contenido")
+    nombre_archivo = models.CharField(max_length=255, verbose_name="Archivo")
+    origen = models.CharField(max_length=20, choices=ORIGEN_CHOICES, verbose_name="Origen")
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='pendiente', verbose_name="Estado")
+    patient = models.ForeignKey(Patient, on_delete=models.SET_NULL, null=True, blank=True, related_name='reportes_laboratorio', verbose_name="Paciente")
+    attachment = models.OneToOneField(Attachment, on_delete=models.SET_NULL, null=True, blank=True, related_name='reporte_laboratorio', verbose_name="Adjunto")
+
+    # Datos leídos del PDF
+    nombre_detectado = models.CharField(max_length=255, blank=True, verbose_name="Nombre Detectado")
+    fecha_nacimiento_detectada = models.DateField(null=True, blank=True, verbose_name="Fecha de Nacimiento Detectada")
+    fecha_reporte = models.DateField(null=True, blank=True, verbose_name="Fecha del Reporte")
+    texto = models.TextField(blank=True, verbose_name="Texto Extraído")
+    raices = models.TextField(blank=True, verbose_name="Texto Indexado")
+
+    # Cola: quién tomó el reporte y cuándo (la toma vence si el proceso muere)
+    tomado_por = models.CharField(max_length=32, blank=True, verbose_name="Tomado por")
+    tomado_en = models.DateTimeField(null=True, blank=True, verbose_name="Tomado en")
+    intentos = models.PositiveSmallIntegerField(default=0, verbose_name="Intentos")
+    error = models.TextField(blank=True, verbose_name="Error")
+
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Subido por")
+    fecha_creacion = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Recepción")
+    fecha_proceso = models.DateTimeField(null=True, blank=True, verbose_name="Fecha de Proceso")
+    # La de quien lo recibió: un reporte sin paciente también es de una sucursal,
+    # y solo se vincula a pacientes de ella
+    clinic = _campo_clinica()
+
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Reporte de Laboratorio"
+        verbose_name_plural = "Reportes de Laboratorio"
+        ordering = ['-fecha_creacion']
+        indexes = [
+            # La cola: solo los que esperan proceso
+            models.Index(fields=['id'], name='reportes_pendientes_idx', condition=models.Q(estado='pendiente')),
+            models.Index(fields=['estado', 'tomado_en'], name='reportes_estado_idx'),
+            models.Index(fields=['patient', '-fecha_reporte'], name='reportes_paciente_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre_archivo} ({self.get_estado_display()})"
+
+
+class LabResult(models.Model):
+    """Valor de un analito leído de un reporte de laboratorio"""
+
+    reporte = models.ForeignKey(LabReport, on_delete=models.CASCADE, related_name='resultados', verbose_name="Reporte")
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, null=True, blank=True, related_name='resultados_laboratorio', verbose_name="Paciente")
+    analito = models.CharField(max_length=50, verbose_name="Analito")
+    nombre = models.CharField(max_length=100, verbose_name="Nombre en el Reporte")
+    valor = models.DecimalField(max_digits=14, decimal_places=4, verbose_name="Valor")
+    unidad = models.CharField(max_length=30, blank=True, verbose_name="Unidad")
+    referencia = models.CharField(max_length=50, blank=True, verbose_name="Valores de Referencia")
+    fuera_de_rango = models.BooleanField(null=True, blank=True, verbose_name="Fuera de Rango")
+    fecha = models.DateField(null=True, blank=True, verbose_name="Fecha")
+
+    RUTA_CLINICA = 'reporte__clinic'
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Resultado de Laboratorio"
+        verbose_name_plural = "Resultados de Laboratorio"
+        ordering = ['reporte', 'id']
+        indexes = [
+            models.Index(fields=['patient', 'analito', 'fecha'], name='resultados_paciente_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre}: {self.valor} {self.unidad}"
+
+
+class DrugCatalogVersion(models.Model):
+    """Importación del catálogo de medicamentos; la última es la versión vigente"""
+
+    version = models.CharField(max_length=50, blank=True, verbose_name="Versión del Proveedor")
+    medicamentos = models.PositiveIntegerField(default=0, verbose_name="Medicamentos")
+    interacciones = models.PositiveIntegerField(default=0, verbose_name="Interacciones")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Importado por")
+    fecha = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Importación")
+
+    class Meta:
+        verbose_name = "Versión del Catálogo de Medicamentos"
+        verbose_name_plural = "Versiones del Catálogo de Medicamentos"
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"Catálogo #{self.id} {self.version}".strip()
+
+
+class Drug(models.Model):
+    """Medicamento del catálogo (presentación comercial con sus principios activos)"""
+
+    clave = models.CharField(max_length=50, unique=True, verbose_name="Clave")
+    nombre = models.CharField(max_length=200, verbose_name="Nombre")
+    # normalizar_termino(nombre): la columna de la búsqueda por prefijo
+    nombre_normalizado = models.CharField(max_length=200, verbose_name="Nombre Normalizado")
+    # Principios normalizados separados por '+', p. ej. 'paracetamol+cafeina'
+    principios_activos = models.CharField(max_length=300, verbose_name="Principios Activos")
+    concentracion = models.CharField(max_length=100, blank=True, verbose_name="Concentración")
+    presentacion = models.CharField(max_length=100, blank=True, verbose_name="Presentación")
+    via = models.CharField(max_length=50, blank=True, verbose_name="Vía de Administración")
+    activo = models.BooleanField(default=True, verbose_name="Activo")
+
+    class Meta:
+        verbose_name = "Medicamento"
+        verbose_name_plural = "Medicamentos"
+        ordering = ['nombre_normalizado']
+        indexes = [
+            # varchar_pattern_ops: LIKE 'prefijo%' usa el índice en PostgreSQL (se ignora en otros motores)
+            models.Index(fields=['nombre_normalizado'], name='medicamentos_nombre_idx', opclasses=['varchar_pattern_ops']),
+            models.Index(fields=['principios_activos'], name='medicamentos_principio_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def __str__(self):
+        return ' '.join(p for p in (self.nombre, self.concentracion, self.presentacion) if p)
+
+
+class DrugInteraction(models.Model):
+    """Interacción entre dos principios activos (normalizados, principio_a < principio_b)"""
+
+    SEVERIDAD_CHOICES = [
+        ('leve', 'Leve'),
+        ('moderada', 'Moderada'),
+        ('grave', 'Grave'),
+        ('contraindicada', 'Contraindicada'),
+    ]
+
+    principio_a = models.CharField(max_length=100, verbose_name="Principio Activo A")
+    principio_b = models.CharField(max_length=100, verbose_name="Principio Activo B")
+    severidad = models.CharField(max_length=20, choices=SEVERIDAD_CHOICES, verbose_name="Severidad")
+    descripcion = models.TextField(blank=True, verbose_name="Descripción")
+    recomendacion = models.TextField(blank=True, verbose_name="Recomendación")
+
+    class Meta:
+        verbose_name = "Interacción Medicamentosa"
+        verbose_name_plural = "Interacciones Medicamentosas"
+        ordering = ['principio_a', 'principio_b']
+        constraints = [
+            models.UniqueConstraint(fields=['principio_a', 'principio_b'], name='interaccion_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.principio_a} + {self.principio_b} ({self.get_severidad_display()})"
+
+
+class ArchivedConsultation(models.Model):
+    """Consulta cerrada y antigua fuera de las tablas calientes, con sus recetas, pagos y facturas (ver archivo.py)"""
+
+    # El mismo id que tenía la consulta: los enlaces a /consultas/<id>/ siguen sirviendo
+    id = models.BigIntegerField(primary_key=True, verbose_name="Id de la Consulta")
+    patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='consultas_archivadas', verbose_name="Paciente")
+    clinic = _campo_clinica(db_index=False)
+    fecha_consulta = models.DateTimeField(verbose_name="Fecha de Consulta")
+    estado = models.CharField(max_length=20, verbose_name="Estado")
+    # {'consulta': {...}, 'recetas': [...], 'pagos': [{..., 'factura': {..., 'conceptos': [...]}}], 'reclamaciones': [...]}
+    datos = models.JSONField(encoder=CodificadorArchivo, verbose_name="Datos")
+    fecha_archivo = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de Archivo")
+
+    objects = ManagerClinica()
+
+    class Meta:
+        verbose_name = "Consulta Archivada"
+        verbose_name_plural = "Consultas Archivadas"
+        ordering = ['-fecha_consulta']
+        indexes = [
+            models.Index(fields=['patient', 'fecha_consulta'], name='archivo_paciente_fecha_idx'),
+            models.Index(fields=['clinic', 'fecha_consulta'], name='archivo_clinica_fecha_idx'),
+        ]
+
+    def __str__(self):
+        return f"Consulta archivada #{self.id} - {self.fecha_consulta:%d/%m/%Y}"
+
+
+class RequestProfile(models.Model):
+    """Perfil de una petición tomado por PerfiladoMiddleware (ver perfilado.py)"""
+
+    MODO_CHOICES = [
+        ('muestreo', 'Muestreo (flame graph)'),
+        ('cprofile', 'Determinista (pstats)'),
+    ]
+
+    id_peticion = models.CharField(max_length=32, unique=True, verbose_name="Id de Petición")
+    metodo = models.CharField(max_length=10, verbose_name="Método")
+    ruta = models.CharField(max_length=500, verbose_name="Ruta")
+    vista = models.CharField(max_length=100, blank=True, verbose_name="Vista")
+    usuario = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Usuario")
+    modo = models.CharField(max_length=20, choices=MODO_CHOICES, verbose_name="Modo")
+    estado_http = models.PositiveSmallIntegerField(verbose_name="Estado HTTP")
+    duracion_ms = models.FloatField(verbose_name="Duración (ms)")
+    consultas_sql = models.PositiveIntegerField(verbose_name="Consultas SQL")
+    tiempo_sql_ms = models.FloatField(verbose_name="Tiempo SQL (ms)")
+    muestras = models.PositiveIntegerField(null=True, blank=True, verbose_name="Muestras")
+    # Relativo a PERFILADO_ROOT: AAAA-MM-DD/<id_peticion>.folded o .pstats
+    archivo = models.CharField(max_length=255, verbose_name="Archivo")
+    resumen = models.TextField(blank=True, verbose_name="Resumen")
+    fecha = models.DateTimeField(auto_now_add=True, verbose_name="Fecha")
+
+    class Meta:
+        verbose_name = "Perfil de Petición"
+        verbose_name_plural = "Perfiles de Peticiones"
+        ordering = ['-id']
+
+    def __str__(self):
+        return f"{self.metodo} {self.ruta} ({self.duracion_ms:.0f} ms)"
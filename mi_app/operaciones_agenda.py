@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Operaciones masivas sobre la agenda.
+
+Reprogramar o cancelar el día de un doctor se resuelve con un UPDATE por
+conjunto dentro de una transacción, no cita por cita. Como `update()` no
+dispara señales, aquí mismo se hace lo que harían: fecha_actualizacion (para
+la sincronización), eventos del feed en vivo, nota clínica y signos vitales.
+Cada operación deja un AgendaOperation con la bitácora por cita
+(AgendaChange) y la lista de citas que no se pudieron aplicar y por qué.
+"""
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, TextField, Value, When
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from .agenda import ESTADOS_OCUPAN_AGENDA, rango_dia
+
+# Estados que se pueden cancelar (los mismos que en cancelar_consulta)
+ESTADOS_CANCELABLES = ['programada', 'en_curso']
+
+RAZONES_CONFLICTO = {
+    'pasado': 'La nueva fecha ya pasó',
+    'ocupado': 'Se encima con otra cita del doctor',
+    'fuera_de_jornada': 'Fuera de la jornada del doctor',
+    'en_curso': 'La consulta ya está en curso',
+}
+
+
+def se_encima(fecha, ocupadas, duracion):
+    """¿Una cita en `fecha` se encima con alguna de `ocupadas` (inicios ordenados)? Todas duran `duracion`"""
+    i = bisect_right(ocupadas, fecha - duracion)
+    return i < len(ocupadas) and ocupadas[i] < fecha + duracion
+
+def razon_conflicto(fecha, doctor, ocupadas, ahora):
+    """
+    Motivo por el que no se puede agendar una cita en `fecha`, o None.
+    `ocupadas` son los inicios (ordenados) de las citas del doctor en esa
+    zona; chocan si sus intervalos de duracion_consulta se enciman.
+    """
+    if fecha < ahora:
+        return 'pasado'
+    if se_encima(fecha, ocupadas, timedelta(minutes=doctor.duracion_consulta)):
+        return 'ocupado'
+    hora = timezone.localtime(fecha).time()
+    if not doctor.hora_inicio <= hora < doctor.hora_fin:
+        return 'fuera_de_jornada'
+    return None
+
+
+def conflicto(consulta_id, fecha, razon):
+    return {
+        'consulta_id': consulta_id,
+        'fecha': timezone.localtime(fecha).strftime('%Y-%m-%d %H:%M'),
+        'razon': razon,
+        'mensaje': RAZONES_CONFLICTO[razon],
+    }
+
+
+def registrar_operacion(tipo, descripcion, doctor_id=None, usuario=None, motivo='', cambios=(), conflictos=()):
+    """Guarda la operación con su bitácora por cita (dicts con los campos de AgendaChange)"""
+    from .models import AgendaChange, AgendaOperation
+
+    operacion = AgendaOperation.objects.create(
+        tipo=tipo,
+        descripcion=descripcion[:200],
+        doctor_id=doctor_id,
+        usuario=usuario if usuario and usuario.is_authenticated else None,
+        motivo=motivo,
+        afectadas=len(cambios),
+        conflictos=list(conflictos),
+    )
+    AgendaChange.objects.bulk_create(
+        [AgendaChange(operacion=operacion, **cambio) for cambio in cambios],
+        batch_size=500,
+    )
+    return operacion
+
+
+def nota_cancelacion(motivo=''):
+    """Expresión que agrega la nota de cancelación a observaciones (como cancelar_consulta)"""
+    if motivo:
+        nueva, agregada = f"CONSULTA CANCELADA\nMotivo: {motivo}", f"\n\n--- CANCELACIÓN ---\nMotivo: {motivo}"
+    else:
+        nueva, agregada = "CONSULTA CANCELADA", "\n\n--- CONSULTA CANCELADA ---"
+    return Case(
+        When(observaciones='', then=Value(nueva)),
+        default=Concat(F('observaciones'), Value(agregada), output_field=TextField()),
+        output_field=TextField(),
+    )
+
+
+def _reindexar_notas(ids):
+    from .busqueda import CAMPOS_NOTA, indexar_consulta
+    from .models import Consultation
+
+    for consulta in Consultation.objects.filter(id__in=ids).only(
+        'id', 'patient_id', 'doctor_id', 'fecha_consulta', *CAMPOS_NOTA
+    ).prefetch_related('prescription_set'):
+        indexar_consulta(consulta, [(r.medicamento, r.indicaciones) for r in consulta.prescription_set.all()])
+
+
+def cancelar_consultas(queryset, tipo, descripcion, doctor_id=None, usuario=None, motivo=''):
+    """Cancela en un solo UPDATE las consultas cancelables del queryset"""
+    from .eventos_agenda import registrar_eventos
+    from .models import Consultation
+
+    with transaction.atomic():
+        filas = list(
+            queryset.select_for_update().filter(estado__in=ESTADOS_CANCELABLES).order_by('fecha_consulta')
+            .values_list('id', 'estado', 'fecha_consulta', 'doctor_id')
+        )
+        ids = [fila[0] for fila in filas]
+        Consultation.objects.filter(id__in=ids).update(
+            estado='cancelada',
+            observaciones=nota_cancelacion(motivo),
+            fecha_actualizacion=timezone.now(),
+        )
+        registrar_eventos([
+            {'consulta_id': consulta_id, 'doctor_id': doctor, 'fecha_consulta': fecha,
+             'tipo': 'estado', 'estado': 'cancelada', 'estado_anterior': estado}
+            for consulta_id, estado, fecha, doctor in filas
+        ])
+        _reindexar_notas(ids)
+        return registrar_operacion(
+            tipo, descripcion, doctor_id=doctor_id, usuario=usuario, motivo=motivo,
+            cambios=[
+                {'consulta_id': consulta_id, 'accion': 'cancelada', 'estado_anterior': estado, 'fecha_anterior': fecha}
+                for consulta_id, estado, fecha, _ in filas
+            ],
+        )
+
+
+def cancelar_dia(doctor_id, fecha, usuario=None, motivo=''):
+    """Cancela todas las citas programadas o en curso de un doctor en un día"""
+    from .models import Consultation
+
+    inicio, fin = rango_dia(fecha)
+    return cancelar_consultas(
+        Consultation.objects.filter(doctor_id=doctor_id, fecha_consulta__range=(inicio, fin)),
+        'cancelar_dia',
+        f'Cancelar {fecha:%d/%m/%Y} del doctor #{doctor_id}',
+        doctor_id=doctor_id,
+        usuario=usuario,
+        motivo=motivo,
+    )
+
+
+def reprogramar_dia(doctor_id, origen, destino, doctor_destino_id=None, usuario=None, motivo=''):
+    """
+    Mueve las citas programadas de un doctor de `origen` a `destino` a la misma hora
+    (opcionalmente a otro doctor). Las que chocan con una cita existente, caen
+    en el pasado o fuera de la jornada se quedan donde están y se reportan.
+    """
+    from .eventos_agenda import registrar_eventos
+    from .models import ClinicalNote, Consultation, Doctor, VitalSign
+
+    doctor_destino = Doctor.objects.only('id', 'hora_inicio', 'hora_fin', 'duracion_consulta').get(id=doctor_destino_id or doctor_id)
+    inicio, fin = rango_dia(origen)
+    inicio_destino, fin_destino = rango_dia(destino)
+    # Diferencia entre medianoches locales: conserva la hora aunque cambie el horario de verano
+    delta = inicio_destino - inicio
+    ahora = timezone.now()
+
+    with transaction.atomic():
+        filas = list(
+            Consultation.objects.select_for_update().filter(
+                doctor_id=doctor_id,
+                fecha_consulta__range=(inicio, fin),
+                estado__in=ESTADOS_CANCELABLES,
+            ).order_by('fecha_consulta').values_list('id', 'estado', 'fecha_consulta')
+        )
+        # Se amplía una duración hacia atrás: una cita de la víspera puede invadir el día
+        margen = timedelta(minutes=doctor_destino.duracion_consulta)
+        ocupadas = sorted(
+            Consultation.objects.filter(
+                doctor_id=doctor_destino.id,
+                fecha_consulta__gt=inicio_destino - margen,
+                fecha_consulta__lte=fin_destino,
+                estado__in=ESTADOS_OCUPAN_AGENDA,
+            ).exclude(id__in=[fila[0] for fila in filas]).values_list('fecha_consulta', flat=True)
+        )
+
+        mover, conflictos = [], []
+        for consulta_id, estado, fecha in filas:
+            razon = 'en_curso' if estado == 'en_curso' else razon_conflicto(fecha + delta, doctor_destino, ocupadas, ahora)
+            if razon:
+                conflictos.append(conflicto(consulta_id, fecha, razon))
+            else:
+                mover.append((consulta_id, estado, fecha))
+        ids = [fila[0] for fila in mover]
+
+        Consultation.objects.filter(id__in=ids).update(
+            fecha_consulta=F('fecha_consulta') + delta,
+            doctor_id=doctor_destino.id,
+            fecha_actualizacion=ahora,
+        )
+        ClinicalNote.objects.filter(consultation_id__in=ids).update(
+            fecha_consulta=F('fecha_consulta') + delta,
+            doctor_id=doctor_destino.id,
+        )
+        VitalSign.objects.filter(consultation_id__in=ids).update(fecha_medicion=F('fecha_medicion') + delta)
+
+        registrar_eventos([
+            {'consulta_id': consulta_id, 'doctor_id': doctor_destino.id, 'fecha_consulta': fecha + delta,
+             'tipo': 'reprogramada', 'estado': estado, 'fecha_anterior': fecha}
+            for consulta_id, estado, fecha in mover
+        ])
+        if doctor_destino.id != doctor_id:
+            # La agenda del doctor original también debe quitar las citas
+            registrar_eventos([
+                {'consulta_id': consulta_id, 'doctor_id': doctor_id, 'fecha_consulta': fecha + delta,
+                 'tipo': 'reprogramada', 'estado': estado, 'fecha_anterior': fecha}
+                for consulta_id, estado, fecha in mover
+            ])
+
+        return registrar_operacion(
+            'reprogramar_dia',
+            f'Mover {origen:%d/%m/%Y} a {destino:%d/%m/%Y} del doctor #{doctor_id}'
+            + (f' al doctor #{doctor_destino.id}' if doctor_destino.id != doctor_id else ''),
+            doctor_id=doctor_id,
+            usuario=usuario,
+            motivo=motivo,
+            cambios=[
+                {'consulta_id': consulta_id, 'accion': 'reprogramada', 'estado_anterior': estado,
+                 'fecha_anterior': fecha, 'fecha_nueva': fecha + delta, 'doctor_anterior_id': doctor_id}
+                for consulta_id, estado, fecha in mover
+            ],
+            conflictos=conflictos,
+        )
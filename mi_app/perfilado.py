@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Perfilado a pedido de peticiones lentas.
+
+Con PERFILADO_ACTIVO, PerfiladoMiddleware ejecuta la vista bajo un
+perfilador cuando un usuario staff lo pide (cabecera X-Perfilar o
+parámetro ?perfilar=) y, en las vistas de PERFILADO_VISTAS, en una
+fracción PERFILADO_MUESTREO de las peticiones. Hay dos modos:
+
+- muestreo (el predeterminado): un hilo toma la pila del hilo de la
+  petición cada PERFILADO_INTERVALO_MS y cuenta las pilas. El archivo
+  queda en pilas plegadas ("a;b;c 12"), el formato de flamegraph.pl y
+  speedscope. Apenas altera los tiempos.
+- cprofile: el perfilador determinista de la biblioteca estándar. Guarda
+  un .pstats (pstats, snakeviz) con conteos de llamadas exactos, pero
+  infla el tiempo de las funciones pequeñas.
+
+El archivo va a PERFILADO_ROOT con el id de la petición como nombre, y un
+RequestProfile guarda la ruta, la duración, las consultas SQL y un
+resumen que se lee en el admin; la respuesta lleva el id en X-Perfil-Id.
+Se conservan los últimos PERFILADO_MAXIMO. Apagado, el middleware se
+retira de la cadena (MiddlewareNotUsed) y no cuesta nada por petición.
+"""
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils import timezone
+
+CABECERA = 'X-Perfilar'
+PARAMETRO = 'perfilar'
+MODOS = ('muestreo', 'cprofile')
+
+# Renglones del resumen que se guarda en la BD
+RENGLONES_RESUMEN = 25
+
+
+class _ContadorSQL:
+    """execute_wrapper que cuenta las consultas y su tiempo"""
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas += 1
+            self.segundos += time.perf_counter() - inicio
+
+
+def _ejecutar(vista, request, args, kwargs):
+    # Raíz de las pilas muestreadas: lo de afuera (middleware, servidor) se omite
+    return vista(request, *args, **kwargs)
+
+
+class _Muestreador(threading.Thread):
+    """Cuenta las pilas del hilo `hilo` tomadas cada `intervalo` segundos"""
+
+    def __init__(self, hilo, intervalo):
+        super().__init__(name='perfilado', daemon=True)
+        self.hilo = hilo
+        self.intervalo = intervalo
+        self.pilas = Counter()
+        self._fin = threading.Event()
+
+    def run(self):
+        while not self._fin.wait(self.intervalo):
+            marco = sys._current_frames().get(self.hilo)
+            pila = []
+            while marco is not None and marco.f_code is not _ejecutar.__code__:
+                pila.append(f"{marco.f_globals.get('__name__', '?')}.{marco.f_code.co_qualname}")
+                marco = marco.f_back
+            if pila:
+                self.pilas[';'.join(reversed(pila))] += 1
+
+    def detener(self):
+        self._fin.set()
+        self.join()
+
+
+def _resumen_pilas(pilas):
+    """Funciones con más muestras: propias (en la cima de la pila) e incluidas"""
+    total = sum(pilas.values())
+    propio, incluido = Counter(), Counter()
+    for pila, muestras in pilas.items():
+        marcos = pila.split(';')
+        propio[marcos[-1]] += muestras
+        for marco in set(marcos):
+            incluido[marco] += muestras
+
+    renglones = [f'{total} muestras']
+    for titulo, conteo in (('Tiempo propio', propio), ('Tiempo incluido', incluido)):
+        renglones += ['', titulo]
+        renglones += [
+            f'{muestras * 100 / total:6.1f}%  {marco}'
+            for marco, muestras in conteo.most_common(RENGLONES_RESUMEN)
+        ]
+    return '\n'.join(renglones)
+
+
+def _resumen_pstats(perfilador):
+    salida = io.StringIO()
+    pstats.Stats(perfilador, stream=salida).strip_dirs().sort_stats('cumulative').print_stats(RENGLONES_RESUMEN)
+    return salida.getvalue().strip()
+
+
+def ruta_perfil(perfil):
+    return os.path.join(settings.PERFILADO_ROOT, perfil.archivo)
+
+
+def perfilar(request, modo, vista, args, kwargs):
+    """Ejecuta la vista bajo el perfilador `modo`, guarda el perfil y devuelve la respuesta"""
+    from .models import RequestProfile
+
+    id_peticion = uuid.uuid4().hex
+    contador = _ContadorSQL()
+    inicio = time.perf_counter()
+    with connection.execute_wrapper(contador):
+        if modo == 'cprofile':
+            perfilador = cProfile.Profile()
+            response = perfilador.runcall(_ejecutar, vista, request, args, kwargs)
+        else:
+            muestreador = _Muestreador(threading.get_ident(), settings.PERFILADO_INTERVALO_MS / 1000)
+            muestreador.start()
+            try:
+                response = _ejecutar(vista, request, args, kwargs)
+            finally:
+                muestreador.detener()
+    duracion = time.perf_counter() - inicio
+
+    archivo = os.path.join(f'{timezone.localdate():%Y-%m-%d}', id_peticion)
+    if modo == 'cprofile':
+        archivo += '.pstats'
+        os.makedirs(os.path.join(settings.PERFILADO_ROOT, os.path.dirname(archivo)), exist_ok=True)
+        perfilador.dump_stats(os.path.join(settings.PERFILADO_ROOT, archivo))
+        resumen, muestras = _resumen_pstats(perfilador), None
+    else:
+        archivo += '.folded'
+        os.makedirs(os.path.join(settings.PERFILADO_ROOT, os.path.dirname(archivo)), exist_ok=True)
+        with open(os.path.join(settings.PERFILADO_ROOT, archivo), 'w', encoding='utf-8') as salida:
+            for pila, conteo in muestreador.pilas.most_common():
+                salida.write(f'{pila} {conteo}\n')
+        muestras = sum(muestreador.pilas.values())
+        resumen = _resumen_pilas(muestreador.pilas) if muestras else 'Sin muestras: la vista tardó menos que el intervalo'
+
+    RequestProfile.objects.create(
+        id_peticion=id_peticion,
+        metodo=request.method,
+        ruta=request.get_full_path()[:500],
+        vista=request.resolver_match.view_name if request.resolver_match else '',
+        usuario=request.user if request.user.is_authenticated else None,
+        modo=modo,
+        estado_http=response.status_code,
+        duracion_ms=duracion * 1000,
+        consultas_sql=contador.consultas,
+        tiempo_sql_ms=contador.segundos * 1000,
+        muestras=muestras,
+        archivo=archivo,
+        resumen=resumen,
+    )
+    _podar()
+    response['X-Perfil-Id'] = id_peticion
+    return response
+
+
+def _podar():
+    """Borra los perfiles (y sus archivos) que pasan de PERFILADO_MAXIMO"""
+    from .models import RequestProfile
+
+    viejos = list(RequestProfile.objects.order_by('-id')[settings.PERFILADO_MAXIMO:])
+    for perfil in viejos:
+        try:
+            os.remove(ruta_perfil(perfil))
+        except FileNotFoundError:
+            pass
+    if viejos:
+        RequestProfile.objects.filter(id__in=[perfil.id for perfil in viejos]).delete()
+
+
+class PerfiladoMiddleware:
+    """Perfila la vista de las peticiones elegidas (va al final de MIDDLEWARE)"""
+
+    def __init__(self, get_response):
+        if not settings.PERFILADO_ACTIVO:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.muestreo = settings.PERFILADO_MUESTREO
+        self.vistas = set(settings.PERFILADO_VISTAS)
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        modo = self._modo(request)
+        # Las vistas async (SSE) corren en el event loop: no se perfilan
+        if modo is None or iscoroutinefunction(view_func):
+            return None
+        return perfilar(request, modo, view_func, view_args, view_kwargs)
+
+    def _modo(self, request):
+        pedido = request.headers.get(CABECERA) or request.GET.get(PARAMETRO)
+        if pedido:
+            if not request.user.is_staff:
+                return None
+            return pedido if pedido in MODOS else MODOS[0]
+        if (
+            self.muestreo
+            and request.resolver_match.url_name in self.vistas
+            and random.random() < self.muestreo
+        ):
+            return MODOS[0]
+        return None
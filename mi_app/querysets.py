@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+QuerySets personalizados.
+
+Las propiedades calculadas de los modelos (Patient.edad, Patient.imc,
+Patient.get_estado_badge) sirven para mostrar un registro, pero filtrar u
+ordenar por ellas obligaba a cargar todos los pacientes en Python. Aquí
+están sus equivalentes como expresiones SQL.
+"""
+from datetime import datetime, time, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+from django.db.models.functions import Cast, ExtractYear, NullIf
+from django.utils import timezone
+
+DIAS_PACIENTE_NUEVO = 30
+
+
+def restar_anios(fecha, anios):
+    """Misma fecha `anios` años antes (29/feb -> 28/feb)"""
+    try:
+        return fecha.replace(year=fecha.year - anios)
+    except ValueError:
+        return fecha.replace(year=fecha.year - anios, day=28)
+
+
+def inicio_periodo_nuevo(hoy=None):
+    """Primer instante (zona de la clínica) en que un registro sigue siendo 'nuevo'"""
+    hoy = hoy or timezone.localdate()
+    inicio = hoy - timedelta(days=DIAS_PACIENTE_NUEVO - 1)
+    return timezone.make_aware(datetime.combine(inicio, time.min))
+
+
+class PatientQuerySet(models.QuerySet):
+
+    def con_edad(self, hoy=None):
+        """Anota `edad_anios` calculada en SQL con la fecha de la clínica"""
+        hoy = hoy or timezone.localdate()
+        cumple_pendiente = (
+            Q(fecha_nacimiento__month__gt=hoy.month) |
+            Q(fecha_nacimiento__month=hoy.month, fecha_nacimiento__day__gt=hoy.day)
+        )
+        return self.annotate(
+            edad_anios=Value(hoy.year) - ExtractYear('fecha_nacimiento') - Case(
+                When(cumple_pendiente, then=Value(1)),
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        )
+
+    def con_imc(self):
+        """Anota `imc_calculado` (peso / altura²); NULL si falta algún dato"""
+        altura = Cast(NullIf('altura', Value(0)), FloatField())
+        return self.annotate(
+            imc_calculado=Cast('peso', FloatField()) / (altura * altura)
+        )
+
+    def con_estado_badge(self, hoy=None):
+        """Anota `estado_badge` ('nuevo' o 'activo') igual que get_estado_badge"""
+        return self.annotate(
+            estado_badge=Case(
+                When(fecha_registro__gte=inicio_periodo_nuevo(hoy), then=Value('nuevo')),
+                default=Value('activo'),
+                output_field=models.CharField(),
+            )
+        )
+
+    def edad_entre(self, minima=None, maxima=None, hoy=None):
+        """Filtra por edad como rango de fecha_nacimiento (usa el índice)"""
+        hoy = hoy or timezone.localdate()
+        filtros = {}
+        if minima is not None:
+            filtros['fecha_nacimiento__lte'] = restar_anios(hoy, minima)
+        if maxima is not None:
+            filtros['fecha_nacimiento__gt'] = restar_anios(hoy, maxima + 1)
+        return self.filter(**filtros)
+
+    def imc_entre(self, minimo=None, maximo=None):
+        qs = self.con_imc()
+        if minimo is not None:
+            qs = qs.filter(imc_calculado__gte=minimo)
+        if maximo is not None:
+            qs = qs.filter(imc_calculado__lte=maximo)
+        return qs
+
+    def nuevos(self, hoy=None):
+        """Pacientes registrados en los últimos 30 días"""
+        return self.filter(fecha_registro__gte=inicio_periodo_nuevo(hoy))
+
+    def ordenar_por_edad(self, descendente=False):
+        """Ordenar por edad equivale a ordenar por fecha de nacimiento invertida"""
+        if descendente:
+            return self.order_by(F('fecha_nacimiento').asc(nulls_last=True), 'apellidos')
+        return self.order_by(F('fecha_nacimiento').desc(nulls_last=True), 'apellidos')
+
+    # ==================== PROYECCIONES ====================
+
+    def para_lista(self):
+        """Solo las columnas que muestran los listados (sin los TextField clínicos)"""
+        return self.only(
+            'id', 'nombres', 'apellidos', 'fecha_nacimiento', 'genero',
+            'telefono_principal', 'email', 'activo', 'fecha_registro',
+        )
+
+    def para_detalle(self):
+        """Expediente completo con el historial de pagos precargado"""
+        from django.db.models import Prefetch
+        from .models import Consultation, Payment
+
+        return self.prefetch_related(
+            Prefetch(
+                'consultation_set',
+                queryset=Consultation.objects.only('id', 'patient_id', 'fecha_consulta'),
+            ),
+            Prefetch(
+                'consultation_set__pagos',
+                queryset=Payment.objects.select_related('factura').defer('notas'),
+            ),
+        )
+
+
+# TextField del paciente que no se muestran junto a una consulta
+_TEXTOS_PACIENTE = (
+    'patient__alergias', 'patient__enfermedades_cronicas',
+    'patient__medicamentos_actuales', 'patient__antecedentes_familiares',
+)
+
+# Columnas de paciente y doctor necesarias para mostrar sus nombres
+_NOMBRES_PACIENTE_DOCTOR = (
+    'patient__id', 'patient__nombres', 'patient__apellidos',
+    'doctor__id', 'doctor__nombres', 'doctor__apellidos',
+)
+
+
+class ConsultationQuerySet(models.QuerySet):
+
+    def para_lista(self):
+        """Paciente, doctor, fecha, tipo y estado; sin los TextField clínicos"""
+        return self.select_related('patient', 'doctor').only(
+            'id', 'patient', 'doctor', 'fecha_consulta', 'tipo_consulta', 'estado',
+            *_NOMBRES_PACIENTE_DOCTOR,
+        )
+
+    def para_agenda(self):
+        """Proyección de lista más los pagos precargados (estado del cobro)"""
+        from django.db.models import Prefetch
+        from .models import Payment
+
+        return self.para_lista().prefetch_related(
+            Prefetch(
+                'pagos',
+                queryset=Payment.objects.only('id', 'consultation_id', 'estado', 'fecha_creacion'),
+            )
+        )
+
+    def para_historial(self):
+        """Línea de tiempo del expediente: notas resumidas sin síntomas ni exploración"""
+        return self.select_related('patient', 'doctor').defer(
+            'sintomas', 'exploracion_fisica',
+            *_TEXTOS_PACIENTE,
+            'doctor__cedula_profesional', 'doctor__telefono', 'doctor__email',
+            'doctor__especialidad', 'doctor__fecha_registro',
+        )
+
+    def para_detalle(self):
+        """Consulta completa con paciente y doctor"""
+        return self.select_related('patient', 'doctor')
+
+
+class PaymentQuerySet(models.QuerySet):
+
+    def para_lista(self):
+        """Montos, estado y nombre del paciente; sin notas ni datos de la consulta"""
+        return self.select_related('consultation__patient', 'factura').only(
+            'id', 'consultation', 'monto_total', 'monto_pagado', 'descuento',
+            'metodo_pago', 'estado', 'referencia', 'fecha_pago', 'fecha_creacion',
+            'consultation__id', 'consultation__patient',
+            'consultation__patient__id', 'consultation__patient__nombres',
+            'consultation__patient__apellidos',
+            'factura__id', 'factura__payment',
+        )
+
+    def para_detalle(self):
+        return self.select_related('consultation__patient', 'consultation__doctor')
+
+
+class InmutableQuerySet(models.QuerySet):
+    """Registros que se escriben una vez (cortes de caja): update() y delete() no se saltan save()"""
+
+    def update(self, **kwargs):
+        raise ValidationError('Un corte de caja cerrado no se modifica')
+
+    def delete(self):
+        raise ValidationError('Un corte de caja cerrado no se elimina')
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+Reclamaciones mensuales a aseguradoras.
+
+Las consultas completadas del mes de pacientes con seguro se leen en una
+sola consulta ordenada —con sus pagos y facturas por LEFT JOIN— y se agrupan
+en una pasada por aseguradora (Patient.seguro_medico normalizado) y póliza.
+Cada aseguradora recibe un ClaimBatch y cada consulta un InsuranceClaim con
+los datos copiados, insertados con executemany por lotes; nunca hay una
+consulta SQL por consulta médica. Los archivos del lote (CSV o XML) se generan en streaming
+desde las reclamaciones guardadas, y los cambios de estado que responde la
+aseguradora se aplican con UPDATE/bulk_update por lote.
+"""
+import csv
+import io
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import groupby
+from xml.sax.saxutils import escape, quoteattr
+
+from django.db import connection, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+
+from .agenda import rango_dia
+from .analitica import normalizar_termino
+
+LOTE = 2000
+
+# Pagos que no cuentan para el monto reclamado
+ESTADOS_PAGO_EXCLUIDOS = {'cancelado', 'reembolsado'}
+
+# Respuestas de la aseguradora
+ESTADOS_RESPUESTA = {'aceptada', 'rechazada', 'pagada'}
+ESTADOS_APROBADOS = ['aceptada', 'pagada']
+
+# Columnas de InsuranceClaim que llena generar_lotes, en orden
+_COLUMNAS_INSERT = (
+    'batch_id', 'consultation_id', 'patient_id_reclamado', 'paciente', 'numero_poliza',
+    'fecha_consulta', 'tipo_consulta', 'diagnostico', 'payment_id', 'folio_factura',
+    'monto', 'estado', 'motivo_rechazo', 'fecha_actualizacion',
+)
+
+COLUMNAS_ARCHIVO = [
+    'reclamacion', 'poliza', 'paciente', 'fecha_consulta', 'tipo_consulta',
+    'diagnostico', 'folio_factura', 'monto',
+]
+
+
+class ReclamacionInvalida(Exception):
+    pass
+
+
+def periodo_de(texto):
+    """'2026-09' -> date(2026, 9, 1)"""
+    try:
+        anio, mes = (int(parte) for parte in texto.split('-'))
+        return date(anio, mes, 1)
+    except (AttributeError, ValueError):
+        raise ReclamacionInvalida(f'Periodo inválido: {texto!r} (se espera AAAA-MM)')
+
+
+def mes_anterior():
+    return (timezone.localdate().replace(day=1) - timedelta(days=1)).replace(day=1)
+
+
+def _fin_de_mes(periodo):
+    return (periodo.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def _consultas_reclamables(periodo):
+    """Filas (consulta × pago) del mes ordenadas por consulta; una sola consulta SQL"""
+    from .models import Consultation, InsuranceClaim
+
+    inicio, _ = rango_dia(periodo)
+    _, fin = rango_dia(_fin_de_mes(periodo))
+    consultas = Consultation.objects.filter(
+        estado='completada',
+        fecha_consulta__range=(inicio, fin),
+    ).exclude(
+        patient__seguro_medico='',
+    ).exclude(
+        Exists(InsuranceClaim.objects.filter(consultation=OuterRef('pk')).exclude(estado='rechazada')),
+    )
+    return consultas.order_by('id', 'pagos__id').values_list(
+        'id', 'clinic_id', 'fecha_consulta', 'tipo_consulta', 'diagnostico',
+        'patient_id', 'patient__nombres', 'patient__apellidos',
+        'patient__seguro_medico', 'patient__numero_poliza',
+        'pagos__id', 'pagos__estado', 'pagos__monto_total', 'pagos__descuento',
+        'pagos__factura__folio', 'pagos__factura__total', 'pagos__factura__cancelada',
+    ).iterator(chunk_size=LOTE)
+
+
+def _monto_y_pago(filas):
+    """Monto reclamable de los pagos de una consulta, su primer pago válido y folio de factura"""
+    monto, pago_id, folio = Decimal('0.00'), None, ''
+    for *_, p_id, p_estado, p_total, p_descuento, f_folio, f_total, f_cancelada in filas:
+        if p_id is None or p_estado in ESTADOS_PAGO_EXCLUIDOS:
+            continue
+        # La factura vigente manda (incluye IVA); si no hay, el monto del pago menos descuento
+        if f_folio and not f_cancelada:
+            monto += f_total
+            folio = folio or f_folio
+        else:
+            monto += p_total - p_descuento
+        pago_id = pago_id or p_id
+    return monto, pago_id, folio
+
+
+def generar_lotes(periodo, usuario=None, clave_aseguradora=None):
+    """
+    Crea los lotes del mes de todas las aseguradoras (o de una) en una pasada.
+
+    Devuelve (lotes, omitidas) donde omitidas cuenta las consultas que no
+    se pudieron reclamar: {'sin_poliza': n, 'sin_pago': n}.
+    """
+    from .models import ClaimBatch
+
+    por_aseguradora = {}
+    nombres = {}
+    omitidas = {'sin_poliza': 0, 'sin_pago': 0}
+
+    for consulta_id, filas in groupby(_consultas_reclamables(periodo), key=lambda f: f[0]):
+        filas = list(filas)
+        _, clinica, fecha, tipo, diagnostico, patient_id, nombres_p, apellidos, seguro, poliza = filas[0][:10]
+        # La aseguradora se filtra ya normalizada ('Médica Sur' = 'medica sur')
+        clave = normalizar_termino(seguro)
+        if not clave or (clave_aseguradora and clave != clave_aseguradora):
+            continue
+        if not poliza.strip():
+            omitidas['sin_poliza'] += 1
+            continue
+        monto, pago_id, folio = _monto_y_pago(filas)
+        if not monto:
+            omitidas['sin_pago'] += 1
+            continue
+        nombres.setdefault(clave, seguro.strip())
+        # Un lote por clínica y aseguradora: cada sucursal reclama lo suyo
+        por_aseguradora.setdefault((clinica, clave), []).append((
+            consulta_id, patient_id, f'{nombres_p} {apellidos}'[:255], poliza.strip(),
+            fecha, tipo, diagnostico or '', pago_id, folio, monto,
+        ))
+
+    with transaction.atomic():
+        lotes = ClaimBatch.objects.bulk_create([
+            ClaimBatch(
+                clinic_id=clinica,
+                clave_aseguradora=clave,
+                aseguradora=nombres[clave][:100],
+                periodo=periodo,
+                reclamaciones=len(reclamaciones),
+                monto_reclamado=sum(r[-1] for r in reclamaciones),
+                usuario=usuario,
+            )
+            for (clinica, clave), reclamaciones in sorted(
+                por_aseguradora.items(), key=lambda par: (par[0][0] or 0, par[0][1]),
+            )
+        ])
+        for lote in lotes:
+            reclamaciones = por_aseguradora[(lote.clinic_id, lote.clave_aseguradora)]
+            # En el orden del archivo: por póliza y fecha
+            reclamaciones.sort(key=lambda r: (r[3], r[4]))
+            _insertar_reclamaciones(lote.id, reclamaciones)
+    return lotes, omitidas
+
+
+def _insertar_reclamaciones(lote_id, reclamaciones):
+    """INSERT por lotes con executemany, sin instanciar modelos (como los movimientos bancarios)"""
+    from .models import InsuranceClaim
+
+    operaciones = connection.ops
+    ahora = operaciones.adapt_datetimefield_value(timezone.now())
+    sql = (
+        f'INSERT INTO {InsuranceClaim._meta.db_table} ({", ".join(_COLUMNAS_INSERT)}) '
+        f'VALUES ({", ".join(["%s"] * len(_COLUMNAS_INSERT))})'
+    )
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(reclamaciones), LOTE):
+            cursor.executemany(sql, [
+                (
+                    lote_id, consulta_id, patient_id, paciente, poliza,
+                    operaciones.adapt_datetimefield_value(fecha), tipo, diagnostico, pago_id, folio,
+                    operaciones.adapt_decimalfield_value(monto, 10, 2), 'pendiente', '', ahora,
+                )
+                for consulta_id, patient_id, paciente, poliza, fecha, tipo, diagnostico, pago_id, folio, monto
+                in reclamaciones[inicio:inicio + LOTE]
+            ])
+
+
+def _reclamaciones_archivo(lote):
+    return lote.partidas.order_by('numero_poliza', 'id').values_list(
+        'id', 'numero_poliza', 'paciente', 'fecha_consulta', 'tipo_consulta',
+        'diagnostico', 'folio_factura', 'monto',
+    ).iterator(chunk_size=LOTE)
+
+
+def csv_lote(lote):
+    """Archivo CSV del lote en trozos de LOTE filas"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUMNAS_ARCHIVO)
+    for n, (reclamacion_id, poliza, paciente, fecha, tipo, diagnostico, folio, monto) in enumerate(
+        _reclamaciones_archivo(lote), start=1
+    ):
+        escritor.writerow([
+            reclamacion_id, poliza, paciente, timezone.localtime(fecha).date().isoformat(),
+            tipo, diagnostico, folio, monto,
+        ])
+        if n % LOTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def xml_lote(lote):
+    """Archivo XML del lote, con las reclamaciones agrupadas por póliza"""
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield (
+        f'<lote id={quoteattr(str(lote.id))} aseguradora={quoteattr(lote.aseguradora)} '
+        f'periodo={quoteattr(f"{lote.periodo:%Y-%m}")} reclamaciones="{lote.reclamaciones}" '
+        f'monto="{lote.monto_reclamado}">\n'
+    )
+    for poliza, filas in groupby(_reclamaciones_archivo(lote), key=lambda f: f[1]):
+        partes = [f'  <poliza numero={quoteattr(poliza)}>\n']
+        for reclamacion_id, _, paciente, fecha, tipo, diagnostico, folio, monto in filas:
+            partes.append(
+                f'    <reclamacion id="{reclamacion_id}">'
+                f'<paciente>{escape(paciente)}</paciente>'
+                f'<fecha>{timezone.localtime(fecha).date().isoformat()}</fecha>'
+                f'<tipo>{escape(tipo)}</tipo>'
+                f'<diagnostico>{escape(diagnostico)}</diagnostico>'
+                f'<factura>{escape(folio)}</factura>'
+                f'<monto>{monto}</monto>'
+                '</reclamacion>\n'
+            )
+        partes.append('  </poliza>\n')
+        yield ''.join(partes)
+    yield '</lote>\n'
+
+
+ARCHIVOS = {
+    'csv': (csv_lote, 'text/csv; charset=utf-8'),
+    'xml': (xml_lote, 'application/xml; charset=utf-8'),
+}
+
+
+def recalcular(lote):
+    """Actualiza contadores y estado del lote con una consulta agregada"""
+    aprobadas = Q(estado__in=ESTADOS_APROBADOS)
+    totales = lote.partidas.aggregate(
+        total=Count('id'),
+        aceptadas=Count('id', filter=aprobadas),
+        rechazadas=Count('id', filter=Q(estado='rechazada')),
+        abiertas=Count('id', filter=Q(estado__in=['pendiente', 'enviada'])),
+        monto_aprobado=Sum('monto_aprobado', filter=aprobadas, default=Decimal('0.00')),
+    )
+    lote.aceptadas = totales['aceptadas']
+    lote.rechazadas = totales['rechazadas']
+    # SQLite suma decimales como flotantes: se redondea a centavos
+    lote.monto_aprobado = Decimal(totales['monto_aprobado']).quantize(Decimal('0.01'))
+    if totales['total'] and not totales['abiertas']:
+        lote.estado = 'cerrado'
+    elif totales['aceptadas'] or totales['rechazadas']:
+        lote.estado = 'en_revision'
+    lote.save(update_fields=['aceptadas', 'rechazadas', 'monto_aprobado', 'estado'])
+    return lote
+
+
+def marcar_enviado(lote):
+    """Marca el lote y sus reclamaciones pendientes como enviados (un UPDATE)"""
+    ahora = timezone.now()
+    with transaction.atomic():
+        enviadas = lote.partidas.filter(estado='pendiente').update(estado='enviada', fecha_actualizacion=ahora)
+        if lote.estado == 'generado':
+            lote.estado = 'enviado'
+            lote.fecha_envio = ahora
+            lote.save(update_fields=['estado', 'fecha_envio'])
+    return enviadas
+
+
+def aplicar_respuestas(lote, respuestas):
+    """
+    Aplica la respuesta de la aseguradora: [{'reclamacion', 'estado',
+    'monto_aprobado', 'motivo'}, ...]. Las respuestas iguales (estado, monto,
+    motivo) se agrupan en un UPDATE ... WHERE id IN por grupo; sin monto se
+    aprueba lo reclamado. Devuelve (actualizadas, errores).
+    """
+    grupos, errores = {}, []
+    for n, respuesta in enumerate(respuestas, start=1):
+        try:
+            reclamacion_id = int(respuesta['reclamacion'])
+            estado = respuesta['estado']
+            if estado not in ESTADOS_RESPUESTA:
+                raise ValueError(f'estado {estado!r} no válido')
+            aprobado = respuesta.get('monto_aprobado')
+            aprobado = Decimal(str(aprobado)) if aprobado not in (None, '') else None
+        except (KeyError, TypeError, ValueError, ArithmeticError) as e:
+            errores.append({'respuesta': n, 'error': str(e)})
+            continue
+        if estado == 'rechazada':
+            llave = (estado, Decimal('0.00'), str(respuesta.get('motivo', ''))[:255])
+        else:
+            llave = (estado, aprobado, '')
+        grupos.setdefault(llave, []).append(reclamacion_id)
+
+    ahora = timezone.now()
+    actualizadas, encontradas = 0, set()
+    with transaction.atomic():
+        for (estado, aprobado, motivo), ids in grupos.items():
+            for inicio in range(0, len(ids), LOTE):
+                tramo = lote.partidas.filter(id__in=ids[inicio:inicio + LOTE])
+                encontradas.update(tramo.values_list('id', flat=True))
+                actualizadas += tramo.update(
+                    estado=estado,
+                    monto_aprobado=F('monto') if aprobado is None else aprobado,
+                    motivo_rechazo=motivo,
+                    fecha_actualizacion=ahora,
+                )
+        recalcular(lote)
+    errores.extend(
+        {'reclamacion': i, 'error': 'No pertenece al lote'}
+        for ids in grupos.values() for i in ids if i not in encontradas
+    )
+    return actualizadas, errores
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Series de citas recurrentes.
+
+Una AppointmentSeries guarda la regla (frecuencia, intervalo, días, fin) al
+estilo RRULE; sus ocurrencias se materializan como consultas normales con un
+solo bulk_create, de modo que la agenda, los pagos y la sincronización no
+distinguen una cita de serie de una suelta. Las series sin fin se
+materializan hasta HORIZONTE y el comando `materializar_series` las extiende.
+"""
+import calendar
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from itertools import count
+
+from django.db import transaction
+from django.utils import timezone
+
+from .agenda import ESTADOS_OCUPAN_AGENDA
+from .operaciones_agenda import cancelar_consultas, conflicto, razon_conflicto, registrar_operacion
+
+# Ventana de citas que se crean por adelantado
+HORIZONTE = timedelta(days=120)
+
+# Tope de ocurrencias por ventana materializada, para reglas mal capturadas;
+# si se alcanza, la ventana se recorta y la siguiente extensión sigue desde ahí
+MAXIMO_OCURRENCIAS = 400
+
+_FREQ_RRULE = {'diaria': 'DAILY', 'semanal': 'WEEKLY', 'mensual': 'MONTHLY'}
+_DIAS_RRULE = ['MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU']
+
+
+def regla_rrule(serie):
+    """La regla de la serie como RRULE (RFC 5545), p. ej. para exportar a iCal"""
+    partes = [f'FREQ={_FREQ_RRULE[serie.frecuencia]}']
+    if serie.intervalo > 1:
+        partes.append(f'INTERVAL={serie.intervalo}')
+    if serie.frecuencia == 'semanal' and serie.dias:
+        partes.append('BYDAY=' + ','.join(_DIAS_RRULE[d] for d in serie.dias))
+    if serie.repeticiones:
+        partes.append(f'COUNT={serie.repeticiones}')
+    if serie.fecha_fin:
+        fin = timezone.make_aware(datetime.combine(serie.fecha_fin, time(23, 59, 59)))
+        partes.append(f'UNTIL={fin.astimezone(dt_timezone.utc):%Y%m%dT%H%M%SZ}')
+    return ';'.join(partes)
+
+
+def _dias(serie, primera):
+    """Fechas candidatas de la regla a partir de la primera cita (sin fin)"""
+    if serie.frecuencia == 'diaria':
+        for k in count():
+            yield primera + timedelta(days=k * serie.intervalo)
+    elif serie.frecuencia == 'semanal':
+        lunes = primera - timedelta(days=primera.weekday())
+        dias = serie.dias or [primera.weekday()]
+        for k in count():
+            semana = lunes + timedelta(weeks=k * serie.intervalo)
+            for dia in dias:
+                fecha = semana + timedelta(days=dia)
+                if fecha >= primera:
+                    yield fecha
+    else:
+        # Mensual el mismo día; los meses que no lo tienen se saltan (como RRULE)
+        for k in count():
+            mes = primera.month - 1 + k * serie.intervalo
+            anio, mes = primera.year + mes // 12, mes % 12 + 1
+            if primera.day <= calendar.monthrange(anio, mes)[1]:
+                yield date(anio, mes, primera.day)
+
+
+def ocurrencias(serie, hasta, despues_de=None, tope=MAXIMO_OCURRENCIAS):
+    """
+    Fechas y horas (aware) de la serie posteriores al día `despues_de` y hasta
+    `hasta` inclusive, como mucho `tope`. Las repeticiones (COUNT) se cuentan
+    desde la primera cita de la serie; el tope, solo sobre las que se devuelven.
+    """
+    inicio = timezone.localtime(serie.fecha_inicio)
+    primera, hora = inicio.date(), inicio.time().replace(tzinfo=None)
+    limite = min(hasta, serie.fecha_fin) if serie.fecha_fin else hasta
+
+    n = devueltas = 0
+    for dia in _dias(serie, primera):
+        if dia > limite or (serie.repeticiones and n >= serie.repeticiones) or devueltas >= tope:
+            return
+        n += 1
+        if despues_de is None or dia > despues_de:
+            devueltas += 1
+            yield timezone.make_aware(datetime.combine(dia, hora))
+
+
+def materializar(serie, hasta=None, usuario=None):
+    """
+    Crea las citas de la serie que faltan hasta `hasta` (por defecto hoy +
+    HORIZONTE) con un bulk_create. Las que chocan con otra cita del doctor,
+    caen en el pasado o fuera de su jornada no se crean y se reportan.
+    Devuelve (consultas creadas, operación o None si no hubo nada que hacer).
+    """
+    from .eventos_agenda import registrar_eventos
+    from .models import Consultation
+
+    hasta = hasta or timezone.localdate() + HORIZONTE
+    ya = serie.materializada_hasta
+    fechas = list(ocurrencias(serie, hasta, despues_de=ya))
+    if len(fechas) == MAXIMO_OCURRENCIAS:
+        # Ventana recortada por el tope: se materializa hasta la última creada
+        hasta = timezone.localtime(fechas[-1]).date()
+    ahora = timezone.now()
+    duracion = timedelta(minutes=serie.doctor.duracion_consulta)
+
+    with transaction.atomic():
+        ocupadas = sorted(
+            Consultation.objects.filter(
+                doctor_id=serie.doctor_id,
+                fecha_consulta__gt=fechas[0] - duracion,
+                fecha_consulta__lt=fechas[-1] + duracion,
+                estado__in=ESTADOS_OCUPAN_AGENDA,
+            ).values_list('fecha_consulta', flat=True)
+        ) if fechas else []
+
+        nuevas, conflictos = [], []
+        for fecha in fechas:
+            razon = razon_conflicto(fecha, serie.doctor, ocupadas, ahora)
+            if razon:
+                conflictos.append(conflicto(None, fecha, razon))
+                continue
+            nuevas.append(Consultation(
+                patient_id=serie.patient_id,
+                doctor_id=serie.doctor_id,
+                # bulk_create no pasa por asignar_clinica_consulta
+                clinic_id=serie.doctor.clinic_id,
+                fecha_consulta=fecha,
+                tipo_consulta=serie.tipo_consulta,
+                motivo=serie.motivo,
+                estado='programada',
+                serie=serie,
+            ))
+        creadas = Consultation.objects.bulk_create(nuevas, batch_size=500)
+
+        serie.materializada_hasta = max(hasta, ya) if ya else hasta
+        serie.save(update_fields=['materializada_hasta'])
+        if not creadas and not conflictos:
+            return creadas, None
+
+        registrar_eventos([
+            {'consulta_id': c.pk, 'doctor_id': c.doctor_id, 'fecha_consulta': c.fecha_consulta,
+             'tipo': 'nueva', 'estado': c.estado}
+            for c in creadas
+        ])
+        operacion = registrar_operacion(
+            'serie',
+            f'Serie #{serie.pk} ({regla_rrule(serie)})',
+            doctor_id=serie.doctor_id,
+            usuario=usuario,
+            cambios=[
+                {'consulta_id': c.pk, 'accion': 'creada', 'fecha_nueva': c.fecha_consulta}
+                for c in creadas
+            ],
+            conflictos=conflictos,
+        )
+    return creadas, operacion
+
+
+def crear_serie(usuario=None, **campos):
+    """Valida y guarda la serie y materializa su primera ventana: (serie, creadas, operación)"""
+    from .models import AppointmentSeries
+
+    serie = AppointmentSeries(**campos)
+    serie.full_clean()
+    with transaction.atomic():
+        serie.save()
+        creadas, operacion = materializar(serie, usuario=usuario)
+    return serie, creadas, operacion
+
+
+def cancelar_serie(serie, desde=None, usuario=None, motivo=''):
+    """Cancela las citas de la serie a partir de `desde` (por defecto, ahora) y la desactiva"""
+    desde = desde or timezone.now()
+    with transaction.atomic():
+        operacion = cancelar_consultas(
+            serie.consultas.filter(fecha_consulta__gte=desde),
+            'cancelar_serie',
+            f'Cancelar serie #{serie.pk} desde {timezone.localtime(desde):%d/%m/%Y}',
+            doctor_id=serie.doctor_id,
+            usuario=usuario,
+            motivo=motivo,
+        )
+        serie.activa = False
+        serie.save(update_fields=['activa'])
+    return operacion
+
+
+def extender_series(hasta=None):
+    """Materializa la siguiente ventana de las series activas; devuelve el total de citas creadas"""
+    from .models import AppointmentSeries
+
+    hasta = hasta or timezone.localdate() + HORIZONTE
+    total = 0
+    for serie in AppointmentSeries.objects.filter(activa=True, materializada_hasta__lt=hasta).select_related('doctor'):
+        if serie.fecha_fin and serie.materializada_hasta >= serie.fecha_fin:
+            continue
+        creadas, _ = materializar(serie, hasta=hasta)
+        total += len(creadas)
+    return total
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Serie de signos vitales por paciente.
+
+Los signos vitales se capturan dentro de cada Consultation (la presión como
+texto libre "120/80"). Aquí se convierten a una serie tipada (VitalSign) con
+índice (patient, fecha_medicion) para que una gráfica de peso o presión de
+años sea un solo recorrido por rango del índice.
+"""
+import re
+from datetime import timedelta
+from decimal import Decimal
+
+from django.utils import timezone
+
+# Métricas disponibles para la tendencia -> columnas de VitalSign
+METRICAS = {
+    'peso': ('peso',),
+    'presion': ('presion_sistolica', 'presion_diastolica'),
+    'frecuencia_cardiaca': ('frecuencia_cardiaca',),
+    'temperatura': ('temperatura',),
+}
+
+PUNTOS_MAXIMOS = 500
+
+_PRESION_RE = re.compile(r'^\s*(\d{2,3})\s*[/\-]\s*(\d{2,3})')
+
+
+def parse_presion_arterial(texto):
+    """Convierte '120/80' (o '120 / 80 mmHg') en (120, 80); None si no es válida"""
+    if not texto:
+        return None, None
+    match = _PRESION_RE.match(texto)
+    if not match:
+        return None, None
+    sistolica, diastolica = int(match.group(1)), int(match.group(2))
+    if not (40 <= sistolica <= 300 and 20 <= diastolica <= 200):
+        return None, None
+    return sistolica, diastolica
+
+
+def valores_desde_consulta(consulta):
+    """Extrae los signos vitales tipados de una consulta (dict vacío si no hay)"""
+    sistolica, diastolica = parse_presion_arterial(consulta.presion_arterial)
+    valores = {
+        'presion_sistolica': sistolica,
+        'presion_diastolica': diastolica,
+        'frecuencia_cardiaca': consulta.frecuencia_cardiaca,
+        'temperatura': consulta.temperatura,
+        'peso': consulta.peso_consulta,
+    }
+    if all(valor is None for valor in valores.values()):
+        return {}
+    valores['fecha_medicion'] = consulta.fecha_consulta
+    return valores
+
+
+def registrar_desde_consulta(consulta, creada=False):
+    """Crea, actualiza o elimina el punto de la serie ligado a una consulta"""
+    from .models import VitalSign
+
+    valores = valores_desde_consulta(consulta)
+    if not valores:
+        # Una consulta recién creada no puede tener punto previo
+        if not creada:
+            VitalSign.objects.filter(consultation_id=consulta.pk).delete()
+        return None
+
+    signo, _ = VitalSign.objects.update_or_create(
+        consultation_id=consulta.pk,
+        defaults={'patient_id': consulta.patient_id, **valores},
+    )
+    return signo
+
+
+def _promedio(valores):
+    valores = [v for v in valores if v is not None]
+    if not valores:
+        return None
+    return round(float(sum(valores)) / len(valores), 2)
+
+
+def tendencia(patient_id, metrica, desde=None, hasta=None, puntos=100):
+    """
+    Serie reducida de una métrica para gráficas.
+
+    Hace una sola consulta por rango sobre (patient, fecha_medicion) trayendo
+    solo las columnas de la métrica, y si hay más mediciones que `puntos`
+    agrupa en cubetas de tiempo iguales con su promedio, mínimo y máximo.
+    """
+    from .models import VitalSign
+
+    if metrica not in METRICAS:
+        raise ValueError(f'Métrica no soportada: {metrica}')
+    columnas = METRICAS[metrica]
+    puntos = max(1, min(int(puntos), PUNTOS_MAXIMOS))
+
+    filas = VitalSign.objects.filter(patient_id=patient_id)
+    if desde:
+        filas = filas.filter(fecha_medicion__gte=desde)
+    if hasta:
+        filas = filas.filter(fecha_medicion__lte=hasta)
+
+    # Excluir filas donde la métrica no se registró
+    filas = filas.exclude(**{f'{columnas[0]}__isnull': True})
+    filas = list(
+        filas.order_by('fecha_medicion').values_list('fecha_medicion', *columnas)
+    )
+
+    if len(filas) <= puntos:
+        serie = []
+        for fila in filas:
+            valores = [float(v) if isinstance(v, Decimal) else v for v in fila[1:]]
+            # Mismas llaves que un punto agrupado: con una medición, min = max = valor
+            serie.append({
+                'fecha': timezone.localtime(fila[0]).isoformat(),
+                'valores': valores,
+                'min': valores,
+                'max': valores,
+                'n': 1,
+            })
+        return serie
+
+    inicio = filas[0][0]
+    fin = filas[-1][0]
+    # Todas las mediciones en el mismo instante caen en una sola cubeta
+    ancho = (fin - inicio) / puntos or timedelta(seconds=1)
+    cubetas = {}
+    for fila in filas:
+        indice = min(int((fila[0] - inicio) / ancho), puntos - 1)
+        cubetas.setdefault(indice, []).append(fila)
+
+    serie = []
+    for indice in sorted(cubetas):
+        grupo = cubetas[indice]
+        fecha_media = grupo[0][0] + (grupo[-1][0] - grupo[0][0]) / 2
+        valores = []
+        minimos = []
+        maximos = []
+        for posicion in range(1, len(columnas) + 1):
+            datos = [fila[posicion] for fila in grupo if fila[posicion] is not None]
+            valores.append(_promedio(datos))
+            minimos.append(float(min(datos)) if datos else None)
+            maximos.append(float(max(datos)) if datos else None)
+        serie.append({
+            'fecha': timezone.localtime(fecha_media).isoformat(),
+            'valores': valores,
+            'min': minimos,
+            'max': maximos,
+            'n': len(grupo),
+        })
+    return serie
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""
+Sincronización delta para tabletas sin conexión.
+
+Los cambios se leen por rango del índice (fecha_actualizacion, id) de cada
+modelo a partir de un token opaco que guarda el último punto visto por
+recurso; las bajas salen de Tombstone. Las subidas llegan en lote y se
+aplican con concurrencia optimista: cada cambio trae la versión
+(fecha_actualizacion) sobre la que se editó y se rechaza como conflicto si el
+registro cambió en el servidor desde entonces.
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+VERSION_API = 1
+
+# Filas máximas por recurso en una respuesta
+LIMITE_DEFAULT = 500
+LIMITE_MAXIMO = 2000
+
+# Cambios máximos por subida
+LOTE_MAXIMO = 200
+
+# Al ponerse al día el cursor retrocede este margen para no perder filas de
+# transacciones que se confirmaron después de la lectura con una fecha anterior
+MARGEN = timedelta(seconds=5)
+
+_SALT_TOKEN = 'mi_app.sincronizacion'
+
+# recurso -> (modelo, campos enviados, campos editables, ¿se puede crear/eliminar?)
+RECURSOS = {
+    'pacientes': (
+        'Patient',
+        ('id', 'nombres', 'apellidos', 'fecha_nacimiento', 'genero', 'tipo_sangre',
+         'peso', 'altura', 'alergias', 'enfermedades_cronicas', 'medicamentos_actuales',
+         'antecedentes_familiares', 'telefono_principal', 'activo', 'fecha_actualizacion'),
+        ('peso', 'altura', 'alergias', 'enfermedades_cronicas', 'medicamentos_actuales',
+         'antecedentes_familiares'),
+        False,
+    ),
+    'consultas': (
+        'Consultation',
+        ('id', 'patient_id', 'doctor_id', 'fecha_consulta', 'tipo_consulta', 'motivo', 'estado',
+         'sintomas', 'exploracion_fisica', 'diagnostico', 'tratamiento', 'observaciones',
+         'proxima_cita', 'presion_arterial', 'frecuencia_cardiaca', 'temperatura',
+         'peso_consulta', 'fecha_actualizacion'),
+        ('estado', 'sintomas', 'exploracion_fisica', 'diagnostico', 'tratamiento',
+         'observaciones', 'proxima_cita', 'presion_arterial', 'frecuencia_cardiaca',
+         'temperatura', 'peso_consulta'),
+        False,
+    ),
+    'expedientes': (
+        'MedicalRecord',
+        ('id', 'patient_id', 'cirugias_previas', 'hospitalizaciones', 'traumatismos',
+         'menarquia', 'ciclo_menstrual', 'embarazos', 'partos', 'cesareas', 'abortos',
+         'notas_importantes', 'fecha_actualizacion'),
+        ('cirugias_previas', 'hospitalizaciones', 'traumatismos', 'menarquia',
+         'ciclo_menstrual', 'embarazos', 'partos', 'cesareas', 'abortos', 'notas_importantes'),
+        False,
+    ),
+    'recetas': (
+        'Prescription',
+        ('id', 'consultation_id', 'drug_id', 'medicamento', 'dosis', 'frecuencia', 'duracion',
+         'indicaciones', 'fecha_actualizacion'),
+        ('medicamento', 'dosis', 'frecuencia', 'duracion', 'indicaciones'),
+        True,
+    ),
+}
+
+
+class TokenInvalido(Exception):
+    pass
+
+
+def _modelo(recurso):
+    from django.apps import apps
+    return apps.get_model('mi_app', RECURSOS[recurso][0])
+
+
+def version(fecha):
+    """Versión de una fila: fecha_actualizacion con microsegundos"""
+    return fecha.isoformat()
+
+
+def _valor(valor):
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return valor
+
+
+def _cursor(fecha, objeto_id=0):
+    return [fecha.isoformat(), objeto_id]
+
+
+def nuevo_token(doctor_id=None, desde=None):
+    """Token inicial: todo desde el principio, con el alcance fijado"""
+    return {
+        'v': VERSION_API,
+        'doctor': doctor_id,
+        'desde': desde.isoformat() if desde else None,
+        'cursores': {},
+    }
+
+
+def leer_token(texto):
+    try:
+        token = signing.loads(texto, salt=_SALT_TOKEN)
+    except signing.BadSignature:
+        raise TokenInvalido('Token de sincronización inválido')
+    if token.get('v') != VERSION_API:
+        raise TokenInvalido('Token de otra versión de la API; sincroniza desde cero')
+    return token
+
+
+def _alcance(recurso, token):
+    """Queryset del recurso restringido al alcance del token (doctor / fecha inicial)"""
+    modelo = _modelo(recurso)
+    consultas = Q()
+    if token['doctor']:
+        consultas &= Q(doctor_id=token['doctor'])
+    if token['desde']:
+        inicio = datetime.combine(date.fromisoformat(token['desde']), time.min)
+        consultas &= Q(fecha_consulta__gte=timezone.make_aware(inicio))
+
+    queryset = modelo.objects.order_by()
+    if recurso == 'consultas':
+        queryset = queryset.filter(consultas)
+    elif recurso == 'recetas':
+        from .models import Consultation
+        queryset = queryset.filter(consultation__in=Consultation.objects.filter(consultas).values('id'))
+    return queryset
+
+
+def cambios(token, limite=LIMITE_DEFAULT):
+    """
+    Cambios y bajas posteriores al token.
+
+    Cada recurso viaja en columnas ({'campos': [...], 'filas': [[...], ...]})
+    para no repetir nombres por fila; `token` es el que se manda en la
+    siguiente petición y `hay_mas` indica que algún recurso llenó el límite y
+    hay que pedir otra vez.
+    """
+    from .models import Tombstone
+
+    corte = timezone.now()
+    cursores = dict(token['cursores'])
+    respuesta = {'version': VERSION_API, 'cambios': {}, 'eliminados': {}, 'hay_mas': False}
+
+    for recurso, (_, campos, _, _) in RECURSOS.items():
+        queryset = _alcance(recurso, token)
+        cursor = cursores.get(recurso)
+        if cursor:
+            fecha, objeto_id = parse_datetime(cursor[0]), cursor[1]
+            queryset = queryset.filter(
+                Q(fecha_actualizacion__gt=fecha) | Q(fecha_actualizacion=fecha, id__gt=objeto_id)
+            )
+        filas = list(queryset.order_by('fecha_actualizacion', 'id').values_list(*campos)[:limite])
+
+        if len(filas) == limite:
+            ultima = filas[-1]
+            cursores[recurso] = [_valor(ultima[-1]), ultima[0]]
+            respuesta['hay_mas'] = True
+        else:
+            cursores[recurso] = _cursor(corte - MARGEN)
+
+        if filas:
+            respuesta['cambios'][recurso] = {
+                'campos': list(campos),
+                'filas': [[_valor(valor) for valor in fila] for fila in filas],
+            }
+
+    # Bajas: solo las de la clínica (manager), sin el alcance de doctor o fecha (el cliente ignora ids que no tiene)
+    por_modelo = {RECURSOS[recurso][0].lower(): recurso for recurso in RECURSOS}
+    bajas = Tombstone.objects.filter(modelo__in=por_modelo).order_by('fecha_eliminacion', 'id')
+    cursor = cursores.get('bajas')
+    if cursor:
+        fecha, objeto_id = parse_datetime(cursor[0]), cursor[1]
+        bajas = bajas.filter(Q(fecha_eliminacion__gt=fecha) | Q(fecha_eliminacion=fecha, id__gt=objeto_id))
+    bajas = list(bajas.values_list('id', 'modelo', 'objeto_id', 'fecha_eliminacion')[:limite])
+    if len(bajas) == limite:
+        cursores['bajas'] = _cursor(bajas[-1][3], bajas[-1][0])
+        respuesta['hay_mas'] = True
+    else:
+        cursores['bajas'] = _cursor(corte - MARGEN)
+    for _, modelo, objeto_id, _ in bajas:
+        respuesta['eliminados'].setdefault(por_modelo[modelo], []).append(objeto_id)
+
+    nuevo = {**token, 'cursores': cursores}
+    respuesta['token'] = signing.dumps(nuevo, salt=_SALT_TOKEN, compress=True)
+    return respuesta
+
+
+def _fila(objeto, campos):
+    return {campo: _valor(getattr(objeto, campo)) for campo in campos}
+
+
+def _aplicar(cambio):
+    """Aplica un cambio de la subida; devuelve el dict de resultado"""
+    # Un elemento malformado es un error de ese cambio, no del lote
+    if not isinstance(cambio, dict):
+        return {'estado': 'error', 'mensaje': 'Cada cambio debe ser un objeto'}
+    valores = cambio.get('campos') or {}
+    if not isinstance(valores, dict):
+        return {'estado': 'error', 'mensaje': '"campos" debe ser un objeto'}
+    recurso = cambio.get('recurso')
+    if not isinstance(recurso, str) or recurso not in RECURSOS:
+        return {'estado': 'error', 'mensaje': f'Recurso no válido: {recurso}'}
+    _, campos, editables, crear_eliminar = RECURSOS[recurso]
+    modelo = _modelo(recurso)
+
+    desconocidos = set(valores) - set(editables) - ({'consultation_id'} if crear_eliminar else set())
+    if desconocidos:
+        return {'estado': 'error', 'mensaje': f'Campos no editables: {", ".join(sorted(desconocidos))}'}
+
+    # Alta (solo recursos que lo permiten, p. ej. recetas)
+    if cambio.get('id') is None:
+        if not crear_eliminar:
+            return {'estado': 'error', 'mensaje': f'No se pueden crear {recurso} desde la tableta'}
+        from .models import Consultation
+        # La consulta se busca con el manager de la clínica activa
+        if not Consultation.objects.filter(id=valores.get('consultation_id')).exists():
+            return {'estado': 'error', 'mensaje': 'Consulta no encontrada'}
+        objeto = modelo(**valores)
+        objeto.full_clean()
+        objeto.save()
+        return {'estado': 'ok', 'id': objeto.pk, 'version': version(objeto.fecha_actualizacion)}
+
+    # El manager filtra por la clínica activa (recetas y expedientes, por la de su padre);
+    # solo se bloquea la fila editada, no la consulta o el paciente del join
+    objeto = modelo.objects.select_for_update(of=('self',)).filter(pk=cambio['id']).first()
+    if objeto is None:
+        return {'estado': 'no_existe', 'id': cambio['id']}
+
+    if parse_datetime(cambio.get('version') or '') != objeto.fecha_actualizacion:
+        return {'estado': 'conflicto', 'id': objeto.pk, 'actual': _fila(objeto, campos)}
+
+    if cambio.get('eliminar'):
+        if not crear_eliminar:
+            return {'estado': 'error', 'mensaje': f'No se pueden eliminar {recurso} desde la tableta'}
+        objeto.delete()
+        return {'estado': 'ok', 'id': cambio['id'], 'eliminado': True}
+
+    # El padre se fija al crear: moverlo sacaría la fila del alcance ya revisado
+    if 'consultation_id' in valores and valores['consultation_id'] != objeto.consultation_id:
+        return {'estado': 'error', 'mensaje': 'No se puede cambiar la consulta de una receta'}
+
+    for campo, valor in valores.items():
+        setattr(objeto, campo, valor)
+    objeto.clean_fields(exclude=[f.name for f in modelo._meta.fields if f.attname not in valores])
+    objeto.save(update_fields=[*valores, 'fecha_actualizacion'])
+    return {'estado': 'ok', 'id': objeto.pk, 'version': version(objeto.fecha_actualizacion)}
+
+
+def subir(cambios_cliente):
+    """
+    Aplica un lote de cambios en una sola transacción de escritura.
+
+    Cada cambio va en su propio savepoint: un conflicto o error de validación
+    no deshace los demás. Los resultados conservan el orden (y la `ref` del
+    cliente, para mapear altas a sus ids definitivos).
+    """
+    resultados = []
+    with transaction.atomic():
+        for indice, cambio in enumerate(cambios_cliente):
+            try:
+                with transaction.atomic():
+                    resultado = _aplicar(cambio)
+            except ValidationError as e:
+                resultado = {'estado': 'error', 'errores': e.message_dict if hasattr(e, 'error_dict') else e.messages}
+            except (TypeError, ValueError) as e:
+                resultado = {'estado': 'error', 'mensaje': str(e)}
+            resultado['indice'] = indice
+            if isinstance(cambio, dict) and 'ref' in cambio:
+                resultado['ref'] = cambio['ref']
+            resultados.append(resultado)
+    return resultados
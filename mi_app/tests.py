@@ -1,3 +1,723 @@
-from django.test import TestCase
+# -*- coding: utf-8 -*-
+"""
+Presupuesto de consultas SQL por vista.
 
-# Create your tests here.
+Cada URL de mi_app.urls declara en PRESUPUESTOS cuántas consultas puede
+hacer (o en SIN_MEDIR por qué no se mide), y los changelists del admin
+comparten PRESUPUESTO_ADMIN salvo excepción en PRESUPUESTOS_ADMIN. La
+prueba siembra N filas de cada cosa, mide cada URL, siembra hasta 10N y
+vuelve a medir: el conteo no puede pasar del presupuesto ni crecer con los
+datos. Al fallar, el mensaje agrupa las consultas repetidas por huella (el
+SQL sin literales), que es como se ve un N+1. Cada URL declara también el
+código que debe responder: una vista no cabe en su presupuesto por fallar.
+
+Al final, pruebas de comportamiento de lo que el presupuesto no ve:
+conciliación, montos de reclamaciones, descargas por Range y lectura del
+archivo.
+
+    python manage.py test mi_app
+"""
+import io
+import json
+import re
+import shutil
+import tempfile
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import count
+from types import SimpleNamespace
+from typing import Callable, NamedTuple, Optional
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from . import urls as urls_app
+from .adjuntos import crear_adjunto, generar_derivados, recibir_flujo
+from .archivo import archivar, consulta_archivada, consultas_archivadas, fecha_corte
+from .conciliacion import EstadoCuentaInvalido, conciliar, excepciones
+from .duplicados import fusionar_pacientes
+from .laboratorio import registrar
+from .reclamaciones import generar_lotes, mes_anterior
+from .sincronizacion import version
+from .models import (
+    AppointmentSeries, BankStatement, CashClose, ClaimBatch, Clinic, ClinicalNote, ConceptoFactura, Consultation,
+    DuplicateCandidate, Doctor, Drug, DrugInteraction, InsuranceClaim, Invoice, LabResult, Patient, Payment,
+    Prescription, StatementLine,
+)
+
+N = 3
+
+
+class Presupuesto(NamedTuple):
+    consultas: int
+    # datos -> argumentos de la URL
+    kwargs: Optional[Callable] = None
+    query: str = ''
+    # datos -> cuerpo del POST; sin él se mide un GET
+    post: Optional[Callable] = None
+    # Código esperado: que una vista quepa en su presupuesto porque responde 404 no cuenta
+    estado: int = 200
+
+
+def _paciente(d):
+    return {'paciente_id': d.paciente.id}
+
+
+def _patient(d):
+    return {'patient_id': d.paciente.id}
+
+
+def _consulta(d):
+    return {'consulta_id': d.consulta.id}
+
+
+PRESUPUESTOS = {
+    'login': Presupuesto(3, estado=302),
+    'dashboard': Presupuesto(25),
+    'perfil_usuario': Presupuesto(4),
+    'lista_pacientes': Presupuesto(6),
+    'nuevo_paciente': Presupuesto(3),
+    'detalle_paciente': Presupuesto(24, _paciente),
+    'tendencia_signos_vitales': Presupuesto(5, _paciente),
+    'nueva_consulta': Presupuesto(5),
+    'editar_consulta': Presupuesto(8, lambda d: {'consulta_id': d.cita.id}),
+    'cancelar_consulta': Presupuesto(19, lambda d: {'consulta_id': d.programada.id}, post=lambda d: {}, estado=302),
+    'busqueda_clinica': Presupuesto(6, query='q=gripe'),
+    'detalle_consulta': Presupuesto(4, _consulta),
+    'agenda_consultas': Presupuesto(10),
+    'calendario_consultas': Presupuesto(6),
+    'calendario_enlace': Presupuesto(5),
+    'calendario_ics': Presupuesto(6, lambda d: {'token': d.doctor.token_calendario}),
+    'adjuntos_paciente': Presupuesto(4, _patient),
+    'descargar_adjunto': Presupuesto(4, lambda d: {'adjunto_id': d.adjunto.id}),
+    'derivado_adjunto': Presupuesto(4, lambda d: {'adjunto_id': d.imagen.id, 'tipo': 'miniatura'}),
+    'eliminar_adjunto': Presupuesto(14, lambda d: {'adjunto_id': d.ultimo_adjunto.id}, post=lambda d: {}),
+    'reportes_laboratorio': Presupuesto(4),
+    'reporte_laboratorio': Presupuesto(5, lambda d: {'reporte_id': d.reporte.id}),
+    'resultados_laboratorio_paciente': Presupuesto(4, _patient),
+    'autocompletar_medicamentos': Presupuesto(6, query='q=para'),
+    'verificar_interacciones': Presupuesto(7, _patient, query='texto=ibuprofeno'),
+    'crear_receta': Presupuesto(23, _consulta, post=lambda d: {
+        'medicamento': 'Paracetamol 500 mg', 'dosis': '1 tableta', 'frecuencia': 'cada 8 horas',
+        'duracion': '3 días', 'confirmar': '1',
+    }, estado=201),
+    'agenda_eventos_poll': Presupuesto(7),
+    'lista_usuarios': Presupuesto(5),
+    'nuevo_usuario': Presupuesto(3),
+    'editar_usuario': Presupuesto(5, lambda d: {'user_id': d.usuario.id}),
+    'registrar_pago': Presupuesto(7, _consulta),
+    'lista_pagos': Presupuesto(5),
+    'generar_factura': Presupuesto(7, lambda d: {'pago_id': d.pago_sin_factura.id}),
+    'excepciones_conciliacion': Presupuesto(6, lambda d: {'estado_cuenta_id': d.estado_cuenta.id}),
+    'corte_caja': Presupuesto(5),
+    'archivo_lote_reclamaciones': Presupuesto(5, lambda d: {'lote_id': d.lote.id}),
+    'detalle_factura': Presupuesto(9, lambda d: {'factura_id': d.factura.id}),
+    'analitica_diagnosticos': Presupuesto(4),
+    'analitica_medicamento_pacientes': Presupuesto(4, query='medicamento=paracetamol'),
+    'analitica_cohortes': Presupuesto(4),
+    'sincronizacion_cambios': Presupuesto(8),
+}
+
+SIN_MEDIR = {
+    'logout': 'cierra la sesión del cliente de prueba',
+    'agenda_eventos': 'SSE: la respuesta no termina',
+    'eliminar_usuario': 'borra al usuario y sus datos relacionados en cascada',
+    'reprogramar_dia': 'mueve la agenda del día que miden las demás vistas',
+    'cancelar_dia': 'cancela la agenda del día que miden las demás vistas',
+    'cancelar_serie': 'cancela la agenda que miden las demás vistas',
+    'conciliar_estado_cuenta': 'importa un archivo del banco',
+    'cerrar_corte_caja': 'solo una vez por día',
+    'generar_reclamaciones': 'solo una vez por periodo',
+    'actualizar_lote_reclamaciones': 'importa la respuesta de la aseguradora',
+    'sincronizacion_subir': 'aplica cambios de una tableta',
+    'subir_adjunto': 'subida en streaming (escribe archivos)',
+    'subir_reporte_laboratorio': 'subida en streaming (escribe archivos y encola la extracción)',
+    'vincular_reporte_laboratorio': 'cambia el paciente del reporte que miden las demás vistas',
+}
+
+PRESUPUESTO_ADMIN = 7
+PRESUPUESTOS_ADMIN = {
+    'mi_app.tombstone': 8,
+    'mi_app.archivedconsultation': 8,
+}
+
+
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LISTAS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+def huella(sql):
+    """SQL sin literales ni listas IN: las repeticiones de un N+1 comparten huella"""
+    return _LISTAS.sub('(...)', _LITERALES.sub('?', sql))
+
+
+def repetidas(consultas):
+    """Huellas que se ejecutaron más de una vez, de la más repetida a la menos"""
+    conteo = Counter(huella(consulta['sql']) for consulta in consultas)
+    return [(sql, veces) for sql, veces in conteo.most_common() if veces > 1]
+
+
+def _recortar(sql, largo=300):
+    # Principio (tabla) y final (WHERE) de la consulta
+    return sql if len(sql) <= largo else f'{sql[:largo // 3]} … {sql[-2 * largo // 3:]}'
+
+
+class Sembrador:
+    """Datos de prueba que crecen con N alrededor de unos objetos fijos (los que miden las vistas de detalle)"""
+
+    def __init__(self):
+        self.creados = 0
+        ahora = timezone.now()
+        self.datos = d = SimpleNamespace()
+        d.usuario = User.objects.create_superuser('admin', 'admin@example.com', 'x')
+        d.doctor = Doctor.objects.create(
+            nombres='Ana', apellidos='Ruiz', cedula_profesional='C0', especialidad='General',
+            telefono='5550000000', email='ana@example.com', token_calendario='token-prueba', usuario=d.usuario,
+        )
+        d.paciente = self._paciente(0)
+        d.consulta = Consultation.objects.create(
+            patient=d.paciente, doctor=d.doctor, fecha_consulta=ahora - timedelta(days=1),
+            tipo_consulta='general', motivo='Dolor', estado='completada',
+            diagnostico='Gripe', tratamiento='Reposo', temperatura=Decimal('37.5'),
+        )
+        d.pago = Payment.objects.create(consultation=d.consulta, monto_total=Decimal('500'), metodo_pago='efectivo', estado='pagado')
+        d.factura = self._factura(d.pago)
+        d.pago_sin_factura = Payment.objects.create(
+            consultation=d.consulta, monto_total=Decimal('200'), metodo_pago='tarjeta', estado='pagado',
+        )
+        d.cita = Consultation.objects.create(
+            patient=d.paciente, doctor=d.doctor, fecha_consulta=ahora + timedelta(days=1),
+            tipo_consulta='seguimiento', motivo='Revisión', estado='programada',
+        )
+        d.serie = AppointmentSeries.objects.create(
+            patient=d.paciente, doctor=d.doctor, motivo='Control', fecha_inicio=ahora,
+        )
+        d.estado_cuenta = BankStatement.objects.create(
+            archivo='estado.csv', origen='banco', huella='h0',
+            desde=timezone.localdate() - timedelta(days=30), hasta=timezone.localdate(),
+        )
+        d.lote = ClaimBatch.objects.create(
+            clave_aseguradora='acme', aseguradora='ACME', periodo=timezone.localdate().replace(day=1),
+        )
+        CashClose.objects.create(fecha=timezone.localdate() - timedelta(days=1))
+        d.adjunto = self._adjunto(0)
+        d.imagen = self._imagen()
+        d.reporte, _ = registrar(recibir_flujo(io.BytesIO(b'%PDF-1.4 reporte 0'), 'reporte.pdf'), 'carpeta')
+        d.reporte.patient = d.paciente
+        d.reporte.save()
+
+    def _paciente(self, i):
+        return Patient.objects.create(
+            nombres=f'Paciente{i}', apellidos=f'Prueba{i}', fecha_nacimiento=timezone.localdate() - timedelta(days=365 * 30 + i),
+            genero='femenino', estado_civil='soltero', tipo_sangre='O+', telefono_principal=f'555{i:07d}',
+            seguro_medico='ACME', numero_poliza=f'P{i}',
+        )
+
+    def _factura(self, pago):
+        factura = Invoice.objects.create(
+            payment=pago, folio=f'F-{pago.id}', cliente_nombre='Cliente', subtotal=Decimal('431.03'),
+            iva=Decimal('68.97'), total=Decimal('500'),
+        )
+        ConceptoFactura.objects.create(factura=factura, descripcion='Consulta', precio_unitario=Decimal('431.03'), importe=Decimal('431.03'))
+        return factura
+
+    def _adjunto(self, i):
+        recibido = recibir_flujo(io.BytesIO(f'nota {i}'.encode()), f'nota{i}.txt')
+        return crear_adjunto(self.datos.paciente.id, recibido)[0]
+
+    def _imagen(self):
+        """Adjunto PNG con su miniatura ya generada (en la prueba no hay commit que la encole)"""
+        from PIL import Image
+
+        contenido = io.BytesIO()
+        Image.new('RGB', (64, 48), 'white').save(contenido, 'PNG')
+        contenido.seek(0)
+        adjunto = crear_adjunto(self.datos.paciente.id, recibir_flujo(contenido, 'imagen.png'))[0]
+        generar_derivados(adjunto.blob_id)
+        return adjunto
+
+    def agregar(self, n):
+        """n más de cada cosa: pacientes, doctores, usuarios y consultas con sus pagos, y detalle de los objetos fijos"""
+        d = self.datos
+        ahora = timezone.now()
+        for i in range(self.creados + 1, self.creados + n + 1):
+            User.objects.create_user(f'usuario{i}', f'u{i}@example.com', 'x')
+            doctor = Doctor.objects.create(
+                nombres=f'Doctor{i}', apellidos=f'Apellido{i}', cedula_profesional=f'C{i}',
+                especialidad='General', telefono='5550000000', email=f'd{i}@example.com',
+            )
+            paciente = self._paciente(i)
+            for dueno in (paciente, d.paciente):
+                consulta = Consultation.objects.create(
+                    patient=dueno, doctor=doctor, fecha_consulta=ahora - timedelta(days=i, hours=1),
+                    tipo_consulta='general', motivo='Control', estado='completada',
+                    diagnostico='Gripe; Hipertensión', tratamiento='Paracetamol',
+                    peso_consulta=Decimal('70.5'), temperatura=Decimal('37.0'),
+                )
+                Prescription.objects.create(
+                    consultation=consulta, medicamento='Paracetamol', dosis='500 mg',
+                    frecuencia='cada 8 horas', duracion='5 días',
+                )
+                pago = Payment.objects.create(consultation=consulta, monto_total=Decimal('500'), metodo_pago='transferencia', estado='pagado')
+                self._factura(pago)
+                InsuranceClaim.objects.create(
+                    batch=d.lote, consultation=consulta, patient_id_reclamado=dueno.id, paciente=str(dueno),
+                    numero_poliza=dueno.numero_poliza, fecha_consulta=consulta.fecha_consulta,
+                    tipo_consulta='general', monto=Decimal('500'),
+                )
+                StatementLine.objects.create(
+                    statement=d.estado_cuenta, linea=pago.id, fecha=timezone.localdate(), monto=Decimal('500'),
+                    estado='sin_pago',
+                )
+            d.programada = Consultation.objects.create(
+                patient=paciente, doctor=d.doctor if i % 2 else doctor, serie=d.serie,
+                fecha_consulta=ahora + timedelta(minutes=10 * i), tipo_consulta='seguimiento',
+                motivo='Revisión', estado='programada',
+            )
+            # Consulta antigua del paciente fijo, que termina en el archivo
+            Consultation.objects.create(
+                patient=d.paciente, doctor=doctor, fecha_consulta=ahora - timedelta(days=365 * 7 + i),
+                tipo_consulta='general', motivo='Antigua', estado='completada', diagnostico='Gripe',
+            )
+            Prescription.objects.create(
+                consultation=d.consulta, medicamento=f'Medicamento {i}', dosis='1', frecuencia='diaria', duracion='30 días',
+            )
+            Drug.objects.create(
+                clave=f'M{i}', nombre=f'Paracetamol {i}', nombre_normalizado=f'paracetamol {i}',
+                principios_activos='paracetamol', concentracion='500 mg',
+            )
+            DrugInteraction.objects.create(principio_a=f'principio{i}', principio_b='paracetamol', severidad='moderada')
+            LabResult.objects.create(reporte=d.reporte, analito=f'analito{i}', nombre=f'Analito {i}', valor=Decimal('1.5'))
+            d.ultimo_adjunto = self._adjunto(i)
+        self.creados += n
+        archivar(fecha_corte())
+
+
+class AlmacenTemporalTestCase(TestCase):
+    """Los adjuntos de la prueba van a un directorio temporal que se borra al final"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.adjuntos = tempfile.mkdtemp()
+        cls._ajustes = override_settings(ADJUNTOS_ROOT=cls.adjuntos, PERFILADO_ACTIVO=False)
+        cls._ajustes.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._ajustes.disable()
+        shutil.rmtree(cls.adjuntos, ignore_errors=True)
+
+
+class PresupuestoConsultasTest(AlmacenTemporalTestCase):
+    """Cada vista cabe en su presupuesto de consultas con N y con 10N filas"""
+
+    def _medir(self, url, post=None, estado=200):
+        cache.clear()
+        # Lo que corre al confirmar (p. ej. los eventos de la agenda) también cuenta
+        with CaptureQueriesContext(connection) as capturadas, self.captureOnCommitCallbacks(execute=True):
+            respuesta = self.client.post(url, post) if post is not None else self.client.get(url)
+            if respuesta.streaming:
+                b''.join(respuesta.streaming_content)
+        self.assertEqual(respuesta.status_code, estado, url)
+        return capturadas.captured_queries
+
+    def _urls(self, datos):
+        """[(nombre, url, cuerpo del POST o None, presupuesto, código esperado)]"""
+        urls = []
+        for nombre, presupuesto in PRESUPUESTOS.items():
+            url = reverse(nombre, kwargs=presupuesto.kwargs(datos) if presupuesto.kwargs else None)
+            if presupuesto.query:
+                url += '?' + presupuesto.query
+            post = presupuesto.post(datos) if presupuesto.post else None
+            urls.append((nombre, url, post, presupuesto.consultas, presupuesto.estado))
+        for modelo in admin.site._registry:
+            nombre = f'{modelo._meta.app_label}.{modelo._meta.model_name}'
+            url = reverse(f'admin:{modelo._meta.app_label}_{modelo._meta.model_name}_changelist')
+            urls.append((f'admin {nombre}', url, None, PRESUPUESTOS_ADMIN.get(nombre, PRESUPUESTO_ADMIN), 200))
+        return urls
+
+    def test_todas_las_urls_tienen_presupuesto(self):
+        nombres = {patron.name for patron in urls_app.urlpatterns if isinstance(patron, URLPattern)}
+        self.assertEqual(nombres - set(PRESUPUESTOS) - set(SIN_MEDIR), set(), 'URLs sin presupuesto en PRESUPUESTOS')
+        self.assertEqual((set(PRESUPUESTOS) | set(SIN_MEDIR)) - nombres, set(), 'Presupuestos de URLs que ya no existen')
+
+    def test_consultas_no_crecen_con_los_datos(self):
+        sembrador = Sembrador()
+        self.client.force_login(sembrador.datos.usuario)
+
+        sembrador.agregar(N)
+        con_n = {nombre: len(self._medir(url, post, estado)) for nombre, url, post, _, estado in self._urls(sembrador.datos)}
+
+        sembrador.agregar(9 * N)
+        for nombre, url, post, presupuesto, estado in self._urls(sembrador.datos):
+            consultas = self._medir(url, post, estado)
+            with self.subTest(vista=nombre):
+                detalle = '\n'.join(f'  {veces}x {_recortar(sql)}' for sql, veces in repetidas(consultas)[:5])
+                self.assertLessEqual(
+                    len(consultas), con_n[nombre],
+                    f'{url}: {len(consultas)} consultas con {10 * N} filas contra {con_n[nombre]} con {N}\n{detalle}',
+                )
+                self.assertLessEqual(
+                    len(consultas), presupuesto,
+                    f'{url}: {len(consultas)} consultas, presupuesto {presupuesto}\n{detalle}',
+                )
+
+
+# ---------- Comportamiento ----------
+
+def _a_las(dia, hora=12):
+    return timezone.make_aware(datetime.combine(dia, time(hora)))
+
+
+_atenciones = count(1)
+
+
+def _atencion(seguro='', poliza='', fecha=None):
+    """(paciente, consulta) con un doctor nuevo"""
+    contador = next(_atenciones)
+    doctor = Doctor.objects.create(
+        nombres='Luis', apellidos=f'Mora{contador}', cedula_profesional=f'X{contador}', especialidad='General',
+        telefono='5550000000', email=f'luis{contador}@example.com',
+    )
+    paciente = Patient.objects.create(
+        nombres='Eva', apellidos=f'Soto{contador}', fecha_nacimiento=date(1990, 1, 1), genero='femenino',
+        estado_civil='soltero', tipo_sangre='O+', telefono_principal=f'556{contador:07d}',
+        seguro_medico=seguro, numero_poliza=poliza,
+    )
+    consulta = Consultation.objects.create(
+        patient=paciente, doctor=doctor, fecha_consulta=fecha or timezone.now() - timedelta(days=1),
+        tipo_consulta='general', motivo='Dolor de cabeza', estado='completada', diagnostico='Migraña',
+    )
+    return paciente, consulta
+
+
+class ConciliacionTest(TestCase):
+    """Cada movimiento del estado de cuenta termina con el pago y el estado que le tocan"""
+
+    def test_movimientos(self):
+        dia = timezone.localdate() - timedelta(days=5)
+        _, consulta = _atencion()
+
+        def pago(monto, metodo='transferencia', referencia='', desfase=0):
+            return Payment.objects.create(
+                consultation=consulta, monto_total=monto, monto_pagado=monto, metodo_pago=metodo,
+                estado='pagado', referencia=referencia, fecha_pago=_a_las(dia + timedelta(days=desfase)),
+            )
+
+        por_referencia = pago(Decimal('500.00'), referencia='ABC123')
+        por_monto = pago(Decimal('300.00'), desfase=-1)
+        otro_monto = pago(Decimal('200.00'), referencia='ZZZ999')
+        tarjeta = pago(Decimal('750.00'), metodo='tarjeta')
+        fecha = dia.strftime('%d/%m/%Y')
+        archivo = io.BytesIO('\n'.join([
+            'Fecha,Concepto,Referencia,Abono',
+            f'{fecha},SPEI RECIBIDO,abc-123,"$500.00"',
+            f'{fecha},SPEI RECIBIDO,abc-123,"$500.00"',
+            f'{fecha},DEPOSITO,,300.00',
+            f'{fecha},SPEI RECIBIDO,ZZZ999,250.00',
+            f'{fecha},TERMINAL,,750.00',
+            f'{fecha},COMISION,,(15.00)',
+        ]).encode())
+
+        estado_cuenta = conciliar(archivo, 'estado.csv', 'banco')
+
+        lineas = dict(estado_cuenta.movimientos.values_list('linea', 'estado'))
+        pagos = dict(estado_cuenta.movimientos.values_list('linea', 'payment_id'))
+        self.assertEqual(lineas, {2: 'conciliada', 3: 'duplicada', 4: 'conciliada', 5: 'monto_distinto', 6: 'sin_pago'})
+        self.assertEqual(pagos, {2: por_referencia.id, 3: None, 4: por_monto.id, 5: otro_monto.id, 6: None})
+        self.assertEqual((estado_cuenta.lineas, estado_cuenta.conciliadas, estado_cuenta.excepciones), (5, 2, 3))
+        conciliados = set(Payment.objects.filter(fecha_conciliacion__isnull=False).values_list('id', flat=True))
+        self.assertEqual(conciliados, {por_referencia.id, por_monto.id})
+        self.assertEqual(
+            [fila['id'] for fila in excepciones(estado_cuenta)['pagos_sin_movimiento']], [otro_monto.id],
+        )
+        self.assertNotIn(tarjeta.id, conciliados)
+
+        archivo.seek(0)
+        with self.assertRaisesMessage(EstadoCuentaInvalido, 'ya fue importado'):
+            conciliar(archivo, 'estado.csv', 'banco')
+
+
+class ReclamacionesTest(TestCase):
+    """El monto reclamado sale de la factura vigente o del pago menos descuento"""
+
+    def test_montos(self):
+        periodo = mes_anterior()
+        fecha = _a_las(periodo.replace(day=10))
+        _, consulta = _atencion('Médica Sur', 'P-1', fecha)
+        con_descuento = Payment.objects.create(
+            consultation=consulta, monto_total=Decimal('1000.00'), descuento=Decimal('100.00'),
+            metodo_pago='efectivo', estado='pagado',
+        )
+        facturado = Payment.objects.create(consultation=consulta, monto_total=Decimal('1000.00'), metodo_pago='tarjeta', estado='pagado')
+        Invoice.objects.create(
+            payment=facturado, folio='F-100', cliente_nombre='Eva', subtotal=Decimal('1000.00'),
+            iva=Decimal('160.00'), total=Decimal('1160.00'),
+        )
+        Payment.objects.create(consultation=consulta, monto_total=Decimal('999.00'), metodo_pago='efectivo', estado='cancelado')
+        _, otra = _atencion('MEDICA SUR', 'P-2', fecha)
+        sin_factura = Payment.objects.create(consultation=otra, monto_total=Decimal('400.00'), metodo_pago='efectivo', estado='pagado')
+        _atencion('Médica Sur', 'P-3', fecha)
+        _, sin_poliza = _atencion('Médica Sur', '', fecha)
+        Payment.objects.create(consultation=sin_poliza, monto_total=Decimal('400.00'), metodo_pago='efectivo', estado='pagado')
+        _, fuera = _atencion('Médica Sur', 'P-4', _a_las(periodo - timedelta(days=1)))
+        Payment.objects.create(consultation=fuera, monto_total=Decimal('400.00'), metodo_pago='efectivo', estado='pagado')
+
+        lotes, omitidas = generar_lotes(periodo)
+
+        self.assertEqual(omitidas, {'sin_poliza': 1, 'sin_pago': 1})
+        self.assertEqual(len(lotes), 1)
+        lote = lotes[0]
+        self.assertEqual((lote.clave_aseguradora, lote.reclamaciones, lote.monto_reclamado), ('medica sur', 2, Decimal('2460.00')))
+        self.assertEqual(
+            list(InsuranceClaim.objects.filter(batch=lote).order_by('numero_poliza').values_list(
+                'consultation_id', 'numero_poliza', 'payment_id', 'folio_factura', 'monto',
+            )),
+            [
+                (consulta.id, 'P-1', con_descuento.id, 'F-100', Decimal('2060.00')),
+                (otra.id, 'P-2', sin_factura.id, '', Decimal('400.00')),
+            ],
+        )
+        # Lo ya reclamado no se vuelve a reclamar
+        self.assertEqual(generar_lotes(periodo)[0], [])
+
+
+class RangoAdjuntoTest(AlmacenTemporalTestCase):
+    """Descarga de adjuntos por tramos: 206, 416 e If-Range"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        paciente, _ = _atencion()
+        self.adjunto = crear_adjunto(paciente.id, recibir_flujo(io.BytesIO(b'0123456789'), 'numeros.txt'))[0]
+        self.url = reverse('descargar_adjunto', kwargs={'adjunto_id': self.adjunto.id})
+
+    def _pedir(self, **encabezados):
+        respuesta = self.client.get(self.url, headers=encabezados)
+        return respuesta, b''.join(respuesta.streaming_content) if respuesta.streaming else respuesta.content
+
+    def test_completo(self):
+        respuesta, contenido = self._pedir()
+        self.assertEqual((respuesta.status_code, contenido), (200, b'0123456789'))
+        self.assertEqual(respuesta['Accept-Ranges'], 'bytes')
+
+    def test_tramos(self):
+        for rango, esperado, content_range in (
+            ('bytes=2-5', b'2345', 'bytes 2-5/10'),
+            ('bytes=7-', b'789', 'bytes 7-9/10'),
+            ('bytes=-3', b'789', 'bytes 7-9/10'),
+            ('bytes=8-50', b'89', 'bytes 8-9/10'),
+        ):
+            with self.subTest(rango=rango):
+                respuesta, contenido = self._pedir(Range=rango)
+                self.assertEqual((respuesta.status_code, contenido), (206, esperado))
+                self.assertEqual(respuesta['Content-Range'], content_range)
+                self.assertEqual(respuesta['Content-Length'], str(len(esperado)))
+
+    def test_fuera_del_archivo(self):
+        for rango in ('bytes=10-', 'bytes=5-2', 'bytes=-0'):
+            with self.subTest(rango=rango):
+                respuesta, _ = self._pedir(Range=rango)
+                self.assertEqual(respuesta.status_code, 416)
+                self.assertEqual(respuesta['Content-Range'], 'bytes */10')
+
+    def test_if_range(self):
+        etag = self._pedir()[0]['ETag']
+        respuesta, contenido = self._pedir(Range='bytes=0-1', **{'If-Range': etag})
+        self.assertEqual((respuesta.status_code, contenido), (206, b'01'))
+        # Otra versión: el rango no vale y va el archivo completo
+        respuesta, contenido = self._pedir(Range='bytes=0-1', **{'If-Range': '"otra"'})
+        self.assertEqual((respuesta.status_code, contenido), (200, b'0123456789'))
+        self.assertEqual(self._pedir(**{'If-None-Match': etag})[0].status_code, 304)
+
+
+class ArchivoTest(TestCase):
+    """Lo archivado sale de las tablas calientes y se sigue leyendo igual"""
+
+    def test_lectura_transparente(self):
+        paciente, antigua = _atencion(fecha=timezone.now() - timedelta(days=365 * 7))
+        Prescription.objects.create(
+            consultation=antigua, medicamento='Sumatriptán', dosis='50 mg', frecuencia='cada 12 horas', duracion='3 días',
+        )
+        pago = Payment.objects.create(consultation=antigua, monto_total=Decimal('650.00'), metodo_pago='efectivo', estado='pagado')
+        _, por_cobrar = _atencion(fecha=timezone.now() - timedelta(days=365 * 7))
+        Payment.objects.create(consultation=por_cobrar, monto_total=Decimal('650.00'), metodo_pago='efectivo', estado='pendiente')
+
+        totales = archivar(fecha_corte())
+
+        self.assertEqual(totales['consultas'], 1)
+        self.assertFalse(Consultation.objects.filter(id=antigua.id).exists())
+        self.assertFalse(Prescription.objects.filter(consultation_id=antigua.id).exists())
+        self.assertTrue(Consultation.objects.filter(id=por_cobrar.id).exists())
+
+        consulta = consulta_archivada(antigua.id)
+        self.assertTrue(consulta.archivada)
+        self.assertEqual((consulta.id, consulta.patient_id, consulta.diagnostico), (antigua.id, paciente.id, 'Migraña'))
+        self.assertEqual([receta.medicamento for receta in consulta.recetas], ['Sumatriptán'])
+        self.assertEqual([(p.id, p.monto_total) for p in consulta.pagos_archivados], [(pago.id, Decimal('650.00'))])
+        self.assertEqual([c.id for c in consultas_archivadas(paciente)], [antigua.id])
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        respuesta = self.client.get(reverse('detalle_consulta', kwargs={'consulta_id': antigua.id}))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.context['archivada'])
+        self.assertContains(respuesta, 'Consulta archivada')
+        self.assertContains(respuesta, 'Migraña')
+        # De solo lectura
+        respuesta = self.client.post(reverse('detalle_consulta', kwargs={'consulta_id': antigua.id}), {'diagnostico': 'Otro'})
+        self.assertRedirects(respuesta, reverse('detalle_consulta', kwargs={'consulta_id': antigua.id}), fetch_redirect_response=False)
+        self.assertEqual(consulta_archivada(antigua.id).diagnostico, 'Migraña')
+
+
+class AgendaDoctorSinLigarTest(TestCase):
+    """Un perfil de doctor sin Doctor ligado no ve la agenda de los demás"""
+
+    def setUp(self):
+        _atencion(fecha=timezone.now())
+
+    def _usuario(self, nombre, rol, superusuario=False):
+        crear = User.objects.create_superuser if superusuario else User.objects.create_user
+        usuario = crear(nombre, f'{nombre}@example.com', 'x')
+        usuario.profile.rol = rol
+        usuario.profile.save()
+        self.client.force_login(usuario)
+
+    def test_doctor_sin_ligar(self):
+        self._usuario('dra', 'doctor')
+        self.assertEqual(self.client.get(reverse('agenda_consultas')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('agenda_eventos_poll'), {'desde': 0, 'espera': 0}).status_code, 403)
+        self.assertEqual(self.client.get(reverse('calendario_enlace')).status_code, 403)
+
+    def test_otros_roles(self):
+        self._usuario('recepcion', 'recepcionista')
+        self.assertEqual(self.client.get(reverse('agenda_consultas')).status_code, 200)
+        self._usuario('admin', 'doctor', superusuario=True)
+        respuesta = self.client.get(reverse('agenda_consultas'))
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertTrue(respuesta.context['agenda_doctores'])
+
+
+class SincronizacionSubirTest(TestCase):
+    """Un cambio malformado se rechaza solo, sin tumbar el lote"""
+
+    def test_cambios_malformados(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        paciente, _ = _atencion()
+        paciente.refresh_from_db()
+        valido = {
+            'recurso': 'pacientes', 'id': paciente.id, 'version': version(paciente.fecha_actualizacion),
+            'campos': {'alergias': 'Penicilina'}, 'ref': 'r3',
+        }
+        cambios = [5, {'recurso': 'pacientes', 'id': paciente.id, 'campos': ['alergias']}, {'recurso': ['pacientes']}, valido]
+
+        respuesta = self.client.post(reverse('sincronizacion_subir'), json.dumps({'cambios': cambios}), content_type='application/json')
+
+        self.assertEqual(respuesta.status_code, 200)
+        resultados = respuesta.json()['resultados']
+        self.assertEqual([r['estado'] for r in resultados], ['error', 'error', 'error', 'ok'])
+        self.assertEqual(resultados[3]['ref'], 'r3')
+        paciente.refresh_from_db()
+        self.assertEqual(paciente.alergias, 'Penicilina')
+
+
+class FusionPacientesTest(TestCase):
+    """La fusión conserva todo lo del duplicado sin pisar lo que ya tiene el paciente"""
+
+    def test_fusion(self):
+        conservar, propia = _atencion()
+        duplicado, ajena = _atencion()
+        Patient.objects.filter(pk=duplicado.pk).update(
+            activo=False, telefono_alternativo='5551234567', alergias='Penicilina',
+        )
+        duplicado.refresh_from_db()
+        self.assertTrue(ClinicalNote.objects.filter(consultation=ajena).exists())
+
+        fusionar_pacientes(conservar, duplicado)
+
+        conservar.refresh_from_db()
+        self.assertFalse(Patient.objects.filter(pk=duplicado.pk).exists())
+        self.assertEqual(set(Consultation.objects.filter(patient=conservar).values_list('id', flat=True)), {propia.id, ajena.id})
+        # Las notas del duplicado siguen en el índice de búsqueda, ahora del paciente conservado
+        self.assertEqual(
+            set(ClinicalNote.objects.filter(patient=conservar).values_list('consultation_id', flat=True)), {propia.id, ajena.id},
+        )
+        self.assertTrue(conservar.activo)
+        self.assertEqual((conservar.telefono_alternativo, conservar.alergias), ('5551234567', 'Penicilina'))
+
+    def test_no_pisa_banderas(self):
+        conservar, _ = _atencion()
+        duplicado, _ = _atencion()
+        Patient.objects.filter(pk=conservar.pk).update(activo=False)
+        conservar.refresh_from_db()
+
+        fusionar_pacientes(conservar, duplicado)
+
+        conservar.refresh_from_db()
+        self.assertFalse(conservar.activo)
+
+
+class DuplicadosClinicaTest(TestCase):
+    """Los duplicados se buscan y se fusionan solo dentro de una clínica"""
+
+    def _paciente(self, clinica):
+        return Patient.objects.create(
+            nombres='María', apellidos='González', fecha_nacimiento=date(1985, 3, 14), genero='femenino',
+            estado_civil='casado', tipo_sangre='A+', telefono_principal='5551112222', clinic=clinica,
+        )
+
+    def setUp(self):
+        self.norte = Clinic.objects.create(nombre='Norte', clave='norte')
+        self.sur = Clinic.objects.create(nombre='Sur', clave='sur')
+
+    def test_bloques_por_clinica(self):
+        primera = self._paciente(self.norte)
+        self._paciente(self.sur)
+        self.assertFalse(DuplicateCandidate.objects.exists())
+
+        segunda = self._paciente(self.norte)
+
+        self.assertEqual(
+            list(DuplicateCandidate.objects.values_list('paciente_a_id', 'paciente_b_id')), [(primera.id, segunda.id)],
+        )
+
+    def test_fusion_entre_clinicas(self):
+        conservar, duplicado = self._paciente(self.norte), self._paciente(self.sur)
+
+        with self.assertRaises(ValueError):
+            fusionar_pacientes(conservar, duplicado)
+        self.assertTrue(Patient.objects.filter(pk=duplicado.pk).exists())
+
+
+class NuevoPacienteTest(TestCase):
+    """El alta desde el formulario crea al paciente y avisa de posibles duplicados"""
+
+    def test_alta_con_posible_duplicado(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'x'))
+        existente = Patient.objects.create(
+            nombres='María', apellidos='González', fecha_nacimiento=date(1985, 3, 14), genero='femenino',
+            estado_civil='casado', tipo_sangre='A+', telefono_principal='5551112222',
+        )
+
+        respuesta = self.client.post(reverse('nuevo_paciente'), {
+            'nombres': 'Maria', 'apellidos': 'Gonzales', 'fecha_nacimiento': '1985-03-14', 'genero': 'femenino',
+            'estado_civil': 'casado', 'tipo_sangre': 'A+', 'telefono_principal': '(555) 111-2222',
+            'direccion': 'Av. Juárez 10, Centro', 'emergencia_nombre': 'Juan', 'emergencia_parentesco': 'Esposo',
+            'emergencia_telefono': '5553334444', 'alergias': 'Penicilina',
+        }, follow=True)
+
+        nuevo = Patient.objects.exclude(pk=existente.pk).get()
+        self.assertRedirects(respuesta, reverse('detalle_paciente', kwargs={'paciente_id': nuevo.id}))
+        self.assertEqual(
+            (nuevo.telefono_principal, nuevo.calle, nuevo.ciudad, nuevo.alergias),
+            ('(555) 111-2222', 'Av. Juárez 10, Centro', 'Sin especificar', 'Penicilina'),
+        )
+        avisos = [str(m) for m in respuesta.context['messages']]
+        self.assertTrue(any(aviso.startswith(f'Posible duplicado de #{existente.id:04d}') for aviso in avisos), avisos)
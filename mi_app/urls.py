@@ -17,14 +17,36 @@ urlpatterns = [
     path('pacientes/', views.lista_pacientes, name='lista_pacientes'),
     path('pacientes/nuevo/', views.nuevo_paciente, name='nuevo_paciente'),
     path('pacientes/<int:paciente_id>/', views.detalle_paciente, name='detalle_paciente'),
+    path('pacientes/<int:paciente_id>/signos-vitales/', views.tendencia_signos_vitales, name='tendencia_signos_vitales'),
     
     # Consultas - ORDEN IMPORTANTE: Las rutas específicas ANTES de las genéricas
     path('consultas/nueva/', views.nueva_consulta, name='nueva_consulta'),
     path('consultas/<int:consulta_id>/editar/', views.editar_consulta, name='editar_consulta'),
     path('consultas/<int:consulta_id>/cancelar/', views.cancelar_consulta, name='cancelar_consulta'),
+    path('consultas/buscar/', views.busqueda_clinica, name='busqueda_clinica'),
+    path('consultas/reprogramar-dia/', views.reprogramar_dia, name='reprogramar_dia'),
+    path('consultas/cancelar-dia/', views.cancelar_dia, name='cancelar_dia'),
+    path('consultas/series/<int:serie_id>/cancelar/', views.cancelar_serie, name='cancelar_serie'),
     path('consultas/<int:consulta_id>/', views.detalle_consulta, name='detalle_consulta'),
     path('consultas/', views.agenda_consultas, name='agenda_consultas'),
     path('consultas/calendario/', views.calendario_consultas, name='calendario_consultas'),
+    path('calendario/enlace/', views.calendario_enlace, name='calendario_enlace'),
+    path('calendario/<str:token>.ics', views.calendario_ics, name='calendario_ics'),
+    path('pacientes/<int:patient_id>/adjuntos/', views.adjuntos_paciente, name='adjuntos_paciente'),
+    path('pacientes/<int:patient_id>/adjuntos/subir/', views.subir_adjunto, name='subir_adjunto'),
+    path('adjuntos/<int:adjunto_id>/', views.descargar_adjunto, name='descargar_adjunto'),
+    path('adjuntos/<int:adjunto_id>/<str:tipo>.jpg', views.derivado_adjunto, name='derivado_adjunto'),
+    path('adjuntos/<int:adjunto_id>/eliminar/', views.eliminar_adjunto, name='eliminar_adjunto'),
+    path('laboratorio/', views.reportes_laboratorio, name='reportes_laboratorio'),
+    path('laboratorio/subir/', views.subir_reporte_laboratorio, name='subir_reporte_laboratorio'),
+    path('laboratorio/<int:reporte_id>/', views.reporte_laboratorio, name='reporte_laboratorio'),
+    path('laboratorio/<int:reporte_id>/vincular/', views.vincular_reporte_laboratorio, name='vincular_reporte_laboratorio'),
+    path('pacientes/<int:patient_id>/laboratorio/', views.resultados_laboratorio_paciente, name='resultados_laboratorio_paciente'),
+    path('medicamentos/buscar/', views.autocompletar_medicamentos, name='autocompletar_medicamentos'),
+    path('pacientes/<int:patient_id>/interacciones/', views.verificar_interacciones, name='verificar_interacciones'),
+    path('consultas/<int:consulta_id>/recetas/', views.crear_receta, name='crear_receta'),
+    path('consultas/eventos/', views.agenda_eventos, name='agenda_eventos'),
+    path('consultas/eventos/poll/', views.agenda_eventos_poll, name='agenda_eventos_poll'),
 
     # Usuarios (nuevo)
     path('usuarios/', views.lista_usuarios, name='lista_usuarios'),
@@ -36,5 +58,21 @@ urlpatterns = [
     path('consultas/<int:consulta_id>/pago/', views.registrar_pago, name='registrar_pago'),
     path('pagos/', views.lista_pagos, name='lista_pagos'),
     path('pagos/<int:pago_id>/factura/', views.generar_factura, name='generar_factura'),
+    path('pagos/conciliacion/', views.conciliar_estado_cuenta, name='conciliar_estado_cuenta'),
+    path('pagos/conciliacion/<int:estado_cuenta_id>/excepciones/', views.excepciones_conciliacion, name='excepciones_conciliacion'),
+    path('pagos/corte/', views.corte_caja, name='corte_caja'),
+    path('pagos/corte/cerrar/', views.cerrar_corte_caja, name='cerrar_corte_caja'),
+    path('reclamaciones/generar/', views.generar_reclamaciones, name='generar_reclamaciones'),
+    path('reclamaciones/<int:lote_id>/archivo/', views.archivo_lote_reclamaciones, name='archivo_lote_reclamaciones'),
+    path('reclamaciones/<int:lote_id>/estado/', views.actualizar_lote_reclamaciones, name='actualizar_lote_reclamaciones'),
     path('facturas/<int:factura_id>/', views.detalle_factura, name='detalle_factura'),
+
+    # Analítica clínica
+    path('analitica/diagnosticos/', views.analitica_diagnosticos, name='analitica_diagnosticos'),
+    path('analitica/medicamentos/pacientes/', views.analitica_medicamento_pacientes, name='analitica_medicamento_pacientes'),
+    path('analitica/cohortes/', views.analitica_cohortes, name='analitica_cohortes'),
+
+    # API de sincronización para tabletas
+    path('api/v1/sincronizacion/cambios/', views.sincronizacion_cambios, name='sincronizacion_cambios'),
+    path('api/v1/sincronizacion/subir/', views.sincronizacion_subir, name='sincronizacion_subir'),
 ]
\ No newline at end of file
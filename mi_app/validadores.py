@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Validadores HTTP (ETag / Last-Modified) para las vistas de detalle.
+
+Cada página calcula en una sola consulta agregada el máximo de
+`fecha_actualizacion` de los objetos de los que depende; con eso el decorador
+`condition` de Django responde 304 sin renderizar cuando nada cambió.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+
+def _estado_paciente(paciente_id):
+    from .models import Patient
+
+    return Patient.objects.filter(id=paciente_id).aggregate(
+        paciente=Max('fecha_actualizacion'),
+        consultas=Max('consultation__fecha_actualizacion'),
+        expediente=Max('medicalrecord__fecha_actualizacion'),
+        pagos=Max('consultation__pagos__fecha_actualizacion'),
+        # Las bajas (y las facturas, sin fecha de actualización) no mueven el
+        # máximo; los conteos sí
+        total=Count('consultation', distinct=True),
+        total_pagos=Count('consultation__pagos', distinct=True),
+        facturas=Count('consultation__pagos__factura', distinct=True),
+    )
+
+
+def _estado_consulta(consulta_id):
+    from .models import Consultation
+
+    return Consultation.objects.filter(id=consulta_id).aggregate(
+        consulta=Max('fecha_actualizacion'),
+        paciente=Max('patient__fecha_actualizacion'),
+        recetas=Max('prescription__fecha_actualizacion'),
+        cobros=Max('pagos__fecha_actualizacion'),
+        signos=Max('signo_vital__fecha_medicion'),
+        # Las bajas no mueven los máximos; los conteos sí
+        total_recetas=Count('prescription', distinct=True),
+        total_pagos=Count('pagos', distinct=True),
+        total_signos=Count('signo_vital', distinct=True),
+    )
+
+
+def _estado_factura(factura_id):
+    from .models import Invoice
+
+    # La factura no tiene fecha_actualizacion: solo cambia al cancelarse
+    return Invoice.objects.filter(id=factura_id).aggregate(
+        emision=Max('fecha_emision'),
+        cancelacion=Max('fecha_cancelacion'),
+        pago=Max('payment__fecha_actualizacion'),
+        conceptos=Count('conceptos'),
+    )
+
+
+ESTADOS = {
+    'paciente': _estado_paciente,
+    'consulta': _estado_consulta,
+    'factura': _estado_factura,
+}
+
+
+def _validadores(request, tipo, objeto_id):
+    """(etag, last_modified) memorizados en el request: una consulta por petición"""
+    cache = request.__dict__.setdefault('_validadores', {})
+    clave = (tipo, objeto_id)
+    if clave in cache:
+        return cache[clave]
+
+    estado = ESTADOS[tipo](objeto_id)
+    fechas = [valor for valor in estado.values() if hasattr(valor, 'tzinfo')]
+    if not fechas:
+        # El objeto no existe: la vista decide (redirige con mensaje)
+        cache[clave] = (None, None)
+        return cache[clave]
+
+    # Lo que cambia el HTML además de los datos: el usuario (menú y rol), el
+    # día (edades, "hace N días") y el token CSRF de los formularios
+    partes = [
+        tipo, objeto_id, request.user.pk, timezone.localdate().isoformat(),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+    ] + [estado[campo] for campo in sorted(estado)]
+    etag = hashlib.md5(repr(partes).encode(), usedforsecurity=False).hexdigest()
+    cache[clave] = (f'"{etag}"', max(fechas))
+    return cache[clave]
+
+
+def _hay_mensajes(request):
+    # len() no marca los mensajes como leídos
+    return len(get_messages(request)) > 0
+
+
+def condicional(tipo, parametro):
+    """
+    Decorador para vistas de detalle: ETag/Last-Modified a partir del estado de
+    `tipo` identificado por el kwarg `parametro`, y Cache-Control privado que
+    obliga al navegador a revalidar (nunca se guarda en caches compartidos).
+    """
+    def etag(request, **kwargs):
+        if _hay_mensajes(request):
+            return None
+        return _validadores(request, tipo, kwargs[parametro])[0]
+
+    def last_modified(request, **kwargs):
+        if _hay_mensajes(request):
+            return None
+        return _validadores(request, tipo, kwargs[parametro])[1]
+
+    def decorador(vista):
+        vista_condicional = condition(etag_func=etag, last_modified_func=last_modified)(vista)
+
+        @wraps(vista)
+        def envoltura(request, *args, **kwargs):
+            response = vista_condicional(request, *args, **kwargs)
+            # private: solo la caché del navegador del usuario; no-cache: puede
+            # guardarla pero debe revalidar (304) antes de mostrarla
+            patch_cache_control(response, private=True, no_cache=True, must_revalidate=True)
+            patch_vary_headers(response, ['Cookie'])
+            return response
+        return envoltura
+    return decorador
@@ -7,7 +7,8 @@ from django.utils import timezone
 from .models import Patient, Doctor, Consultation, MedicalRecord
 from datetime import datetime, timedelta, date
 from django.views.decorators.http import require_POST
-from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from .models import Consultation
 import json
 from django.core.serializers.json import DjangoJSONEncoder
@@ -16,56 +17,94 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from .models import UserProfile
 from .models import Payment, Invoice, ConceptoFactura
+from .validadores import condicional
 
 
+# Filtros de edad del listado -> (edad mínima, edad máxima)
+RANGOS_EDAD_PACIENTES = {
+    '0-18': (0, 18),
+    '19-35': (19, 35),
+    '36-60': (36, 60),
+    '60+': (60, None),
+}
+
 @login_required
 def lista_pacientes(request):
-    """Lista de pacientes con búsqueda y filtros"""
-    from django.db.models import Q
-    from datetime import datetime
+    """Lista de pacientes con búsqueda, filtros y orden resueltos en SQL"""
+    from django.db.models import Q, Count, Max, F
     
     # Obtener parámetros de búsqueda
     busqueda = request.GET.get('busqueda', '')
+    edad_filtro = request.GET.get('edad', '')
+    estado_filtro = request.GET.get('estado', '')
+    orden = request.GET.get('orden', 'nombre')
+    imc_min = request.GET.get('imc_min', '')
+    imc_max = request.GET.get('imc_max', '')
     
     # Query base
-    pacientes = Patient.objects.filter(activo=True)
+    if estado_filtro == 'inactivo':
+        pacientes = Patient.objects.para_lista().filter(activo=False)
+    else:
+        pacientes = Patient.objects.para_lista().filter(activo=True)
     
     # Aplicar búsqueda
     if busqueda:
         pacientes = pacientes.filter(
             Q(nombres__icontains=busqueda) |
             Q(apellidos__icontains=busqueda) |
-            Q(telefono__icontains=busqueda) |
+            Q(telefono_principal__icontains=busqueda) |
             Q(email__icontains=busqueda)
         )
     
-    # Ordenar por apellidos
-    pacientes = pacientes.order_by('apellidos', 'nombres')
+    # Filtros (rangos sobre columnas indexadas en lugar de propiedades Python)
+    if edad_filtro in RANGOS_EDAD_PACIENTES:
+        minima, maxima = RANGOS_EDAD_PACIENTES[edad_filtro]
+        pacientes = pacientes.edad_entre(minima, maxima)
+    
+    if estado_filtro == 'nuevo':
+        pacientes = pacientes.nuevos()
+    
+    try:
+        if imc_min or imc_max:
+            pacientes = pacientes.imc_entre(
+                float(imc_min) if imc_min else None,
+                float(imc_max) if imc_max else None,
+            )
+    except ValueError:
+        messages.error(request, 'El rango de IMC no es válido')
+    
+    # Datos de consultas en la misma consulta SQL (sin una query por paciente)
+    pacientes = pacientes.con_edad().con_estado_badge().annotate(
+        total_consultas=Count('consultation'),
+        ultima_consulta=Max('consultation__fecha_consulta'),
+    )
+    
+    # Ordenamiento
+    if orden == 'fecha':
+        pacientes = pacientes.order_by('-fecha_registro')
+    elif orden == 'ultima_consulta':
+        pacientes = pacientes.order_by(F('ultima_consulta').desc(nulls_last=True), 'apellidos')
+    elif orden == 'edad':
+        pacientes = pacientes.ordenar_por_edad()
+    else:
+        pacientes = pacientes.order_by('apellidos', 'nombres')
     
     # Preparar datos para el template
     pacientes_data = []
     for paciente in pacientes:
-        # Contar consultas
-        total_consultas = Consultation.objects.filter(patient=paciente).count()
-        
-        # Última consulta
-        ultima_consulta = Consultation.objects.filter(
-            patient=paciente
-        ).order_by('-fecha_consulta').first()
-        
         pacientes_data.append({
             'paciente': paciente,
-            'total_consultas': total_consultas,
-            'ultima_consulta': ultima_consulta,
+            'total_consultas': paciente.total_consultas,
+            'ultima_consulta': paciente.ultima_consulta,
+            'edad': paciente.edad_anios,
+            'estado': paciente.estado_badge if paciente.activo else 'inactivo',
         })
     
     # Estadísticas
-    ahora = datetime.now()
     total_pacientes = Patient.objects.filter(activo=True).count()
     nuevos_mes = Patient.objects.filter(
         activo=True,
-        fecha_registro__month=ahora.month,
-        fecha_registro__year=ahora.year
+        fecha_registro__gte=timezone.localtime().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
     ).count()
     
     context = {
@@ -73,6 +112,11 @@ def lista_pacientes(request):
         'total_pacientes': total_pacientes,
         'nuevos_mes': nuevos_mes,
         'busqueda': busqueda,
+        'edad_filtro': edad_filtro,
+        'estado_filtro': estado_filtro,
+        'orden': orden,
+        'imc_min': imc_min,
+        'imc_max': imc_max,
     }
     
     return render(request, 'mi_app/lista_pacientes.html', context)
@@ -104,10 +148,10 @@ def dashboard(request):
     inicio_dia = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
     fin_dia = ahora.replace(hour=23, minute=59, second=59, microsecond=999999)
     
-    consultas_hoy = Consultation.objects.filter(
+    consultas_hoy = Consultation.objects.para_lista().filter(
         fecha_consulta__gte=inicio_dia,
         fecha_consulta__lte=fin_dia
-    ).select_related('patient', 'doctor').order_by('fecha_consulta')
+    ).order_by('fecha_consulta')
     
     total_consultas_hoy = consultas_hoy.count()
     
@@ -135,9 +179,7 @@ def dashboard(request):
     ingresos_mes = pagos_mes.aggregate(Sum('monto_pagado'))['monto_pagado__sum'] or 0
     
     # Pagos recientes (últimos 5)
-    pagos_recientes = Payment.objects.select_related(
-        'consultation__patient'
-    ).order_by('-fecha_creacion')[:5]
+    pagos_recientes = Payment.objects.para_lista().order_by('-fecha_creacion')[:5]
     
     # Consultas completadas sin pago
     consultas_sin_pago = Consultation.objects.filter(
@@ -153,10 +195,10 @@ def dashboard(request):
     ).count()
     
     # ==================== PRÓXIMAS CONSULTAS ====================
-    proximas_consultas = Consultation.objects.filter(
+    proximas_consultas = Consultation.objects.para_lista().filter(
         fecha_consulta__gt=ahora,
         estado='programada'
-    ).select_related('patient', 'doctor').order_by('fecha_consulta')[:5]
+    ).order_by('fecha_consulta')[:5]
     
     # ==================== ALERTAS ====================
     alertas = []
@@ -259,36 +301,42 @@ def nuevo_paciente(request):
     if request.method == 'POST':
         try:
             # Crear el paciente con todos los datos del formulario
-            patient = Patient.objects.create(
+            datos = {
                 # Datos personales
-                nombres=request.POST.get('nombres'),
-                apellidos=request.POST.get('apellidos'),
-                fecha_nacimiento=request.POST.get('fecha_nacimiento'),
-                genero=request.POST.get('genero'),
-                estado_civil=request.POST.get('estado_civil', 'soltero'),
+                'nombres': request.POST.get('nombres'),
+                'apellidos': request.POST.get('apellidos'),
+                'fecha_nacimiento': request.POST.get('fecha_nacimiento'),
+                'genero': request.POST.get('genero'),
+                'estado_civil': request.POST.get('estado_civil') or 'soltero',
+                'tipo_sangre': request.POST.get('tipo_sangre', ''),
                 
                 # Contacto
-                telefono=request.POST.get('telefono'),
-                telefono_alternativo=request.POST.get('telefono_alternativo', ''),
-                email=request.POST.get('email', ''),
-                email_alternativo=request.POST.get('email_alternativo', ''),
+                'telefono_principal': request.POST.get('telefono_principal', ''),
+                'telefono_alternativo': request.POST.get('telefono_alternativo', ''),
+                'email': request.POST.get('email', ''),
+                'email_alternativo': request.POST.get('email_alternativo', ''),
                 
-                # Dirección
-                direccion=request.POST.get('direccion', ''),
-                ciudad=request.POST.get('ciudad', ''),
-                estado=request.POST.get('estado', ''),
-                codigo_postal=request.POST.get('codigo_postal', ''),
+                # Dirección: el formulario la captura en un solo campo
+                'calle': request.POST.get('direccion', '').strip()[:200],
                 
                 # Contacto de emergencia
-                emergencia_nombre=request.POST.get('emergencia_nombre'),
-                emergencia_parentesco=request.POST.get('emergencia_parentesco'),
-                emergencia_telefono=request.POST.get('emergencia_telefono'),
-                emergencia_telefono2=request.POST.get('emergencia_telefono2', ''),
+                'emergencia_nombre': request.POST.get('emergencia_nombre', ''),
+                'emergencia_parentesco': request.POST.get('emergencia_parentesco', ''),
+                'emergencia_telefono': request.POST.get('emergencia_telefono', ''),
+                'emergencia_telefono2': request.POST.get('emergencia_telefono2', ''),
+                
+                # Antecedentes
+                'alergias': request.POST.get('alergias', ''),
+                'enfermedades_cronicas': request.POST.get('enfermedades_cronicas', ''),
+                'medicamentos_actuales': request.POST.get('medicamentos_actuales', ''),
+                'antecedentes_familiares': request.POST.get('antecedentes_familiares', ''),
                 
                 # Seguro médico
-                seguro_medico=request.POST.get('seguro_medico', ''),
-                numero_poliza=request.POST.get('numero_poliza', ''),
-            )
+                'seguro_medico': request.POST.get('seguro_medico', ''),
+                'numero_poliza': request.POST.get('numero_poliza', ''),
+            }
+            # Lo que viene en blanco queda con el valor por omisión del modelo ('Sin especificar', 'S/N'...)
+            patient = Patient.objects.create(**{campo: valor for campo, valor in datos.items() if valor})
             
             # Crear expediente médico automáticamente
             MedicalRecord.objects.create(patient=patient)
@@ -298,6 +346,18 @@ def nuevo_paciente(request):
                 f'Paciente registrado exitosamente: {patient.nombre_completo} - ID: #{patient.id:04d}'
             )
             
+            # La señal post_save ya buscó duplicados dentro de sus bloques
+            from .models import DuplicateCandidate
+            posibles = DuplicateCandidate.objects.filter(
+                paciente_b=patient, estado='pendiente'
+            ).select_related('paciente_a')[:3]
+            for candidato in posibles:
+                messages.warning(
+                    request,
+                    f'Posible duplicado de #{candidato.paciente_a.id:04d} {candidato.paciente_a.nombre_completo} '
+                    f'({candidato.razones})'
+                )
+            
             return redirect('detalle_paciente', paciente_id=patient.id)
             
         except Exception as e:
@@ -307,15 +367,16 @@ def nuevo_paciente(request):
     return render(request, 'mi_app/nuevo_paciente.html')
 
 @login_required
+@condicional('paciente', 'paciente_id')
 def detalle_paciente(request, paciente_id):
     """Detalle completo del paciente con historial de consultas mejorado - ACTUALIZADO"""
     try:
-        paciente = Patient.objects.get(id=paciente_id)
+        paciente = Patient.objects.para_detalle().get(id=paciente_id)
         
         # Obtener TODAS las consultas del paciente ordenadas por fecha descendente
         consultas = Consultation.objects.filter(
             patient=paciente
-        ).select_related('doctor').order_by('-fecha_consulta')
+        ).para_historial().order_by('-fecha_consulta')
         
         # Separar consultas por estado (INCLUIR CANCELADAS)
         consultas_completadas = consultas.filter(estado='completada')
@@ -334,6 +395,18 @@ def detalle_paciente(request, paciente_id):
         ultima_consulta = consultas_completadas.first()
         proxima_consulta = consultas_programadas.first()
         
+        # Consultas archivadas (ver archivo.py): completan el historial
+        # cuando las recientes no llenan la página
+        from .archivo import consultas_archivadas
+        historial = list(consultas[:20])  # Primeras 20 para mostrar inicialmente
+        total_archivadas = paciente.consultas_archivadas.count()
+        if total_archivadas:
+            total_consultas += total_archivadas
+            if len(historial) < 20:
+                historial += consultas_archivadas(paciente, limite=20 - len(historial))
+            if ultima_consulta is None:
+                ultima_consulta = next(iter(consultas_archivadas(paciente, limite=1, estado='completada')), None)
+        
         # Calcular días desde última consulta
         dias_desde_ultima = None
         if ultima_consulta:
@@ -342,13 +415,14 @@ def detalle_paciente(request, paciente_id):
         
         context = {
             'paciente': paciente,
-            'consultas': consultas[:20],  # Primeras 20 para mostrar inicialmente
+            'consultas': historial,
             'consultas_completadas': consultas_completadas,
             'consultas_programadas': consultas_programadas,
             'consultas_en_curso': consultas_en_curso,
             'consultas_canceladas': consultas_canceladas,  # ← AGREGAR ESTA LÍNEA
             'expediente': expediente,
             'total_consultas': total_consultas,
+            'total_archivadas': total_archivadas,
             'ultima_consulta': ultima_consulta,
             'proxima_consulta': proxima_consulta,
             'dias_desde_ultima': dias_desde_ultima,
@@ -372,60 +446,164 @@ def lista_consultas(request):
 
 @login_required
 def agenda_consultas(request):
-    """Vista de agenda - consultas del día"""
+    """Vista de agenda - consultas del día agrupadas por doctor"""
     from datetime import datetime, timedelta
     from django.utils import timezone
     from zoneinfo import ZoneInfo
+    from .agenda import agenda_por_doctor, doctor_del_usuario
+    from .eventos_agenda import ultima_version
+    
+    # Versión del feed en vivo antes de leer la agenda: ningún cambio se pierde
+    version_eventos = ultima_version()
     
     # Obtener fecha/hora actual en México
     mexico_tz = ZoneInfo('America/Mexico_City')
     ahora_mexico = timezone.now().astimezone(mexico_tz)
     hoy = ahora_mexico.date()
     
-    # Crear rango del día en timezone de México
-    inicio_dia = datetime.combine(hoy, datetime.min.time()).replace(tzinfo=mexico_tz)
-    fin_dia = datetime.combine(hoy, datetime.max.time()).replace(tzinfo=mexico_tz)
+    # Día a mostrar (por defecto hoy)
+    try:
+        fecha = datetime.strptime(request.GET['fecha'], '%Y-%m-%d').date() if request.GET.get('fecha') else hoy
+    except ValueError:
+        fecha = hoy
+    
+    # Un doctor solo ve su propia agenda; el resto puede filtrar por doctor
+    doctor_usuario = doctor_del_usuario(request.user)
+    if doctor_usuario:
+        doctor_filtro = doctor_usuario.id
+    else:
+        doctor_filtro = request.GET.get('doctor') or None
+        if doctor_filtro and not str(doctor_filtro).isdigit():
+            doctor_filtro = None
     
-    # Consultas de hoy
-    consultas_hoy = Consultation.objects.filter(
-        fecha_consulta__gte=inicio_dia,
-        fecha_consulta__lte=fin_dia,
-        estado__in=['programada', 'en_curso']
-    ).select_related('patient', 'doctor').order_by('fecha_consulta')
+    # Agenda del día: estadísticas agrupadas por doctor + consultas del día
+    agenda_doctores, consultas_dia = agenda_por_doctor(fecha, doctor_filtro)
+    consultas_hoy = [c for c in consultas_dia if c.estado in ('programada', 'en_curso')]
     
     # Próximas consultas (próximos 7 días)
-    inicio_manana = fin_dia + timedelta(seconds=1)
+    inicio_manana = datetime.combine(fecha + timedelta(days=1), datetime.min.time()).replace(tzinfo=mexico_tz)
     fin_proximos_7_dias = datetime.combine(
-        hoy + timedelta(days=7), 
+        fecha + timedelta(days=7), 
         datetime.max.time()
     ).replace(tzinfo=mexico_tz)
     
-    proximas_consultas = Consultation.objects.filter(
+    proximas_consultas = Consultation.objects.para_agenda().filter(
         fecha_consulta__gte=inicio_manana,
         fecha_consulta__lte=fin_proximos_7_dias,
         estado='programada'
-    ).select_related('patient', 'doctor').order_by('fecha_consulta')
+    ).order_by('fecha_consulta')
+    if doctor_filtro:
+        proximas_consultas = proximas_consultas.filter(doctor_id=doctor_filtro)
     
-    # Estadísticas del día
-    total_hoy = consultas_hoy.count()
-    completadas_hoy = Consultation.objects.filter(
-        fecha_consulta__gte=inicio_dia,
-        fecha_consulta__lte=fin_dia,
-        estado='completada'
-    ).count()
-    pendientes_hoy = consultas_hoy.filter(estado='programada').count()
+    # Estadísticas del día (sumadas de la consulta agrupada, sin queries extra)
+    total_hoy = sum(d['stats']['programada'] + d['stats']['en_curso'] for d in agenda_doctores)
+    completadas_hoy = sum(d['stats']['completada'] for d in agenda_doctores)
+    pendientes_hoy = sum(d['stats']['programada'] for d in agenda_doctores)
     
     context = {
         'consultas_hoy': consultas_hoy,
         'proximas_consultas': proximas_consultas,
-        'fecha_hoy': hoy,
+        'fecha_hoy': fecha,
         'total_hoy': total_hoy,
         'completadas_hoy': completadas_hoy,
         'pendientes_hoy': pendientes_hoy,
+        'agenda_doctores': agenda_doctores,
+        'doctor_filtro': int(doctor_filtro) if doctor_filtro else None,
+        'es_agenda_doctor': doctor_usuario is not None,
+        'version_eventos': version_eventos,
     }
     
     return render(request, 'mi_app/agenda_consultas.html', context)
 
+async def _parametros_eventos(request):
+    """(fecha, doctor_id) del feed; un doctor solo recibe su propia agenda"""
+    from asgiref.sync import sync_to_async
+    from .agenda import doctor_del_usuario
+
+    fecha = _fecha_param(request, 'fecha', timezone.localdate())
+    user = await request.auser()
+    doctor_usuario = await sync_to_async(doctor_del_usuario)(user)
+    if doctor_usuario:
+        return fecha, doctor_usuario.id
+    doctor = request.GET.get('doctor')
+    return fecha, int(doctor) if doctor else None
+
+@login_required
+async def agenda_eventos(request):
+    """Feed SSE de cambios en la agenda del día (?fecha=, ?doctor=, ?desde=)"""
+    import asyncio
+    import time
+    from asgiref.sync import sync_to_async
+    from django.http import StreamingHttpResponse
+    from .eventos_agenda import (
+        eventos_desde, formato_sse, ultima_version,
+        INTERVALO, INTERVALO_PING, DURACION_MAXIMA_SSE,
+    )
+
+    try:
+        fecha, doctor_id = await _parametros_eventos(request)
+        desde = request.headers.get('Last-Event-ID') or request.GET.get('desde')
+        version = int(desde) if desde else await sync_to_async(ultima_version)()
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    leer = sync_to_async(eventos_desde)
+
+    async def flujo():
+        nonlocal version
+        yield 'retry: 3000\n\n'
+        fin = time.monotonic() + DURACION_MAXIMA_SSE
+        ultimo_envio = time.monotonic()
+        while time.monotonic() < fin:
+            eventos = await leer(version, fecha, doctor_id)
+            for evento in eventos:
+                version = evento['version']
+                yield formato_sse(evento)
+            if eventos:
+                ultimo_envio = time.monotonic()
+            elif time.monotonic() - ultimo_envio >= INTERVALO_PING:
+                yield ': ping\n\n'
+                ultimo_envio = time.monotonic()
+            await asyncio.sleep(INTERVALO)
+
+    response = StreamingHttpResponse(flujo(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+async def agenda_eventos_poll(request):
+    """Long-poll de respaldo: espera hasta ?espera= segundos por eventos posteriores a ?desde="""
+    import asyncio
+    import time
+    from asgiref.sync import sync_to_async
+    from .eventos_agenda import eventos_desde, ultima_version, INTERVALO, ESPERA_MAXIMA
+
+    try:
+        fecha, doctor_id = await _parametros_eventos(request)
+        espera = min(float(request.GET.get('espera', 25)), ESPERA_MAXIMA)
+        desde = request.GET.get('desde')
+        if not desde:
+            # Sin versión: solo se entrega la actual para empezar a esperar
+            return JsonResponse({'success': True, 'version': await sync_to_async(ultima_version)(), 'eventos': []})
+        version = int(desde)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    leer = sync_to_async(eventos_desde)
+    fin = time.monotonic() + espera
+    while True:
+        eventos = await leer(version, fecha, doctor_id)
+        if eventos or time.monotonic() >= fin:
+            break
+        await asyncio.sleep(INTERVALO)
+
+    return JsonResponse({
+        'success': True,
+        'version': eventos[-1]['version'] if eventos else version,
+        'eventos': eventos,
+    })
+
 @login_required
 def nueva_consulta(request):
     """Formulario para programar nueva consulta"""
@@ -461,6 +639,10 @@ def nueva_consulta(request):
                 messages.error(request, 'No se puede programar una consulta en el pasado')
                 return redirect('nueva_consulta')
             
+            # Cita recurrente: se crea la serie y se materializan sus citas
+            if request.POST.get('repetir'):
+                return _crear_serie_desde_formulario(request, fecha_hora)
+            
             # Crear consulta
             consulta = Consultation.objects.create(
                 patient_id=int(patient_id),
@@ -479,39 +661,70 @@ def nueva_consulta(request):
             )
             
             # Renderizar template con el mensaje (modal se mostrará automáticamente)
-            context = {
-                'pacientes': Patient.objects.filter(activo=True).order_by('apellidos', 'nombres'),
-                'doctores': Doctor.objects.filter(activo=True).order_by('apellidos', 'nombres'),
-                'fecha_hoy': datetime.now().date(),
-            }
-            return render(request, 'mi_app/nueva_consulta.html', context)
+            return render(request, 'mi_app/nueva_consulta.html', get_nueva_consulta_context())
             
         except Exception as e:
             messages.error(request, f'Error al programar consulta: {str(e)}')
     
     # Contexto para GET
-    context = {
-        'pacientes': Patient.objects.filter(activo=True).order_by('apellidos', 'nombres'),
-        'doctores': Doctor.objects.filter(activo=True).order_by('apellidos', 'nombres'),
-        'fecha_hoy': datetime.now().date(),
-    }
+    return render(request, 'mi_app/nueva_consulta.html', get_nueva_consulta_context())
+
+def _crear_serie_desde_formulario(request, fecha_hora):
+    """Alta de una serie desde nueva_consulta (campos repetir, intervalo, dias_semana, repeticiones, repetir_hasta)"""
+    from django.core.exceptions import ValidationError
+    from .series import crear_serie
+
+    repetir_hasta = request.POST.get('repetir_hasta')
+    repeticiones = request.POST.get('repeticiones')
+    if not repetir_hasta and not repeticiones:
+        messages.error(request, 'Indica el número de citas o la fecha final de la serie')
+        return redirect('nueva_consulta')
+    try:
+        serie, creadas, operacion = crear_serie(
+            usuario=request.user,
+            patient_id=int(request.POST['patient_id']),
+            doctor_id=int(request.POST['doctor_id']),
+            tipo_consulta=request.POST['tipo_consulta'],
+            motivo=request.POST['motivo'],
+            fecha_inicio=fecha_hora,
+            frecuencia=request.POST['repetir'],
+            intervalo=int(request.POST.get('intervalo') or 1),
+            dias_semana=','.join(request.POST.getlist('dias_semana')),
+            repeticiones=int(repeticiones) if repeticiones else None,
+            fecha_fin=datetime.strptime(repetir_hasta, '%Y-%m-%d').date() if repetir_hasta else None,
+        )
+    except ValidationError as e:
+        messages.error(request, 'Serie no válida: ' + '; '.join(e.messages))
+        return redirect('nueva_consulta')
     
-    return render(request, 'mi_app/nueva_consulta.html', context)
+    messages.success(
+        request,
+        f'Serie programada para {serie.patient.nombre_completo}: {len(creadas)} cita(s) creada(s)'
+    )
+    if operacion and operacion.conflictos:
+        messages.warning(
+            request,
+            f'{len(operacion.conflictos)} cita(s) no se crearon: '
+            + ', '.join(f"{c['fecha']} ({c['mensaje']})" for c in operacion.conflictos[:5])
+            + ('…' if len(operacion.conflictos) > 5 else '')
+        )
+    return render(request, 'mi_app/nueva_consulta.html', get_nueva_consulta_context())
 
-@login_required
 def get_nueva_consulta_context():
     """Helper function para obtener contexto de nueva consulta"""
     return {
-        'pacientes': Patient.objects.filter(activo=True).order_by('apellidos', 'nombres'),
+        'pacientes': Patient.objects.para_lista().filter(activo=True).order_by('apellidos', 'nombres'),
         'doctores': Doctor.objects.filter(activo=True).order_by('apellidos', 'nombres'),
         'fecha_hoy': datetime.now().date(),
+        'dias_semana': list(enumerate(['Lun', 'Mar', 'Mié', 'Jue', 'Vie', 'Sáb', 'Dom'])),
     }
 
 @login_required
+@condicional('consulta', 'consulta_id')
 def detalle_consulta(request, consulta_id):
     """Vista detallada de una consulta específica"""
     try:
-        consulta = Consultation.objects.select_related('patient', 'doctor').get(id=consulta_id)
+        consulta = Consultation.objects.para_detalle().get(id=consulta_id)
         
         if request.method == 'POST':
             try:
@@ -553,10 +766,14 @@ def detalle_consulta(request, consulta_id):
                 
                 consulta.save()
                 
-                # Actualizar peso del paciente si se registró
+                # Actualizar peso del paciente si se registró (solo esa columna,
+                # la serie de signos vitales se sincroniza con la señal post_save)
                 if consulta.peso_consulta:
+                    Patient.objects.filter(id=consulta.patient_id).update(
+                        peso=consulta.peso_consulta,
+                        fecha_actualizacion=timezone.now()
+                    )
                     consulta.patient.peso = consulta.peso_consulta
-                    consulta.patient.save()
                 
                 messages.success(request, f'Consulta actualizada exitosamente - Estado: {consulta.get_estado_display()}')
                 
@@ -577,8 +794,46 @@ def detalle_consulta(request, consulta_id):
         return render(request, 'mi_app/detalle_consulta.html', context)
         
     except Consultation.DoesNotExist:
-        messages.error(request, 'Consulta no encontrada')
-        return redirect('agenda_consultas')
+        # Consulta archivada (ver archivo.py): solo lectura
+        from .archivo import consulta_archivada
+        consulta = consulta_archivada(consulta_id)
+        if consulta is None:
+            messages.error(request, 'Consulta no encontrada')
+            return redirect('agenda_consultas')
+        if request.method == 'POST':
+            messages.error(request, 'La consulta está archivada y no se puede modificar')
+            return redirect('detalle_consulta', consulta_id=consulta.id)
+        return render(request, 'mi_app/detalle_consulta.html', {'consulta': consulta, 'archivada': True})
+
+@login_required
+def tendencia_signos_vitales(request, paciente_id):
+    """API JSON con la tendencia (reducida) de un signo vital del paciente"""
+    from .signos_vitales import tendencia, METRICAS
+
+    paciente = get_object_or_404(Patient.objects.only('id'), id=paciente_id)
+    metrica = request.GET.get('metrica', 'peso')
+    if metrica not in METRICAS:
+        return JsonResponse({
+            'success': False,
+            'message': f'Métrica no válida. Opciones: {", ".join(METRICAS)}'
+        }, status=400)
+
+    try:
+        desde = request.GET.get('desde')
+        hasta = request.GET.get('hasta')
+        desde = timezone.make_aware(datetime.strptime(desde, '%Y-%m-%d')) if desde else None
+        hasta = timezone.make_aware(datetime.combine(datetime.strptime(hasta, '%Y-%m-%d'), datetime.max.time())) if hasta else None
+        puntos = int(request.GET.get('puntos', 100))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'paciente_id': paciente.id,
+        'metrica': metrica,
+        'columnas': METRICAS[metrica],
+        'serie': tendencia(paciente.id, metrica, desde=desde, hasta=hasta, puntos=puntos),
+    })
 
 @login_required    
 @require_POST
@@ -629,7 +884,7 @@ def cancelar_consulta(request, consulta_id):
         else:
             # Si es petición normal, redirigir con mensaje
             messages.success(request, f'Consulta cancelada exitosamente.')
-            return redirect('detalle_paciente', paciente_id=consulta.patient.id)
+            return redirect('detalle_paciente', paciente_id=consulta.patient_id)
             
     except Consultation.DoesNotExist:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -780,7 +1035,7 @@ def editar_consulta(request, consulta_id):
         # GET - Mostrar formulario
         context = {
             'consulta': consulta,
-            'pacientes': Patient.objects.filter(activo=True).order_by('apellidos', 'nombres'),
+            'pacientes': Patient.objects.para_lista().filter(activo=True).order_by('apellidos', 'nombres'),
             'doctores': Doctor.objects.filter(activo=True).order_by('apellidos', 'nombres'),
             'fecha_hoy': date.today(),
             'es_edicion': True,
@@ -1055,10 +1310,10 @@ def calendario_consultas(request):
     estado_filtro = request.GET.get('estado')
     
     # Consultas del mes con filtros aplicados
-    consultas = Consultation.objects.filter(
+    consultas = Consultation.objects.para_lista().filter(
         fecha_consulta__gte=primer_dia,
         fecha_consulta__lte=ultimo_dia
-    ).select_related('patient', 'doctor')
+    )
     
     if doctor_filtro:
         consultas = consultas.filter(doctor_id=doctor_filtro)
@@ -1084,7 +1339,7 @@ def calendario_consultas(request):
     
     # Doctores para filtro
     doctores = Doctor.objects.filter(activo=True)
-    pacientes = Patient.objects.filter(activo=True).order_by('apellidos', 'nombres')
+    pacientes = Patient.objects.para_lista().filter(activo=True).order_by('apellidos', 'nombres')
     
     context = {
         'mes': mes,
@@ -1129,7 +1384,8 @@ def registrar_pago(request, consulta_id):
                 metodo_pago=metodo_pago,
                 referencia=referencia,
                 notas=notas,
-                fecha_pago=timezone.now()
+                fecha_pago=timezone.now(),
+                registrado_por=request.user,
             )
             
             # Determinar estado
@@ -1175,10 +1431,7 @@ def lista_pagos(request):
     fecha_desde = request.GET.get('fecha_desde', '')
     fecha_hasta = request.GET.get('fecha_hasta', '')
     
-    pagos = Payment.objects.all().select_related(
-        'consultation__patient',
-        'consultation__doctor'
-    ).order_by('-fecha_creacion')
+    pagos = Payment.objects.para_lista().order_by('-fecha_creacion')
     
     if estado_filtro:
         pagos = pagos.filter(estado=estado_filtro)
@@ -1192,14 +1445,14 @@ def lista_pagos(request):
     if fecha_hasta:
         pagos = pagos.filter(fecha_creacion__lte=fecha_hasta)
     
-    # Estadísticas
-    from django.db.models import Sum, Count
-    stats = {
-        'total_pagos': pagos.count(),
-        'monto_total': pagos.aggregate(Sum('monto_pagado'))['monto_pagado__sum'] or 0,
-        'pagos_pendientes': pagos.filter(estado='pendiente').count(),
-        'pagos_completados': pagos.filter(estado='pagado').count(),
-    }
+    # Estadísticas (una sola consulta con agregación condicional)
+    from django.db.models import Sum, Count, Q
+    stats = pagos.order_by().aggregate(
+        total_pagos=Count('id'),
+        monto_total=Sum('monto_pagado', default=0),
+        pagos_pendientes=Count('id', filter=Q(estado='pendiente')),
+        pagos_completados=Count('id', filter=Q(estado='pagado')),
+    )
     
     context = {
         'pagos': pagos[:50],  # Primeros 50
@@ -1221,16 +1474,17 @@ def generar_factura(request, pago_id):
             messages.warning(request, 'Este pago ya tiene una factura generada')
             return redirect('detalle_factura', factura_id=pago.factura.id)
         
+        # Calcular IVA (16%)
+        from decimal import Decimal
+        subtotal = pago.monto_final
+        iva = (subtotal * Decimal('0.16')).quantize(Decimal('0.01'))
+        total = subtotal + iva
+        
         if request.method == 'POST':
             # Generar folio único
             import random
             folio = f"FAC-{timezone.now().year}-{random.randint(10000, 99999)}"
             
-            # Calcular IVA (16%)
-            subtotal = pago.monto_final
-            iva = subtotal * 0.16
-            total = subtotal + iva
-            
             # Crear factura
             factura = Invoice.objects.create(
                 payment=pago,
@@ -1263,6 +1517,8 @@ def generar_factura(request, pago_id):
         context = {
             'pago': pago,
             'paciente': paciente,
+            'iva': iva,
+            'total': total,
         }
         
         return render(request, 'mi_app/generar_factura.html', context)
@@ -1272,6 +1528,7 @@ def generar_factura(request, pago_id):
         return redirect('lista_pagos')
 
 @login_required
+@condicional('factura', 'factura_id')
 def detalle_factura(request, factura_id):
     """Ver detalle de una factura"""
     try:
@@ -1287,4 +1544,825 @@ def detalle_factura(request, factura_id):
         
     except Invoice.DoesNotExist:
         messages.error(request, 'Factura no encontrada')
-        return redirect('lista_pagos')
\ No newline at end of file
+        return redirect('lista_pagos')
+
+
+# ==================== CONCILIACIÓN BANCARIA ====================
+
+@login_required
+@require_POST
+def conciliar_estado_cuenta(request):
+    """Importa un CSV de banco o terminal (archivo, origen) y concilia contra los pagos"""
+    from .conciliacion import conciliar, EstadoCuentaInvalido
+
+    archivo = request.FILES.get('archivo')
+    if archivo is None:
+        return JsonResponse({'success': False, 'message': 'Falta el archivo del estado de cuenta'}, status=400)
+    try:
+        estado_cuenta = conciliar(
+            archivo.file,
+            archivo.name,
+            request.POST.get('origen', 'banco'),
+            usuario=request.user,
+        )
+    except EstadoCuentaInvalido as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'estado_cuenta_id': estado_cuenta.id,
+        'desde': estado_cuenta.desde,
+        'hasta': estado_cuenta.hasta,
+        'lineas': estado_cuenta.lineas,
+        'conciliadas': estado_cuenta.conciliadas,
+        'excepciones': estado_cuenta.excepciones,
+        'reporte': reverse('excepciones_conciliacion', args=[estado_cuenta.id]),
+    })
+
+@login_required
+def excepciones_conciliacion(request, estado_cuenta_id):
+    """Reporte de excepciones de un estado de cuenta (JSON, o CSV con ?formato=csv)"""
+    from .conciliacion import escribir_excepciones_csv, excepciones
+    from .models import BankStatement
+
+    estado_cuenta = get_object_or_404(BankStatement, id=estado_cuenta_id)
+    if request.GET.get('formato') == 'csv':
+        respuesta = HttpResponse(content_type='text/csv; charset=utf-8')
+        respuesta['Content-Disposition'] = f'attachment; filename="excepciones_{estado_cuenta.id}.csv"'
+        escribir_excepciones_csv(estado_cuenta, respuesta)
+        return respuesta
+
+    return JsonResponse({'success': True, 'estado_cuenta_id': estado_cuenta.id, **excepciones(estado_cuenta)})
+
+
+# ==================== CORTE DE CAJA ====================
+
+@login_required
+def corte_caja(request):
+    """Corte de caja de un día (?fecha=YYYY-MM-DD, hoy por defecto): foto guardada o totales en vivo"""
+    from .corte_caja import reporte
+
+    try:
+        fecha = _fecha_param(request, 'fecha', timezone.localdate())
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    return JsonResponse({'success': True, **reporte(fecha, verificar=request.GET.get('verificar') != '0')})
+
+@login_required
+@require_POST
+def cerrar_corte_caja(request):
+    """Cierra el día (fecha, notas) guardando sus totales; un día se cierra una sola vez"""
+    from .corte_caja import CorteInvalido, cerrar_dia, reporte
+
+    try:
+        fecha = datetime.strptime(request.POST['fecha'], '%Y-%m-%d').date() if request.POST.get('fecha') else timezone.localdate()
+        cerrar_dia(fecha, usuario=request.user, notas=request.POST.get('notas', ''))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Fecha inválida: {str(e)}'}, status=400)
+    except CorteInvalido as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    return JsonResponse({'success': True, **reporte(fecha, verificar=False)})
+
+
+# ==================== RECLAMACIONES A ASEGURADORAS ====================
+
+def _datos_lote(lote):
+    return {
+        'id': lote.id,
+        'aseguradora': lote.aseguradora,
+        'periodo': f'{lote.periodo:%Y-%m}',
+        'estado': lote.estado,
+        'reclamaciones': lote.reclamaciones,
+        'monto_reclamado': lote.monto_reclamado,
+        'aceptadas': lote.aceptadas,
+        'rechazadas': lote.rechazadas,
+        'monto_aprobado': lote.monto_aprobado,
+        'archivos': {
+            formato: f"{reverse('archivo_lote_reclamaciones', args=[lote.id])}?formato={formato}"
+            for formato in ('csv', 'xml')
+        },
+    }
+
+@login_required
+@require_POST
+def generar_reclamaciones(request):
+    """Genera los lotes de un mes (periodo=AAAA-MM, el anterior por defecto) para todas las aseguradoras o una"""
+    from .analitica import normalizar_termino
+    from .reclamaciones import ReclamacionInvalida, generar_lotes, mes_anterior, periodo_de
+
+    try:
+        periodo = periodo_de(request.POST['periodo']) if request.POST.get('periodo') else mes_anterior()
+    except ReclamacionInvalida as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    lotes, omitidas = generar_lotes(
+        periodo,
+        usuario=request.user,
+        clave_aseguradora=normalizar_termino(request.POST.get('aseguradora', '')) or None,
+    )
+    return JsonResponse({'success': True, 'lotes': [_datos_lote(lote) for lote in lotes], 'omitidas': omitidas})
+
+@login_required
+def archivo_lote_reclamaciones(request, lote_id):
+    """Archivo del lote para la aseguradora en streaming (?formato=csv|xml)"""
+    from django.http import StreamingHttpResponse
+    from .models import ClaimBatch
+    from .reclamaciones import ARCHIVOS
+
+    lote = get_object_or_404(ClaimBatch, id=lote_id)
+    formato = request.GET.get('formato', 'csv')
+    if formato not in ARCHIVOS:
+        return JsonResponse({'success': False, 'message': 'Formato no soportado (csv o xml)'}, status=400)
+
+    generar, tipo = ARCHIVOS[formato]
+    respuesta = StreamingHttpResponse(generar(lote), content_type=tipo)
+    respuesta['Content-Disposition'] = (
+        f'attachment; filename="reclamaciones_{lote.clave_aseguradora.replace(" ", "_")}_{lote.periodo:%Y%m}.{formato}"'
+    )
+    return respuesta
+
+@login_required
+@require_POST
+def actualizar_lote_reclamaciones(request, lote_id):
+    """
+    Estado del lote: {"accion": "enviar"} marca sus reclamaciones pendientes
+    como enviadas; {"respuestas": [{"reclamacion", "estado", "monto_aprobado",
+    "motivo"}, ...]} aplica la respuesta de la aseguradora.
+    """
+    from .models import ClaimBatch
+    from .reclamaciones import aplicar_respuestas, marcar_enviado
+
+    lote = get_object_or_404(ClaimBatch, id=lote_id)
+    try:
+        datos = _datos_operacion(request)
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'JSON inválido'}, status=400)
+    if isinstance(datos, list):
+        datos = {'respuestas': datos}
+
+    if datos.get('accion') == 'enviar':
+        enviadas = marcar_enviado(lote)
+        return JsonResponse({'success': True, 'enviadas': enviadas, 'lote': _datos_lote(lote)})
+
+    respuestas = datos.get('respuestas')
+    if not isinstance(respuestas, list):
+        return JsonResponse({'success': False, 'message': 'Se espera "accion" o una lista de "respuestas"'}, status=400)
+    actualizadas, errores = aplicar_respuestas(lote, respuestas)
+    return JsonResponse({'success': True, 'actualizadas': actualizadas, 'errores': errores, 'lote': _datos_lote(lote)})
+
+
+# ==================== ANALÍTICA CLÍNICA ====================
+
+def _fecha_param(request, nombre, default=None):
+    valor = request.GET.get(nombre)
+    return datetime.strptime(valor, '%Y-%m-%d').date() if valor else default
+
+def _id_param(request, nombre):
+    valor = request.GET.get(nombre)
+    return int(valor) if valor else None
+
+@login_required
+def analitica_diagnosticos(request):
+    """Top de diagnósticos por mes (y por doctor con ?por_doctor=1)"""
+    from .analitica import top_diagnosticos
+
+    hoy = timezone.localdate()
+    try:
+        hasta = _fecha_param(request, 'hasta', hoy)
+        desde = _fecha_param(request, 'desde', (hasta - timedelta(days=365)).replace(day=1))
+        limite = int(request.GET.get('limite', 10))
+        doctor_id = _id_param(request, 'doctor')
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'resultados': top_diagnosticos(
+            desde,
+            hasta,
+            doctor_id=doctor_id,
+            por_doctor=request.GET.get('por_doctor') == '1',
+            limite=limite,
+        ),
+    })
+
+@login_required
+def analitica_medicamento_pacientes(request):
+    """Pacientes a los que se les ha recetado un medicamento (?medicamento=)"""
+    from .analitica import pacientes_con_medicamento
+
+    medicamento = request.GET.get('medicamento', '')
+    pacientes = pacientes_con_medicamento(medicamento)
+    return JsonResponse({
+        'success': True,
+        'medicamento': medicamento,
+        'pacientes': [
+            {
+                'id': p.id,
+                'nombre': p.nombre_completo,
+                'edad': p.edad,
+                'genero': p.genero,
+            }
+            for p in pacientes
+        ],
+    })
+
+@login_required
+def analitica_cohortes(request):
+    """Pacientes y consultas por grupo de edad y género"""
+    from .analitica import cohortes
+
+    try:
+        desde = _fecha_param(request, 'desde')
+        hasta = _fecha_param(request, 'hasta')
+        termino_id = _id_param(request, 'termino')
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'cohortes': cohortes(
+            termino_id=termino_id,
+            desde=desde,
+            hasta=hasta,
+        ),
+    })
+
+
+# ==================== BÚSQUEDA CLÍNICA ====================
+
+@login_required
+def busqueda_clinica(request):
+    """Búsqueda de texto completo en notas clínicas (?q=, ?doctor=, ?paciente=, ?desde=, ?hasta=, ?pagina=)"""
+    from .busqueda import buscar, POR_PAGINA
+
+    consulta = request.GET.get('q', '').strip()
+    if not consulta:
+        return JsonResponse({'success': False, 'message': 'El parámetro "q" es obligatorio'}, status=400)
+    try:
+        desde = _fecha_param(request, 'desde')
+        hasta = _fecha_param(request, 'hasta')
+        pagina = max(int(request.GET.get('pagina', 1)), 1)
+        doctor_id = int(request.GET['doctor']) if request.GET.get('doctor') else None
+        patient_id = int(request.GET['paciente']) if request.GET.get('paciente') else None
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    resultados = buscar(
+        consulta,
+        pagina=pagina,
+        doctor_id=doctor_id,
+        patient_id=patient_id,
+        desde=timezone.make_aware(datetime.combine(desde, datetime.min.time())) if desde else None,
+        hasta=timezone.make_aware(datetime.combine(hasta, datetime.max.time())) if hasta else None,
+    )
+    return JsonResponse({
+        'success': True,
+        'q': consulta,
+        'pagina': pagina,
+        'hay_mas': len(resultados) == POR_PAGINA,
+        'resultados': [
+            {
+                'consulta_id': r['consulta'].id,
+                'url': reverse('detalle_consulta', args=[r['consulta'].id]),
+                'fecha': timezone.localtime(r['consulta'].fecha_consulta).strftime('%Y-%m-%d %H:%M'),
+                'estado': r['consulta'].estado,
+                'paciente': r['consulta'].patient.nombre_completo,
+                'doctor': r['consulta'].doctor.nombre_completo,
+                'fragmentos': r['fragmentos'],
+            }
+            for r in resultados
+        ],
+    })
+
+
+# ==================== API DE SINCRONIZACIÓN (v1) ====================
+
+@login_required
+@gzip_page
+def sincronizacion_cambios(request):
+    """Cambios desde ?token= (sin token: sincronización inicial con ?doctor= y ?desde=)"""
+    from .sincronizacion import (
+        cambios, leer_token, nuevo_token, TokenInvalido, LIMITE_DEFAULT, LIMITE_MAXIMO,
+    )
+
+    try:
+        limite = min(int(request.GET.get('limite', LIMITE_DEFAULT)), LIMITE_MAXIMO)
+        if request.GET.get('token'):
+            token = leer_token(request.GET['token'])
+        else:
+            token = nuevo_token(
+                doctor_id=int(request.GET['doctor']) if request.GET.get('doctor') else None,
+                desde=_fecha_param(request, 'desde'),
+            )
+    except TokenInvalido as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=410)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    return JsonResponse({'success': True, **cambios(token, limite=max(limite, 1))})
+
+@login_required
+@require_POST
+def sincronizacion_subir(request):
+    """Lote de cambios de la tableta: {"cambios": [{"recurso", "id", "version", "campos"}, ...]}"""
+    from .sincronizacion import subir, LOTE_MAXIMO
+
+    try:
+        cambios = json.loads(request.body)['cambios']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'success': False, 'message': 'Se esperaba JSON con la lista "cambios"'}, status=400)
+    if not isinstance(cambios, list) or len(cambios) > LOTE_MAXIMO:
+        return JsonResponse({'success': False, 'message': f'"cambios" debe ser una lista de hasta {LOTE_MAXIMO} elementos'}, status=400)
+
+    resultados = subir(cambios)
+    return JsonResponse({
+        'success': True,
+        'conflictos': sum(1 for r in resultados if r['estado'] == 'conflicto'),
+        'resultados': resultados,
+    })
+
+
+# ==================== OPERACIONES MASIVAS DE AGENDA ====================
+
+def _datos_operacion(request):
+    """Datos de una operación masiva enviados como JSON o formulario"""
+    if request.content_type == 'application/json':
+        return json.loads(request.body or '{}')
+    return request.POST
+
+def _respuesta_operacion(operacion):
+    return JsonResponse({
+        'success': True,
+        'operacion_id': operacion.id,
+        'afectadas': operacion.afectadas,
+        'conflictos': operacion.conflictos,
+    })
+
+@login_required
+@require_POST
+def reprogramar_dia(request):
+    """Mueve las citas de un doctor de un día a otro: doctor, origen, destino [, doctor_destino, motivo]"""
+    from .operaciones_agenda import reprogramar_dia as mover
+
+    try:
+        datos = _datos_operacion(request)
+        origen = datetime.strptime(datos['origen'], '%Y-%m-%d').date()
+        destino = datetime.strptime(datos['destino'], '%Y-%m-%d').date()
+        doctor_id = int(datos['doctor'])
+        doctor_destino_id = int(datos['doctor_destino']) if datos.get('doctor_destino') else None
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+    if origen == destino and not doctor_destino_id:
+        return JsonResponse({'success': False, 'message': 'El día destino es el mismo que el de origen'}, status=400)
+
+    try:
+        operacion = mover(
+            doctor_id, origen, destino,
+            doctor_destino_id=doctor_destino_id,
+            usuario=request.user,
+            motivo=datos.get('motivo', ''),
+        )
+    except Doctor.DoesNotExist:
+        return JsonResponse({'success': False, 'message': 'Doctor no encontrado'}, status=404)
+    return _respuesta_operacion(operacion)
+
+@login_required
+@require_POST
+def cancelar_dia(request):
+    """Cancela el día de un doctor: doctor, fecha [, motivo]"""
+    from .operaciones_agenda import cancelar_dia as cancelar
+
+    try:
+        datos = _datos_operacion(request)
+        fecha = datetime.strptime(datos['fecha'], '%Y-%m-%d').date()
+        doctor_id = int(datos['doctor'])
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    operacion = cancelar(doctor_id, fecha, usuario=request.user, motivo=datos.get('motivo', ''))
+    return _respuesta_operacion(operacion)
+
+@login_required
+@require_POST
+def cancelar_serie(request, serie_id):
+    """Cancela las citas futuras de una serie [desde, motivo]"""
+    from .models import AppointmentSeries
+    from .series import cancelar_serie as cancelar
+
+    serie = get_object_or_404(AppointmentSeries, id=serie_id)
+    try:
+        datos = _datos_operacion(request)
+        desde = datos.get('desde')
+        desde = timezone.make_aware(datetime.strptime(desde, '%Y-%m-%d')) if desde else None
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': f'Parámetros inválidos: {str(e)}'}, status=400)
+
+    operacion = cancelar(serie, desde=desde, usuario=request.user, motivo=datos.get('motivo', ''))
+    return _respuesta_operacion(operacion)
+
+
+# ==================== CALENDARIO (iCal) ====================
+
+@gzip_page
+def calendario_ics(request, token):
+    """Feed .ics de un doctor, autenticado por el token de la URL (sin sesión)"""
+    from django.http import Http404, StreamingHttpResponse
+    from django.utils.cache import get_conditional_response, patch_cache_control
+    from .calendario import cuerpo_en_cache, doctor_por_token, generar_y_guardar, huella
+
+    doctor = doctor_por_token(token)
+    if doctor is None:
+        raise Http404('Calendario no encontrado')
+
+    etag = f'"{huella(doctor)}"'
+    respuesta = get_conditional_response(request, etag=etag)
+    if respuesta is None:
+        cuerpo = cuerpo_en_cache(doctor, etag)
+        if cuerpo is not None:
+            respuesta = HttpResponse(cuerpo, content_type='text/calendar; charset=utf-8')
+        else:
+            url_consulta = lambda consulta_id: request.build_absolute_uri(reverse('detalle_consulta', args=[consulta_id]))
+            respuesta = StreamingHttpResponse(
+                generar_y_guardar(doctor, etag, url_consulta),
+                content_type='text/calendar; charset=utf-8',
+            )
+        respuesta['Content-Disposition'] = 'inline; filename="consultas.ics"'
+    respuesta['ETag'] = etag
+    patch_cache_control(respuesta, private=True, no_cache=True)
+    return respuesta
+
+@login_required
+def calendario_enlace(request):
+    """URL del feed .ics del doctor del usuario; POST genera una nueva y revoca la anterior"""
+    from django.core.exceptions import PermissionDenied
+    from .agenda import doctor_del_usuario
+    from .calendario import nuevo_token
+
+    try:
+        doctor = doctor_del_usuario(request.user)
+    except PermissionDenied:
+        doctor = None
+    if doctor is None:
+        return JsonResponse({'success': False, 'message': 'El usuario no está ligado a un doctor'}, status=403)
+
+    if request.method == 'POST' or not doctor.token_calendario:
+        doctor.token_calendario = nuevo_token()
+        doctor.save(update_fields=['token_calendario'])
+
+    url = request.build_absolute_uri(reverse('calendario_ics', args=[doctor.token_calendario]))
+    return JsonResponse({
+        'success': True,
+        'url': url,
+        'webcal': 'webcal://' + url.split('://', 1)[1],
+    })
+
+
+# ==================== ADJUNTOS DEL EXPEDIENTE ====================
+
+def _datos_adjunto(adjunto):
+    blob = adjunto.blob
+    return {
+        'id': adjunto.id,
+        'nombre': adjunto.nombre,
+        'categoria': adjunto.categoria,
+        'descripcion': adjunto.descripcion,
+        'consulta_id': adjunto.consultation_id,
+        'tamano': blob.tamano,
+        'tipo': blob.tipo_mime,
+        'paginas': blob.paginas,
+        'sha256': blob.sha256,
+        'derivados': blob.derivados,
+        'fecha_subida': adjunto.fecha_subida,
+        'descargar': reverse('descargar_adjunto', args=[adjunto.id]),
+        'miniatura': reverse('derivado_adjunto', args=[adjunto.id, 'miniatura']) if blob.derivados == 'listo' else None,
+        'vista_previa': reverse('derivado_adjunto', args=[adjunto.id, 'vista']) if blob.derivados == 'listo' else None,
+    }
+
+@csrf_exempt
+@login_required
+def subir_adjunto(request, patient_id):
+    """Sube un adjunto al expediente (archivo, categoria, descripcion, consulta) en streaming al almacén"""
+    from .adjuntos import ManejadorAdjuntos
+
+    # Los manejadores se cambian antes de leer el cuerpo; el CSRF se valida después
+    manejador = ManejadorAdjuntos(request)
+    request.upload_handlers = [manejador]
+    try:
+        return _subir_adjunto(request, patient_id, manejador)
+    finally:
+        # Lo recibido que no llegó al almacén (CSRF, 404, 405, errores) no se queda en tmp/
+        manejador.descartar_pendientes()
+
+@csrf_protect
+@require_POST
+def _subir_adjunto(request, patient_id, manejador):
+    from django.conf import settings
+    from .adjuntos import AdjuntoInvalido, crear_adjunto
+
+    paciente = get_object_or_404(Patient.objects.only('id'), id=patient_id)
+    archivo = request.FILES.get('archivo')
+    if manejador.excedido:
+        return JsonResponse(
+            {'success': False, 'message': f'El archivo excede {settings.ADJUNTOS_TAMANO_MAXIMO // (1024 * 1024)} MB'},
+            status=413,
+        )
+    if archivo is None:
+        return JsonResponse({'success': False, 'message': 'Falta el archivo'}, status=400)
+
+    consulta_id = request.POST.get('consulta') or None
+    if consulta_id and not Consultation.objects.filter(id=consulta_id, patient_id=paciente.id).exists():
+        archivo.descartar()
+        return JsonResponse({'success': False, 'message': 'La consulta no es de este paciente'}, status=400)
+    try:
+        adjunto, nuevo = crear_adjunto(
+            paciente.id,
+            archivo,
+            categoria=request.POST.get('categoria', 'otro'),
+            descripcion=request.POST.get('descripcion', ''),
+            consultation_id=consulta_id,
+            usuario=request.user,
+        )
+    except AdjuntoInvalido as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    return JsonResponse({'success': True, 'duplicado': not nuevo, 'adjunto': _datos_adjunto(adjunto)}, status=201)
+
+@login_required
+def adjuntos_paciente(request, patient_id):
+    """Adjuntos del expediente de un paciente, del más reciente al más antiguo (?categoria=, ?pagina=)"""
+    from .models import Attachment
+
+    adjuntos = Attachment.objects.filter(patient_id=patient_id).select_related('blob')
+    if request.GET.get('categoria'):
+        adjuntos = adjuntos.filter(categoria=request.GET['categoria'])
+    try:
+        pagina = max(int(request.GET.get('pagina', 1)), 1)
+    except ValueError:
+        pagina = 1
+    por_pagina = 50
+    return JsonResponse({
+        'success': True,
+        'adjuntos': [_datos_adjunto(a) for a in adjuntos[(pagina - 1) * por_pagina:pagina * por_pagina]],
+    })
+
+@login_required
+def descargar_adjunto(request, adjunto_id):
+    """Contenido del adjunto desde disco (Range/ETag); ?descargar=1 fuerza la descarga"""
+    from .adjuntos import TIPOS_EN_LINEA, respuesta_archivo, ruta_contenido
+    from .models import Attachment
+
+    adjunto = get_object_or_404(Attachment.objects.select_related('blob'), id=adjunto_id)
+    blob = adjunto.blob
+    return respuesta_archivo(
+        request,
+        ruta_contenido(blob),
+        blob.tipo_mime,
+        blob.sha256,
+        nombre=adjunto.nombre,
+        en_linea=blob.tipo_mime in TIPOS_EN_LINEA and request.GET.get('descargar') != '1',
+    )
+
+@login_required
+def derivado_adjunto(request, adjunto_id, tipo):
+    """Miniatura o vista previa (JPEG) del adjunto; 404 mientras no esté lista"""
+    from .adjuntos import respuesta_archivo, ruta_derivado
+    from .models import Attachment
+
+    adjunto = get_object_or_404(Attachment.objects.select_related('blob'), id=adjunto_id)
+    if tipo not in ('miniatura', 'vista') or adjunto.blob.derivados != 'listo':
+        return JsonResponse({'success': False, 'derivados': adjunto.blob.derivados}, status=404)
+    return respuesta_archivo(request, ruta_derivado(adjunto.blob, tipo), 'image/jpeg', f'{adjunto.blob.sha256}-{tipo}')
+
+@login_required
+@require_POST
+def eliminar_adjunto(request, adjunto_id):
+    """Elimina el adjunto; el contenido se borra del disco si ningún otro adjunto lo usa"""
+    from .adjuntos import eliminar_adjunto as eliminar
+    from .models import Attachment
+
+    adjunto = get_object_or_404(Attachment, id=adjunto_id)
+    return JsonResponse({'success': True, 'contenido_borrado': eliminar(adjunto)})
+
+
+# ==================== REPORTES DE LABORATORIO ====================
+
+def _datos_reporte(reporte, detalle=False):
+    datos = {
+        'id': reporte.id,
+        'nombre_archivo': reporte.nombre_archivo,
+        'origen': reporte.origen,
+        'estado': reporte.estado,
+        'paciente_id': reporte.patient_id,
+        'adjunto_id': reporte.attachment_id,
+        'nombre_detectado': reporte.nombre_detectado,
+        'fecha_nacimiento_detectada': reporte.fecha_nacimiento_detectada,
+        'fecha_reporte': reporte.fecha_reporte,
+        'error': reporte.error,
+        'fecha_creacion': reporte.fecha_creacion,
+        'descargar': reverse('descargar_adjunto', args=[reporte.attachment_id]) if reporte.attachment_id else None,
+    }
+    if detalle:
+        datos['resultados'] = [
+            {
+                'analito': r.analito,
+                'nombre': r.nombre,
+                'valor': r.valor,
+                'unidad': r.unidad,
+                'referencia': r.referencia,
+                'fuera_de_rango': r.fuera_de_rango,
+            }
+            for r in reporte.resultados.all()
+        ]
+        datos['texto'] = reporte.texto
+    return datos
+
+@csrf_exempt
+@login_required
+def subir_reporte_laboratorio(request):
+    """Sube un PDF de laboratorio (archivo); se extrae y vincula al paciente en segundo plano"""
+    from .adjuntos import ManejadorAdjuntos
+
+    manejador = ManejadorAdjuntos(request)
+    request.upload_handlers = [manejador]
+    try:
+        return _subir_reporte_laboratorio(request, manejador)
+    finally:
+        manejador.descartar_pendientes()
+
+@csrf_protect
+@require_POST
+def _subir_reporte_laboratorio(request, manejador):
+    from django.conf import settings
+    from django.db import transaction
+    from .adjuntos import AdjuntoInvalido
+    from .laboratorio import LaboratorioInvalido, procesar_en_segundo_plano, registrar
+
+    archivo = request.FILES.get('archivo')
+    if manejador.excedido:
+        return JsonResponse(
+            {'success': False, 'message': f'El archivo excede {settings.ADJUNTOS_TAMANO_MAXIMO // (1024 * 1024)} MB'},
+            status=413,
+        )
+    if archivo is None:
+        return JsonResponse({'success': False, 'message': 'Falta el archivo'}, status=400)
+    try:
+        with transaction.atomic():
+            reporte, nuevo = registrar(archivo, 'subida', usuario=request.user)
+            if reporte.estado == 'pendiente':
+                procesar_en_segundo_plano(reporte.id)
+    except (AdjuntoInvalido, LaboratorioInvalido) as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    return JsonResponse({'success': True, 'duplicado': not nuevo, 'reporte': _datos_reporte(reporte)}, status=202)
+
+@login_required
+def reportes_laboratorio(request):
+    """Reportes de laboratorio (?estado=, ?paciente=, ?q= texto completo, ?pagina=), del más reciente al más antiguo"""
+    from .laboratorio import buscar_reportes
+    from .models import LabReport
+
+    try:
+        pagina = max(int(request.GET.get('pagina', 1)), 1)
+        patient_id = int(request.GET['paciente']) if request.GET.get('paciente') else None
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Parámetros inválidos'}, status=400)
+    por_pagina = 50
+
+    reportes = LabReport.objects.defer('texto', 'raices')
+    if request.GET.get('q'):
+        ids = buscar_reportes(request.GET['q'], patient_id=patient_id, pagina=pagina, por_pagina=por_pagina)
+        encontrados = reportes.in_bulk(ids)
+        pagina_actual = [encontrados[i] for i in ids if i in encontrados]
+    else:
+        if request.GET.get('estado'):
+            reportes = reportes.filter(estado=request.GET['estado'])
+        if patient_id:
+            reportes = reportes.filter(patient_id=patient_id)
+        pagina_actual = reportes.order_by('-id')[(pagina - 1) * por_pagina:pagina * por_pagina]
+    return JsonResponse({
+        'success': True,
+        'pagina': pagina,
+        'reportes': [_datos_reporte(r) for r in pagina_actual],
+    })
+
+@login_required
+def reporte_laboratorio(request, reporte_id):
+    """Un reporte con sus resultados y el texto extraído"""
+    from .models import LabReport
+
+    reporte = get_object_or_404(LabReport.objects.prefetch_related('resultados'), id=reporte_id)
+    return JsonResponse({'success': True, 'reporte': _datos_reporte(reporte, detalle=True)})
+
+@login_required
+@require_POST
+def vincular_reporte_laboratorio(request, reporte_id):
+    """Vincula a mano un reporte sin paciente, ambiguo o mal vinculado (paciente)"""
+    from .laboratorio import vincular
+    from .models import LabReport
+
+    reporte = get_object_or_404(LabReport.objects.defer('texto', 'raices'), id=reporte_id)
+    if reporte.estado in ('pendiente', 'procesando'):
+        return JsonResponse({'success': False, 'message': 'El reporte aún no se procesa'}, status=409)
+    paciente = get_object_or_404(Patient.objects.only('id'), id=request.POST.get('paciente') or 0)
+    vincular(reporte, paciente.id)
+    return JsonResponse({'success': True, 'reporte': _datos_reporte(reporte)})
+
+@login_required
+def resultados_laboratorio_paciente(request, patient_id):
+    """Evolución de los analitos de un paciente ({analito: [{fecha, valor, ...}]}); ?analito= filtra uno"""
+    from .models import LabResult
+
+    resultados = LabResult.objects.filter(patient_id=patient_id).order_by('analito', 'fecha', 'id')
+    if request.GET.get('analito'):
+        resultados = resultados.filter(analito=request.GET['analito'])
+    series = {}
+    for r in resultados.values('analito', 'fecha', 'valor', 'unidad', 'referencia', 'fuera_de_rango', 'reporte_id'):
+        series.setdefault(r.pop('analito'), []).append(r)
+    return JsonResponse({'success': True, 'analitos': series})
+
+
+# ==================== CATÁLOGO DE MEDICAMENTOS Y RECETAS ====================
+
+def _datos_medicamento(medicamento):
+    return {
+        'id': medicamento.id,
+        'clave': medicamento.clave,
+        'nombre': medicamento.nombre,
+        'etiqueta': str(medicamento),
+        'concentracion': medicamento.concentracion,
+        'presentacion': medicamento.presentacion,
+        'via': medicamento.via,
+        'principios_activos': medicamento.principios_activos.split('+'),
+    }
+
+def _datos_alertas(alertas):
+    return [{**a, 'con': a['con'][:200]} for a in alertas]
+
+@login_required
+def autocompletar_medicamentos(request):
+    """Medicamentos del catálogo para el campo de receta (?q=, al menos 2 letras)"""
+    from .medicamentos import autocompletar
+
+    texto = request.GET.get('q', '').strip()
+    if len(texto) < 2:
+        return JsonResponse({'success': True, 'medicamentos': []})
+    return JsonResponse({'success': True, 'medicamentos': [_datos_medicamento(m) for m in autocompletar(texto)]})
+
+@login_required
+def verificar_interacciones(request, patient_id):
+    """Alertas de un medicamento (?medicamento=<id del catálogo> o ?texto=) contra lo que toma el paciente"""
+    from .medicamentos import verificar
+    from .models import Drug
+
+    get_object_or_404(Patient.objects.only('id'), id=patient_id)
+    drug = None
+    if request.GET.get('medicamento'):
+        drug = get_object_or_404(Drug.objects.only('id', 'principios_activos'), id=request.GET['medicamento'])
+    alertas = verificar(patient_id, drug=drug, texto=request.GET.get('texto', ''))
+    return JsonResponse({'success': True, 'alertas': _datos_alertas(alertas)})
+
+@login_required
+@require_POST
+def crear_receta(request, consulta_id):
+    """
+    Agrega una receta a la consulta (medicamento_id del catálogo o
+    medicamento en texto, dosis, frecuencia, duracion, indicaciones). Si hay
+    interacciones graves o contraindicadas responde 409 con las alertas y
+    no guarda, salvo con confirmar=1.
+    """
+    from django.core.exceptions import ValidationError
+    from .medicamentos import SEVERIDADES_BLOQUEAN, verificar
+    from .models import Drug, Prescription
+
+    consulta = get_object_or_404(Consultation.objects.only('id', 'patient_id', 'estado'), id=consulta_id)
+    if consulta.estado == 'cancelada':
+        return JsonResponse({'success': False, 'message': 'La consulta está cancelada'}, status=400)
+    drug = None
+    if request.POST.get('medicamento_id'):
+        drug = get_object_or_404(Drug, id=request.POST['medicamento_id'])
+    receta = Prescription(
+        consultation_id=consulta.id,
+        drug=drug,
+        medicamento=request.POST.get('medicamento') or (str(drug) if drug else ''),
+        dosis=request.POST.get('dosis', ''),
+        frecuencia=request.POST.get('frecuencia', ''),
+        duracion=request.POST.get('duracion', ''),
+        indicaciones=request.POST.get('indicaciones', ''),
+    )
+    try:
+        receta.full_clean()
+    except ValidationError as e:
+        return JsonResponse({'success': False, 'message': 'Receta no válida: ' + '; '.join(e.messages)}, status=400)
+
+    alertas = verificar(consulta.patient_id, drug=drug, texto=receta.medicamento, consulta_id=consulta.id)
+    if request.POST.get('confirmar') != '1' and any(a['severidad'] in SEVERIDADES_BLOQUEAN for a in alertas):
+        return JsonResponse({
+            'success': False,
+            'message': 'La receta tiene interacciones graves; confírmala para guardarla',
+            'alertas': _datos_alertas(alertas),
+        }, status=409)
+    receta.save()
+    return JsonResponse({'success': True, 'receta_id': receta.id, 'alertas': _datos_alertas(alertas)}, status=201)
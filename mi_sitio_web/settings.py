@@ -49,9 +49,12 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'mi_app.clinicas.ClinicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',     
+    # Al final: ejecuta la vista él mismo cuando la perfila
+    'mi_app.perfilado.PerfiladoMiddleware',
 ]
 
 ROOT_URLCONF = 'mi_sitio_web.urls'
@@ -84,6 +87,67 @@ DATABASES = {
     )
 }
 
+# Perfil de producción para SQLite (clínicas pequeñas sin servidor de BD)
+# WAL permite leer mientras otro worker escribe; las escrituras toman el
+# candado al inicio (IMMEDIATE) para no fallar con "database is locked" a mitad
+# de la transacción. Se puede desactivar con SQLITE_TUNING=False.
+if (
+    DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3'
+    and os.environ.get('SQLITE_TUNING', 'True') == 'True'
+):
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', '20'))  # segundos
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))  # bytes
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '64000'))
+
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'timeout': SQLITE_BUSY_TIMEOUT,
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT * 1000};'
+            f'PRAGMA mmap_size={SQLITE_MMAP_SIZE};'
+            f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB};'
+            'PRAGMA temp_store=MEMORY;'
+        ),
+    })
+
+# Caché: memoria local de cada worker por defecto; con REDIS_URL se comparte
+# entre workers (p. ej. los feeds iCal se generan una sola vez por cambio)
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+
+# Adjuntos del expediente: almacén direccionado por contenido (sha256) en disco
+ADJUNTOS_ROOT = os.environ.get('ADJUNTOS_ROOT', os.path.join(BASE_DIR, 'adjuntos'))
+ADJUNTOS_TAMANO_MAXIMO = int(os.environ.get('ADJUNTOS_TAMANO_MAXIMO', 100 * 1024 * 1024))
+# Hilos para miniaturas y vistas previas (Pillow / PyMuPDF) por proceso
+ADJUNTOS_WORKERS = int(os.environ.get('ADJUNTOS_WORKERS', 2))
+# Carpeta donde se dejan los PDF de laboratorio para `ingerir_laboratorio` (vacía: solo subidas)
+LABORATORIO_CARPETA = os.environ.get('LABORATORIO_CARPETA', '')
+# Copias Parquet para BI que escribe `exportar_bi`, y el alias de la BD de la
+# que lee (p. ej. una réplica de lectura para no cargar la de las clínicas)
+BI_CARPETA = os.environ.get('BI_CARPETA', os.path.join(BASE_DIR, 'bi'))
+BI_BASE_DATOS = os.environ.get('BI_BASE_DATOS', 'default')
+# Clave del seudónimo de los pacientes en BI. Propia y fuera del repositorio
+# (no SECRET_KEY): quien la tenga puede volver a ligar los seudónimos a los
+# ids. Sin ella `exportar_bi` no corre.
+BI_SEUDONIMO_CLAVE = os.environ.get('BI_SEUDONIMO_CLAVE', '')
+
+# Perfilado a pedido (ver mi_app/perfilado.py): staff con la cabecera
+# X-Perfilar o ?perfilar=1 (o =cprofile), y una fracción de las peticiones de
+# PERFILADO_VISTAS. Apagado, el middleware no se instala
+PERFILADO_ACTIVO = os.environ.get('PERFILADO_ACTIVO', 'False') == 'True'
+PERFILADO_MUESTREO = float(os.environ.get('PERFILADO_MUESTREO', '0'))
+PERFILADO_VISTAS = ['detalle_paciente', 'dashboard', 'calendario_consultas']
+PERFILADO_INTERVALO_MS = float(os.environ.get('PERFILADO_INTERVALO_MS', '5'))
+PERFILADO_ROOT = os.environ.get('PERFILADO_ROOT', os.path.join(BASE_DIR, 'perfiles'))
+PERFILADO_MAXIMO = int(os.environ.get('PERFILADO_MAXIMO', '500'))
+
 # Configuración adicional para MariaDB
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 